@@ -38,15 +38,12 @@ from . import account
 from .forms import RegistUserForm, EditUserAdminForm, EditUserForm, PasswordChangeForm, BankInfoForm, IssuerInfoForm
 from config import Config
 from app import db
-from app.utils import ContractUtils
+from app.utils import ContractUtils, Web3Utils
 from app.models import User, Role, Bank, Issuer
 from app.decorators import admin_required
 
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+web3 = Web3Utils.get_web3()
 from eth_utils import to_checksum_address
 
 from logging import getLogger
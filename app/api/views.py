@@ -17,468 +17,138 @@ limitations under the License.
 SPDX-License-Identifier: Apache-2.0
 """
 
-import re
+import uuid
 from http import HTTPStatus
 
+from flask import abort, jsonify, url_for
 from flask_jwt import jwt_required, current_identity
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
+from sqlalchemy.dialects.postgresql import insert
 
 from app import db
-from app.models import Transfer, HolderList, Issuer, User
-from app.models import PersonalInfo as PersonalInfoModel
-from app.utils import ContractUtils, TokenUtils
+from app.models import HolderListJob, HolderListJobStatus, User
+from app.utils import TokenUtils, Web3Utils
 from config import Config
 from . import api
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+web3 = Web3Utils.get_web3()
 
 from logging import getLogger
 logger = getLogger('api')
 
-DEFAULT_VALUE = "--"
-
 
 @api.route('/share/holders/<string:token_address>', methods=['POST'])
 @jwt_required()
 def share_holders(token_address):
     """
-    株式_保有者一覧取得
+    株式_保有者一覧取得（保有者名簿CSV作成依頼）
     :param token_address: トークンアドレス
     """
     logger.info(f'[{current_identity._get_current_object()}] api/share/holders')
-
-    # API実行ユーザの取得
-    # LocalProxy (current_identity) のままSQLAlchemyに渡すとエラーになるためプロキシ先オブジェクトを取得する
-    user_id = current_identity._get_current_object()
-    user = User.query.get(user_id)
-    issuer = Issuer.query.filter(Issuer.eth_account == user.eth_account).first()
-
-    # トークン情報の取得
-    TokenContract = TokenUtils.get_contract(
-        token_address=token_address,
-        issuer_address=user.eth_account,
-        template_id=Config.TEMPLATE_ID_SHARE
-    )
-    try:
-        token_name = TokenContract.functions.name().call()
-    except Exception as e:
-        logger.exception(e)
-        token_name = ''
-
-    # OTC取引コントラクト接続
-    try:
-        tradable_exchange = TokenContract.functions.tradableExchange().call()
-    except Exception as err:
-        logger.error(f"Failed to get token attributes: {err}")
-        tradable_exchange = Config.ZERO_ADDRESS
-    dex_contract = ContractUtils.get_contract('IbetOTCExchange', tradable_exchange)
-
-    # Transferイベントを検索
-    # →　残高を保有している可能性のあるアドレスを抽出
-    # →　保有者リストをユニークにする
-    transfer_events = Transfer.query. \
-        distinct(Transfer.account_address_to). \
-        filter(Transfer.token_address == token_address).all()
-
-    token_owner = TokenContract.functions.owner().call()  # トークン発行体アドレスを取得
-    holders_temp = [token_owner]  # 発行体アドレスをリストに追加
-    for event in transfer_events:
-        holders_temp.append(event.account_address_to)
-
-    holders_uniq = []
-    for x in holders_temp:
-        if x not in holders_uniq:
-            holders_uniq.append(x)
-
-    # 保有者情報抽出
-    holders = []
-    for account_address in holders_uniq:
-        balance = TokenContract.functions.balanceOf(account_address).call()
-        try:
-            commitment = dex_contract.functions.commitmentOf(account_address, token_address).call()
-        except Exception as e:
-            logger.warning(e)
-            commitment = 0
-
-        if balance > 0 or commitment > 0:  # 残高（balance）、または注文中の残高（commitment）が存在する情報を抽出
-            # 保有者情報：デフォルト値（個人情報なし）
-            holder = {
-                'account_address': account_address,
-                'key_manager': DEFAULT_VALUE,
-                'name': DEFAULT_VALUE,
-                'postal_code': DEFAULT_VALUE,
-                'email': DEFAULT_VALUE,
-                'address': DEFAULT_VALUE,
-                'birth_date': DEFAULT_VALUE,
-                'balance': balance,
-                'commitment': commitment
-            }
-
-            if account_address == token_owner:  # 保有者が発行体の場合
-                holder["name"] = issuer.issuer_name or DEFAULT_VALUE
-            else:  # 保有者が発行体以外の場合
-                record = PersonalInfoModel.query. \
-                    filter(PersonalInfoModel.account_address == account_address). \
-                    filter(PersonalInfoModel.issuer_address == token_owner). \
-                    first()
-
-                if record is not None:
-                    decrypted_personal_info = record.personal_info
-                    key_manager = decrypted_personal_info.get("key_manager") or DEFAULT_VALUE
-                    name = decrypted_personal_info.get("name") or DEFAULT_VALUE
-                    postal_code = decrypted_personal_info.get("postal_code") or DEFAULT_VALUE
-                    email = decrypted_personal_info.get("email") or DEFAULT_VALUE
-                    birth_date = decrypted_personal_info.get("birth") or DEFAULT_VALUE
-
-                    # 住所に含まれるUnicodeの各種ハイフン文字を半角ハイフン（U+002D）に変換する
-                    address = decrypted_personal_info.get("address", DEFAULT_VALUE)
-                    try:
-                        formatted_address = \
-                            re.sub('\u2010|\u2011|\u2012|\u2013|\u2014|\u2015|\u2212|\uff0d', '-', address)
-                    except TypeError:  # データ変換エラー
-                        formatted_address = DEFAULT_VALUE
-
-                    holder = {
-                        'account_address': account_address,
-                        'key_manager': key_manager,
-                        'name': name,
-                        'postal_code': postal_code,
-                        'email': email,
-                        'address': formatted_address,
-                        'birth_date': birth_date,
-                        'balance': balance,
-                        'commitment': commitment
-                    }
-
-            # CSV出力用にトークンに関する情報を追加
-            holder['token_name'] = token_name
-            holder['token_address'] = token_address
-
-            holders.append(holder)
-
-    # CSV作成
-    csv_columns = [
-        'token_name',
-        'token_address',
-        'account_address',
-        'key_manager',
-        'balance',
-        'commitment',
-        'name',
-        'birth_date',
-        'postal_code',
-        'address',
-        'email'
-    ]
-    csv_data = '\n'.join([
-        # CSVヘッダ行
-        ','.join(csv_columns),
-        # CSVデータ行
-        *[','.join(map(lambda column: str(holder1[column]), csv_columns)) for holder1 in holders]
-    ]) + '\n'
-
-    # DBに登録
-    holder_list = HolderList(token_address=token_address, holder_list=csv_data.encode('sjis', 'ignore'))
-    db.session.add(holder_list)
-
-    return '', HTTPStatus.CREATED
+    return create_holder_list_job(token_address, Config.TEMPLATE_ID_SHARE)
 
 
 @api.route('/bond/holders/<string:token_address>', methods=['POST'])
 @jwt_required()
 def bond_holders(token_address):
     """
-    債券_保有者一覧取得
+    債券_保有者一覧取得（保有者名簿CSV作成依頼）
     :param token_address: トークンアドレス
     """
     logger.info(f'[{current_identity._get_current_object()}] api/bond/holders')
+    return create_holder_list_job(token_address, Config.TEMPLATE_ID_SB)
 
-    # API実行ユーザの取得
-    # LocalProxy (current_identity) のままSQLAlchemyに渡すとエラーになるためプロキシ先オブジェクトを取得する
-    user_id = current_identity._get_current_object()
-    user = User.query.get(user_id)
-    issuer = Issuer.query.filter(Issuer.eth_account == user.eth_account).first()
-
-    # トークン情報の取得
-    TokenContract = TokenUtils.get_contract(
-        token_address=token_address,
-        issuer_address=user.eth_account,
-        template_id=Config.TEMPLATE_ID_SB
-    )
-    try:
-        token_name = TokenContract.functions.name().call()
-        face_value = TokenContract.functions.faceValue().call()
-    except Exception as e:
-        logger.exception(e)
-        token_name = ''
-        face_value = 0
-
-    # DEXコントラクト接続
-    try:
-        tradable_exchange = TokenContract.functions.tradableExchange().call()
-    except Exception as err:
-        logger.error(f"Failed to get token attributes: {err}")
-        tradable_exchange = Config.ZERO_ADDRESS
-    dex_contract = ContractUtils.get_contract('IbetStraightBondExchange', tradable_exchange)
-
-    # Transferイベントを検索
-    # →　残高を保有している可能性のあるアドレスを抽出
-    # →　保有者リストをユニークにする
-    transfer_events = Transfer.query. \
-        distinct(Transfer.account_address_to). \
-        filter(Transfer.token_address == token_address).all()
-
-    token_owner = TokenContract.functions.owner().call()  # トークン発行体アドレスを取得
-    holders_temp = [token_owner]  # 発行体アドレスをリストに追加
-    for event in transfer_events:
-        holders_temp.append(event.account_address_to)
-
-    holders_uniq = []
-    for x in holders_temp:
-        if x not in holders_uniq:
-            holders_uniq.append(x)
 
-    # 保有者情報抽出
-    holders = []
-    for account_address in holders_uniq:
-        balance = TokenContract.functions.balanceOf(account_address).call()
-        try:
-            commitment = dex_contract.functions.commitmentOf(account_address, token_address).call()
-        except Exception as e:
-            logger.warning(e)
-            commitment = 0
-
-        if balance > 0 or commitment > 0:  # 残高（balance）、または注文中の残高（commitment）が存在する情報を抽出
-            # 保有者情報：デフォルト値（個人情報なし）
-            holder = {
-                'account_address': account_address,
-                'key_manager': DEFAULT_VALUE,
-                'name': DEFAULT_VALUE,
-                'postal_code': DEFAULT_VALUE,
-                'email': DEFAULT_VALUE,
-                'address': DEFAULT_VALUE,
-                'birth_date': DEFAULT_VALUE,
-                'balance': balance,
-                'commitment': commitment
-            }
-
-            if account_address == token_owner:  # 保有者が発行体の場合
-                holder["name"] = issuer.issuer_name or DEFAULT_VALUE
-            else:  # 保有者が発行体以外の場合
-                record = PersonalInfoModel.query. \
-                    filter(PersonalInfoModel.account_address == account_address). \
-                    filter(PersonalInfoModel.issuer_address == token_owner). \
-                    first()
-
-                if record is not None:
-                    decrypted_personal_info = record.personal_info
-                    key_manager = decrypted_personal_info.get("key_manager") or DEFAULT_VALUE
-                    name = decrypted_personal_info.get("name") or DEFAULT_VALUE
-                    postal_code = decrypted_personal_info.get("postal_code") or DEFAULT_VALUE
-                    email = decrypted_personal_info.get("email") or DEFAULT_VALUE
-                    birth_date = decrypted_personal_info.get("birth") or DEFAULT_VALUE
-
-                    # 住所に含まれるUnicodeの各種ハイフン文字を半角ハイフン（U+002D）に変換する
-                    address = decrypted_personal_info.get("address", DEFAULT_VALUE)
-                    try:
-                        formatted_address = \
-                            re.sub('\u2010|\u2011|\u2012|\u2013|\u2014|\u2015|\u2212|\uff0d', '-', address)
-                    except TypeError:  # データ変換エラー
-                        formatted_address = ""
+@api.route('/membership/holders/<string:token_address>', methods=['POST'])
+@jwt_required()
+def membership_holders(token_address):
+    """
+    会員権_保有者一覧取得（保有者名簿CSV作成依頼）
+    :param token_address: トークンアドレス
+    """
+    logger.info(f'[{current_identity._get_current_object()}] api/membership/holders')
+    return create_holder_list_job(token_address, Config.TEMPLATE_ID_MEMBERSHIP)
 
-                    holder = {
-                        'account_address': account_address,
-                        'key_manager': key_manager,
-                        'name': name,
-                        'postal_code': postal_code,
-                        'email': email,
-                        'address': formatted_address,
-                        'birth_date': birth_date,
-                        'balance': balance,
-                        'commitment': commitment
-                    }
 
-            # CSV出力用にトークンに関する情報を追加
-            holder['token_name'] = token_name
-            holder['token_address'] = token_address
-            total_balance = holder['balance'] + holder['commitment']
-            holder['total_balance'] = total_balance
-            holder['total_holdings'] = total_balance * face_value
+@api.route('/holders/jobs/<string:job_id>', methods=['GET'])
+@jwt_required()
+def holder_list_job(job_id):
+    """
+    保有者名簿CSV作成ジョブの状態取得
+    :param job_id: ジョブID
+    """
+    logger.info(f'[{current_identity._get_current_object()}] api/holders/jobs')
 
-            holders.append(holder)
+    # API実行ユーザの取得
+    user_id = current_identity._get_current_object()
+    user = User.query.get(user_id)
 
-    # CSV作成
-    csv_columns = [
-        'token_name',
-        'token_address',
-        'account_address',
-        'key_manager',
-        'balance',
-        'commitment',
-        'total_balance',
-        'total_holdings',
-        'name',
-        'birth_date',
-        'postal_code',
-        'address',
-        'email'
-    ]
-    csv_data = '\n'.join([
-        # CSVヘッダ行
-        ','.join(csv_columns),
-        # CSVデータ行
-        *[','.join(map(lambda column: str(holder1[column]), csv_columns)) for holder1 in holders]
-    ]) + '\n'
+    job = HolderListJob.query. \
+        filter(HolderListJob.job_id == job_id). \
+        filter(HolderListJob.eth_account == user.eth_account). \
+        first()
+    if job is None:
+        abort(HTTPStatus.NOT_FOUND)
+    return jsonify(holder_list_job_to_dict(job))
 
-    # DBに登録
-    holder_list = HolderList(token_address=token_address, holder_list=csv_data.encode('sjis', 'ignore'))
-    db.session.add(holder_list)
 
-    return '', HTTPStatus.CREATED
+def create_holder_list_job(token_address, template_id):
+    """
+    保有者名簿CSV作成ジョブ登録
 
+    CSVはバッチ（processor_HolderList）で作成し、HolderListに登録する。
+    同一トークン・同一ブロック高の依頼は登録済のジョブにまとめる（異常終了したジョブは再実行する）。
 
-@api.route('/membership/holders/<string:token_address>', methods=['POST'])
-@jwt_required()
-def membership_holders(token_address):
-    """
-    会員権_保有者一覧取得
     :param token_address: トークンアドレス
+    :param template_id: トークン種別
+    :return: HTTPレスポンス（202）
     """
-    logger.info(f'[{current_identity._get_current_object()}] api/membership/holders')
-
     # API実行ユーザの取得
     # LocalProxy (current_identity) のままSQLAlchemyに渡すとエラーになるためプロキシ先オブジェクトを取得する
     user_id = current_identity._get_current_object()
     user = User.query.get(user_id)
-    issuer = Issuer.query.filter(Issuer.eth_account == user.eth_account).first()
 
-    # トークン情報の取得
-    TokenContract = TokenUtils.get_contract(
+    # トークンの存在・発行体の確認
+    TokenUtils.get_contract(
         token_address=token_address,
         issuer_address=user.eth_account,
-        template_id=Config.TEMPLATE_ID_MEMBERSHIP
+        template_id=template_id
     )
-    try:
-        token_name = TokenContract.functions.name().call()
-    except Exception as e:
-        logger.exception(e)
-        token_name = ''
-
-    # 会員権取引コントラクト接続
-    try:
-        tradable_exchange = TokenContract.functions.tradableExchange().call()
-    except Exception as err:
-        logger.error(f"Failed to get token attributes: {err}")
-        tradable_exchange = Config.ZERO_ADDRESS
-    dex_contract = ContractUtils.get_contract('IbetMembershipExchange', tradable_exchange)
-
-    # Transferイベントを検索
-    # →　残高を保有している可能性のあるアドレスを抽出
-    # →　保有者リストをユニークにする
-    transfer_events = Transfer.query. \
-        distinct(Transfer.account_address_to). \
-        filter(Transfer.token_address == token_address).all()
-
-    token_owner = TokenContract.functions.owner().call()  # トークン発行体アドレスを取得
-    holders_temp = [token_owner]  # 発行体アドレスをリストに追加
-    for event in transfer_events:
-        holders_temp.append(event.account_address_to)
-
-    holders_uniq = []
-    for x in holders_temp:
-        if x not in holders_uniq:
-            holders_uniq.append(x)
 
-    # 保有者情報抽出
-    holders = []
-    for account_address in holders_uniq:
-        balance = TokenContract.functions.balanceOf(account_address).call()
-        try:
-            commitment = dex_contract.functions.commitmentOf(account_address, token_address).call()
-        except Exception as e:
-            logger.warning(e)
-            commitment = 0
-
-        if balance > 0 or commitment > 0:  # 残高（balance）、または注文中の残高（commitment）が存在する情報を抽出
-            # 保有者情報：デフォルト値（個人情報なし）
-            holder = {
-                'account_address': account_address,
-                'key_manager': DEFAULT_VALUE,
-                'name': DEFAULT_VALUE,
-                'postal_code': DEFAULT_VALUE,
-                'email': DEFAULT_VALUE,
-                'address': DEFAULT_VALUE,
-                'birth_date': DEFAULT_VALUE,
-                'balance': balance,
-                'commitment': commitment
-            }
-
-            if account_address == token_owner:  # 保有者が発行体の場合
-                holder["name"] = issuer.issuer_name or DEFAULT_VALUE
-            else:  # 保有者が発行体以外の場合
-                record = PersonalInfoModel.query. \
-                    filter(PersonalInfoModel.account_address == account_address). \
-                    filter(PersonalInfoModel.issuer_address == token_owner). \
-                    first()
-                if record is not None:
-                    decrypted_personal_info = record.personal_info
-                    key_manager = decrypted_personal_info.get("key_manager") or DEFAULT_VALUE
-                    name = decrypted_personal_info.get("name") or DEFAULT_VALUE
-                    postal_code = decrypted_personal_info.get("postal_code") or DEFAULT_VALUE
-                    email = decrypted_personal_info.get("email") or DEFAULT_VALUE
-                    birth_date = decrypted_personal_info.get("birth") or DEFAULT_VALUE
-
-                    # 住所に含まれるUnicodeの各種ハイフン文字を半角ハイフン（U+002D）に変換する
-                    address = decrypted_personal_info.get("address", DEFAULT_VALUE)
-                    try:
-                        formatted_address = \
-                            re.sub('\u2010|\u2011|\u2012|\u2013|\u2014|\u2015|\u2212|\uff0d', '-', address)
-                    except TypeError:
-                        formatted_address = ""
-
-                    holder = {
-                        'account_address': account_address,
-                        'key_manager': key_manager,
-                        'name': name,
-                        'postal_code': postal_code,
-                        'email': email,
-                        'address': formatted_address,
-                        'birth_date': birth_date,
-                        'balance': balance,
-                        'commitment': commitment
-                    }
-
-            # CSV出力用にトークンに関する情報を追加
-            holder['token_name'] = token_name
-            holder['token_address'] = token_address
-
-            holders.append(holder)
+    # ジョブ登録
+    block_number = web3.eth.blockNumber
+    db.session.execute(
+        insert(HolderListJob).values(
+            job_id=str(uuid.uuid4()),
+            eth_account=user.eth_account,
+            token_address=token_address,
+            template_id=template_id,
+            block_number=block_number,
+            status=HolderListJobStatus.PENDING.value
+        ).on_conflict_do_nothing(index_elements=["token_address", "block_number"])
+    )
+    job = HolderListJob.query. \
+        filter(HolderListJob.token_address == token_address). \
+        filter(HolderListJob.block_number == block_number). \
+        first()
+    if job.status == HolderListJobStatus.FAILED.value:
+        job.status = HolderListJobStatus.PENDING.value
 
-    # CSV作成
-    csv_columns = [
-        'token_name',
-        'token_address',
-        'account_address',
-        'key_manager',
-        'balance',
-        'commitment',
-        'name',
-        'birth_date',
-        'postal_code',
-        'address',
-        'email'
-    ]
-    csv_data = '\n'.join([
-        # CSVヘッダ行
-        ','.join(csv_columns),
-        # CSVデータ行
-        *[','.join(map(lambda column: str(holder1[column]), csv_columns)) for holder1 in holders]
-    ]) + '\n'
+    response = jsonify(holder_list_job_to_dict(job))
+    response.status_code = HTTPStatus.ACCEPTED
+    response.headers["Location"] = url_for("api.holder_list_job", job_id=job.job_id)
+    return response
 
-    # DBに登録
-    holder_list = HolderList(token_address=token_address, holder_list=csv_data.encode('sjis', 'ignore'))
-    db.session.add(holder_list)
 
-    return '', HTTPStatus.CREATED
+def holder_list_job_to_dict(job):
+    """
+    保有者名簿CSV作成ジョブ（レスポンス）
+    :param job: HolderListJob
+    :return: dict
+    """
+    return {
+        'job_id': job.job_id,
+        'token_address': job.token_address,
+        'block_number': job.block_number,
+        'status': HolderListJobStatus(job.status).name,
+        'holder_list_id': job.holder_list_id
+    }
@@ -31,9 +31,8 @@ from flask import request, redirect, url_for, flash, make_response, \
     render_template, abort, jsonify, session
 from flask_login import login_required, current_user
 
-from sqlalchemy import func, desc, or_
+from sqlalchemy import func, desc
 from web3 import Web3
-from web3.middleware import geth_poa_middleware
 from eth_utils import to_checksum_address
 from eth_typing import ChecksumAddress
 
@@ -41,9 +40,9 @@ from app import db
 from app.exceptions import EthRuntimeError
 from app.models import Token, Certification, Order, Agreement, AgreementStatus, \
     Transfer, AddressType, ApplyFor, Issuer, HolderList, BondLedger, \
-    CorporateBondLedgerTemplate, PersonalInfoContract, BulkTransfer, BulkTransferUpload
+    CorporateBondLedgerTemplate, PersonalInfoContract, BulkTransfer, BulkTransferUpload, IDXTokenExchange
 from app.models import PersonalInfo as PersonalInfoModel
-from app.utils import ContractUtils, TokenUtils
+from app.utils import ContractUtils, CsvUtils, TokenUtils, Web3Utils
 from config import Config
 
 from . import bond
@@ -55,8 +54,7 @@ from logging import getLogger
 
 logger = getLogger('api')
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+web3 = Web3Utils.get_web3()
 JST = timezone(timedelta(hours=+9), 'JST')
 
 
@@ -312,9 +310,11 @@ def list():
                 )
 
                 # Token-Contractから情報を取得する
-                name = TokenContract.functions.name().call()
-                symbol = TokenContract.functions.symbol().call()
-                is_redeemed = TokenContract.functions.isRedeemed().call()
+                name, symbol, is_redeemed = ContractUtils.batch_call([
+                    TokenContract.functions.name(),
+                    TokenContract.functions.symbol(),
+                    TokenContract.functions.isRedeemed()
+                ], use_cache=True)
 
             # 作成日時（JST）
             created = datetime.fromtimestamp(row.created.timestamp(), JST).strftime("%Y/%m/%d %H:%M:%S %z")
@@ -362,55 +362,51 @@ def holders_csv_download():
         logger.error(e)
         face_value = 0
 
-    f = io.StringIO()
-
-    # ヘッダー行
-    data_header = f"token_name," \
-                  f"token_address," \
-                  f"account_address," \
-                  f"key_manager," \
-                  f"balance," \
-                  f"total_holdings," \
-                  f"name," \
-                  f"birth_date," \
-                  f"postal_code," \
-                  f"address," \
-                  f"email" \
-                  f"\n"
-    f.write(data_header)
-
-    # 明細行
-    for _holder in _holders:
-        # Unicodeの各種ハイフン文字を半角ハイフン（U+002D）に変換する
-        try:
-            holder_address = re.sub('\u2010|\u2011|\u2012|\u2013|\u2014|\u2015|\u2212|\uff0d', '-', _holder["address"])
-        except TypeError:  # データ変換エラー
-            holder_address = ""
-        # 保有金額合計
-        total_holdings = _holder["balance"] * face_value
-        # データ行
-        data_row = f"{token_name}," \
-                   f"{token_address}," \
-                   f"{_holder['account_address']}," \
-                   f"{_holder['key_manager']}," \
-                   f"{str(_holder['balance'])}," \
-                   f"{str(total_holdings)}," \
-                   f"{_holder['name']}," \
-                   f"{_holder['birth_date']}," \
-                   f"{_holder['postal_code']}," \
-                   f"{holder_address}," \
-                   f"{_holder['email']}" \
-                   f"\n"
-        f.write(data_row)
+    def generate_csv():
+        # ヘッダー行
+        data_header = f"token_name," \
+                      f"token_address," \
+                      f"account_address," \
+                      f"key_manager," \
+                      f"balance," \
+                      f"total_holdings," \
+                      f"name," \
+                      f"birth_date," \
+                      f"postal_code," \
+                      f"address," \
+                      f"email" \
+                      f"\n"
+        yield data_header
+
+        # 明細行
+        for _holder in _holders:
+            # Unicodeの各種ハイフン文字を半角ハイフン（U+002D）に変換する
+            try:
+                holder_address = re.sub('\u2010|\u2011|\u2012|\u2013|\u2014|\u2015|\u2212|\uff0d', '-', _holder["address"])
+            except TypeError:  # データ変換エラー
+                holder_address = ""
+            # 保有金額合計
+            total_holdings = _holder["balance"] * face_value
+            # データ行
+            data_row = f"{token_name}," \
+                       f"{token_address}," \
+                       f"{_holder['account_address']}," \
+                       f"{_holder['key_manager']}," \
+                       f"{str(_holder['balance'])}," \
+                       f"{str(total_holdings)}," \
+                       f"{_holder['name']}," \
+                       f"{_holder['birth_date']}," \
+                       f"{_holder['postal_code']}," \
+                       f"{holder_address}," \
+                       f"{_holder['email']}" \
+                       f"\n"
+            yield data_row
 
     now = datetime.now(tz=JST)
-    res = make_response()
-    csvdata = f.getvalue()
-    res.data = csvdata.encode('sjis', 'ignore')
-    res.headers['Content-Type'] = 'text/plain'
-    res.headers['Content-Disposition'] = f"attachment; filename={now.strftime('%Y%m%d%H%M%S')}bond_holders_list.csv"
-
-    return res
+    return CsvUtils.stream_response(
+        generate_csv(),
+        filename=f"{now.strftime('%Y%m%d%H%M%S')}bond_holders_list.csv"
+    )
 
 
 # 保有者リスト取得
@@ -452,103 +448,72 @@ def get_holders(token_address: str) -> Dict:
 
     # DEXアドレスを取得
     try:
-        tradable_exchange = TokenContract.functions.tradableExchange().call()
+        tradable_exchange = ContractUtils.cached_call(TokenContract.functions.tradableExchange())
     except Exception as err:
         logger.error(f"Failed to get token attributes: {err}")
         tradable_exchange = Config.ZERO_ADDRESS
 
-    # Transferイベントを検索
-    # →　残高を保有している可能性のあるアドレスを抽出
-    # →　保有者リストをユニークにする
-    query = Transfer.query. \
-        distinct(Transfer.account_address_to). \
-        filter(Transfer.token_address == token_address)
-    if search_address:
-        transfer_events = query.filter(or_(
-            Transfer.account_address_from.like(f"%{search_address}%"),
-            Transfer.account_address_to.like(f"%{search_address}%"))
-        ).all()
-    else:
-        transfer_events = query.all()
-
-    holders_temp = [token_owner]  # 発行体アドレスをリストに追加
-    for event in transfer_events:
-        holders_temp.append(event.account_address_to)
-
-    holders_uniq = []
-    for x in holders_temp:
-        if x not in holders_uniq:
-            if search_address is None:
-                holders_uniq.append(x)
-            elif search_address in x:
-                holders_uniq.append(x)
+    # 保有者と残高を取得
+    holder_page = TokenUtils.get_holder_balances(
+        token_contract=TokenContract,
+        token_owner=token_owner,
+        search_address=search_address,
+        start=start,
+        length=length,
+        with_personal_info=True
+    )
 
     # 保有者情報を取得
     _holders = []
-    cursor = -1  # 開始位置
-    count = 0  # 取得レコード
-    for account_address in holders_uniq:
-        cursor += 1
-        if ((start is not None and cursor >= start) and (length is not None and count < length)) or (start is None and length is None):
-            count += 1
-
-            # 残高取得
-            balance = TokenContract.functions.balanceOf(account_address).call()
-
-            # アドレス種別判定
-            if account_address == token_owner:
-                address_type = AddressType.ISSUER.value
-            elif account_address == tradable_exchange:
-                address_type = AddressType.EXCHANGE.value
-            else:
-                address_type = AddressType.OTHERS.value
-
-            # 保有者情報：デフォルト値（個人情報なし）
-            _holder = {
-                'account_address': account_address,
-                'key_manager': DEFAULT_VALUE,
-                'name': DEFAULT_VALUE,
-                'postal_code': DEFAULT_VALUE,
-                'email': DEFAULT_VALUE,
-                'address': DEFAULT_VALUE,
-                'birth_date': DEFAULT_VALUE,
-                'balance': balance,
-                'address_type': address_type
-            }
-            if address_type == AddressType.ISSUER.value:  # 保有者が発行体の場合
-                _holder["name"] = issuer.issuer_name or DEFAULT_VALUE
-                _holders.append(_holder)
-            else:  # 保有者が発行体以外の場合
-                record = PersonalInfoModel.query. \
-                    filter(PersonalInfoModel.account_address == account_address). \
-                    filter(PersonalInfoModel.issuer_address == token_owner). \
-                    first()
+    for account_address, balance in holder_page.holders:
+        # アドレス種別判定
+        if account_address == token_owner:
+            address_type = AddressType.ISSUER.value
+        elif account_address == tradable_exchange:
+            address_type = AddressType.EXCHANGE.value
+        else:
+            address_type = AddressType.OTHERS.value
+
+        # 保有者情報：デフォルト値（個人情報なし）
+        _holder = {
+            'account_address': account_address,
+            'key_manager': DEFAULT_VALUE,
+            'name': DEFAULT_VALUE,
+            'postal_code': DEFAULT_VALUE,
+            'email': DEFAULT_VALUE,
+            'address': DEFAULT_VALUE,
+            'birth_date': DEFAULT_VALUE,
+            'balance': balance,
+            'address_type': address_type
+        }
+        if address_type == AddressType.ISSUER.value:  # 保有者が発行体の場合
+            _holder["name"] = issuer.issuer_name or DEFAULT_VALUE
+            _holders.append(_holder)
+        else:  # 保有者が発行体以外の場合
+            decrypted_personal_info = holder_page.personal_info.get(account_address)
+
+            if decrypted_personal_info is not None:
+                key_manager = decrypted_personal_info.get("key_manager") or DEFAULT_VALUE
+                name = decrypted_personal_info.get("name") or DEFAULT_VALUE
+                postal_code = decrypted_personal_info.get("postal_code") or DEFAULT_VALUE
+                address = decrypted_personal_info.get("address") or DEFAULT_VALUE
+                email = decrypted_personal_info.get("email") or DEFAULT_VALUE
+                birth_date = decrypted_personal_info.get("birth") or DEFAULT_VALUE
+                _holder = {
+                    'account_address': account_address,
+                    'key_manager': key_manager,
+                    'name': name,
+                    'postal_code': postal_code,
+                    'address': address,
+                    'email': email,
+                    'birth_date': birth_date,
+                    'balance': balance,
+                    'address_type': address_type
+                }
+            _holders.append(_holder)
 
-                if record is not None:
-                    decrypted_personal_info = record.personal_info
-                    key_manager = decrypted_personal_info.get("key_manager") or DEFAULT_VALUE
-                    name = decrypted_personal_info.get("name") or DEFAULT_VALUE
-                    postal_code = decrypted_personal_info.get("postal_code") or DEFAULT_VALUE
-                    address = decrypted_personal_info.get("address") or DEFAULT_VALUE
-                    email = decrypted_personal_info.get("email") or DEFAULT_VALUE
-                    birth_date = decrypted_personal_info.get("birth") or DEFAULT_VALUE
-                    _holder = {
-                        'account_address': account_address,
-                        'key_manager': key_manager,
-                        'name': name,
-                        'postal_code': postal_code,
-                        'address': address,
-                        'email': email,
-                        'birth_date': birth_date,
-                        'balance': balance,
-                        'address_type': address_type
-                    }
-                _holders.append(_holder)
-        elif length is not None and count >= length:
-            break
-
-    records_total = len(holders_uniq)
-    records_filtered = records_total
+    records_total = holder_page.records_total
+    records_filtered = holder_page.records_filtered
 
     res_body = {
         "draw": draw,
@@ -815,38 +780,44 @@ def setting(token_address: ChecksumAddress):
         address=token.token_address,
         abi=token_abi
     )
-    name = TokenContract.functions.name().call()
-    symbol = TokenContract.functions.symbol().call()
-    totalSupply = TokenContract.functions.totalSupply().call()
-    faceValue = TokenContract.functions.faceValue().call()
-    interestRate_int = TokenContract.functions.interestRate().call()
+    issuer = Issuer.query.get(session['issuer_id'])
+    list_contract_address = issuer.token_list_contract_address
+    ListContract = ContractUtils.get_contract('TokenList', list_contract_address)
+    name, symbol, totalSupply, faceValue, interestRate_int, interestPaymentDate_string, \
+        redemptionDate, redemptionValue, returnDate, returnDetails, purpose, memo, tradableExchange, \
+        image_1, image_2, image_3, contact_information, privacy_policy, transferable, personalInfoAddress, \
+        initial_offering_status, is_redeemed, token_struct = ContractUtils.batch_call([
+            TokenContract.functions.name(),
+            TokenContract.functions.symbol(),
+            TokenContract.functions.totalSupply(),
+            TokenContract.functions.faceValue(),
+            TokenContract.functions.interestRate(),
+            TokenContract.functions.interestPaymentDate(),
+            TokenContract.functions.redemptionDate(),
+            TokenContract.functions.redemptionValue(),
+            TokenContract.functions.returnDate(),
+            TokenContract.functions.returnAmount(),
+            TokenContract.functions.purpose(),
+            TokenContract.functions.memo(),
+            TokenContract.functions.tradableExchange(),
+            TokenContract.functions.getImageURL(0),
+            TokenContract.functions.getImageURL(1),
+            TokenContract.functions.getImageURL(2),
+            TokenContract.functions.contactInformation(),
+            TokenContract.functions.privacyPolicy(),
+            TokenContract.functions.transferable(),
+            TokenContract.functions.personalInfoAddress(),
+            TokenContract.functions.initialOfferingStatus(),
+            TokenContract.functions.isRedeemed(),
+            # TokenList登録状態取得
+            ListContract.functions.getTokenByAddress(token_address)
+        ])
     interestRate = interestRate_int * 0.0001
-    interestPaymentDate_string = TokenContract.functions.interestPaymentDate().call()
     interestPaymentDate = \
         json.loads(interestPaymentDate_string.replace("'", '"').replace('True', 'true').replace('False', 'false')) \
         if interestPaymentDate_string else default_interest_payment_date()
-    redemptionDate = TokenContract.functions.redemptionDate().call()
-    redemptionValue = TokenContract.functions.redemptionValue().call()
-    returnDate = TokenContract.functions.returnDate().call()
-    returnDetails = TokenContract.functions.returnAmount().call()
-    purpose = TokenContract.functions.purpose().call()
-    memo = TokenContract.functions.memo().call()
-    tradableExchange = TokenContract.functions.tradableExchange().call()
-    image_1 = TokenContract.functions.getImageURL(0).call()
-    image_2 = TokenContract.functions.getImageURL(1).call()
-    image_3 = TokenContract.functions.getImageURL(2).call()
-    contact_information = TokenContract.functions.contactInformation().call()
-    privacy_policy = TokenContract.functions.privacyPolicy().call()
-    transferable = str(TokenContract.functions.transferable().call())
-    personalInfoAddress = TokenContract.functions.personalInfoAddress().call()
-    initial_offering_status = TokenContract.functions.initialOfferingStatus().call()
-    is_redeemed = TokenContract.functions.isRedeemed().call()
-
-    # TokenList登録状態取得
-    issuer = Issuer.query.get(session['issuer_id'])
-    list_contract_address = issuer.token_list_contract_address
-    ListContract = ContractUtils.get_contract('TokenList', list_contract_address)
-    token_struct = ListContract.functions.getTokenByAddress(token_address).call()
+    transferable = str(transferable)
+
     is_released = False
     if token_struct[0] == token_address:
         is_released = True
@@ -980,6 +951,8 @@ def setting(token_address: ChecksumAddress):
                     setTradableExchange(to_checksum_address(form.tradableExchange.data)). \
                     buildTransaction({'from': session['eth_account'], 'gas': Config.TX_GAS_LIMIT})
                 ContractUtils.send_transaction(transaction=tx, eth_account=session['eth_account'])
+                # インデクサがDEXアドレスを取得し直すよう、キャッシュを削除する
+                IDXTokenExchange.query.filter(IDXTokenExchange.token_address == TokenContract.address).delete()
 
             # PersonalInfoコントラクトアドレス変更
             if form.personalInfoAddress.data != personalInfoAddress:
@@ -1314,28 +1287,23 @@ def positions():
                     abi=json.loads(row.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
                 )
 
-                # Exchange
-                token_exchange_address = TokenContract.functions.tradableExchange().call()
+                # Exchange、トークン名称、トークン略称、総発行量、残高、償還状況
+                token_exchange_address, name, symbol, total_supply, balance, is_redeemed = \
+                    ContractUtils.batch_call([
+                        TokenContract.functions.tradableExchange(),
+                        TokenContract.functions.name(),
+                        TokenContract.functions.symbol(),
+                        TokenContract.functions.totalSupply(),
+                        TokenContract.functions.balanceOf(owner),
+                        TokenContract.functions.isRedeemed()
+                    ], use_cache=True)
                 ExchangeContract = ContractUtils.get_contract('IbetStraightBondExchange', token_exchange_address)
 
-                # トークン名称
-                name = TokenContract.functions.name().call()
-
-                # トークン略称
-                symbol = TokenContract.functions.symbol().call()
-
-                # 総発行量
-                total_supply = TokenContract.functions.totalSupply().call()
-
-                # 残高
-                balance = TokenContract.functions.balanceOf(owner).call()
-
-                # 償還状況
-                is_redeemed = TokenContract.functions.isRedeemed().call()
-
                 # 拘束中数量
                 try:
-                    commitment = ExchangeContract.functions.commitmentOf(owner, row.token_address).call()
+                    commitment = ContractUtils.cached_call(
+                        ExchangeContract.functions.commitmentOf(owner, row.token_address)
+                    )
                 except Exception as e:
                     logger.warning(e)
                     commitment = 0
@@ -1415,30 +1383,34 @@ def sell(token_address):
         abi=token_abi
     )
 
-    name = TokenContract.functions.name().call()
-    symbol = TokenContract.functions.symbol().call()
-    totalSupply = TokenContract.functions.totalSupply().call()
-    faceValue = TokenContract.functions.faceValue().call()
-    interestRate = TokenContract.functions.interestRate().call() * 0.0001
-    interestPaymentDate_string = TokenContract.functions.interestPaymentDate().call()
+    owner = session['eth_account']
+    name, symbol, totalSupply, faceValue, interestRate_int, interestPaymentDate_string, \
+        redemptionDate, redemptionValue, returnDate, returnDetails, purpose, memo, tradableExchange, \
+        balance, personalinfo_address = ContractUtils.batch_call([
+            TokenContract.functions.name(),
+            TokenContract.functions.symbol(),
+            TokenContract.functions.totalSupply(),
+            TokenContract.functions.faceValue(),
+            TokenContract.functions.interestRate(),
+            TokenContract.functions.interestPaymentDate(),
+            TokenContract.functions.redemptionDate(),
+            TokenContract.functions.redemptionValue(),
+            TokenContract.functions.returnDate(),
+            TokenContract.functions.returnAmount(),
+            TokenContract.functions.purpose(),
+            TokenContract.functions.memo(),
+            TokenContract.functions.tradableExchange(),
+            TokenContract.functions.balanceOf(owner),
+            TokenContract.functions.personalInfoAddress()
+        ])
+    interestRate = interestRate_int * 0.0001
     interestPaymentDate = \
         json.loads(interestPaymentDate_string.replace("'", '"').replace('True', 'true').replace('False', 'false')) \
             if interestPaymentDate_string else default_interest_payment_date()
-    redemptionDate = TokenContract.functions.redemptionDate().call()
-    redemptionValue = TokenContract.functions.redemptionValue().call()
-    returnDate = TokenContract.functions.returnDate().call()
-    returnDetails = TokenContract.functions.returnAmount().call()
-    purpose = TokenContract.functions.purpose().call()
-    memo = TokenContract.functions.memo().call()
-    tradableExchange = TokenContract.functions.tradableExchange().call()
-
-    owner = session['eth_account']
-    balance = TokenContract.functions.balanceOf(owner).call()
 
     if request.method == 'POST':
         if form.validate():
             # PersonalInfo Contract
-            personalinfo_address = TokenContract.functions.personalInfoAddress().call()
             personal_info_contract = ContractUtils.get_contract(
                 'PersonalInfo', personalinfo_address)
 
@@ -1450,10 +1422,14 @@ def sell(token_address):
             eth_account = session['eth_account']
             agent_account = issuer.agent_address
 
-            if personal_info_contract.functions.isRegistered(eth_account, eth_account).call() is False:
+            is_registered, account_approved = ContractUtils.batch_call([
+                personal_info_contract.functions.isRegistered(eth_account, eth_account),
+                PaymentGatewayContract.functions.accountApproved(eth_account, agent_account)
+            ])
+            if is_registered is False:
                 flash('発行体情報が未登録です。', 'error')
                 return redirect(url_for('.sell', token_address=token_address))
-            elif PaymentGatewayContract.functions.accountApproved(eth_account, agent_account).call() is False:
+            elif account_approved is False:
                 flash('銀行口座情報が未登録です。', 'error')
                 return redirect(url_for('.sell', token_address=token_address))
             else:
@@ -1621,38 +1597,34 @@ def applications_csv_download():
     application = json.loads(get_applications(token_address).data)
     token_name = json.loads(get_token_name(token_address).data)
 
-    f = io.StringIO()
-
-    # ヘッダー行
-    data_header = \
-        'token_name,' + \
-        'token_address,' + \
-        'account_address,' + \
-        'name,' + \
-        'email,' + \
-        'code,' + \
-        'requested_amount,' + \
-        'allot_amount,' + \
-        'balance\n'
-    f.write(data_header)
-
-    for item in application:
-        # データ行
-        data_row = \
-            token_name + ',' + token_address + ',' + item["account_address"] + ',' + \
-            item["account_name"] + ',' + item["account_email_address"] + ',' + item["data"] + ',' + \
-            str(item["requested_amount"]) + ',' + str(item["allotted_amount"]) + ',' + \
-            str(item["balance"]) + '\n'
-        f.write(data_row)
+    def generate_csv():
+        # ヘッダー行
+        data_header = \
+            'token_name,' + \
+            'token_address,' + \
+            'account_address,' + \
+            'name,' + \
+            'email,' + \
+            'code,' + \
+            'requested_amount,' + \
+            'allot_amount,' + \
+            'balance\n'
+        yield data_header
+
+        for item in application:
+            # データ行
+            data_row = \
+                token_name + ',' + token_address + ',' + item["account_address"] + ',' + \
+                item["account_name"] + ',' + item["account_email_address"] + ',' + item["data"] + ',' + \
+                str(item["requested_amount"]) + ',' + str(item["allotted_amount"]) + ',' + \
+                str(item["balance"]) + '\n'
+            yield data_row
 
     now = datetime.now(tz=JST)
-    res = make_response()
-    csvdata = f.getvalue()
-    res.data = csvdata.encode('sjis', 'ignore')
-    res.headers['Content-Type'] = 'text/plain'
-    res.headers['Content-Disposition'] = \
-        'attachment; filename=' + now.strftime("%Y%m%d%H%M%S") + 'bond_applications_list.csv'
-    return res
+    return CsvUtils.stream_response(
+        generate_csv(),
+        filename=now.strftime("%Y%m%d%H%M%S") + 'bond_applications_list.csv'
+    )
 
 
 # 申込一覧取得
@@ -1902,44 +1874,41 @@ def token_tracker_csv():
     if token is None:
         abort(404)
 
+    # サーバサイドカーソルで取得する（CSVの送信中に順次取得）
     tracks = Transfer.query.filter(Transfer.token_address == token_address). \
         order_by(desc(Transfer.block_timestamp)). \
-        all()
-
-    f = io.StringIO()
-
-    # ヘッダー行
-    data_header = \
-        'transaction_hash,' + \
-        'token_address,' + \
-        'account_address_from,' + \
-        'account_address_to,' + \
-        'transfer_amount,' + \
-        'block_timestamp\n'
-    f.write(data_header)
-
-    for track in tracks:
-        # utc→jst の変換
-        block_timestamp = track.block_timestamp.replace(tzinfo=timezone.utc).astimezone(JST). \
-            strftime("%Y/%m/%d %H:%M:%S %z")
-        # データ行
-        data_row = \
-            track.transaction_hash + ',' + \
-            track.token_address + ',' + \
-            track.account_address_from + ',' + \
-            track.account_address_to + ',' + \
-            str(track.transfer_amount) + ',' + \
-            block_timestamp + '\n'
-        f.write(data_row)
+        yield_per(1000)
+
+    def generate_csv():
+        # ヘッダー行
+        data_header = \
+            'transaction_hash,' + \
+            'token_address,' + \
+            'account_address_from,' + \
+            'account_address_to,' + \
+            'transfer_amount,' + \
+            'block_timestamp\n'
+        yield data_header
+
+        for track in tracks:
+            # utc→jst の変換
+            block_timestamp = track.block_timestamp.replace(tzinfo=timezone.utc).astimezone(JST). \
+                strftime("%Y/%m/%d %H:%M:%S %z")
+            # データ行
+            data_row = \
+                track.transaction_hash + ',' + \
+                track.token_address + ',' + \
+                track.account_address_from + ',' + \
+                track.account_address_to + ',' + \
+                str(track.transfer_amount) + ',' + \
+                block_timestamp + '\n'
+            yield data_row
 
     now = datetime.now(tz=JST)
-    res = make_response()
-    csvdata = f.getvalue()
-    res.data = csvdata.encode('sjis', 'ignore')
-    res.headers['Content-Type'] = 'text/plain'
-    res.headers['Content-Disposition'] = f"attachment; filename={now.strftime('%Y%m%d%H%M%S')}_bond_tracks.csv"
-
-    return res
+    return CsvUtils.stream_response(
+        generate_csv(),
+        filename=f"{now.strftime('%Y%m%d%H%M%S')}_bond_tracks.csv"
+    )
 
 
 #################################################
@@ -2066,17 +2035,17 @@ def ledger_download():
         bond_ledger[u"社債原簿管理人"][u"事務取扱場所"] = ledger_template.ledger_admin_location
 
         # 社債権者情報の更新
+        # DBから直近の個人情報を一括で取得
+        personal_info_list = PersonalInfoModel.get_personal_info_list(
+            issuer_address=issuer_address,
+            account_address_list=[item[u"アカウントアドレス"] for item in bond_ledger[u"社債権者"]]
+        )
         for i, item in enumerate(bond_ledger[u"社債権者"]):
             account_address = item[u"アカウントアドレス"]
-
-            # DBから直近の個人情報を取得
-            personal_info_record = PersonalInfoModel.query. \
-                filter(PersonalInfoModel.account_address == account_address). \
-                filter(PersonalInfoModel.issuer_address == issuer_address). \
-                first()
+            personal_info = personal_info_list.get(account_address)
 
             # DBに個人情報が存在しない場合は、コントラクトから個人情報を取得
-            if personal_info_record is None:
+            if personal_info is None:
                 # トークンで指定した個人情報コントラクトのアドレスを取得
                 TokenContract = TokenUtils.get_contract(
                     token_address=token_address,
@@ -2096,8 +2065,6 @@ def ledger_download():
                     account_address=account_address,
                     default_value=""
                 )
-            else:
-                personal_info = personal_info_record.personal_info
 
             bond_ledger[u"社債権者"][i][u"氏名または名称"] = personal_info.get("name", "")
             bond_ledger[u"社債権者"][i][u"住所"] = personal_info.get("address", "")
@@ -28,13 +28,13 @@ from datetime import datetime, timezone, timedelta
 from flask_wtf import FlaskForm as Form
 from flask import request, redirect, url_for, flash, make_response, render_template, abort, jsonify, session
 from flask_login import login_required, current_user
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, exists
 
 from app import db
 from app.models import Token, Order, Agreement, AgreementStatus, AddressType, ApplyFor, Transfer, \
-    Issuer, Consume, PersonalInfoContract, BulkTransfer, BulkTransferUpload
-from app.models import PersonalInfo as PersonalInfoModel
-from app.utils import ContractUtils, TokenUtils
+    Issuer, Consume, PersonalInfoContract, BulkTransfer, BulkTransferUpload, IDXTokenExchange, IDXBalanceEvent, \
+    TokenHolderBalance
+from app.utils import ContractUtils, CsvUtils, TokenUtils, Web3Utils
 from app.exceptions import EthRuntimeError
 from config import Config
 from . import coupon
@@ -43,10 +43,8 @@ from .forms import IssueCouponForm, SellForm, CancelOrderForm, TransferForm, Tra
 
 from web3 import Web3
 from eth_utils import to_checksum_address
-from web3.middleware import geth_poa_middleware
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+web3 = Web3Utils.get_web3()
 
 from logging import getLogger
 
@@ -185,9 +183,11 @@ def list():
                     abi=json.loads(row.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
                 )
                 # Token-Contractから情報を取得する
-                name = TokenContract.functions.name().call()
-                symbol = TokenContract.functions.symbol().call()
-                status = TokenContract.functions.status().call()
+                name, symbol, status = ContractUtils.batch_call([
+                    TokenContract.functions.name(),
+                    TokenContract.functions.symbol(),
+                    TokenContract.functions.status()
+                ], use_cache=True)
 
             # 作成日時（JST）
             created = datetime.fromtimestamp(row.created.timestamp(), JST).strftime("%Y/%m/%d %H:%M:%S %z")
@@ -276,44 +276,41 @@ def token_tracker_csv():
     if token is None:
         abort(404)
 
+    # サーバサイドカーソルで取得する（CSVの送信中に順次取得）
     tracks = Transfer.query.filter(Transfer.token_address == token_address). \
         order_by(desc(Transfer.block_timestamp)). \
-        all()
-
-    f = io.StringIO()
-
-    # ヘッダー行
-    data_header = \
-        'transaction_hash,' + \
-        'token_address,' + \
-        'account_address_from,' + \
-        'account_address_to,' + \
-        'transfer_amount,' + \
-        'block_timestamp\n'
-    f.write(data_header)
-
-    for track in tracks:
-        # utc→jst の変換
-        block_timestamp = track.block_timestamp.replace(tzinfo=timezone.utc).astimezone(JST). \
-            strftime("%Y/%m/%d %H:%M:%S %z")
-        # データ行
-        data_row = \
-            track.transaction_hash + ',' + \
-            track.token_address + ',' + \
-            track.account_address_from + ',' + \
-            track.account_address_to + ',' + \
-            str(track.transfer_amount) + ',' + \
-            block_timestamp + '\n'
-        f.write(data_row)
+        yield_per(1000)
+
+    def generate_csv():
+        # ヘッダー行
+        data_header = \
+            'transaction_hash,' + \
+            'token_address,' + \
+            'account_address_from,' + \
+            'account_address_to,' + \
+            'transfer_amount,' + \
+            'block_timestamp\n'
+        yield data_header
+
+        for track in tracks:
+            # utc→jst の変換
+            block_timestamp = track.block_timestamp.replace(tzinfo=timezone.utc).astimezone(JST). \
+                strftime("%Y/%m/%d %H:%M:%S %z")
+            # データ行
+            data_row = \
+                track.transaction_hash + ',' + \
+                track.token_address + ',' + \
+                track.account_address_from + ',' + \
+                track.account_address_to + ',' + \
+                str(track.transfer_amount) + ',' + \
+                block_timestamp + '\n'
+            yield data_row
 
     now = datetime.now(tz=JST)
-    res = make_response()
-    csvdata = f.getvalue()
-    res.data = csvdata.encode('sjis', 'ignore')
-    res.headers['Content-Type'] = 'text/plain'
-    res.headers['Content-Disposition'] = f"attachment; filename={now.strftime('%Y%m%d%H%M%S')}_coupon_tracks.csv"
-
-    return res
+    return CsvUtils.stream_response(
+        generate_csv(),
+        filename=f"{now.strftime('%Y%m%d%H%M%S')}_coupon_tracks.csv"
+    )
 
 
 ####################################################
@@ -337,33 +334,29 @@ def applications_csv_download():
     application = json.loads(get_applications(token_address).data)
     token_name = json.loads(get_token_name(token_address).data)
 
-    f = io.StringIO()
-
-    # ヘッダー行
-    data_header = \
-        'token_name,' + \
-        'token_address,' + \
-        'account_address,' + \
-        'name,' + \
-        'email,' + \
-        'code\n'
-    f.write(data_header)
-
-    for item in application:
-        # データ行
-        data_row = \
-            token_name + ',' + token_address + ',' + item["account_address"] + ',' + \
-            item["account_name"] + ',' + item["account_email_address"] + ',' + item["data"] + '\n'
-        f.write(data_row)
+    def generate_csv():
+        # ヘッダー行
+        data_header = \
+            'token_name,' + \
+            'token_address,' + \
+            'account_address,' + \
+            'name,' + \
+            'email,' + \
+            'code\n'
+        yield data_header
+
+        for item in application:
+            # データ行
+            data_row = \
+                token_name + ',' + token_address + ',' + item["account_address"] + ',' + \
+                item["account_name"] + ',' + item["account_email_address"] + ',' + item["data"] + '\n'
+            yield data_row
 
     now = datetime.now(tz=JST)
-    res = make_response()
-    csvdata = f.getvalue()
-    res.data = csvdata.encode('sjis', 'ignore')
-    res.headers['Content-Type'] = 'text/plain'
-    res.headers['Content-Disposition'] = \
-        'attachment; filename=' + now.strftime("%Y%m%d%H%M%S") + 'coupon_applications_list.csv'
-    return res
+    return CsvUtils.stream_response(
+        generate_csv(),
+        filename=now.strftime("%Y%m%d%H%M%S") + 'coupon_applications_list.csv'
+    )
 
 
 # 募集申込一覧取得（API）
@@ -511,30 +504,33 @@ def setting(token_address):
         address=token.token_address,
         abi=token_abi
     )
-    name = TokenContract.functions.name().call()
-    symbol = TokenContract.functions.symbol().call()
-    totalSupply = TokenContract.functions.totalSupply().call()
-    details = TokenContract.functions.details().call()
-    return_details = TokenContract.functions.returnDetails().call()
-    memo = TokenContract.functions.memo().call()
-    expirationDate = TokenContract.functions.expirationDate().call()
-    status = TokenContract.functions.status().call()
-    transferable = str(TokenContract.functions.transferable().call())
-    image_1 = TokenContract.functions.getImageURL(0).call()
-    image_2 = TokenContract.functions.getImageURL(1).call()
-    image_3 = TokenContract.functions.getImageURL(2).call()
-    tradableExchange = TokenContract.functions.tradableExchange().call()
-    contact_information = TokenContract.functions.contactInformation().call()
-    privacy_policy = TokenContract.functions.privacyPolicy().call()
-    initial_offering_status = TokenContract.functions.initialOfferingStatus().call()
-
-    # TokenListへの登録有無
     issuer = Issuer.query.get(session['issuer_id'])
     list_contract_address = issuer.token_list_contract_address
     ListContract = ContractUtils. \
         get_contract('TokenList', list_contract_address)
-    token_struct = ListContract.functions. \
-        getTokenByAddress(token_address).call()
+    name, symbol, totalSupply, details, return_details, memo, expirationDate, status, transferable, \
+        image_1, image_2, image_3, tradableExchange, contact_information, privacy_policy, \
+        initial_offering_status, token_struct = ContractUtils.batch_call([
+            TokenContract.functions.name(),
+            TokenContract.functions.symbol(),
+            TokenContract.functions.totalSupply(),
+            TokenContract.functions.details(),
+            TokenContract.functions.returnDetails(),
+            TokenContract.functions.memo(),
+            TokenContract.functions.expirationDate(),
+            TokenContract.functions.status(),
+            TokenContract.functions.transferable(),
+            TokenContract.functions.getImageURL(0),
+            TokenContract.functions.getImageURL(1),
+            TokenContract.functions.getImageURL(2),
+            TokenContract.functions.tradableExchange(),
+            TokenContract.functions.contactInformation(),
+            TokenContract.functions.privacyPolicy(),
+            TokenContract.functions.initialOfferingStatus(),
+            # TokenListへの登録有無
+            ListContract.functions.getTokenByAddress(token_address)
+        ])
+    transferable = str(transferable)
 
     isReleased = False
     if token_struct[0] == token_address:
@@ -564,6 +560,8 @@ def setting(token_address):
                     setTradableExchange(to_checksum_address(form.tradableExchange.data)). \
                     buildTransaction({'from': session['eth_account'], 'gas': Config.TX_GAS_LIMIT})
                 ContractUtils.send_transaction(transaction=tx, eth_account=session['eth_account'])
+                # インデクサがDEXアドレスを取得し直すよう、キャッシュを削除する
+                IDXTokenExchange.query.filter(IDXTokenExchange.token_address == TokenContract.address).delete()
 
             # トークン詳細変更
             if form.details.data != details:
@@ -697,25 +695,21 @@ def positions():
                     abi=json.loads(row.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
                 )
 
-                # Exchange
-                token_exchange_address = TokenContract.functions.tradableExchange().call()
+                # Exchange、トークン名称、トークン略称、総発行量、残高
+                token_exchange_address, name, symbol, total_supply, balance = ContractUtils.batch_call([
+                    TokenContract.functions.tradableExchange(),
+                    TokenContract.functions.name(),
+                    TokenContract.functions.symbol(),
+                    TokenContract.functions.totalSupply(),
+                    TokenContract.functions.balanceOf(owner)
+                ], use_cache=True)
                 ExchangeContract = ContractUtils.get_contract('IbetCouponExchange', token_exchange_address)
 
-                # トークン名称
-                name = TokenContract.functions.name().call()
-
-                # トークン略称
-                symbol = TokenContract.functions.symbol().call()
-
-                # 総発行量
-                total_supply = TokenContract.functions.totalSupply().call()
-
-                # 残高
-                balance = TokenContract.functions.balanceOf(owner).call()
-
                 # 拘束中数量
                 try:
-                    commitment = ExchangeContract.functions.commitmentOf(owner, row.token_address).call()
+                    commitment = ContractUtils.cached_call(
+                        ExchangeContract.functions.commitmentOf(owner, row.token_address)
+                    )
                 except Exception as e:
                     logger.warning(e)
                     commitment = 0
@@ -793,18 +787,20 @@ def sell(token_address):
         abi=token_abi
     )
 
-    name = TokenContract.functions.name().call()
-    symbol = TokenContract.functions.symbol().call()
-    totalSupply = TokenContract.functions.totalSupply().call()
-    details = TokenContract.functions.details().call()
-    expirationDate = TokenContract.functions.expirationDate().call()
-    memo = TokenContract.functions.memo().call()
-    transferable = TokenContract.functions.transferable().call()
-    tradableExchange = TokenContract.functions.tradableExchange().call()
-    status = TokenContract.functions.status().call()
-
     owner = session['eth_account']
-    balance = TokenContract.functions.balanceOf(owner).call()
+    name, symbol, totalSupply, details, expirationDate, memo, transferable, tradableExchange, status, \
+        balance = ContractUtils.batch_call([
+            TokenContract.functions.name(),
+            TokenContract.functions.symbol(),
+            TokenContract.functions.totalSupply(),
+            TokenContract.functions.details(),
+            TokenContract.functions.expirationDate(),
+            TokenContract.functions.memo(),
+            TokenContract.functions.transferable(),
+            TokenContract.functions.tradableExchange(),
+            TokenContract.functions.status(),
+            TokenContract.functions.balanceOf(owner)
+        ])
 
     if request.method == 'POST':
         if form.validate():
@@ -1132,49 +1128,37 @@ def used_csv_download():
     token_name = json.loads(get_token_name(token_address).data)
 
     # トークンの消費イベント（Consume）を検索
-    entries = Consume.query.filter(Consume.token_address == token_address).all()
-
-    # リスト作成
-    usage_list = []
-    for entry in entries:
-        usage = {
-            'block_timestamp': entry.block_timestamp.replace(tzinfo=timezone.utc).astimezone(JST).strftime(
-                "%Y/%m/%d %H:%M:%S %z"),
-            'consumer': entry.consumer_address,
-            'value': entry.used_amount
-        }
-        usage_list.append(usage)
+    # サーバサイドカーソルで取得する（CSVの送信中に順次取得）
+    entries = Consume.query.filter(Consume.token_address == token_address).yield_per(1000)
 
     # ファイル作成
-    f = io.StringIO()
-
-    # ヘッダー行
-    data_header = \
-        'token_name,' + \
-        'token_address,' + \
-        'timestamp,' + \
-        'account_address,' + \
-        'amount\n'
-    f.write(data_header)
-
-    for usage in usage_list:
-        # データ行
-        data_row = \
-            token_name + ',' + \
-            token_address + ',' + \
-            str(usage["block_timestamp"]) + ',' + \
-            str(usage["consumer"]) + ',' + \
-            str(usage["value"]) + '\n'
-        f.write(data_row)
+    def generate_csv():
+        # ヘッダー行
+        data_header = \
+            'token_name,' + \
+            'token_address,' + \
+            'timestamp,' + \
+            'account_address,' + \
+            'amount\n'
+        yield data_header
+
+        for entry in entries:
+            block_timestamp = entry.block_timestamp.replace(tzinfo=timezone.utc).astimezone(JST). \
+                strftime("%Y/%m/%d %H:%M:%S %z")
+            # データ行
+            data_row = \
+                token_name + ',' + \
+                token_address + ',' + \
+                block_timestamp + ',' + \
+                str(entry.consumer_address) + ',' + \
+                str(entry.used_amount) + '\n'
+            yield data_row
 
     now = datetime.now(tz=JST)
-    res = make_response()
-    csvdata = f.getvalue()
-    res.data = csvdata.encode('sjis')
-    res.headers['Content-Type'] = 'text/plain'
-    res.headers['Content-Disposition'] = 'attachment; filename=' + now.strftime("%Y%m%d%H%M%S") + \
-                                         'coupon_used_list.csv'
-    return res
+    return CsvUtils.stream_response(
+        generate_csv(),
+        filename=now.strftime("%Y%m%d%H%M%S") + 'coupon_used_list.csv'
+    )
 
 
 ####################################################
@@ -1206,53 +1190,49 @@ def holders_csv_download():
     logger.info(f'[{current_user.login_id}] coupon/holders_csv_download')
 
     token_address = request.form.get('token_address')
-    _holders = json.loads(get_holders(token_address).data)
+    _holders = get_holders(token_address)["data"]
     token_name = json.loads(get_token_name(token_address).data)
 
-    f = io.StringIO()
-
-    # ヘッダー行
-    data_header = f"token_name," \
-                  f"token_address," \
-                  f"account_address," \
-                  f"balance," \
-                  f"used_amount," \
-                  f"name," \
-                  f"birth_date," \
-                  f"postal_code," \
-                  f"address," \
-                  f"email" \
-                  f"\n"
-    f.write(data_header)
-
-    for _holder in _holders:
-        # Unicodeの各種ハイフン文字を半角ハイフン（U+002D）に変換する
-        try:
-            holder_address = re.sub('\u2010|\u2011|\u2012|\u2013|\u2014|\u2015|\u2212|\uff0d', '-', _holder["address"])
-        except TypeError:
-            holder_address = ""
-        # データ行
-        data_row = f"{token_name}," \
-                   f"{token_address}," \
-                   f"{_holder['account_address']}," \
-                   f"{str(_holder['balance'])}," \
-                   f"{str(_holder['used'])}," \
-                   f"{_holder['name']}," \
-                   f"{_holder['birth_date']}," \
-                   f"{_holder['postal_code']}," \
-                   f"{holder_address}," \
-                   f"{_holder['email']}" \
-                   f"\n"
-        f.write(data_row)
+    def generate_csv():
+        # ヘッダー行
+        data_header = f"token_name," \
+                      f"token_address," \
+                      f"account_address," \
+                      f"balance," \
+                      f"used_amount," \
+                      f"name," \
+                      f"birth_date," \
+                      f"postal_code," \
+                      f"address," \
+                      f"email" \
+                      f"\n"
+        yield data_header
+
+        for _holder in _holders:
+            # Unicodeの各種ハイフン文字を半角ハイフン（U+002D）に変換する
+            try:
+                holder_address = re.sub('\u2010|\u2011|\u2012|\u2013|\u2014|\u2015|\u2212|\uff0d', '-', _holder["address"])
+            except TypeError:
+                holder_address = ""
+            # データ行
+            data_row = f"{token_name}," \
+                       f"{token_address}," \
+                       f"{_holder['account_address']}," \
+                       f"{str(_holder['balance'])}," \
+                       f"{str(_holder['used'])}," \
+                       f"{_holder['name']}," \
+                       f"{_holder['birth_date']}," \
+                       f"{_holder['postal_code']}," \
+                       f"{holder_address}," \
+                       f"{_holder['email']}" \
+                       f"\n"
+            yield data_row
 
     now = datetime.now(tz=JST)
-    res = make_response()
-    csvdata = f.getvalue()
-    res.data = csvdata.encode('sjis', 'ignore')
-    res.headers['Content-Type'] = 'text/plain'
-    res.headers['Content-Disposition'] = 'attachment; filename=' + now.strftime("%Y%m%d%H%M%S") + \
-                                         'coupon_holders_list.csv'
-    return res
+    return CsvUtils.stream_response(
+        generate_csv(),
+        filename=now.strftime("%Y%m%d%H%M%S") + 'coupon_holders_list.csv'
+    )
 
 
 # 保有者一覧取得（API）
@@ -1268,6 +1248,12 @@ def get_holders(token_address):
 
     DEFAULT_VALUE = "--"
 
+    # query parameters
+    draw = int(request.args.get("draw")) if request.args.get("draw") else None  # record the number of operations
+    start = int(request.args.get("start")) if request.args.get("start") else None  # start position
+    length = int(request.args.get("length")) if request.args.get("length") else None  # length of each page
+    search_address = request.args.get("search[value]")  # search keyword
+
     token_owner = session['eth_account']
     issuer = Issuer.query.get(session['issuer_id'])
 
@@ -1280,88 +1266,93 @@ def get_holders(token_address):
 
     # DEXコントラクトアドレス取得
     try:
-        tradable_exchange = TokenContract.functions.tradableExchange().call()
+        tradable_exchange = ContractUtils.cached_call(TokenContract.functions.tradableExchange())
     except Exception as err:
         logger.error(f"Failed to get token attributes: {err}")
         tradable_exchange = Config.ZERO_ADDRESS
 
-    # Transferイベントを検索
-    # →　残高を保有している可能性のあるアドレスを抽出
-    # →　保有者リストをユニークにする
-    transfer_events = Transfer.query. \
-        distinct(Transfer.account_address_to). \
-        filter(Transfer.token_address == token_address).all()
-
-    holders_temp = [token_owner]  # 発行体アドレスをリストに追加
-    for event in transfer_events:
-        holders_temp.append(event.account_address_to)
+    # 保有者と残高を取得（残高、または使用済数量が存在する保有者）
+    used_condition = exists(). \
+        where(IDXBalanceEvent.token_address == TokenHolderBalance.token_address). \
+        where(IDXBalanceEvent.account_address == TokenHolderBalance.account_address). \
+        where(IDXBalanceEvent.event == "Consume")
+    holder_page = TokenUtils.get_holder_balances(
+        token_contract=TokenContract,
+        token_owner=token_owner,
+        search_address=search_address,
+        start=start,
+        length=length,
+        holding_only=True,
+        holding_condition=used_condition,
+        with_personal_info=True
+    )
 
-    holders_uniq = []
-    for x in holders_temp:
-        if x not in holders_uniq:
-            holders_uniq.append(x)
+    # 使用済数量を取得
+    used_amounts = ContractUtils.batch_call([
+        TokenContract.functions.usedOf(account_address) for account_address, _ in holder_page.holders
+    ])
 
     # 保有者情報抽出
     _holders = []
-    for account_address in holders_uniq:
-        balance = TokenContract.functions.balanceOf(account_address).call()
-        used = TokenContract.functions.usedOf(account_address).call()
-        if balance > 0 or used > 0:  # 残高（balance）、または使用済（used）が存在する情報を抽出
-            # アドレス種別判定
-            if account_address == token_owner:
-                address_type = AddressType.ISSUER.value
-            elif account_address == tradable_exchange:
-                address_type = AddressType.EXCHANGE.value
-            else:
-                address_type = AddressType.OTHERS.value
-
-            # 保有者情報：デフォルト値（個人情報なし）
-            _holder = {
-                'account_address': account_address,
-                'key_manager': DEFAULT_VALUE,
-                'name': DEFAULT_VALUE,
-                'postal_code': DEFAULT_VALUE,
-                'email': DEFAULT_VALUE,
-                'address': DEFAULT_VALUE,
-                'birth_date': DEFAULT_VALUE,
-                'balance': balance,
-                'used': used,
-                'address_type': address_type
-            }
-
-            if address_type == AddressType.ISSUER.value:  # 保有者が発行体の場合
-                _holder["name"] = issuer.issuer_name or DEFAULT_VALUE
-                _holders.append(_holder)
-            else:  # 保有者が発行体以外の場合
-                record = PersonalInfoModel.query. \
-                    filter(PersonalInfoModel.account_address == account_address). \
-                    filter(PersonalInfoModel.issuer_address == token_owner). \
-                    first()
+    for (account_address, balance), used in zip(holder_page.holders, used_amounts):
+        # アドレス種別判定
+        if account_address == token_owner:
+            address_type = AddressType.ISSUER.value
+        elif account_address == tradable_exchange:
+            address_type = AddressType.EXCHANGE.value
+        else:
+            address_type = AddressType.OTHERS.value
+
+        # 保有者情報：デフォルト値（個人情報なし）
+        _holder = {
+            'account_address': account_address,
+            'key_manager': DEFAULT_VALUE,
+            'name': DEFAULT_VALUE,
+            'postal_code': DEFAULT_VALUE,
+            'email': DEFAULT_VALUE,
+            'address': DEFAULT_VALUE,
+            'birth_date': DEFAULT_VALUE,
+            'balance': balance,
+            'used': used,
+            'address_type': address_type
+        }
+
+        if address_type == AddressType.ISSUER.value:  # 保有者が発行体の場合
+            _holder["name"] = issuer.issuer_name or DEFAULT_VALUE
+            _holders.append(_holder)
+        else:  # 保有者が発行体以外の場合
+            decrypted_personal_info = holder_page.personal_info.get(account_address)
+
+            if decrypted_personal_info is not None:
+                key_manager = decrypted_personal_info.get("key_manager") or DEFAULT_VALUE
+                name = decrypted_personal_info.get("name") or DEFAULT_VALUE
+                postal_code = decrypted_personal_info.get("postal_code") or DEFAULT_VALUE
+                address = decrypted_personal_info.get("address") or DEFAULT_VALUE
+                email = decrypted_personal_info.get("email") or DEFAULT_VALUE
+                birth_date = decrypted_personal_info.get("birth") or DEFAULT_VALUE
+                _holder = {
+                    'account_address': account_address,
+                    'key_manager': key_manager,
+                    'name': name,
+                    'postal_code': postal_code,
+                    'address': address,
+                    'email': email,
+                    'birth_date': birth_date,
+                    'balance': balance,
+                    'used': used,
+                    'address_type': address_type
+                }
+
+            _holders.append(_holder)
+
+    res_body = {
+        "draw": draw,
+        "recordsTotal": holder_page.records_total,
+        "recordsFiltered": holder_page.records_filtered,
+        "data": _holders
+    }
 
-                if record is not None:
-                    decrypted_personal_info = record.personal_info
-                    key_manager = decrypted_personal_info.get("key_manager") or DEFAULT_VALUE
-                    name = decrypted_personal_info.get("name") or DEFAULT_VALUE
-                    postal_code = decrypted_personal_info.get("postal_code") or DEFAULT_VALUE
-                    address = decrypted_personal_info.get("address") or DEFAULT_VALUE
-                    email = decrypted_personal_info.get("email") or DEFAULT_VALUE
-                    birth_date = decrypted_personal_info.get("birth") or DEFAULT_VALUE
-                    _holder = {
-                        'account_address': account_address,
-                        'key_manager': key_manager,
-                        'name': name,
-                        'postal_code': postal_code,
-                        'address': address,
-                        'email': email,
-                        'birth_date': birth_date,
-                        'balance': balance,
-                        'used': used,
-                        'address_type': address_type
-                    }
-
-                _holders.append(_holder)
-
-    return jsonify(_holders)
+    return res_body
 
 
 # トークン名称取得（API）
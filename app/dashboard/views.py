@@ -17,6 +17,7 @@ limitations under the License.
 SPDX-License-Identifier: Apache-2.0
 """
 
+from datetime import datetime
 import json
 
 from flask import render_template, jsonify, session
@@ -24,19 +25,19 @@ from flask_login import login_required, current_user
 
 from . import dashboard
 from config import Config
-from app.utils import ContractUtils
+from app.utils import ContractUtils, Web3Utils
 
 from logging import getLogger
 
-from ..models import Token
+from ..models import (
+    Token,
+    BatchTaskMetrics
+)
 
 logger = getLogger('api')
 
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+web3 = Web3Utils.get_web3()
 
 
 @dashboard.route('/main', methods=['GET'])
@@ -77,17 +78,20 @@ def token_list_share():
                 )
 
                 # Token-Contractから情報を取得する
-                name = TokenContract.functions.name().call()
-                symbol = TokenContract.functions.symbol().call()
-                _, dividend_record_date, _ = TokenContract.functions.dividendInformation().call()
+                name, symbol, dividend_information, cancellation_date, total_supply = ContractUtils.batch_call([
+                    TokenContract.functions.name(),
+                    TokenContract.functions.symbol(),
+                    TokenContract.functions.dividendInformation(),
+                    TokenContract.functions.cancellationDate(),
+                    TokenContract.functions.totalSupply()
+                ], use_cache=True)
+                _, dividend_record_date, _ = dividend_information
                 if dividend_record_date != "":
                     dividend_record_date = dividend_record_date[:4] + '/' + dividend_record_date[4:6] + \
                                            '/' + dividend_record_date[6:]
-                cancellation_date = TokenContract.functions.cancellationDate().call()
                 if cancellation_date != "":
                     cancellation_date = cancellation_date[:4] + '/' + cancellation_date[4:6] + \
                                         '/' + cancellation_date[6:]
-                total_supply = TokenContract.functions.totalSupply().call()
 
             token_list.append({
                 'name': name,
@@ -129,12 +133,14 @@ def token_list_bond():
                 )
 
                 # Token-Contractから情報を取得する
-                name = TokenContract.functions.name().call()
-                symbol = TokenContract.functions.symbol().call()
-                redemption_date = TokenContract.functions.redemptionDate().call()
+                name, symbol, redemption_date, total_supply = ContractUtils.batch_call([
+                    TokenContract.functions.name(),
+                    TokenContract.functions.symbol(),
+                    TokenContract.functions.redemptionDate(),
+                    TokenContract.functions.totalSupply()
+                ], use_cache=True)
                 if redemption_date != "":
                     redemption_date = redemption_date[:4] + '/' + redemption_date[4:6] + '/' + redemption_date[6:]
-                total_supply = TokenContract.functions.totalSupply().call()
 
             token_list.append({
                 'name': name,
@@ -175,17 +181,19 @@ def token_list_membership():
                 )
 
                 # Token-Contractから情報を取得する
-                name = TokenContract.functions.name().call()
-                symbol = TokenContract.functions.symbol().call()
-                total_supply = TokenContract.functions.totalSupply().call()
-                tradable_exchange = TokenContract.functions.tradableExchange().call()
+                name, symbol, total_supply, tradable_exchange = ContractUtils.batch_call([
+                    TokenContract.functions.name(),
+                    TokenContract.functions.symbol(),
+                    TokenContract.functions.totalSupply(),
+                    TokenContract.functions.tradableExchange()
+                ], use_cache=True)
 
                 # 現在値の取得
                 ExchangeContract = ContractUtils.get_contract(
                     'IbetMembershipExchange',
                     tradable_exchange
                 )
-                last_price = ExchangeContract.functions.lastPrice(row.token_address).call()
+                last_price = ContractUtils.cached_call(ExchangeContract.functions.lastPrice(row.token_address))
 
             token_list.append({
                 'name': name,
@@ -226,10 +234,12 @@ def token_list_coupon():
                 )
 
                 # Token-Contractから情報を取得する
-                name = TokenContract.functions.name().call()
-                symbol = TokenContract.functions.symbol().call()
-                total_supply = TokenContract.functions.totalSupply().call()
-                tradable_exchange = TokenContract.functions.tradableExchange().call()
+                name, symbol, total_supply, tradable_exchange = ContractUtils.batch_call([
+                    TokenContract.functions.name(),
+                    TokenContract.functions.symbol(),
+                    TokenContract.functions.totalSupply(),
+                    TokenContract.functions.tradableExchange()
+                ], use_cache=True)
 
                 # Exchange-Contractへの接続
                 ExchangeContract = ContractUtils.get_contract(
@@ -238,7 +248,7 @@ def token_list_coupon():
                 )
 
                 # Token-Contractから情報を取得する
-                last_price = ExchangeContract.functions.lastPrice(row.token_address).call()
+                last_price = ContractUtils.cached_call(ExchangeContract.functions.lastPrice(row.token_address))
 
             token_list.append({
                 'name': name,
@@ -251,3 +261,23 @@ def token_list_coupon():
             logger.exception(e)
             pass
     return jsonify(token_list)
+
+
+@dashboard.route('/batch_metrics', methods=['GET'])
+@login_required
+def batch_metrics():
+    """バッチ処理のメトリクス（同期済ブロック・最新ブロックとの差・処理件数・エラー件数・レイテンシ）
+
+    メトリクスはバッチ処理から一定間隔で書き込まれる（Config.BATCH_METRICS_INTERVAL）。
+    最終書き込みからの経過時間が長いタスクは停止している。
+    """
+    now = datetime.utcnow()
+    metrics_list = []
+    for row in BatchTaskMetrics.query.order_by(BatchTaskMetrics.task_name).all():
+        metrics_list.append({
+            'task_name': row.task_name,
+            'modified': row.modified.isoformat(),
+            'seconds_since_modified': int((now - row.modified).total_seconds()),
+            'metrics': row.metrics
+        })
+    return jsonify(metrics_list)
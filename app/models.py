@@ -37,19 +37,20 @@ from werkzeug.security import (
     check_password_hash
 )
 from web3 import Web3
-from web3.middleware import geth_poa_middleware
 
 from . import db, login_manager
 from config import Config
 from logging import getLogger
 
 from .exceptions import EthRuntimeError
-from .utils import ContractUtils
+from .utils import (
+    ContractUtils,
+    Web3Utils
+)
 
 logger = getLogger('api')
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+web3 = Web3Utils.get_web3()
 
 
 @login_manager.user_loader
@@ -342,6 +343,48 @@ class HolderList(db.Model):
     created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
 
+class HolderListJobStatus(Enum):
+    """保有者名簿CSV作成ジョブのステータス"""
+    PENDING = 0  # 未処理
+    PROCESSING = 1  # 処理中
+    SUCCEEDED = 2  # 正常終了
+    FAILED = 3  # 異常終了
+
+
+class HolderListJob(db.Model):
+    """保有者名簿CSV作成ジョブ
+
+    同一トークン・同一ブロック高の作成依頼は1つのジョブにまとめる。
+    """
+    __tablename__ = 'holder_list_job'
+    __table_args__ = (
+        db.UniqueConstraint('token_address', 'block_number'),
+    )
+
+    # ジョブID
+    job_id = db.Column(db.String(36), primary_key=True)
+    # 発行体アカウントアドレス
+    eth_account = db.Column(db.String(42), nullable=False)
+    # トークンアドレス
+    token_address = db.Column(db.String(42), nullable=False)
+    # トークン種別
+    template_id = db.Column(db.Integer, nullable=False)
+    # 作成依頼時のブロック高
+    block_number = db.Column(db.BigInteger, nullable=False)
+    # ステータス（HolderListJobStatus）
+    status = db.Column(db.Integer, nullable=False, default=HolderListJobStatus.PENDING.value, index=True)
+    # 保有者名簿CSVのシーケンスID（正常終了時）
+    holder_list_id = db.Column(db.Integer)
+    # 作成タイムスタンプ
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # 更新タイムスタンプ
+    modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<HolderListJob(job_id={self.job_id}, token_address={self.token_address}, " \
+               f"block_number={self.block_number}, status={self.status})>"
+
+
 class UTXO(db.Model):
     """UTXO"""
     __tablename__ = "utxo"
@@ -437,6 +480,9 @@ class CorporateBondLedgerTemplate(db.Model):
 class Transfer(db.Model):
     """Token Transfer Events (INDEX)"""
     __tablename__ = 'transfer'
+    __table_args__ = (
+        db.UniqueConstraint('transaction_hash', 'token_address', 'log_index'),
+    )
 
     # Sequence ID
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -452,11 +498,67 @@ class Transfer(db.Model):
     transfer_amount = db.Column(db.Integer)
     # Block Timestamp
     block_timestamp = db.Column(db.DateTime)
+    # Block Number
+    block_number = db.Column(db.BigInteger, index=True)
+    # Log Index
+    log_index = db.Column(db.Integer)
+
+
+class IDXBalanceEvent(db.Model):
+    """Token Balance Change Events other than Transfer (INDEX)
+
+    Issue, Redeem, Lock, Unlock and Consume events which change balanceOf of an account
+    """
+    __tablename__ = 'idx_balance_event'
+    __table_args__ = (
+        db.UniqueConstraint('transaction_hash', 'token_address', 'log_index'),
+    )
+
+    # Sequence ID
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Transaction Hash
+    transaction_hash = db.Column(db.String(66), index=True)
+    # Token Address
+    token_address = db.Column(db.String(42), index=True)
+    # Event Name
+    event = db.Column(db.String(20), nullable=False)
+    # Account Address
+    account_address = db.Column(db.String(42), index=True)
+    # Change of the Balance (negative on decrease)
+    amount = db.Column(db.BigInteger, nullable=False)
+    # Block Number
+    block_number = db.Column(db.BigInteger, index=True)
+    # Log Index
+    log_index = db.Column(db.Integer)
+
+
+class TokenHolderBalance(db.Model):
+    """Token Balance of Holders (INDEX)
+
+    Maintained by indexer_Transfer from the Transfer events and the IDXBalanceEvent events.
+    The balance includes the amount pending for transfer approval (IbetShare).
+
+    NOTE: Tokens issued without an event (e.g. by the constructor) are not included,
+    so the balance of the token owner has to be read from the contract.
+    """
+    __tablename__ = 'token_holder_balance'
+
+    # Token Address
+    token_address = db.Column(db.String(42), primary_key=True)
+    # Account Address
+    account_address = db.Column(db.String(42), primary_key=True)
+    # Balance
+    balance = db.Column(db.BigInteger, nullable=False)
+    # Block Number of the Last Change
+    updated_block = db.Column(db.BigInteger, nullable=False)
 
 
 class ApplyFor(db.Model):
     """募集申込イベント"""
     __tablename__ = 'apply_for'
+    __table_args__ = (
+        db.UniqueConstraint('transaction_hash', 'token_address', 'log_index'),
+    )
 
     # シーケンスID
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -470,6 +572,10 @@ class ApplyFor(db.Model):
     amount = db.Column(db.Integer)
     # ブロックタイムスタンプ
     block_timestamp = db.Column(db.DateTime)
+    # ブロック番号
+    block_number = db.Column(db.BigInteger, index=True)
+    # ログインデックス
+    log_index = db.Column(db.Integer)
 
     def __repr__(self):
         return "<ApplyFor('transaction_hash'='%s', 'token_address'='%s')>" % \
@@ -483,6 +589,9 @@ class ApplyFor(db.Model):
 class Consume(db.Model):
     """トークン消費イベント"""
     __tablename__ = 'consume'
+    __table_args__ = (
+        db.UniqueConstraint('transaction_hash', 'token_address', 'log_index'),
+    )
 
     # トランザクションハッシュ
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -500,6 +609,10 @@ class Consume(db.Model):
     used_amount = db.Column(db.Integer)
     # ブロックタイムスタンプ
     block_timestamp = db.Column(db.DateTime)
+    # ブロック番号
+    block_number = db.Column(db.BigInteger, index=True)
+    # ログインデックス
+    log_index = db.Column(db.Integer)
 
     def __repr__(self):
         return "<Consume('transaction_hash'='%s', 'token_address'='%s')>" % \
@@ -513,6 +626,9 @@ class Consume(db.Model):
 class Order(db.Model):
     """注文イベント"""
     __tablename__ = 'order'
+    __table_args__ = (
+        db.UniqueConstraint('exchange_address', 'order_id'),
+    )
 
     # シーケンスID
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -536,6 +652,10 @@ class Order(db.Model):
     agent_address = db.Column(db.String(42))
     # 注文取消区分
     is_cancelled = db.Column(db.Boolean)
+    # 注文ブロック番号
+    block_number = db.Column(db.BigInteger, index=True)
+    # 注文取消ブロック番号
+    cancelled_block_number = db.Column(db.BigInteger, index=True)
 
     def __repr__(self):
         return "<Order('token_address'='%s', 'exchange_address'='%s', 'order_id'='%i')>" % \
@@ -546,9 +666,38 @@ class Order(db.Model):
         return Order.id
 
 
+class IDXOrderAmountEvent(db.Model):
+    """Order Amount Change Events (INDEX)
+
+    Agree and SettlementNG events applied to the remaining amount of an order by the Order indexer
+    """
+    __tablename__ = 'idx_order_amount_event'
+    __table_args__ = (
+        db.UniqueConstraint('exchange_address', 'order_id', 'agreement_id', 'event'),
+    )
+
+    # Sequence ID
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Exchange Address
+    exchange_address = db.Column(db.String(42), index=True)
+    # Order ID
+    order_id = db.Column(db.Integer)
+    # Agreement ID
+    agreement_id = db.Column(db.Integer)
+    # Event Name (Agree or SettlementNG)
+    event = db.Column(db.String(20), nullable=False)
+    # Amount of the Agreement
+    amount = db.Column(db.BigInteger, nullable=False)
+    # Block Number
+    block_number = db.Column(db.BigInteger, index=True)
+
+
 class Agreement(db.Model):
     """約定イベント"""
     __tablename__ = 'agreement'
+    __table_args__ = (
+        db.UniqueConstraint('exchange_address', 'order_id', 'agreement_id'),
+    )
 
     # シーケンスID
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -574,6 +723,10 @@ class Agreement(db.Model):
     agent_address = db.Column(db.String(42))
     # 約定ステータス
     status = db.Column(db.Integer)
+    # 約定ブロック番号
+    block_number = db.Column(db.BigInteger, index=True)
+    # 約定ステータス更新ブロック番号
+    status_block_number = db.Column(db.BigInteger, index=True)
 
     def __repr__(self):
         return "<Agreement('token_address'='%s', 'exchange_address'='%s', 'order_id'='%i', 'agreement_id'='%i')>" % \
@@ -611,12 +764,18 @@ class IDXTransferApproval(db.Model):
     application_datetime = db.Column(db.DateTime)
     # Application Blocktimestamp
     application_blocktimestamp = db.Column(db.DateTime)
+    # Application Block Number
+    application_block_number = db.Column(db.BigInteger, index=True)
     # Approval Datetime
     approval_datetime = db.Column(db.DateTime)
     # Approval Blocktimestamp
     approval_blocktimestamp = db.Column(db.DateTime)
+    # Approval Block Number
+    approval_block_number = db.Column(db.BigInteger, index=True)
     # Cancellation Status
     cancelled = db.Column(db.Boolean)
+    # Cancellation Block Number
+    cancellation_block_number = db.Column(db.BigInteger, index=True)
 
 
 class TransferApprovalHistory(db.Model):
@@ -633,19 +792,119 @@ class TransferApprovalHistory(db.Model):
     result = db.Column(db.Integer)
 
 
+class IDXBlockNumber(db.Model):
+    """Synchronized Block Number of Indexers (INDEX)"""
+    __tablename__ = 'idx_block_number'
+    __table_args__ = (
+        db.UniqueConstraint('indexer_name', 'contract_address'),
+    )
+
+    # Sequence Id
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Indexer Name
+    indexer_name = db.Column(db.String(64), nullable=False)
+    # Contract Address (Token or Exchange)
+    contract_address = db.Column(db.String(42), nullable=False)
+    # Latest Synchronized Block Number
+    latest_block_number = db.Column(db.BigInteger)
+
+
+class IDXBlockHash(db.Model):
+    """Recent Block Hash of Indexers (INDEX)"""
+    __tablename__ = 'idx_block_hash'
+    __table_args__ = (
+        db.UniqueConstraint('indexer_name', 'block_number'),
+    )
+
+    # Sequence Id
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Indexer Name
+    indexer_name = db.Column(db.String(64), nullable=False)
+    # Block Number
+    block_number = db.Column(db.BigInteger, nullable=False)
+    # Block Hash
+    block_hash = db.Column(db.String(66), nullable=False)
+
+
+class IDXBlockTimestamp(db.Model):
+    """Block Timestamp (INDEX)"""
+    __tablename__ = 'idx_block_timestamp'
+
+    # Block Number
+    block_number = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    # Block Timestamp (unixtime)
+    timestamp = db.Column(db.BigInteger, nullable=False)
+
+
+class IDXTokenExchange(db.Model):
+    """Tradable Exchange of Tokens (INDEX)"""
+    __tablename__ = 'idx_token_exchange'
+
+    # Token Address
+    token_address = db.Column(db.String(42), primary_key=True)
+    # Exchange Address
+    exchange_address = db.Column(db.String(42), index=True)
+
+
+class BatchTaskMetrics(db.Model):
+    """Metrics of Batch Tasks"""
+    __tablename__ = 'batch_task_metrics'
+
+    # Task Name (e.g. INDEXER-Transfer)
+    task_name = db.Column(db.String(64), primary_key=True)
+    # Metrics
+    metrics = db.Column(db.JSON, nullable=False)
+    # Last Written Datetime
+    modified = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class IDXContractUpdate(db.Model):
+    """Last State Change of Contracts (INDEX)
+
+    Invalidates the contract call cache (ContractCallCache)
+    """
+    __tablename__ = 'idx_contract_update'
+
+    # Contract Address
+    contract_address = db.Column(db.String(42), primary_key=True)
+    # Block Number of the Last Observed Event (or Transaction)
+    block_number = db.Column(db.BigInteger, nullable=False)
+    # Last Written Datetime
+    modified = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class ContractCallResult(db.Model):
+    """Contract Call Results (shared storage of ContractCallCache)"""
+    __tablename__ = 'contract_call_result'
+
+    # Contract Address
+    contract_address = db.Column(db.String(42), primary_key=True)
+    # Call Data (function selector and arguments)
+    call_data = db.Column(db.Text, primary_key=True)
+    # Block Number of the Call
+    block_number = db.Column(db.BigInteger, nullable=False)
+    # Return Data
+    result = db.Column(db.Text, nullable=False)
+    # Last Written Datetime
+    modified = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
 ########################################################
 # 購入者情報
 ########################################################
 class PersonalInfo(db.Model):
     """購入者個人情報（復号化済）"""
     __tablename__ = 'personalinfo'
+    __table_args__ = (
+        db.Index('ix_personalinfo_issuer_address_account_address', 'issuer_address', 'account_address'),
+    )
 
     # シーケンスID
     id = db.Column(db.Integer, primary_key=True)
     # アカウントアドレス
     account_address = db.Column(db.String(42), index=True)
     # 発行体アドレス
-    issuer_address = db.Column(db.String(42), index=True)
+    issuer_address = db.Column(db.String(42))
     # 個人情報
     #   {
     #       "key_manager": "string",
@@ -664,6 +923,33 @@ class PersonalInfo(db.Model):
     def __repr__(self):
         return f"<PersonalInfo('account_address'={self.account_address}, 'issuer_address'={self.issuer_address}>"
 
+    # IN句に指定するアカウントアドレスの最大件数
+    IN_CLAUSE_SIZE = 1000
+
+    @classmethod
+    def get_personal_info_list(cls, issuer_address: str, account_address_list: list, db_session=None) -> dict:
+        """個人情報取得（一括）
+
+        :param issuer_address: 発行体アドレス
+        :param account_address_list: アカウントアドレスのリスト
+        :param db_session: DBセッション。Flaskアプリ以外の場合、必須。
+        :return: アカウントアドレスごとの個人情報（登録されていないアカウントは含まない）
+        """
+        if db_session is None:
+            db_session = db.session
+        account_address_list = list(dict.fromkeys(account_address_list))
+        personal_info_list = {}
+        for i in range(0, len(account_address_list), cls.IN_CLAUSE_SIZE):
+            records = db_session.query(cls). \
+                filter(cls.issuer_address == issuer_address). \
+                filter(cls.account_address.in_(account_address_list[i:i + cls.IN_CLAUSE_SIZE])). \
+                order_by(cls.id.desc()). \
+                all()
+            # 同一アカウントのレコードが複数ある場合は、indexerが更新する最初のレコードを優先する
+            for record in records:
+                personal_info_list[record.account_address] = record.personal_info
+        return personal_info_list
+
 
 class PersonalInfoBlockNumber(db.Model):
     """購入者個人情報の同期済blockNumber"""
@@ -691,12 +977,7 @@ class PersonalInfoContract:
             contract_address = issuer.personal_info_contract_address
         else:
             contract_address = to_checksum_address(custom_personal_info_address)
-        contract_file = f"contracts/PersonalInfo.json"
-        contract_json = json.load(open(contract_file, "r"))
-        self.personal_info_contract = web3.eth.contract(
-            address=to_checksum_address(contract_address),
-            abi=contract_json['abi'],
-        )
+        self.personal_info_contract = ContractUtils.get_contract("PersonalInfo", contract_address)
 
     def get_info(self, account_address: str, default_value=None):
         """個人情報取得
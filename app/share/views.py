@@ -44,14 +44,9 @@ from flask_login import (
     login_required,
     current_user
 )
-from sqlalchemy import (
-    desc,
-    or_
-)
+from sqlalchemy import desc
 from eth_utils import to_checksum_address
 from web3 import Web3
-from web3.middleware import geth_poa_middleware
-from web3.exceptions import ABIFunctionNotFound
 
 from config import Config
 from logging import getLogger
@@ -76,20 +71,20 @@ from app.models import (
     HolderList,
     PersonalInfoContract,
     BulkTransfer,
-    BulkTransferUpload,
-    PersonalInfo as PersonalInfoModel
+    BulkTransferUpload
 )
 from app.utils import (
     ContractUtils,
-    TokenUtils
+    CsvUtils,
+    TokenUtils,
+    Web3Utils
 )
 from app.exceptions import EthRuntimeError
 
 logger = getLogger('api')
 JST = timezone(timedelta(hours=+9), 'JST')
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+web3 = Web3Utils.get_web3()
 
 
 ####################################################
@@ -268,9 +263,11 @@ def list():
                 )
 
                 # Token-Contractから情報を取得する
-                name = TokenContract.functions.name().call()
-                symbol = TokenContract.functions.symbol().call()
-                status = TokenContract.functions.status().call()
+                name, symbol, status = ContractUtils.batch_call([
+                    TokenContract.functions.name(),
+                    TokenContract.functions.symbol(),
+                    TokenContract.functions.status()
+                ], use_cache=True)
 
             created = _to_jst(row.created).strftime("%Y/%m/%d %H:%M:%S %z") if row.created is not None else '--'
 
@@ -315,31 +312,39 @@ def setting(token_address):
 
     # トークン情報の参照
     TokenContract = web3.eth.contract(address=token.token_address, abi=token_abi)
-    name = TokenContract.functions.name().call()
-    symbol = TokenContract.functions.symbol().call()
-    totalSupply = TokenContract.functions.totalSupply().call()
-    issuePrice = TokenContract.functions.issuePrice().call()
-    principalValue = TokenContract.functions.principalValue().call()
-    dividends, dividendRecordDate, dividendPaymentDate = TokenContract.functions.dividendInformation().call()
-    dividends = dividends * 0.01
-    cancellationDate = TokenContract.functions.cancellationDate().call()
-    transferable = str(TokenContract.functions.transferable().call())
-    transferApprovalRequired = str(TokenContract.functions.transferApprovalRequired().call())
-    memo = TokenContract.functions.memo().call()
-    referenceUrls_1 = TokenContract.functions.referenceUrls(0).call()
-    referenceUrls_2 = TokenContract.functions.referenceUrls(1).call()
-    referenceUrls_3 = TokenContract.functions.referenceUrls(2).call()
-    tradableExchange = TokenContract.functions.tradableExchange().call()
-    personalInfoAddress = TokenContract.functions.personalInfoAddress().call()
-    contact_information = TokenContract.functions.contactInformation().call()
-    privacy_policy = TokenContract.functions.privacyPolicy().call()
-    status = TokenContract.functions.status().call()
-    offering_status = TokenContract.functions.offeringStatus().call()
-
-    # TokenList登録状態取得
     list_contract_address = issuer.token_list_contract_address
     ListContract = ContractUtils.get_contract('TokenList', list_contract_address)
-    token_struct = ListContract.functions.getTokenByAddress(token_address).call()
+    name, symbol, totalSupply, issuePrice, principalValue, dividend_information, cancellationDate, \
+        transferable, transferApprovalRequired, memo, referenceUrls_1, referenceUrls_2, referenceUrls_3, \
+        tradableExchange, personalInfoAddress, contact_information, privacy_policy, status, offering_status, \
+        token_struct = ContractUtils.batch_call([
+            TokenContract.functions.name(),
+            TokenContract.functions.symbol(),
+            TokenContract.functions.totalSupply(),
+            TokenContract.functions.issuePrice(),
+            TokenContract.functions.principalValue(),
+            TokenContract.functions.dividendInformation(),
+            TokenContract.functions.cancellationDate(),
+            TokenContract.functions.transferable(),
+            TokenContract.functions.transferApprovalRequired(),
+            TokenContract.functions.memo(),
+            TokenContract.functions.referenceUrls(0),
+            TokenContract.functions.referenceUrls(1),
+            TokenContract.functions.referenceUrls(2),
+            TokenContract.functions.tradableExchange(),
+            TokenContract.functions.personalInfoAddress(),
+            TokenContract.functions.contactInformation(),
+            TokenContract.functions.privacyPolicy(),
+            TokenContract.functions.status(),
+            TokenContract.functions.offeringStatus(),
+            # TokenList登録状態取得
+            ListContract.functions.getTokenByAddress(token_address)
+        ])
+    dividends, dividendRecordDate, dividendPaymentDate = dividend_information
+    dividends = dividends * 0.01
+    transferable = str(transferable)
+    transferApprovalRequired = str(transferApprovalRequired)
+
     is_released = False
     if token_struct[0] == token_address:
         is_released = True
@@ -745,44 +750,41 @@ def token_tracker_csv():
     if token is None:
         abort(404)
 
+    # サーバサイドカーソルで取得する（CSVの送信中に順次取得）
     tracks = Transfer.query.filter(Transfer.token_address == token_address). \
         order_by(desc(Transfer.block_timestamp)). \
-        all()
-
-    f = io.StringIO()
-
-    # ヘッダー行
-    data_header = \
-        'transaction_hash,' + \
-        'token_address,' + \
-        'account_address_from,' + \
-        'account_address_to,' + \
-        'transfer_amount,' + \
-        'block_timestamp\n'
-    f.write(data_header)
-
-    for track in tracks:
-        # utc→jst の変換
-        block_timestamp = track.block_timestamp.replace(tzinfo=timezone.utc).astimezone(JST). \
-            strftime("%Y/%m/%d %H:%M:%S %z")
-        # データ行
-        data_row = \
-            track.transaction_hash + ',' + \
-            track.token_address + ',' + \
-            track.account_address_from + ',' + \
-            track.account_address_to + ',' + \
-            str(track.transfer_amount) + ',' + \
-            block_timestamp + '\n'
-        f.write(data_row)
+        yield_per(1000)
+
+    def generate_csv():
+        # ヘッダー行
+        data_header = \
+            'transaction_hash,' + \
+            'token_address,' + \
+            'account_address_from,' + \
+            'account_address_to,' + \
+            'transfer_amount,' + \
+            'block_timestamp\n'
+        yield data_header
+
+        for track in tracks:
+            # utc→jst の変換
+            block_timestamp = track.block_timestamp.replace(tzinfo=timezone.utc).astimezone(JST). \
+                strftime("%Y/%m/%d %H:%M:%S %z")
+            # データ行
+            data_row = \
+                track.transaction_hash + ',' + \
+                track.token_address + ',' + \
+                track.account_address_from + ',' + \
+                track.account_address_to + ',' + \
+                str(track.transfer_amount) + ',' + \
+                block_timestamp + '\n'
+            yield data_row
 
     now = datetime.now(tz=JST)
-    res = make_response()
-    csvdata = f.getvalue()
-    res.data = csvdata.encode('sjis', 'ignore')
-    res.headers['Content-Type'] = 'text/plain'
-    res.headers['Content-Disposition'] = f"attachment; filename={now.strftime('%Y%m%d%H%M%S')}_share_tracks.csv"
-
-    return res
+    return CsvUtils.stream_response(
+        generate_csv(),
+        filename=f"{now.strftime('%Y%m%d%H%M%S')}_share_tracks.csv"
+    )
 
 
 ####################################################
@@ -874,35 +876,31 @@ def applications_csv_download():
     application = json.loads(get_applications(token_address).data)
     token_name = json.loads(get_token_name(token_address).data)
 
-    f = io.StringIO()
-
-    # ヘッダー行
-    data_header = \
-        'token_name,' + \
-        'token_address,' + \
-        'account_address,' + \
-        'name,' + \
-        'email,' + \
-        'code,' + \
-        'requested_amount\n'
-    f.write(data_header)
-
-    for item in application:
-        # データ行
-        data_row = \
-            token_name + ',' + token_address + ',' + item["account_address"] + ',' + \
-            item["account_name"] + ',' + item["account_email_address"] + ',' + item["data"] + ',' + \
-            str(item["requested_amount"]) + '\n'
-        f.write(data_row)
+    def generate_csv():
+        # ヘッダー行
+        data_header = \
+            'token_name,' + \
+            'token_address,' + \
+            'account_address,' + \
+            'name,' + \
+            'email,' + \
+            'code,' + \
+            'requested_amount\n'
+        yield data_header
+
+        for item in application:
+            # データ行
+            data_row = \
+                token_name + ',' + token_address + ',' + item["account_address"] + ',' + \
+                item["account_name"] + ',' + item["account_email_address"] + ',' + item["data"] + ',' + \
+                str(item["requested_amount"]) + '\n'
+            yield data_row
 
     now = datetime.now(tz=JST)
-    res = make_response()
-    csvdata = f.getvalue()
-    res.data = csvdata.encode('sjis', 'ignore')
-    res.headers['Content-Type'] = 'text/plain'
-    res.headers['Content-Disposition'] = \
-        'attachment; filename=' + now.strftime("%Y%m%d%H%M%S") + 'share_applications_list.csv'
-    return res
+    return CsvUtils.stream_response(
+        generate_csv(),
+        filename=now.strftime("%Y%m%d%H%M%S") + 'share_applications_list.csv'
+    )
 
 
 # 申込一覧取得
@@ -1168,49 +1166,46 @@ def holders_csv_download():
     _holders = get_holders(token_address)["data"]
     token_name = json.loads(get_token_name(token_address).data)
 
-    f = io.StringIO()
-
-    # ヘッダー行
-    data_header = f"token_name," \
-                  f"token_address," \
-                  f"account_address," \
-                  f"key_manager," \
-                  f"balance," \
-                  f"name," \
-                  f"birth_date," \
-                  f"postal_code," \
-                  f"address," \
-                  f"email" \
-                  f"\n"
-    f.write(data_header)
-
-    for _holder in _holders:
-        # Unicodeの各種ハイフン文字を半角ハイフン（U+002D）に変換する
-        try:
-            holder_address = re.sub('\u2010|\u2011|\u2012|\u2013|\u2014|\u2015|\u2212|\uff0d', '-', _holder["address"])
-        except TypeError:
-            holder_address = ""
-        # データ行
-        data_row = f"{token_name}," \
-                   f"{token_address}," \
-                   f"{_holder['account_address']}," \
-                   f"{_holder['key_manager']}," \
-                   f"{str(_holder['balance'])}," \
-                   f"{_holder['name']}," \
-                   f"{_holder['birth_date']}," \
-                   f"{_holder['postal_code']}," \
-                   f"{holder_address}," \
-                   f"{_holder['email']}" \
-                   f"\n"
-        f.write(data_row)
+    def generate_csv():
+        # ヘッダー行
+        data_header = f"token_name," \
+                      f"token_address," \
+                      f"account_address," \
+                      f"key_manager," \
+                      f"balance," \
+                      f"name," \
+                      f"birth_date," \
+                      f"postal_code," \
+                      f"address," \
+                      f"email" \
+                      f"\n"
+        yield data_header
+
+        for _holder in _holders:
+            # Unicodeの各種ハイフン文字を半角ハイフン（U+002D）に変換する
+            try:
+                holder_address = re.sub('\u2010|\u2011|\u2012|\u2013|\u2014|\u2015|\u2212|\uff0d', '-', _holder["address"])
+            except TypeError:
+                holder_address = ""
+            # データ行
+            data_row = f"{token_name}," \
+                       f"{token_address}," \
+                       f"{_holder['account_address']}," \
+                       f"{_holder['key_manager']}," \
+                       f"{str(_holder['balance'])}," \
+                       f"{_holder['name']}," \
+                       f"{_holder['birth_date']}," \
+                       f"{_holder['postal_code']}," \
+                       f"{holder_address}," \
+                       f"{_holder['email']}" \
+                       f"\n"
+            yield data_row
 
     now = datetime.now(tz=JST)
-    res = make_response()
-    csvdata = f.getvalue()
-    res.data = csvdata.encode('sjis', 'ignore')
-    res.headers['Content-Type'] = 'text/plain'
-    res.headers['Content-Disposition'] = f"attachment; filename={now.strftime('%Y%m%d%H%M%S')}share_holders_list.csv"
-    return res
+    return CsvUtils.stream_response(
+        generate_csv(),
+        filename=f"{now.strftime('%Y%m%d%H%M%S')}share_holders_list.csv"
+    )
 
 
 # 保有者リストCSV履歴ダウンロード
@@ -1282,115 +1277,74 @@ def get_holders(token_address):
 
     # DEXコントラクト接続
     try:
-        tradable_exchange = TokenContract.functions.tradableExchange().call()
+        tradable_exchange = ContractUtils.cached_call(TokenContract.functions.tradableExchange())
     except Exception as err:
         logger.error(f"Failed to get token attributes: {err}")
         tradable_exchange = Config.ZERO_ADDRESS
 
-    # Transferイベントを検索
-    # →　残高を保有している可能性のあるアドレスを抽出
-    # →　保有者リストをユニークにする
-    query = Transfer.query. \
-        distinct(Transfer.account_address_to). \
-        filter(Transfer.token_address == token_address)
-    if search_address:
-        transfer_events = query.filter(or_(
-            Transfer.account_address_from.like(f"%{search_address}%"),
-            Transfer.account_address_to.like(f"%{search_address}%"))
-        ).all()
-    else:
-        transfer_events = query.all()
-
-    holders_temp = [token_owner]  # 発行体アドレスをリストに追加
-    for event in transfer_events:
-        holders_temp.append(event.account_address_to)
-
-    holders_uniq = []
-    for x in holders_temp:
-        if x not in holders_uniq:
-            if search_address is None:
-                holders_uniq.append(x)
-            elif search_address in x:
-                holders_uniq.append(x)
+    # 保有者と残高（移転承諾待ち数量を含む）を取得
+    holder_page = TokenUtils.get_holder_balances(
+        token_contract=TokenContract,
+        token_owner=token_owner,
+        search_address=search_address,
+        start=start,
+        length=length,
+        with_personal_info=True
+    )
 
     # 保有者情報を取得
     _holders = []
-    cursor = -1  # 開始位置
-    count = 0  # 取得レコード
-    for account_address in holders_uniq:
-        cursor += 1
-        if ((start is not None and cursor >= start) and (length is not None and count < length)) or \
-                (start is None and length is None):
-            count += 1
-
-            # 保有残高取得
-            try:
-                balance = TokenContract.functions.balanceOf(account_address).call()
-            except ABIFunctionNotFound:
-                balance = 0
+    for account_address, balance in holder_page.holders:
+        # アドレス種別判定
+        if account_address == token_owner:
+            address_type = AddressType.ISSUER.value
+        elif account_address == tradable_exchange:
+            address_type = AddressType.EXCHANGE.value
+        else:
+            address_type = AddressType.OTHERS.value
 
-            # 移転承諾待ち数量取得
-            try:
-                pending_transfer = TokenContract.functions.pendingTransfer(account_address).call()
-            except ABIFunctionNotFound:
-                pending_transfer = 0
-
-            # アドレス種別判定
-            if account_address == token_owner:
-                address_type = AddressType.ISSUER.value
-            elif account_address == tradable_exchange:
-                address_type = AddressType.EXCHANGE.value
-            else:
-                address_type = AddressType.OTHERS.value
-
-            # 保有者情報：デフォルト値（個人情報なし）
-            _holder = {
-                'account_address': account_address,
-                'key_manager': DEFAULT_VALUE,
-                'name': DEFAULT_VALUE,
-                'postal_code': DEFAULT_VALUE,
-                'email': DEFAULT_VALUE,
-                'address': DEFAULT_VALUE,
-                'birth_date': DEFAULT_VALUE,
-                'balance': balance + pending_transfer,
-                'address_type': address_type
-            }
-
-            if address_type == AddressType.ISSUER.value:  # 保有者が発行体の場合
-                _holder["name"] = issuer.issuer_name or DEFAULT_VALUE
-                _holders.append(_holder)
-            else:  # 保有者が発行体以外の場合
-                record = PersonalInfoModel.query. \
-                    filter(PersonalInfoModel.account_address == account_address). \
-                    filter(PersonalInfoModel.issuer_address == token_owner). \
-                    first()
-
-                if record is not None:
-                    decrypted_personal_info = record.personal_info
-                    key_manager = decrypted_personal_info.get("key_manager") or DEFAULT_VALUE
-                    name = decrypted_personal_info.get("name") or DEFAULT_VALUE
-                    postal_code = decrypted_personal_info.get("postal_code") or DEFAULT_VALUE
-                    address = decrypted_personal_info.get("address") or DEFAULT_VALUE
-                    email = decrypted_personal_info.get("email") or DEFAULT_VALUE
-                    birth_date = decrypted_personal_info.get("birth") or DEFAULT_VALUE
-                    _holder = {
-                        'account_address': account_address,
-                        'key_manager': key_manager,
-                        'name': name,
-                        'postal_code': postal_code,
-                        'address': address,
-                        'email': email,
-                        'birth_date': birth_date,
-                        'balance': balance + pending_transfer,
-                        'address_type': address_type
-                    }
-
-                _holders.append(_holder)
-        elif length is not None and count >= length:
-            break
-
-    records_total = len(holders_uniq)
-    records_filtered = records_total
+        # 保有者情報：デフォルト値（個人情報なし）
+        _holder = {
+            'account_address': account_address,
+            'key_manager': DEFAULT_VALUE,
+            'name': DEFAULT_VALUE,
+            'postal_code': DEFAULT_VALUE,
+            'email': DEFAULT_VALUE,
+            'address': DEFAULT_VALUE,
+            'birth_date': DEFAULT_VALUE,
+            'balance': balance,
+            'address_type': address_type
+        }
+
+        if address_type == AddressType.ISSUER.value:  # 保有者が発行体の場合
+            _holder["name"] = issuer.issuer_name or DEFAULT_VALUE
+            _holders.append(_holder)
+        else:  # 保有者が発行体以外の場合
+            decrypted_personal_info = holder_page.personal_info.get(account_address)
+
+            if decrypted_personal_info is not None:
+                key_manager = decrypted_personal_info.get("key_manager") or DEFAULT_VALUE
+                name = decrypted_personal_info.get("name") or DEFAULT_VALUE
+                postal_code = decrypted_personal_info.get("postal_code") or DEFAULT_VALUE
+                address = decrypted_personal_info.get("address") or DEFAULT_VALUE
+                email = decrypted_personal_info.get("email") or DEFAULT_VALUE
+                birth_date = decrypted_personal_info.get("birth") or DEFAULT_VALUE
+                _holder = {
+                    'account_address': account_address,
+                    'key_manager': key_manager,
+                    'name': name,
+                    'postal_code': postal_code,
+                    'address': address,
+                    'email': email,
+                    'birth_date': birth_date,
+                    'balance': balance,
+                    'address_type': address_type
+                }
+
+            _holders.append(_holder)
+
+    records_total = holder_page.records_total
+    records_filtered = holder_page.records_filtered
 
     res_body = {
         "draw": draw,
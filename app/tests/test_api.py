@@ -19,17 +19,18 @@ SPDX-License-Identifier: Apache-2.0
 
 import base64
 import json
-from datetime import datetime
 
 import pytest
 from Crypto.Cipher import PKCS1_OAEP
 from Crypto.PublicKey import RSA
 
-from app.models import Token, HolderList
+from app.models import Token, HolderList, HolderListJob, HolderListJobStatus
+from batch.processor_HolderList import Processor as HolderListProcessor
 from config import Config
 from .conftest import TestBase
 from .utils.account_config import eth_account
-from .utils.contract_utils_common import processor_issue_event, clean_issue_event, index_transfer_event
+from .utils.contract_utils_common import processor_issue_event, clean_issue_event, index_transfer_event, \
+    index_transfer_block_number
 from .utils.contract_utils_payment_gateway import register_payment_account
 from .utils.contract_utils_personal_info import register_personal_info
 
@@ -90,6 +91,7 @@ def setup(db, shared_contract):
 class TestAPIShareHolders(TestBase):
     # テスト対象URL
     url_share_holders = 'api/share/holders/'  # 保有者一覧(株式)
+    url_holder_list_job = 'api/holders/jobs/'  # 保有者名簿CSV作成ジョブ
 
     #############################################################################
     # 前処理
@@ -153,10 +155,7 @@ class TestAPIShareHolders(TestBase):
 
     # ＜正常系1＞
     #   株式保有者一覧(API)
-    def test_normal_1(self, app):
-        # DB登録データの検証用にテスト開始時刻を取得
-        test_started = datetime.utcnow()
-
+    def test_normal_1(self, app, db):
         # 発行済みトークン情報を取得
         tokens = Token.query.filter_by(template_id=Config.TEMPLATE_ID_SHARE).all()
         token = tokens[0]
@@ -170,13 +169,28 @@ class TestAPIShareHolders(TestBase):
         )
 
         # レスポンスの検証
-        assert response.status_code == 201
+        assert response.status_code == 202
+        job = json.loads(response.data.decode('utf-8'))
+        assert job['token_address'] == token.token_address
+        assert job['status'] == 'PENDING'
+        assert job['holder_list_id'] is None
+        assert response.headers['Location'].endswith(self.url_holder_list_job + job['job_id'])
+
+        # 保有者名簿CSV作成（バッチ）
+        index_transfer_block_number(db, token.token_address)
+        HolderListProcessor(db.session).process()
+
+        # ジョブの状態の検証
+        response = client.get(
+            self.url_holder_list_job + job['job_id'],
+            headers={'Authorization': 'JWT ' + jwt}
+        )
+        assert response.status_code == 200
+        job = json.loads(response.data.decode('utf-8'))
+        assert job['status'] == 'SUCCEEDED'
 
         # DB登録内容の検証
-        # 他のテストでの更新されている可能性を考慮し、複数件取得する
-        rows = HolderList.query.filter(HolderList.token_address == token.token_address) \
-            .filter(HolderList.created >= test_started) \
-            .all()
+        rows = HolderList.query.filter(HolderList.id == job['holder_list_id']).all()
 
         csv_data = '\n'.join([
             # CSVヘッダ
@@ -202,6 +216,103 @@ class TestAPIShareHolders(TestBase):
         # CSVデータが一致するレコードが1件のみ存在することを検証する
         assert len(list(filter(lambda row: row.holder_list == assumed_binary_data, rows))) == 1
 
+    # ＜正常系2＞
+    #   株式保有者一覧(API)
+    #   同一ブロック高の依頼は同じジョブにまとめる
+    def test_normal_2(self, app, db):
+        # 発行済みトークン情報を取得
+        tokens = Token.query.filter_by(template_id=Config.TEMPLATE_ID_SHARE).all()
+        token = tokens[0]
+
+        client, jwt = self.client_with_api_login(app)
+
+        # 保有者一覧の参照（2回）
+        response_1 = client.post(
+            self.url_share_holders + token.token_address,
+            headers={'Authorization': 'JWT ' + jwt}
+        )
+        response_2 = client.post(
+            self.url_share_holders + token.token_address,
+            headers={'Authorization': 'JWT ' + jwt}
+        )
+
+        # レスポンスの検証
+        assert response_1.status_code == 202
+        assert response_2.status_code == 202
+        job_1 = json.loads(response_1.data.decode('utf-8'))
+        job_2 = json.loads(response_2.data.decode('utf-8'))
+        assert job_1['job_id'] == job_2['job_id']
+        assert HolderListJob.query.filter(HolderListJob.token_address == token.token_address). \
+            filter(HolderListJob.block_number == job_1['block_number']).count() == 1
+
+        index_transfer_block_number(db, token.token_address)
+        HolderListProcessor(db.session).process()
+
+    # ＜正常系3＞
+    #   保有者名簿CSV作成（バッチ）
+    #   Transferインデクサがジョブのブロックまで同期していない場合は待機する
+    def test_normal_3(self, app, db):
+        # 発行済みトークン情報を取得
+        tokens = Token.query.filter_by(template_id=Config.TEMPLATE_ID_SHARE).all()
+        token = tokens[0]
+
+        # 未処理のジョブ
+        job = HolderListJob.query.filter(HolderListJob.token_address == token.token_address).first()
+        job.status = HolderListJobStatus.PENDING.value
+        job.holder_list_id = None
+        db.session.commit()
+
+        # 保有者名簿CSV作成（バッチ）：Transferインデクサの同期前
+        index_transfer_block_number(db, token.token_address, block_number=job.block_number - 1)
+        HolderListProcessor(db.session).process()
+
+        job = HolderListJob.query.filter(HolderListJob.job_id == job.job_id).first()
+        assert job.status == HolderListJobStatus.PENDING.value
+        assert job.holder_list_id is None
+
+        # 保有者名簿CSV作成（バッチ）：Transferインデクサの同期後
+        index_transfer_block_number(db, token.token_address, block_number=job.block_number)
+        HolderListProcessor(db.session).process()
+
+        job = HolderListJob.query.filter(HolderListJob.job_id == job.job_id).first()
+        assert job.status == HolderListJobStatus.SUCCEEDED.value
+        assert HolderList.query.filter(HolderList.id == job.holder_list_id).count() == 1
+
+    # ＜正常系4＞
+    #   保有者名簿CSV作成（バッチ）
+    #   処理中に中断したジョブは再起動時に再実行する
+    def test_normal_4(self, app, db):
+        # 発行済みトークン情報を取得
+        tokens = Token.query.filter_by(template_id=Config.TEMPLATE_ID_SHARE).all()
+        token = tokens[0]
+
+        # 処理中に中断したジョブ
+        job = HolderListJob.query.filter(HolderListJob.token_address == token.token_address).first()
+        job.status = HolderListJobStatus.PROCESSING.value
+        job.holder_list_id = None
+        db.session.commit()
+
+        # 再起動
+        processor = HolderListProcessor(db.session)
+        processor.recover()
+
+        job = HolderListJob.query.filter(HolderListJob.job_id == job.job_id).first()
+        assert job.status == HolderListJobStatus.PENDING.value
+
+        # 保有者名簿CSV作成（バッチ）
+        index_transfer_block_number(db, token.token_address)
+        processor.process()
+
+        client, jwt = self.client_with_api_login(app)
+        response = client.get(
+            self.url_holder_list_job + job.job_id,
+            headers={'Authorization': 'JWT ' + jwt}
+        )
+        assert response.status_code == 200
+        job = json.loads(response.data.decode('utf-8'))
+        assert job['status'] == 'SUCCEEDED'
+        assert HolderList.query.filter(HolderList.id == job['holder_list_id']).count() == 1
+
     #############################################################################
     # エラー系
     #############################################################################
@@ -265,10 +376,63 @@ class TestAPIShareHolders(TestBase):
         )
         assert response.status_code == 404
 
+    # ＜エラー系4＞
+    #   保有者名簿CSV作成ジョブの状態取得(API)
+    #   発行体相違エラー：404
+    def test_error_4(self, app):
+        # 発行体1の作成依頼を取得
+        job = HolderListJob.query.filter(
+            HolderListJob.eth_account == eth_account['issuer']['account_address']
+        ).first()
+
+        client, jwt = self.client_with_api_login(app, login_id='admin2')
+
+        # ジョブの状態の参照（発行体2が発行体1のジョブを指定）
+        response = client.get(
+            self.url_holder_list_job + job.job_id,
+            headers={'Authorization': 'JWT ' + jwt}
+        )
+        assert response.status_code == 404
+        assert json.loads(response.data.decode('utf-8')) == {
+            'error': 'Not Found',
+            'status_code': 404
+        }
+
+    # ＜エラー系5＞
+    #   保有者名簿CSV作成（バッチ）
+    #   作成に失敗したジョブ：FAILED
+    def test_error_5(self, app, db):
+        # 発行済みトークン情報を取得
+        tokens = Token.query.filter_by(template_id=Config.TEMPLATE_ID_SHARE).all()
+        token = tokens[0]
+
+        # トークン種別が相違するジョブ（トークンが見つからない）
+        job = HolderListJob.query.filter(HolderListJob.token_address == token.token_address).first()
+        job.template_id = Config.TEMPLATE_ID_SB
+        job.status = HolderListJobStatus.PENDING.value
+        job.holder_list_id = None
+        db.session.commit()
+
+        # 保有者名簿CSV作成（バッチ）
+        index_transfer_block_number(db, token.token_address)
+        HolderListProcessor(db.session).process()
+
+        # ジョブの状態の検証
+        client, jwt = self.client_with_api_login(app)
+        response = client.get(
+            self.url_holder_list_job + job.job_id,
+            headers={'Authorization': 'JWT ' + jwt}
+        )
+        assert response.status_code == 200
+        job = json.loads(response.data.decode('utf-8'))
+        assert job['status'] == 'FAILED'
+        assert job['holder_list_id'] is None
+
 
 class TestAPIBondHolders(TestBase):
     # テスト対象URL
     url_bond_holders = 'api/bond/holders/'  # 保有者一覧(債券)
+    url_holder_list_job = 'api/holders/jobs/'  # 保有者名簿CSV作成ジョブ
 
     #############################################################################
     # 前処理
@@ -337,10 +501,7 @@ class TestAPIBondHolders(TestBase):
 
     # ＜正常系1＞
     #   債券保有者一覧(API)
-    def test_normal_1(self, app):
-        # DB登録データの検証用にテスト開始時刻を取得
-        test_started = datetime.utcnow()
-
+    def test_normal_1(self, app, db):
         # 発行済みトークン情報を取得
         tokens = Token.query.filter_by(template_id=Config.TEMPLATE_ID_SB).all()
         token = tokens[0]
@@ -354,13 +515,28 @@ class TestAPIBondHolders(TestBase):
         )
 
         # レスポンスの検証
-        assert response.status_code == 201
+        assert response.status_code == 202
+        job = json.loads(response.data.decode('utf-8'))
+        assert job['token_address'] == token.token_address
+        assert job['status'] == 'PENDING'
+        assert job['holder_list_id'] is None
+        assert response.headers['Location'].endswith(self.url_holder_list_job + job['job_id'])
+
+        # 保有者名簿CSV作成（バッチ）
+        index_transfer_block_number(db, token.token_address)
+        HolderListProcessor(db.session).process()
+
+        # ジョブの状態の検証
+        response = client.get(
+            self.url_holder_list_job + job['job_id'],
+            headers={'Authorization': 'JWT ' + jwt}
+        )
+        assert response.status_code == 200
+        job = json.loads(response.data.decode('utf-8'))
+        assert job['status'] == 'SUCCEEDED'
 
         # DB登録内容の検証
-        # 他のテストでの更新されている可能性を考慮し、複数件取得する
-        rows = HolderList.query.filter(HolderList.token_address == token.token_address) \
-            .filter(HolderList.created >= test_started) \
-            .all()
+        rows = HolderList.query.filter(HolderList.id == job['holder_list_id']).all()
 
         csv_data = '\n'.join([
             # CSVヘッダ
@@ -453,6 +629,7 @@ class TestAPIBondHolders(TestBase):
 class TestAPIMembershipHolders(TestBase):
     # テスト対象URL
     url_membership_holders = 'api/membership/holders/'  # 保有者一覧(会員権)
+    url_holder_list_job = 'api/holders/jobs/'  # 保有者名簿CSV作成ジョブ
 
     #############################################################################
     # 前処理
@@ -509,10 +686,7 @@ class TestAPIMembershipHolders(TestBase):
 
     # ＜正常系1＞
     #   会員権保有者一覧(API)
-    def test_normal_1(self, app):
-        # DB登録データの検証用にテスト開始時刻を取得
-        test_started = datetime.utcnow()
-
+    def test_normal_1(self, app, db):
         # 発行済みトークン情報を取得
         tokens = Token.query.filter_by(template_id=Config.TEMPLATE_ID_MEMBERSHIP).all()
         token = tokens[0]
@@ -526,13 +700,28 @@ class TestAPIMembershipHolders(TestBase):
         )
 
         # レスポンスの検証
-        assert response.status_code == 201
+        assert response.status_code == 202
+        job = json.loads(response.data.decode('utf-8'))
+        assert job['token_address'] == token.token_address
+        assert job['status'] == 'PENDING'
+        assert job['holder_list_id'] is None
+        assert response.headers['Location'].endswith(self.url_holder_list_job + job['job_id'])
+
+        # 保有者名簿CSV作成（バッチ）
+        index_transfer_block_number(db, token.token_address)
+        HolderListProcessor(db.session).process()
+
+        # ジョブの状態の検証
+        response = client.get(
+            self.url_holder_list_job + job['job_id'],
+            headers={'Authorization': 'JWT ' + jwt}
+        )
+        assert response.status_code == 200
+        job = json.loads(response.data.decode('utf-8'))
+        assert job['status'] == 'SUCCEEDED'
 
         # DB登録内容の検証
-        # 他のテストでの更新されている可能性を考慮し、複数件取得する
-        rows = HolderList.query.filter(HolderList.token_address == token.token_address) \
-            .filter(HolderList.created >= test_started) \
-            .all()
+        rows = HolderList.query.filter(HolderList.id == job['holder_list_id']).all()
 
         csv_data = '\n'.join([
             # CSVヘッダ
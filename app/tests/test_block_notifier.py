@@ -0,0 +1,202 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import threading
+import time
+
+import pytest
+from web3 import Web3
+
+from batch.benchmark.fake_node import FakeNode, SyntheticChain
+from batch.lib.block_notifier import BlockNotifier
+
+
+@pytest.fixture(scope='module')
+def fake_node():
+    node = FakeNode(SyntheticChain(block_count=10), ws_port=0)
+    threading.Thread(target=node.serve_forever, daemon=True).start()
+    yield node
+    node.shutdown()
+
+
+def wait_available(notifier, timeout=5):
+    """
+    通知元への接続を待機
+    :param notifier: BlockNotifier
+    :param timeout: 最大待機時間（秒）
+    :return: なし
+    """
+    notifier.start()
+    deadline = time.monotonic() + timeout
+    while not notifier.available:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def mine_later(node, delay):
+    """
+    一定時間後にブロックを追加
+    :param node: FakeNode
+    :param delay: 追加までの時間（秒）
+    :return: なし
+    """
+    threading.Timer(delay, node.mine).start()
+
+
+class TestBlockNotifier:
+
+    #############################################################################
+    # 正常系
+    #############################################################################
+
+    # ＜正常系1＞
+    #   filter：新規ブロックが通知された時点で待機を終了する
+    def test_normal_1(self, fake_node):
+        notified = []
+        notifier = BlockNotifier(
+            Web3(Web3.HTTPProvider(fake_node.endpoint_uri)),
+            mode=BlockNotifier.MODE_FILTER,
+            timeout=30,
+            listener=notified.append
+        )
+        notifier.FILTER_POLL_INTERVAL = 0.05
+        wait_available(notifier)
+
+        mine_later(fake_node, 0.2)
+        start = time.monotonic()
+        notifier.wait(30)
+
+        assert time.monotonic() - start < 5
+        assert notifier.block_number == fake_node.chain.get_block_number()
+        assert notified == [notifier.block_number]
+
+    # ＜正常系2＞
+    #   websocket：新規ブロックが通知された時点で待機を終了する
+    def test_normal_2(self, fake_node):
+        notified = []
+        notifier = BlockNotifier(
+            None,
+            mode=BlockNotifier.MODE_WEBSOCKET,
+            ws_endpoint=fake_node.ws_endpoint_uri,
+            timeout=30,
+            listener=notified.append
+        )
+        wait_available(notifier)
+
+        mine_later(fake_node, 0.2)
+        start = time.monotonic()
+        notifier.wait(30)
+
+        assert time.monotonic() - start < 5
+        assert notifier.block_number == fake_node.chain.get_block_number()
+        assert notified == [notifier.block_number]
+
+    # ＜正常系3＞
+    #   新規ブロックが生成されない場合は最大待機時間で待機を終了する
+    def test_normal_3(self, fake_node):
+        notifier = BlockNotifier(
+            Web3(Web3.HTTPProvider(fake_node.endpoint_uri)),
+            mode=BlockNotifier.MODE_FILTER,
+            timeout=0.5
+        )
+        notifier.FILTER_POLL_INTERVAL = 0.05
+        wait_available(notifier)
+
+        # 最初のブロックの通知
+        mine_later(fake_node, 0.1)
+        notifier.wait(30)
+        block_number = notifier.block_number
+
+        # ブロック生成なし
+        start = time.monotonic()
+        notifier.wait(30)
+
+        assert 0.4 <= time.monotonic() - start < 5
+        assert notifier.block_number == block_number
+
+    # ＜正常系4＞
+    #   既に通知済の新規ブロックがある場合は待機しない
+    def test_normal_4(self, fake_node):
+        notifier = BlockNotifier(
+            Web3(Web3.HTTPProvider(fake_node.endpoint_uri)),
+            mode=BlockNotifier.MODE_FILTER,
+            timeout=30
+        )
+        notifier.FILTER_POLL_INTERVAL = 0.05
+        wait_available(notifier)
+
+        mine_later(fake_node, 0.1)
+        notifier.wait(30)
+
+        # 待機の開始前にブロックを通知
+        fake_node.mine()
+        deadline = time.monotonic() + 5
+        while notifier.block_number < fake_node.chain.get_block_number():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        notifier.wait(30)
+
+        assert time.monotonic() - start < 1
+
+    #############################################################################
+    # エラー系
+    #############################################################################
+
+    # ＜エラー系1＞
+    #   通知元に接続できない場合は指定の間隔でスリープする
+    def test_error_1(self):
+        notifier = BlockNotifier(
+            None,
+            mode=BlockNotifier.MODE_WEBSOCKET,
+            ws_endpoint='ws://127.0.0.1:1',  # 接続できないエンドポイント
+            timeout=30
+        )
+        notifier.start()
+
+        start = time.monotonic()
+        notifier.wait(0.2)
+
+        assert 0.2 <= time.monotonic() - start < 5
+        assert notifier.available is False
+        assert notifier.block_number is None
+
+    # ＜エラー系2＞
+    #   フィルタが失効した場合は再作成するまで指定の間隔でスリープする
+    def test_error_2(self, fake_node):
+        notifier = BlockNotifier(
+            Web3(Web3.HTTPProvider(fake_node.endpoint_uri)),
+            mode=BlockNotifier.MODE_FILTER,
+            timeout=30
+        )
+        notifier.FILTER_POLL_INTERVAL = 0.05
+        wait_available(notifier)
+
+        # フィルタの失効
+        with fake_node.lock:
+            fake_node.block_filter_list.clear()
+        deadline = time.monotonic() + 5
+        while notifier.available:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        notifier.wait(0.2)
+
+        assert 0.2 <= time.monotonic() - start < 5
@@ -762,6 +762,55 @@ class TestBond(TestBase):
         assert response.status_code == 200
         assert 'テスト債券' == response_data
 
+    # ＜正常系17_3＞
+    # ＜保有者一覧＞
+    #   ページング・アドレス検索
+    #   ※17_2の続き
+    def test_normal_17_3(self, app):
+        client = self.client_with_admin_login(app)
+        tokens = Token.query.filter_by(template_id=Config.TEMPLATE_ID_SB).all()
+        token = tokens[0]
+        issuer_address = to_checksum_address(eth_account['issuer']['account_address'])
+        trader_address = to_checksum_address(eth_account['trader']['account_address'])
+
+        # 1ページ目（発行体）
+        response = client.get(
+            self.url_get_holders + token.token_address,
+            query_string={'draw': 1, 'start': 0, 'length': 1}
+        )
+        response_data = json.loads(response.data)
+        assert response.status_code == 200
+        assert response_data['draw'] == 1
+        assert response_data['recordsTotal'] == 2
+        assert response_data['recordsFiltered'] == 2
+        assert len(response_data['data']) == 1
+        assert response_data['data'][0]['account_address'] == issuer_address
+
+        # 2ページ目（投資家）
+        response = client.get(
+            self.url_get_holders + token.token_address,
+            query_string={'draw': 2, 'start': 1, 'length': 1}
+        )
+        response_data = json.loads(response.data)
+        assert response.status_code == 200
+        assert response_data['recordsTotal'] == 2
+        assert response_data['recordsFiltered'] == 2
+        assert len(response_data['data']) == 1
+        assert response_data['data'][0]['account_address'] == trader_address
+        assert response_data['data'][0]['balance'] == 10
+
+        # アドレス検索
+        response = client.get(
+            self.url_get_holders + token.token_address,
+            query_string={'draw': 3, 'start': 0, 'length': 10, 'search[value]': trader_address[2:12]}
+        )
+        response_data = json.loads(response.data)
+        assert response.status_code == 200
+        assert response_data['recordsTotal'] == 2
+        assert response_data['recordsFiltered'] == 1
+        assert len(response_data['data']) == 1
+        assert response_data['data'][0]['account_address'] == trader_address
+
     # ＜正常系18-1＞
     #   保有者リスト履歴
     def test_normal_18_1(self, app):
@@ -468,7 +468,7 @@ class TestCoupon(TestBase):
 
         # 保有者一覧APIの参照
         response = client.get(self.url_get_holders + tokens[0].token_address)
-        response_data_list = json.loads(response.data)
+        response_data_list = json.loads(response.data)["data"]
 
         assert response.status_code == 200
         for response_data in response_data_list:
@@ -645,7 +645,7 @@ class TestCoupon(TestBase):
 
         # 保有者一覧APIの参照
         response = client.get(self.url_get_holders + token.token_address)
-        response_data_list = json.loads(response.data)
+        response_data_list = json.loads(response.data)["data"]
 
         assert response.status_code == 200
 
@@ -875,7 +875,7 @@ class TestCoupon(TestBase):
 
         # 保有者一覧APIの参照
         response = client.get(self.url_get_holders + token_address)
-        response_data = json.loads(response.data)
+        response_data = json.loads(response.data)["data"]
         assert response.status_code == 200
 
         # issuer
@@ -0,0 +1,74 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from datetime import (
+    datetime,
+    timedelta
+)
+import json
+
+from app.models import BatchTaskMetrics
+from .conftest import TestBase
+
+
+# バッチ処理のメトリクス
+class TestDashboardBatchMetrics(TestBase):
+    target_url = '/dashboard/batch_metrics'
+
+    # ＜正常系１＞
+    # メトリクスなし
+    def test_normal_1(self, app, db):
+        client = self.client_with_admin_login(app)
+        response = client.get(self.target_url)
+        assert response.status_code == 200
+        assert json.loads(response.data.decode('utf-8')) == []
+
+    # ＜正常系２＞
+    # タスク名順に返却
+    def test_normal_2(self, app, db):
+        metrics = {
+            'block_number': 100,
+            'head_block_number': 110,
+            'head_lag': 10,
+            'events': 5,
+            'errors': 1,
+            'errors_per_token': {'0x0000000000000000000000000000000000000001': 1}
+        }
+        record = BatchTaskMetrics()
+        record.task_name = 'RPC'
+        record.metrics = {'calls': {'eth_getLogs': 3}, 'errors': {}, 'latency': {}}
+        record.modified = datetime.utcnow()
+        db.session.add(record)
+        record = BatchTaskMetrics()
+        record.task_name = 'INDEXER-Transfer'
+        record.metrics = metrics
+        record.modified = datetime.utcnow() - timedelta(seconds=60)
+        db.session.add(record)
+        db.session.commit()
+
+        client = self.client_with_admin_login(app)
+        response = client.get(self.target_url)
+        assert response.status_code == 200
+        response_data = json.loads(response.data.decode('utf-8'))
+        assert [item['task_name'] for item in response_data] == ['INDEXER-Transfer', 'RPC']
+        assert response_data[0]['metrics'] == metrics
+        assert response_data[0]['seconds_since_modified'] >= 60
+        assert response_data[1]['metrics']['calls'] == {'eth_getLogs': 3}
+
+        db.session.query(BatchTaskMetrics).delete()
+        db.session.commit()
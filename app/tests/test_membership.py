@@ -646,7 +646,7 @@ class TestMembership(TestBase):
 
         # 保有者一覧APIの参照
         response = client.get(self.url_get_holders + token.token_address)
-        response_data = json.loads(response.data)
+        response_data = json.loads(response.data)["data"]
 
         assert response.status_code == 200
         assert eth_account['issuer']['account_address'] == response_data[0]['account_address']
@@ -696,7 +696,7 @@ class TestMembership(TestBase):
 
         # 保有者一覧APIの参照
         response = client.get(self.url_get_holders + token.token_address)
-        response_data_list = json.loads(response.data)
+        response_data_list = json.loads(response.data)["data"]
 
         for response_data in response_data_list:
             if eth_account['issuer']['account_address'] == response_data['account_address']:  # issuer
@@ -790,7 +790,7 @@ class TestMembership(TestBase):
 
         # 保有者一覧APIの参照
         response = client.get(self.url_get_holders + token.token_address)
-        response_data_list = json.loads(response.data)
+        response_data_list = json.loads(response.data)["data"]
         assert response.status_code == 200
 
         for response_data in response_data_list:
@@ -991,7 +991,7 @@ class TestMembership(TestBase):
 
         # 保有者一覧APIの参照
         response = client.get(self.url_get_holders + token.token_address)
-        response_data = json.loads(response.data)
+        response_data = json.loads(response.data)["data"]
         assert response.status_code == 200
 
         # issuer
@@ -5,7 +5,7 @@ from logging import getLogger
 from web3 import Web3
 from web3.middleware import geth_poa_middleware
 
-from app.models import Token, Transfer, Consume
+from app.models import Token, Transfer, Consume, TokenHolderBalance, IDXBlockNumber
 from config import Config
 
 logger = getLogger('api')
@@ -53,7 +53,7 @@ def clean_issue_event(db):
 def index_transfer_event(db, transaction_hash, token_address, account_address_from, account_address_to, amount,
                          block_timestamp=None):
     """
-    任意のTransferイベントをDBに登録
+    任意のTransferイベントをDBに登録（保有者残高も更新する）
     :param db: pytest fixture
     :param transaction_hash: トランザクションハッシュ
     :param token_address: トークンアドレス
@@ -72,6 +72,18 @@ def index_transfer_event(db, transaction_hash, token_address, account_address_fr
     record.block_timestamp = block_timestamp
     db.session.add(record)
 
+    # 保有者残高の更新（indexer_Transfer）
+    for account_address, change in [(account_address_from, -amount), (account_address_to, amount)]:
+        holder_balance = TokenHolderBalance.query.get((token_address, account_address))
+        if holder_balance is None:
+            holder_balance = TokenHolderBalance()
+            holder_balance.token_address = token_address
+            holder_balance.account_address = account_address
+            holder_balance.balance = 0
+            holder_balance.updated_block = 0
+        holder_balance.balance += change
+        db.session.add(holder_balance)
+
 
 def index_consume_event(db, transaction_hash, token_address, consumer_address, balance, total_used_amount, used_amount,
                         block_timestamp=None):
@@ -99,3 +111,23 @@ def index_consume_event(db, transaction_hash, token_address, consumer_address, b
     db.session.add(record)
 
     return record
+
+
+def index_transfer_block_number(db, token_address, block_number=None):
+    """
+    Transferインデクサの同期済blockNumberを更新
+    :param db: pytest fixture
+    :param token_address: トークンアドレス
+    :param block_number: 同期済blockNumber (省略時: 最新ブロック)
+    :return: なし
+    """
+    record = IDXBlockNumber.query. \
+        filter(IDXBlockNumber.indexer_name == "Transfer"). \
+        filter(IDXBlockNumber.contract_address == token_address). \
+        first()
+    if record is None:
+        record = IDXBlockNumber()
+        record.indexer_name = "Transfer"
+        record.contract_address = token_address
+    record.latest_block_number = block_number if block_number is not None else web3.eth.blockNumber
+    db.session.add(record)
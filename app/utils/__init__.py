@@ -18,4 +18,7 @@ SPDX-License-Identifier: Apache-2.0
 """
 
 from .contract_utils import ContractUtils
+from .csv_utils import CsvUtils
 from .token_utils import TokenUtils
+from .web3_utils import Web3Utils
+from .holder_list_utils import HolderListUtils
@@ -0,0 +1,331 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from collections import OrderedDict
+from datetime import (
+    datetime,
+    timedelta
+)
+import threading
+import time
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+
+from flask import (
+    has_request_context,
+    request
+)
+from sqlalchemy import (
+    func,
+    tuple_
+)
+from sqlalchemy.dialects.postgresql import insert
+
+from config import Config
+
+
+class ContractCallCache:
+    """コントラクト参照（eth_call）のキャッシュ
+
+    呼び出し結果（戻り値のデータ）を（コントラクトアドレス, 呼び出しデータ（関数セレクタと引数）, ブロック番号）
+    でキャッシュする。
+
+    - 同一ブロックの同一呼び出しは、RPCを送信せずにキャッシュから返却する。
+    - 最新ブロック（"latest"）のブロック番号はリクエストごとに1回取得する。
+      block_number_ttl を設定した場合、その期間はリクエストをまたいで同じブロック番号を使用する。
+    - ほぼ変更されない関数（STATIC_FUNCTION_LIST）の結果は、static_ttl 秒まで後続のブロックでも再利用する。
+      ただし、Indexerがそのコントラクトの UPDATE_EVENT_LIST のイベントを検知した場合（idx_contract_update）、
+      またはアプリがそのコントラクトにトランザクションを送信した場合は無効とする。
+    - 結果はLRUで最大 max_size 件保持する。
+      storage が "db" の場合、結果を contract_call_result テーブルにも保存し、プロセス間で共有する。
+
+    NOTE: アプリ以外から変更された値は、Indexerが検知するまで（INDEXER_CONFIRMATION_DEPTH を含む）古い可能性がある。
+    """
+
+    STORAGE_MEMORY = "memory"
+    STORAGE_DB = "db"
+
+    # 後続のブロックでも結果を再利用する関数
+    STATIC_FUNCTION_LIST = ("name", "symbol", "owner", "faceValue", "tradableExchange", "personalInfoAddress")
+    # STATIC_FUNCTION_LISTの関数の結果を変更するイベント（Indexerが検知した場合にキャッシュを無効とする）
+    UPDATE_EVENT_LIST = ("OwnershipTransferred", "ChangeFaceValue")
+    # idx_contract_update の差分読込時に遡る時間（秒）：プロセス間の時刻差とコミットの遅延を考慮する
+    REFRESH_MARGIN = 60
+    # リクエストで使用するブロック番号（WSGI environのキー）
+    REQUEST_BLOCK_NUMBER_KEY = "ibet.contract_call_block_number"
+
+    def __init__(self, web3,
+                 max_size: int = Config.CONTRACT_CALL_CACHE_SIZE,
+                 storage: str = Config.CONTRACT_CALL_CACHE_STORAGE,
+                 block_number_ttl: float = Config.CONTRACT_CALL_CACHE_BLOCK_NUMBER_TTL,
+                 static_ttl: int = Config.CONTRACT_CALL_CACHE_STATIC_TTL,
+                 refresh_interval: float = Config.CONTRACT_CALL_CACHE_REFRESH_INTERVAL):
+        if storage not in (self.STORAGE_MEMORY, self.STORAGE_DB):
+            raise ValueError(f"unknown storage: {storage}")
+        self.web3 = web3
+        self.max_size = max_size
+        self.storage = storage
+        self.block_number_ttl = block_number_ttl
+        self.static_ttl = static_ttl
+        self.refresh_interval = refresh_interval
+        # (コントラクトアドレス, 呼び出しデータ) -> (ブロック番号, 戻り値のデータ, 保存日時（UNIX時間）)
+        self.results = OrderedDict()
+        # コントラクトアドレス -> 最後に状態が変更されたブロック番号
+        self.updates = {}
+        self.block_number = None
+        self.block_number_at = 0
+        self.refreshed_at = None
+        self.refresh_checked_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def peek_block_number(self, block_identifier="latest") -> Optional[int]:
+        """参照するブロック番号の取得（RPCを送信しない）
+
+        :param block_identifier: ブロック番号または"latest"
+        :return: ブロック番号（最新ブロックのブロック番号が未取得の場合はNone）
+        """
+        if isinstance(block_identifier, int):
+            return block_identifier
+        if block_identifier != "latest":
+            raise ValueError(f"unsupported block identifier: {block_identifier}")
+
+        if has_request_context() and self.REQUEST_BLOCK_NUMBER_KEY in request.environ:
+            return request.environ[self.REQUEST_BLOCK_NUMBER_KEY]
+        with self.lock:
+            if self.block_number is not None and time.monotonic() - self.block_number_at < self.block_number_ttl:
+                return self.block_number
+        return None
+
+    def get_block_number(self, block_identifier="latest") -> int:
+        """参照するブロック番号の取得
+
+        :param block_identifier: ブロック番号または"latest"
+        :return: ブロック番号
+        """
+        block_number = self.peek_block_number(block_identifier)
+        if block_number is not None:
+            return block_number
+
+        block_number = self.web3.eth.blockNumber
+        with self.lock:
+            self.block_number = block_number
+            self.block_number_at = time.monotonic()
+        if has_request_context():
+            request.environ[self.REQUEST_BLOCK_NUMBER_KEY] = block_number
+        return block_number
+
+    def note_block_number(self, block_number: int):
+        """トランザクションが取り込まれたブロック番号の通知
+
+        以降の参照（同一リクエストを含む）で、そのブロック以降を参照する。
+
+        :param block_number: ブロック番号
+        :return: None
+        """
+        with self.lock:
+            if self.block_number is not None and self.block_number < block_number:
+                self.block_number = block_number
+        if has_request_context() and \
+                request.environ.get(self.REQUEST_BLOCK_NUMBER_KEY, block_number) < block_number:
+            request.environ[self.REQUEST_BLOCK_NUMBER_KEY] = block_number
+
+    def get(self, call_list: List[Tuple[str, str, bool]], block_number: Optional[int],
+            db_session=None) -> List[Optional[str]]:
+        """キャッシュの参照
+
+        :param call_list: 呼び出し（コントラクトアドレス, 呼び出しデータ, STATIC_FUNCTION_LISTの関数か）のリスト
+        :param block_number: ブロック番号（None: 最新ブロック。STATIC_FUNCTION_LISTの関数のみ参照する）
+        :param db_session: DBセッション。Flaskアプリ以外の場合、必須。
+        :return: 各呼び出しの戻り値のデータ（キャッシュにない場合はNone）
+        """
+        result_list = [None] * len(call_list)
+        if not self.enabled:
+            return result_list
+        self.__refresh_updates(db_session)
+
+        missing = []
+        with self.lock:
+            for i, (address, call_data, is_static) in enumerate(call_list):
+                entry = self.results.get((address, call_data))
+                if entry is not None and self.__is_valid(address, entry, is_static, block_number):
+                    self.results.move_to_end((address, call_data))
+                    result_list[i] = entry[1]
+                else:
+                    missing.append(i)
+
+        if self.storage == self.STORAGE_DB and len(missing) > 0:
+            from app.models import ContractCallResult
+            rows = self.__get_session(db_session). \
+                query(ContractCallResult). \
+                filter(tuple_(ContractCallResult.contract_address, ContractCallResult.call_data).in_(
+                    list(set((call_list[i][0], call_list[i][1]) for i in missing))
+                )). \
+                all()
+            entry_list = {
+                (row.contract_address, row.call_data): (
+                    row.block_number, row.result, (row.modified - datetime(1970, 1, 1)).total_seconds()
+                ) for row in rows
+            }
+            with self.lock:
+                for i in missing:
+                    address, call_data, is_static = call_list[i]
+                    entry = entry_list.get((address, call_data))
+                    if entry is not None and self.__is_valid(address, entry, is_static, block_number):
+                        self.__put_entry((address, call_data), entry)
+                        result_list[i] = entry[1]
+        return result_list
+
+    def put(self, call_list: List[Tuple[str, str, bool]], result_list: List[str], block_number: int,
+            db_session=None):
+        """キャッシュへの保存
+
+        :param call_list: 呼び出し（コントラクトアドレス, 呼び出しデータ, STATIC_FUNCTION_LISTの関数か）のリスト
+        :param result_list: 各呼び出しの戻り値のデータ
+        :param block_number: ブロック番号
+        :param db_session: DBセッション。Flaskアプリ以外の場合、必須。
+        :return: None
+        """
+        if not self.enabled or len(call_list) == 0:
+            return
+        stored_at = time.time()
+        with self.lock:
+            for (address, call_data, _), result in zip(call_list, result_list):
+                self.__put_entry((address, call_data), (block_number, result, stored_at))
+
+        if self.storage == self.STORAGE_DB:
+            from app.models import ContractCallResult
+            # 同一の呼び出しは1件にまとめる（ON CONFLICTは同じ行を2回更新できない）
+            values = {
+                (address, call_data): {
+                    "contract_address": address,
+                    "call_data": call_data,
+                    "block_number": block_number,
+                    "result": result,
+                    "modified": datetime.utcfromtimestamp(stored_at)
+                } for (address, call_data, _), result in zip(call_list, result_list)
+            }
+            stmt = insert(ContractCallResult).values(list(values.values()))
+            self.__execute(stmt.on_conflict_do_update(
+                index_elements=["contract_address", "call_data"],
+                set_={
+                    "block_number": stmt.excluded.block_number,
+                    "result": stmt.excluded.result,
+                    "modified": stmt.excluded.modified
+                },
+                where=ContractCallResult.block_number <= stmt.excluded.block_number
+            ), db_session)
+
+    def invalidate(self, block_number_list: Dict[str, int], db_session=None):
+        """コントラクトの状態変更の記録
+
+        記録されたブロックより前の結果は、後続のブロックで再利用しない。
+        idx_contract_update テーブルに記録し、他のプロセスのキャッシュも無効とする。
+
+        :param block_number_list: コントラクトアドレス -> 状態が変更されたブロック番号
+        :param db_session: DBセッション。Flaskアプリ以外の場合、必須（記録は次回のコミットで確定する）。
+        :return: None
+        """
+        if len(block_number_list) == 0:
+            return
+        with self.lock:
+            for address, block_number in block_number_list.items():
+                self.updates[address] = max(self.updates.get(address, block_number), block_number)
+
+        from app.models import IDXContractUpdate
+        modified = datetime.utcnow()
+        stmt = insert(IDXContractUpdate).values([
+            {
+                "contract_address": address,
+                "block_number": block_number,
+                "modified": modified
+            } for address, block_number in block_number_list.items()
+        ])
+        self.__execute(stmt.on_conflict_do_update(
+            index_elements=["contract_address"],
+            set_={
+                "block_number": func.greatest(IDXContractUpdate.block_number, stmt.excluded.block_number),
+                "modified": stmt.excluded.modified
+            }
+        ), db_session)
+
+    def __is_valid(self, address: str, entry: tuple, is_static: bool, block_number: Optional[int]) -> bool:
+        entry_block_number, _, stored_at = entry
+        if block_number is not None and entry_block_number == block_number:
+            return True
+        if not is_static:
+            return False
+        if block_number is not None and entry_block_number > block_number:
+            return False
+        if self.updates.get(address, entry_block_number) > entry_block_number:
+            return False
+        return time.time() - stored_at <= self.static_ttl
+
+    def __put_entry(self, key: tuple, entry: tuple):
+        current_entry = self.results.get(key)
+        if current_entry is not None and current_entry[0] > entry[0]:
+            return
+        self.results[key] = entry
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    def __refresh_updates(self, db_session):
+        """他のプロセス（Indexer等）が記録したコントラクトの状態変更の読込"""
+        with self.lock:
+            now = time.monotonic()
+            if self.refresh_checked_at is not None and now - self.refresh_checked_at < self.refresh_interval:
+                return
+            self.refresh_checked_at = now
+            refreshed_since = self.refreshed_at
+
+        from app.models import IDXContractUpdate
+        refreshed_at = datetime.utcnow()
+        query = self.__get_session(db_session). \
+            query(IDXContractUpdate.contract_address, IDXContractUpdate.block_number)
+        if refreshed_since is not None:
+            query = query.filter(IDXContractUpdate.modified >= refreshed_since - timedelta(seconds=self.REFRESH_MARGIN))
+        rows = query.all()
+
+        with self.lock:
+            for address, block_number in rows:
+                self.updates[address] = max(self.updates.get(address, block_number), block_number)
+            self.refreshed_at = refreshed_at
+
+    @staticmethod
+    def __get_session(db_session):
+        if db_session is not None:
+            return db_session
+        from app import db
+        return db.session
+
+    @staticmethod
+    def __execute(stmt, db_session):
+        if db_session is not None:
+            db_session.execute(stmt)
+        else:
+            # Flaskアプリの場合、リクエストのトランザクションとは別に即時コミットする
+            from app import db
+            db.engine.execute(stmt)
@@ -0,0 +1,94 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import json
+import os
+import threading
+from typing import NamedTuple
+
+
+class ContractDefinition(NamedTuple):
+    """コントラクト定義"""
+    # コントラクト名
+    name: str
+    # ABI
+    abi: list
+    # bytecode
+    bytecode: str
+    # deployedBytecode
+    bytecode_runtime: str
+    # web3のContractクラス（アドレス未割当）
+    factory: type
+
+
+class ContractRegistry:
+    """コントラクト定義（contracts/*.json）のレジストリ
+
+    コントラクト定義はコントラクト名ごとに初回参照時に1回だけ読み込み、プロセス内で共有する。
+    web3のContractクラスも同時に生成するため、アドレスの割当（bind）にABIの読込・解析を伴わない。
+
+    NOTE: ABI等は共有されるため、参照元で変更しないこと。
+    """
+
+    def __init__(self, web3, contract_dir: str = "contracts"):
+        self.web3 = web3
+        self.contract_dir = contract_dir
+        # 読込済の定義は差し替えのみ行う（参照時にロック不要）
+        self.definitions = {}
+        self.lock = threading.Lock()
+
+    def get(self, contract_name: str) -> ContractDefinition:
+        """コントラクト定義取得
+
+        :param contract_name: コントラクト名
+        :return: ContractDefinition
+        """
+        definition = self.definitions.get(contract_name)
+        if definition is not None:
+            return definition
+        with self.lock:
+            definition = self.definitions.get(contract_name)
+            if definition is None:
+                definition = self.__load(contract_name)
+                self.definitions = {**self.definitions, contract_name: definition}
+            return definition
+
+    def bind(self, contract_name: str, address: str):
+        """コントラクト接続
+
+        :param contract_name: コントラクト名
+        :param address: コントラクトアドレス（checksumアドレス）
+        :return: Contract
+        """
+        return self.get(contract_name).factory(address=address)
+
+    def __load(self, contract_name: str) -> ContractDefinition:
+        with open(os.path.join(self.contract_dir, f"{contract_name}.json"), "r") as f:
+            contract_json = json.load(f)
+        factory = self.web3.eth.contract(
+            abi=contract_json["abi"],
+            bytecode=contract_json["bytecode"],
+            bytecode_runtime=contract_json["deployedBytecode"]
+        )
+        return ContractDefinition(
+            name=contract_name,
+            abi=contract_json["abi"],
+            bytecode=contract_json["bytecode"],
+            bytecode_runtime=contract_json["deployedBytecode"],
+            factory=factory
+        )
@@ -22,21 +22,33 @@ import json
 import boto3
 from cryptography.fernet import Fernet
 from eth_keyfile import decode_keyfile_json
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
+from hexbytes import HexBytes
+from web3._utils.abi import (
+    get_abi_output_types,
+    map_abi_data
+)
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3.exceptions import BadFunctionCallOutput
 from eth_utils import to_checksum_address
 
 from config import Config
+from .contract_call_cache import ContractCallCache
+from .contract_registry import ContractRegistry
+from .web3_utils import Web3Utils
 from logging import getLogger
 
 logger = getLogger('api')
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+web3 = Web3Utils.get_web3()
+contract_call_cache = ContractCallCache(web3)
+contract_registry = ContractRegistry(web3)
 
 
 class ContractUtils:
 
+    # JSON-RPCバッチリクエストの最大件数
+    BATCH_CALL_SIZE = 100
+
     @staticmethod
     def get_contract_info(contract_name):
         """コントラクト情報取得
@@ -44,9 +56,8 @@ class ContractUtils:
         :param contract_name: コントラクト名
         :return: ABI, bytecode, deployedBytecode
         """
-        contract_file = f"contracts/{contract_name}.json"
-        contract_json = json.load(open(contract_file, "r"))
-        return contract_json["abi"], contract_json["bytecode"], contract_json["deployedBytecode"]
+        definition = contract_registry.get(contract_name)
+        return definition.abi, definition.bytecode, definition.bytecode_runtime
 
     @staticmethod
     def get_contract(contract_name, address):
@@ -56,13 +67,122 @@ class ContractUtils:
         :param address: コントラクトアドレス
         :return: Contract
         """
-        contract_file = f"contracts/{contract_name}.json"
-        contract_json = json.load(open(contract_file, "r"))
-        contract = web3.eth.contract(
-            address=to_checksum_address(address),
-            abi=contract_json['abi'],
-        )
-        return contract
+        return contract_registry.bind(contract_name, to_checksum_address(address))
+
+    @staticmethod
+    def batch_call(function_list: list, block_identifier="latest", use_cache: bool = False, db_session=None) -> list:
+        """コントラクト参照（一括）
+
+        複数の関数呼び出し（call()）をJSON-RPCのバッチリクエストで送信する。
+        HTTPリクエストは BATCH_CALL_SIZE 件ごとに1回となる。
+
+            name, symbol = ContractUtils.batch_call([
+                TokenContract.functions.name(),
+                TokenContract.functions.symbol()
+            ])
+
+        use_cache を指定した場合、ContractCallCache を参照し、キャッシュにない呼び出しのみ送信する。
+
+        :param function_list: 呼び出す関数（ContractFunction）のリスト
+        :param block_identifier: 参照するブロック（ブロック番号または"latest"）
+        :param use_cache: キャッシュを使用するか
+        :param db_session: DBセッション。キャッシュを使用する場合、Flaskアプリ以外では必須。
+        :return: 各関数の戻り値のリスト（戻り値の形式はcall()と同じ）
+        :raises ValueError: JSON-RPCのエラーが返却された場合
+        :raises BadFunctionCallOutput: 戻り値が空の場合（コントラクトが存在しない場合など）
+        """
+        call_list = [
+            (
+                function.address,
+                function._encode_transaction_data(),
+                function.fn_name in ContractCallCache.STATIC_FUNCTION_LIST
+            ) for function in function_list
+        ]
+
+        if use_cache:
+            # 最新ブロックのブロック番号が未取得の場合、まずSTATIC_FUNCTION_LISTの関数のみキャッシュを参照する
+            block_number = contract_call_cache.peek_block_number(block_identifier)
+            output_data_list = contract_call_cache.get(call_list, block_number, db_session=db_session)
+            if block_number is None and None in output_data_list:
+                block_number = contract_call_cache.get_block_number(block_identifier)
+                missing = [i for i, output_data in enumerate(output_data_list) if output_data is None]
+                cached_list = contract_call_cache.get(
+                    [call_list[i] for i in missing], block_number, db_session=db_session
+                )
+                for i, output_data in zip(missing, cached_list):
+                    output_data_list[i] = output_data
+            block_identifier = block_number
+        else:
+            output_data_list = [None] * len(function_list)
+
+        if isinstance(block_identifier, int):
+            block_identifier = hex(block_identifier)
+
+        missing = [i for i, output_data in enumerate(output_data_list) if output_data is None]
+        for i in range(0, len(missing), ContractUtils.BATCH_CALL_SIZE):
+            chunk = missing[i:i + ContractUtils.BATCH_CALL_SIZE]
+            response = web3.provider.make_batch_request([
+                {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "method": "eth_call",
+                    "params": [
+                        {
+                            "to": call_list[index][0],
+                            "data": call_list[index][1]
+                        },
+                        block_identifier
+                    ]
+                } for request_id, index in enumerate(chunk)
+            ])
+
+            # レスポンスの順序はリクエストと一致するとは限らないため、idで対応付ける
+            response_list = {item["id"]: item for item in response}
+            for request_id, index in enumerate(chunk):
+                item = response_list.get(request_id)
+                if item is None or item.get("error") is not None:
+                    raise ValueError(
+                        item["error"] if item is not None else f"no response: {function_list[index].fn_name}"
+                    )
+                output_data_list[index] = item["result"]
+
+            if use_cache:
+                # 戻り値が空の結果（コントラクトが存在しない場合など）はキャッシュしない
+                cached = [index for index in chunk if len(HexBytes(output_data_list[index])) > 0]
+                contract_call_cache.put(
+                    [call_list[index] for index in cached],
+                    [output_data_list[index] for index in cached],
+                    block_number,
+                    db_session=db_session
+                )
+
+        result_list = []
+        for function, output_data in zip(function_list, output_data_list):
+            output_types = get_abi_output_types(function.abi)
+            output_data = HexBytes(output_data)
+            if len(output_types) > 0 and len(output_data) == 0:
+                raise BadFunctionCallOutput(
+                    f"Could not decode contract function call {function.fn_name} return data 0x"
+                )
+            output = map_abi_data(
+                BASE_RETURN_NORMALIZERS,
+                output_types,
+                web3.codec.decode_abi(output_types, output_data)
+            )
+            result_list.append(output[0] if len(output) == 1 else output)
+        return result_list
+
+    @staticmethod
+    def cached_call(function, db_session=None):
+        """コントラクト参照（キャッシュあり）
+
+            name = ContractUtils.cached_call(TokenContract.functions.name())
+
+        :param function: 呼び出す関数（ContractFunction）
+        :param db_session: DBセッション。Flaskアプリ以外の場合、必須。
+        :return: 戻り値（形式はcall()と同じ）
+        """
+        return ContractUtils.batch_call([function], use_cache=True, db_session=db_session)[0]
 
     @staticmethod
     def deploy_contract(contract_name, args, deployer, db_session=None):
@@ -74,16 +194,9 @@ class ContractUtils:
         :param db_session: DBセッション。Flaskアプリ以外（Processor）の場合、必須。
         :return: contract address, ABI, transaction hash
         """
-        contract_file = f"contracts/{contract_name}.json"
-        contract_json = json.load(open(contract_file, "r"))
+        definition = contract_registry.get(contract_name)
 
-        contract = web3.eth.contract(
-            abi=contract_json["abi"],
-            bytecode=contract_json["bytecode"],
-            bytecode_runtime=contract_json["deployedBytecode"],
-        )
-
-        tx = contract.constructor(*args).buildTransaction(transaction={'from': deployer, 'gas': Config.TX_GAS_LIMIT})
+        tx = definition.factory.constructor(*args).buildTransaction(transaction={'from': deployer, 'gas': Config.TX_GAS_LIMIT})
         tx_hash, txn_receipt = ContractUtils.send_transaction(
             transaction=tx,
             eth_account=deployer,
@@ -96,7 +209,7 @@ class ContractUtils:
             if 'contractAddress' in txn_receipt.keys():
                 contract_address = txn_receipt['contractAddress']
 
-        return contract_address, contract_json['abi'], tx_hash
+        return contract_address, definition.abi, tx_hash
 
     @staticmethod
     def send_transaction(*, transaction, eth_account, db_session=None):
@@ -136,4 +249,16 @@ class ContractUtils:
 
         txn_receipt = web3.eth.waitForTransactionReceipt(tx_hash)
         logger.debug("Send Transaction: tx_hash={}, txn_receipt={}".format(tx_hash.hex(), txn_receipt))
+
+        # 送信先コントラクトの参照結果のキャッシュを無効にする
+        contract_address = transaction.get("to") or txn_receipt.get("contractAddress")
+        if contract_address is not None:
+            contract_call_cache.note_block_number(txn_receipt["blockNumber"])
+            try:
+                contract_call_cache.invalidate(
+                    {to_checksum_address(contract_address): txn_receipt["blockNumber"]},
+                    db_session=db_session
+                )
+            except Exception as err:
+                logger.error(f"Failed to invalidate the contract call cache: {err}")
         return tx_hash.hex(), txn_receipt
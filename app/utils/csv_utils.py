@@ -0,0 +1,70 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import codecs
+from typing import Iterable
+
+from flask import Response, stream_with_context
+
+
+class CsvUtils:
+
+    # 1回の送信にまとめるデータサイズ（バイト）
+    CHUNK_SIZE = 65536
+
+    @staticmethod
+    def stream_response(rows: Iterable[str], filename: str) -> Response:
+        """CSVダウンロードのレスポンス作成（ストリーミング）
+
+        行を生成しながらShift_JISに変換して送信する。ファイル全体をメモリに保持しない。
+        Shift_JISで表現できない文字は出力しない。
+
+            def generate_csv():
+                yield 'token_address,balance\\n'
+                for record in query.yield_per(1000):
+                    yield f'{record.token_address},{record.balance}\\n'
+
+            return CsvUtils.stream_response(generate_csv(), filename='holders.csv')
+
+        NOTE: 行の生成はレスポンスの送信中（リクエストコンテキスト内）に行われる。
+        入力チェック等のエラー（abort）は、生成を開始する前に行うこと。
+
+        :param rows: CSVの行（改行を含む）を生成するiterable
+        :param filename: ファイル名
+        :return: Response
+        """
+        def generate():
+            encoder = codecs.getincrementalencoder('sjis')(errors='ignore')
+            chunk = []
+            size = 0
+            for row in rows:
+                data = encoder.encode(row)
+                chunk.append(data)
+                size += len(data)
+                if size >= CsvUtils.CHUNK_SIZE:
+                    yield b''.join(chunk)
+                    chunk = []
+                    size = 0
+            chunk.append(encoder.encode('', final=True))
+            yield b''.join(chunk)
+
+        res = Response(stream_with_context(generate()))
+        res.headers['Content-Type'] = 'text/plain'
+        res.headers['Content-Disposition'] = f"attachment; filename={filename}"
+        return res
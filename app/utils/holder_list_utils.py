@@ -0,0 +1,195 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+
+import re
+from typing import Optional
+
+from config import Config
+from .contract_utils import ContractUtils
+from .token_utils import TokenUtils
+from logging import getLogger
+logger = getLogger('api')
+
+DEFAULT_VALUE = "--"
+
+
+class HolderListUtils:
+    """保有者名簿CSV（JWT API）"""
+
+    # トークン種別ごとの取引コントラクト
+    EXCHANGE_CONTRACT_NAME = {
+        Config.TEMPLATE_ID_SHARE: "IbetOTCExchange",
+        Config.TEMPLATE_ID_SB: "IbetStraightBondExchange",
+        Config.TEMPLATE_ID_MEMBERSHIP: "IbetMembershipExchange"
+    }
+
+    # CSVの列
+    CSV_COLUMNS = [
+        'token_name',
+        'token_address',
+        'account_address',
+        'key_manager',
+        'balance',
+        'commitment',
+        'name',
+        'birth_date',
+        'postal_code',
+        'address',
+        'email'
+    ]
+    # CSVの列（債券）
+    CSV_COLUMNS_SB = [
+        'token_name',
+        'token_address',
+        'account_address',
+        'key_manager',
+        'balance',
+        'commitment',
+        'total_balance',
+        'total_holdings',
+        'name',
+        'birth_date',
+        'postal_code',
+        'address',
+        'email'
+    ]
+
+    @staticmethod
+    def create_csv(token_contract, template_id: int, issuer_name: str, block_number: Optional[int] = None,
+                   db_session=None) -> bytes:
+        """保有者名簿CSV作成
+
+        残高（balance）、または注文中の残高（commitment）が存在する保有者を出力する。
+        ブロック番号を指定した場合、そのブロック時点のコントラクトの状態で作成する。
+
+        :param token_contract: トークンコントラクト
+        :param template_id: トークン種別（株式、債券、会員権）
+        :param issuer_name: 発行体名称
+        :param block_number: （任意項目）参照するブロック番号。未指定の場合は最新ブロック。
+        :param db_session: DBセッション。Flaskアプリ以外の場合、必須。
+        :return: CSV（Shift_JIS）
+        """
+        token_address = token_contract.address
+        block_identifier = block_number if block_number is not None else "latest"
+        try:
+            token_name = token_contract.functions.name().call(block_identifier=block_identifier)
+            face_value = token_contract.functions.faceValue().call(block_identifier=block_identifier) \
+                if template_id == Config.TEMPLATE_ID_SB else 0
+        except Exception as e:
+            logger.exception(e)
+            token_name = ''
+            face_value = 0
+
+        # 取引コントラクト接続
+        try:
+            tradable_exchange = token_contract.functions.tradableExchange().call(block_identifier=block_identifier)
+        except Exception as err:
+            logger.error(f"Failed to get token attributes: {err}")
+            tradable_exchange = Config.ZERO_ADDRESS
+        dex_contract = ContractUtils.get_contract(HolderListUtils.EXCHANGE_CONTRACT_NAME[template_id], tradable_exchange)
+
+        # 保有者と残高を取得
+        # トークン発行体アドレスを取得
+        token_owner = token_contract.functions.owner().call(block_identifier=block_identifier)
+        holder_page = TokenUtils.get_holder_balances(
+            token_contract=token_contract,
+            token_owner=token_owner,
+            with_personal_info=True,
+            block_identifier=block_identifier,
+            db_session=db_session
+        )
+        commitments = TokenUtils.get_commitments(
+            exchange_contract=dex_contract,
+            token_address=token_address,
+            account_address_list=[account_address for account_address, _ in holder_page.holders],
+            block_identifier=block_identifier
+        )
+
+        # 保有者情報抽出
+        holders = []
+        for account_address, balance in holder_page.holders:
+            commitment = commitments[account_address]
+
+            if balance > 0 or commitment > 0:  # 残高（balance）、または注文中の残高（commitment）が存在する情報を抽出
+                # 保有者情報：デフォルト値（個人情報なし）
+                holder = {
+                    'account_address': account_address,
+                    'key_manager': DEFAULT_VALUE,
+                    'name': DEFAULT_VALUE,
+                    'postal_code': DEFAULT_VALUE,
+                    'email': DEFAULT_VALUE,
+                    'address': DEFAULT_VALUE,
+                    'birth_date': DEFAULT_VALUE,
+                    'balance': balance,
+                    'commitment': commitment
+                }
+
+                if account_address == token_owner:  # 保有者が発行体の場合
+                    holder["name"] = issuer_name or DEFAULT_VALUE
+                else:  # 保有者が発行体以外の場合
+                    decrypted_personal_info = holder_page.personal_info.get(account_address)
+                    if decrypted_personal_info is not None:
+                        key_manager = decrypted_personal_info.get("key_manager") or DEFAULT_VALUE
+                        name = decrypted_personal_info.get("name") or DEFAULT_VALUE
+                        postal_code = decrypted_personal_info.get("postal_code") or DEFAULT_VALUE
+                        email = decrypted_personal_info.get("email") or DEFAULT_VALUE
+                        birth_date = decrypted_personal_info.get("birth") or DEFAULT_VALUE
+
+                        # 住所に含まれるUnicodeの各種ハイフン文字を半角ハイフン（U+002D）に変換する
+                        address = decrypted_personal_info.get("address", DEFAULT_VALUE)
+                        try:
+                            formatted_address = \
+                                re.sub('\u2010|\u2011|\u2012|\u2013|\u2014|\u2015|\u2212|\uff0d', '-', address)
+                        except TypeError:  # データ変換エラー
+                            formatted_address = DEFAULT_VALUE
+
+                        holder = {
+                            'account_address': account_address,
+                            'key_manager': key_manager,
+                            'name': name,
+                            'postal_code': postal_code,
+                            'email': email,
+                            'address': formatted_address,
+                            'birth_date': birth_date,
+                            'balance': balance,
+                            'commitment': commitment
+                        }
+
+                # CSV出力用にトークンに関する情報を追加
+                holder['token_name'] = token_name
+                holder['token_address'] = token_address
+                if template_id == Config.TEMPLATE_ID_SB:
+                    total_balance = holder['balance'] + holder['commitment']
+                    holder['total_balance'] = total_balance
+                    holder['total_holdings'] = total_balance * face_value
+
+                holders.append(holder)
+
+        # CSV作成
+        if template_id == Config.TEMPLATE_ID_SB:
+            csv_columns = HolderListUtils.CSV_COLUMNS_SB
+        else:
+            csv_columns = HolderListUtils.CSV_COLUMNS
+        csv_data = '\n'.join([
+            # CSVヘッダ行
+            ','.join(csv_columns),
+            # CSVデータ行
+            *[','.join(map(lambda column: str(holder1[column]), csv_columns)) for holder1 in holders]
+        ]) + '\n'
+        return csv_data.encode('sjis', 'ignore')
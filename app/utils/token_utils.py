@@ -18,18 +18,35 @@ SPDX-License-Identifier: Apache-2.0
 """
 
 import json
-from typing import Optional
+from typing import (
+    List,
+    NamedTuple,
+    Optional,
+    Tuple
+)
 
 from flask import abort
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
+from sqlalchemy import or_
 
 from config import Config
+from .contract_utils import ContractUtils
+from .web3_utils import Web3Utils
 from logging import getLogger
 logger = getLogger('api')
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+web3 = Web3Utils.get_web3()
+
+
+class HolderPage(NamedTuple):
+    """保有者一覧（ページ）"""
+    # 保有者数（検索条件なし）
+    records_total: int
+    # 保有者数（検索条件あり）
+    records_filtered: int
+    # （アカウントアドレス, 残高）のリスト
+    holders: List[Tuple[str, int]]
+    # アカウントアドレスごとの個人情報（with_personal_info指定時のみ、それ以外はNone。登録されていないアカウントは含まない）
+    personal_info: Optional[dict] = None
 
 
 class TokenUtils:
@@ -66,3 +83,173 @@ class TokenUtils:
             abort(404)
         token_abi = json.loads(token.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
         return web3.eth.contract(address=token.token_address, abi=token_abi)
+
+    @staticmethod
+    def get_holder_balances(token_contract, token_owner: str,
+                            search_address: Optional[str] = None,
+                            start: Optional[int] = None,
+                            length: Optional[int] = None,
+                            holding_only: bool = False,
+                            holding_condition=None,
+                            with_personal_info: bool = False,
+                            block_identifier="latest",
+                            db_session=None) -> HolderPage:
+        """保有者残高一覧取得
+
+        保有者残高（token_holder_balance）から保有者と残高を取得する。
+        残高には移転承認待ちの数量（pendingTransfer）を含む。
+        検索・並び替え（アカウントアドレス順）・ページングはDBで行うため、コントラクトの参照はページ内の保有者のみとなる。
+
+        発行体はイベントを伴わずに発行された数量（コンストラクタ、issue()）を保有するため、
+        リストの先頭とし、残高はコントラクトから取得する。
+
+        Config.HOLDER_BALANCE_MODE が "verify" の場合、ページ内の保有者の残高をコントラクトから取得して比較する。
+        差異がある場合は警告ログを出力し、コントラクトの残高を使用する。
+
+        ブロック番号を指定した場合、ページ内の保有者の残高はそのブロック時点のコントラクトから取得する。
+        保有者の抽出（holding_only）は現在の残高で行われるため、全保有者を対象とすること。
+
+        :param token_contract: トークンコントラクト
+        :param token_owner: 発行体アドレス
+        :param search_address: （任意項目）アカウントアドレスの検索キーワード（部分一致）
+        :param start: （任意項目）開始位置（0始まり）
+        :param length: （任意項目）取得件数。未指定または負数の場合は全件。
+        :param holding_only: 残高が0の保有者を除外するか（発行体は除外しない）
+        :param holding_condition: （任意項目）残高が0の場合に保有者に含める条件（SQL式）。holding_only指定時のみ有効。
+        :param with_personal_info: ページ内の保有者の個人情報（発行体が復号化済のもの）を一括で取得するか
+        :param block_identifier: 残高を参照するブロック（ブロック番号または"latest"）
+        :param db_session: DBセッション。Flaskアプリ以外の場合、必須。
+        :return: HolderPage
+        """
+        from app.models import PersonalInfo, TokenHolderBalance
+
+        if db_session is None:
+            from app import db
+            db_session = db.session
+
+        query = db_session.query(TokenHolderBalance). \
+            filter(TokenHolderBalance.token_address == token_contract.address). \
+            filter(TokenHolderBalance.account_address != token_owner)
+        if holding_only:
+            if holding_condition is not None:
+                query = query.filter(or_(TokenHolderBalance.balance > 0, holding_condition))
+            else:
+                query = query.filter(TokenHolderBalance.balance > 0)
+        records_total = query.count() + 1  # 発行体を含む
+
+        owner_matched = True
+        if search_address:
+            escaped = search_address.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            query = query.filter(TokenHolderBalance.account_address.like(f"%{escaped}%", escape="\\"))
+            owner_matched = search_address in token_owner
+            records_filtered = query.count() + (1 if owner_matched else 0)
+        else:
+            records_filtered = records_total
+
+        # ページ範囲：発行体は先頭行とする
+        start = max(start or 0, 0)
+        if length is not None and length < 0:
+            length = None
+        holder_list = []
+        offset = start
+        if owner_matched:
+            if start == 0:
+                holder_list.append((token_owner, None))
+            else:
+                offset = start - 1
+        query = query.order_by(TokenHolderBalance.account_address).offset(offset)
+        if length is not None:
+            query = query.limit(max(length - len(holder_list), 0))
+        if length is None or length > len(holder_list):
+            holder_list.extend([(record.account_address, record.balance) for record in query.all()])
+
+        verify = Config.HOLDER_BALANCE_MODE == "verify"
+        at_block = block_identifier != "latest"
+        target_list = [
+            account_address for account_address, balance in holder_list
+            if balance is None or verify or at_block
+        ]
+        chain_balance_list = TokenUtils.get_balances(
+            token_contract, target_list, use_cache=not verify, block_identifier=block_identifier, db_session=db_session
+        )
+
+        holders = []
+        for account_address, balance in holder_list:
+            chain_balance = chain_balance_list.get(account_address)
+            if not at_block and balance is not None and chain_balance is not None and balance != chain_balance:
+                logger.warning(
+                    f"Holder balance mismatch: token_address={token_contract.address}, "
+                    f"account_address={account_address}, db={balance}, contract={chain_balance}"
+                )
+            holders.append((account_address, chain_balance if chain_balance is not None else balance))
+
+        personal_info = None
+        if with_personal_info:
+            personal_info = PersonalInfo.get_personal_info_list(
+                issuer_address=token_owner,
+                account_address_list=[account_address for account_address, _ in holders],
+                db_session=db_session
+            )
+        return HolderPage(
+            records_total=records_total,
+            records_filtered=records_filtered,
+            holders=holders,
+            personal_info=personal_info
+        )
+
+    @staticmethod
+    def get_balances(token_contract, account_address_list: List[str], use_cache: bool = True,
+                     block_identifier="latest", db_session=None) -> dict:
+        """残高取得（コントラクト）
+
+        残高（balanceOf）と移転承認待ちの数量（pendingTransfer、株式のみ）の合計を一括で取得する。
+
+        :param token_contract: トークンコントラクト
+        :param account_address_list: アカウントアドレスのリスト
+        :param use_cache: キャッシュを使用するか
+        :param block_identifier: 参照するブロック（ブロック番号または"latest"）
+        :param db_session: DBセッション。キャッシュを使用する場合、Flaskアプリ以外では必須。
+        :return: アカウントアドレスごとの残高
+        """
+        if len(account_address_list) == 0:
+            return {}
+        function_list = [token_contract.functions.balanceOf(address) for address in account_address_list]
+        has_pending_transfer = any(
+            item.get("type") == "function" and item.get("name") == "pendingTransfer" for item in token_contract.abi
+        )
+        if has_pending_transfer:
+            function_list += [token_contract.functions.pendingTransfer(address) for address in account_address_list]
+        output_list = ContractUtils.batch_call(
+            function_list, block_identifier=block_identifier, use_cache=use_cache, db_session=db_session
+        )
+
+        count = len(account_address_list)
+        balance_list = {}
+        for i, account_address in enumerate(account_address_list):
+            balance = output_list[i]
+            if has_pending_transfer:
+                balance += output_list[count + i]
+            balance_list[account_address] = balance
+        return balance_list
+
+    @staticmethod
+    def get_commitments(exchange_contract, token_address: str, account_address_list: List[str],
+                        block_identifier="latest") -> dict:
+        """注文中数量取得（取引コントラクト）
+
+        commitmentOf を一括で取得する。取得に失敗した場合は 0 とする。
+
+        :param exchange_contract: 取引コントラクト
+        :param token_address: トークンアドレス
+        :param account_address_list: アカウントアドレスのリスト
+        :param block_identifier: 参照するブロック（ブロック番号または"latest"）
+        :return: アカウントアドレスごとの注文中数量
+        """
+        try:
+            commitment_list = ContractUtils.batch_call([
+                exchange_contract.functions.commitmentOf(address, token_address) for address in account_address_list
+            ], block_identifier=block_identifier)
+        except Exception as err:
+            logger.warning(f"Failed to get commitment: {err}")
+            commitment_list = [0] * len(account_address_list)
+        return dict(zip(account_address_list, commitment_list))
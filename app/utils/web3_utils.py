@@ -0,0 +1,234 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import json
+import threading
+import time
+from typing import (
+    Callable,
+    List,
+    Optional
+)
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from web3 import (
+    Web3,
+    HTTPProvider
+)
+from web3.middleware import geth_poa_middleware
+
+from config import Config
+from logging import getLogger
+
+logger = getLogger('api')
+
+
+class PooledHTTPProvider(HTTPProvider):
+    """JSON-RPC HTTPプロバイダ
+
+    - requests.Session のコネクションプールを使用し、keep-alive でコネクションを再利用する
+    - 接続タイムアウト・読込タイムアウトを設定する
+    - 一時的なエラー（接続エラー、タイムアウト、HTTP 429/502/503/504）の場合、バックオフしてリトライする
+    - 複数のエンドポイントを指定した場合、以下のいずれかの方式で振り分ける
+        - "failover": 先頭のエンドポイントを使用し、エラーの場合は次のエンドポイントに切り替える
+        - "round_robin": リクエストごとに順番にエンドポイントを使用する（エラーの場合は次のエンドポイントでリトライ）
+
+    observer を設定した場合、JSON-RPCのメソッドごとに observer(method, seconds, failed) が呼び出される。
+    """
+
+    # エンドポイントの振り分け方式
+    STRATEGY_LIST = ("failover", "round_robin")
+    # リトライ対象のHTTPステータス
+    RETRY_STATUS_LIST = (429, 502, 503, 504)
+    # 冪等でないメソッド（ノードに送信済みの可能性がある場合はリトライしない）
+    NON_IDEMPOTENT_METHOD_LIST = ("eth_sendTransaction", "eth_sendRawTransaction", "personal_sendTransaction")
+
+    def __init__(self,
+                 endpoint_uri_list: List[str],
+                 strategy: str = "failover",
+                 pool_size: int = 10,
+                 connect_timeout: float = 5,
+                 read_timeout: float = 60,
+                 max_retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 observer: Optional[Callable[[str, float, bool], None]] = None):
+        if len(endpoint_uri_list) == 0:
+            raise ValueError("no endpoint is specified")
+        if strategy not in self.STRATEGY_LIST:
+            raise ValueError(f"invalid strategy: {strategy}")
+        super().__init__(endpoint_uri_list[0], request_kwargs={"timeout": (connect_timeout, read_timeout)})
+        self.endpoint_uri_list = list(endpoint_uri_list)
+        self.strategy = strategy
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.observer = observer
+
+        # リトライは本クラスで行う（エンドポイントの切り替え・冪等性の判定のため）
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.endpoint_uri_list), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.endpoint_index = 0
+        self.lock = threading.Lock()
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        start_time = time.monotonic()
+        failed = True
+        try:
+            raw_response = self.__post(request_data, retryable=method not in self.NON_IDEMPOTENT_METHOD_LIST)
+            response = self.decode_rpc_response(raw_response)
+            failed = "error" in response
+            return response
+        finally:
+            if self.observer is not None:
+                self.observer(method, time.monotonic() - start_time, failed)
+
+    def make_batch_request(self, request_list: list) -> list:
+        """JSON-RPCバッチリクエスト
+
+        :param request_list: リクエスト（jsonrpc, id, method, params）のリスト
+        :return: レスポンスのリスト（順序はリクエストと一致するとは限らない）
+        :raises ValueError: バッチリクエスト自体がエラーとなった場合
+        """
+        retryable = all(request["method"] not in self.NON_IDEMPOTENT_METHOD_LIST for request in request_list)
+        start_time = time.monotonic()
+        response_list = None
+        try:
+            raw_response = self.__post(json.dumps(request_list).encode("utf-8"), retryable=retryable)
+            response = json.loads(raw_response)
+            if not isinstance(response, list):
+                raise ValueError(response.get("error") if isinstance(response, dict) else response)
+            response_list = response
+            return response_list
+        finally:
+            if self.observer is not None:
+                seconds = time.monotonic() - start_time
+                failed_id_list = None
+                if response_list is not None:
+                    failed_id_list = [item.get("id") for item in response_list if item.get("error") is not None]
+                for request in request_list:
+                    failed = failed_id_list is None or request["id"] in failed_id_list
+                    self.observer(request["method"], seconds, failed)
+
+    def __post(self, data: bytes, retryable: bool) -> bytes:
+        """リクエスト送信（リトライ・エンドポイント切り替えあり）
+
+        :param data: リクエストボディ
+        :param retryable: ノードに送信済みの可能性がある場合にリトライするか
+        :return: レスポンスボディ
+        """
+        endpoint_index = self.__get_endpoint_index()
+        retry_count = 0
+        while True:
+            endpoint_uri = self.endpoint_uri_list[endpoint_index]
+            try:
+                response = self.session.post(
+                    endpoint_uri,
+                    data=data,
+                    headers=self.get_request_headers(),
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+                return response.content
+            except requests.exceptions.RequestException as err:
+                if retry_count >= self.max_retries or not self.__is_retryable(err, retryable):
+                    raise
+                logger.warning(f"JSON-RPC request failed, retrying: endpoint={endpoint_uri}, error={err}")
+
+            retry_count += 1
+            endpoint_index = self.__switch_endpoint(endpoint_index)
+            # 全てのエンドポイントで失敗した場合にバックオフする
+            endpoint_count = len(self.endpoint_uri_list)
+            if retry_count % endpoint_count == 0:
+                time.sleep(self.backoff_factor * (2 ** (retry_count // endpoint_count - 1)))
+
+    def __get_endpoint_index(self) -> int:
+        with self.lock:
+            endpoint_index = self.endpoint_index
+            if self.strategy == "round_robin":
+                self.endpoint_index = (endpoint_index + 1) % len(self.endpoint_uri_list)
+            return endpoint_index
+
+    def __switch_endpoint(self, endpoint_index: int) -> int:
+        next_index = (endpoint_index + 1) % len(self.endpoint_uri_list)
+        if self.strategy == "failover":
+            # 以降のリクエストも次のエンドポイントを使用する
+            with self.lock:
+                if self.endpoint_index == endpoint_index:
+                    self.endpoint_index = next_index
+        return next_index
+
+    def __is_retryable(self, err: requests.exceptions.RequestException, retryable: bool) -> bool:
+        # 接続できなかった場合、リクエストはノードに送信されていない
+        if isinstance(err, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(err, requests.exceptions.ConnectionError) and len(err.args) > 0 and \
+                isinstance(getattr(err.args[0], "reason", None), NewConnectionError):
+            return True
+        if isinstance(err, requests.exceptions.HTTPError):
+            status_code = err.response.status_code if err.response is not None else None
+            if status_code == 429:
+                return True
+            return retryable and status_code in self.RETRY_STATUS_LIST
+        return retryable and isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+_web3 = None
+_web3_lock = threading.Lock()
+
+
+class Web3Utils:
+
+    @staticmethod
+    def get_web3() -> Web3:
+        """Web3取得
+
+        プロセス内で1つのWeb3（PooledHTTPProvider）を共有する。
+
+        :return: Web3
+        """
+        global _web3
+        with _web3_lock:
+            if _web3 is None:
+                _web3 = Web3Utils.create_web3()
+            return _web3
+
+    @staticmethod
+    def create_web3(endpoint_uri_list: Optional[List[str]] = None) -> Web3:
+        """Web3生成
+
+        :param endpoint_uri_list: （任意項目）JSON-RPCエンドポイントのリスト。未指定の場合は Config.WEB3_HTTP_PROVIDER_LIST
+        :return: Web3
+        """
+        provider = PooledHTTPProvider(
+            endpoint_uri_list or Config.WEB3_HTTP_PROVIDER_LIST,
+            strategy=Config.WEB3_HTTP_PROVIDER_STRATEGY,
+            pool_size=Config.WEB3_HTTP_POOL_SIZE,
+            connect_timeout=Config.WEB3_HTTP_CONNECT_TIMEOUT,
+            read_timeout=Config.WEB3_HTTP_READ_TIMEOUT,
+            max_retries=Config.WEB3_HTTP_MAX_RETRIES,
+            backoff_factor=Config.WEB3_HTTP_RETRY_BACKOFF
+        )
+        web3 = Web3(provider)
+        web3.middleware_onion.inject(geth_poa_middleware, layer=0)
+        return web3
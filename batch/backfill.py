@@ -0,0 +1,225 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import importlib
+import logging
+from logging.config import dictConfig
+import multiprocessing
+import os
+import sys
+from typing import (
+    List,
+    Tuple
+)
+
+path = os.path.join(os.path.dirname(__file__), '../')
+sys.path.append(path)
+
+from app.models import IDXBlockNumber
+from config import Config
+from batch.lib.block_checkpoint import BlockCheckpoint
+from batch.lib.index_upgrade import check_legacy_index
+
+dictConfig(Config.LOG_CONFIG)
+log_fmt = '[%(asctime)s] [BACKFILL] [%(process)d] [%(levelname)s] %(message)s'
+logging.basicConfig(format=log_fmt)
+
+# Indexers which can be backfilled (option name: (module, indexer name, number of phases))
+#   Events which update the indexed records are synchronized in a later phase,
+#   after the records have been inserted by all the partitions.
+INDEXER_LIST = {
+    "transfer": ("batch.indexer_Transfer", "Transfer", 1),
+    "apply_for": ("batch.indexer_ApplyFor", "ApplyFor", 1),
+    "consume": ("batch.indexer_Consume", "Consume", 1),
+    "order": ("batch.indexer_Order", "Order", 2),
+    "agreement": ("batch.indexer_Agreement", "Agreement", 2),
+}
+
+# Number of partitions per worker process
+PARTITIONS_PER_WORKER = 4
+# Number of retries of a partition
+MAX_RETRIES = 3
+
+
+def get_partition_list(block_from: int, block_to: int, partition_count: int) -> List[Tuple[int, int]]:
+    """Split the block range into partitions
+
+    The partitions only depend on the arguments, so that an interrupted run resumes
+    the same partitions when the command is run again with the same arguments.
+
+    :param block_from: first block
+    :param block_to: last block
+    :param partition_count: number of partitions
+    :return: list of (first block, last block)
+    """
+    partition_count = max(min(partition_count, block_to - block_from + 1), 1)
+    size = (block_to - block_from + 1) // partition_count
+    partition_list = []
+    for i in range(partition_count):
+        _from_block = block_from + size * i
+        _to_block = block_to if i == partition_count - 1 else _from_block + size - 1
+        partition_list.append((_from_block, _to_block))
+    return partition_list
+
+
+def get_partition_name(indexer_name: str, phase: int, block_from: int, block_to: int) -> str:
+    """Indexer name under which the progress of a partition is recorded (idx_block_number)"""
+    return f"{indexer_name}:backfill:{phase}:{block_from}-{block_to}"
+
+
+def run_partition(args: Tuple[str, int, int, int]) -> Tuple[int, int, list, list]:
+    """Synchronize a partition (runs in a worker process)
+
+    :param args: (option name of the indexer, phase, first block, last block)
+    :return: (first block, last block, synchronized contracts, unsynchronized contracts)
+    """
+    indexer, phase, block_from, block_to = args
+    module_name, indexer_name, phase_count = INDEXER_LIST[indexer]
+    module = importlib.import_module(module_name)
+    from batch.lib.shared import db_session
+
+    sink = module.Sinks()
+    sink.register(module.DBSink(db_session))
+    processor = module.Processor(sink=sink, db=db_session)
+    block_checkpoint = BlockCheckpoint(
+        db=db_session,
+        indexer_name=get_partition_name(indexer_name, phase, block_from, block_to),
+        initial_block_number=block_from - 1
+    )
+
+    unsynced_address_list = []
+    try:
+        for _ in range(MAX_RETRIES + 1):
+            try:
+                if phase_count > 1:
+                    unsynced_address_list = processor.backfill(block_checkpoint, block_to, phase=phase)
+                else:
+                    unsynced_address_list = processor.backfill(block_checkpoint, block_to)
+            except Exception as err:
+                logging.exception(err)
+                db_session.rollback()
+                block_checkpoint.load()
+                continue
+            if len(unsynced_address_list) == 0:
+                break
+    finally:
+        processor.close()
+
+    synced_address_list = [
+        contract_address for contract_address, block_number in block_checkpoint.load().items()
+        if block_number >= block_to
+    ]
+    db_session.remove()
+    return block_from, block_to, synced_address_list, unsynced_address_list
+
+
+def run(indexer: str, block_from: int, block_to: int, workers: int) -> bool:
+    """Backfill an index with worker processes
+
+    The block range is split into partitions, which are synchronized by the worker
+    processes with the sinks of the indexer (idempotent bulk inserts). The progress
+    of each partition is recorded in idx_block_number, so that an interrupted run
+    resumes where it stopped. When all the partitions have been synchronized, the
+    checkpoint of the live indexer is moved to the last block.
+
+    NOTE: Stop the live indexer while backfilling.
+
+    :param indexer: option name of the indexer
+    :param block_from: first block
+    :param block_to: last block
+    :param workers: number of worker processes
+    :return: True if the backfill has been completed
+    """
+    from batch.lib.shared import (
+        db_session,
+        block_height_poller
+    )
+
+    if indexer not in INDEXER_LIST:
+        logging.error(f"Unknown indexer: {indexer} (choose from {', '.join(INDEXER_LIST.keys())})")
+        return False
+    module_name, indexer_name, phase_count = INDEXER_LIST[indexer]
+
+    latest_block = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
+    if block_from < 0 or block_from > block_to or block_to > latest_block:
+        logging.error(f"Invalid block range: from={block_from}, to={block_to}, latest={latest_block}")
+        return False
+
+    # 旧バージョンで登録したデータが残っている場合は実行しない（manage.py upgrade_index）
+    try:
+        check_legacy_index(db_session, indexer_name=indexer_name)
+    except RuntimeError as e:
+        logging.error(e)
+        return False
+
+    # 稼働中のインデクサが同期済の範囲と重複する場合は実行しない
+    live_checkpoint = BlockCheckpoint(db=db_session, indexer_name=indexer_name)
+    synced_block_number = max(live_checkpoint.load().values(), default=-1)
+    if synced_block_number >= block_from:
+        logging.error(
+            f"The {indexer_name} indexer has already synchronized up to block {synced_block_number}: "
+            f"backfill from block {synced_block_number + 1}, or delete its checkpoint to rebuild the index"
+        )
+        return False
+
+    partition_list = get_partition_list(block_from, block_to, workers * PARTITIONS_PER_WORKER)
+    partition_name_list = []
+    handover_address_list = None
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes=workers) as pool:
+        for phase in range(1, phase_count + 1):
+            logging.info(f"Backfilling {indexer_name}: phase={phase}/{phase_count}, partitions={len(partition_list)}")
+            completed = True
+            for _from_block, _to_block, synced_address_list, unsynced_address_list in pool.imap_unordered(
+                    run_partition,
+                    [(indexer, phase, _from_block, _to_block) for _from_block, _to_block in partition_list]):
+                partition_name_list.append(get_partition_name(indexer_name, phase, _from_block, _to_block))
+                if len(unsynced_address_list) > 0:
+                    completed = False
+                    logging.error(f"Partition incomplete: from={_from_block}, to={_to_block}, "
+                                  f"contracts={unsynced_address_list}")
+                else:
+                    logging.info(f"Partition completed: from={_from_block}, to={_to_block}")
+                # 全パーティションで同期が完了したコントラクトのみを引き継ぐ
+                if handover_address_list is None:
+                    handover_address_list = set(synced_address_list)
+                else:
+                    handover_address_list &= set(synced_address_list)
+            if not completed:
+                logging.error("Backfill incomplete: run the same command again to resume")
+                return False
+
+    # 稼働中のインデクサの同期済blockNumberを引き継ぐ
+    #   直前のブロックまで同期済でないコントラクトは、間のブロックが未同期となるため引き継がない
+    skipped_address_list = [
+        contract_address for contract_address in sorted(handover_address_list or [])
+        if live_checkpoint.get_block_number(contract_address) != block_from - 1
+    ]
+    if len(skipped_address_list) > 0:
+        logging.warning(f"Not synchronized up to block {block_from - 1}, not handed over: {skipped_address_list}")
+    handover_address_list = [
+        contract_address for contract_address in sorted(handover_address_list or [])
+        if contract_address not in skipped_address_list
+    ]
+    live_checkpoint.set_block_number(handover_address_list, block_to)
+    db_session.query(IDXBlockNumber). \
+        filter(IDXBlockNumber.indexer_name.in_(partition_name_list)). \
+        delete(synchronize_session=False)
+    db_session.commit()
+    logging.info(f"Backfill completed: indexer={indexer_name}, to={block_to}, contracts={len(handover_address_list)}")
+    return True
@@ -0,0 +1,512 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import asyncio
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer
+)
+import json
+import os
+import threading
+import time
+from typing import (
+    List,
+    Optional
+)
+
+from eth_utils import (
+    encode_hex,
+    event_abi_to_log_topic,
+    function_signature_to_4byte_selector
+)
+import websockets
+
+CONTRACT_DIR = os.path.join(os.path.dirname(__file__), "../../contracts")
+
+
+class SyntheticChain:
+    """Synthetic chain served by FakeNode
+
+    Each registered contract emits event_count logs of every event of its ABI,
+    spread evenly over the blocks: the k-th log (k = 0, 1, ...) is in block
+    1 + k * block_count // event_count, and its arguments are
+      - uint: k + 1 (order ids, amounts, ...)
+      - address: one of HOLDER_COUNT holder addresses (tokenAddress: one of the registered tokens)
+      - bool: k is odd
+      - string: "benchmark"
+    The logs are generated on each eth_getLogs call, so the chain does not hold them in memory.
+    """
+
+    GENESIS_TIMESTAMP = 1600000000
+    HOLDER_COUNT = 1000
+    STRING_VALUE = "benchmark"
+    # Result of eth_call for functions without a registered result (8 zero words)
+    DEFAULT_CALL_RESULT = "0x" + "0" * 64 * 8
+
+    def __init__(self, block_count: int):
+        self.block_count = block_count
+        self.contract_list = {}
+        self.token_address_list = []
+        self.call_result_list = {}
+        self.event_list = {}
+
+    def add_contract(self, address: str, contract_name: str, event_count: int, is_token: bool = False):
+        """Register a contract emitting logs
+
+        :param address: contract address
+        :param contract_name: contract name (contracts/*.json)
+        :param event_count: number of logs of each event
+        :param is_token: whether the contract is a token (used for tokenAddress arguments)
+        :return: None
+        """
+        if contract_name not in self.event_list:
+            with open(os.path.join(CONTRACT_DIR, f"{contract_name}.json"), "r") as f:
+                abi = json.load(f)["abi"]
+            self.event_list[contract_name] = {
+                encode_hex(event_abi_to_log_topic(event_abi)): (event_index, event_abi)
+                for event_index, event_abi in enumerate(item for item in abi if item["type"] == "event")
+            }
+        self.contract_list[address.lower()] = (len(self.contract_list), contract_name, event_count)
+        if is_token:
+            self.token_address_list.append(address.lower())
+
+    def set_call_result(self, address: str, signature: str, result: str):
+        """Register the result of eth_call
+
+        :param address: contract address
+        :param signature: function signature (e.g. "tradableExchange()")
+        :param result: ABI encoded result (hex string)
+        :return: None
+        """
+        selector = encode_hex(function_signature_to_4byte_selector(signature))
+        self.call_result_list[(address.lower(), selector)] = result
+
+    def get_block_number(self) -> int:
+        return self.block_count
+
+    def get_block(self, block_identifier: str) -> Optional[dict]:
+        """Block returned by eth_getBlockByNumber
+
+        :param block_identifier: block number (hex string) or tag
+        :return: block (None if the block does not exist)
+        """
+        block_number = self.__to_block_number(block_identifier)
+        if block_number < 0 or block_number > self.block_count:
+            return None
+        return {
+            "number": hex(block_number),
+            "hash": self.__get_block_hash(block_number),
+            "parentHash": self.__get_block_hash(block_number - 1) if block_number > 0 else "0x" + "0" * 64,
+            "nonce": "0x0000000000000000",
+            "sha3Uncles": "0x" + "0" * 64,
+            "logsBloom": "0x" + "0" * 512,
+            "transactionsRoot": "0x" + "0" * 64,
+            "stateRoot": "0x" + "0" * 64,
+            "receiptsRoot": "0x" + "0" * 64,
+            "miner": "0x" + "0" * 40,
+            "difficulty": "0x1",
+            "totalDifficulty": hex(block_number + 1),
+            "extraData": "0x",
+            "size": "0x0",
+            "gasLimit": "0x0",
+            "gasUsed": "0x0",
+            "timestamp": hex(self.GENESIS_TIMESTAMP + block_number),
+            "transactions": [],
+            "uncles": []
+        }
+
+    def get_logs(self, filter_params: dict) -> List[dict]:
+        """Logs returned by eth_getLogs
+
+        Only the address and topic0 filters are supported.
+
+        :param filter_params: filter parameters
+        :return: logs ordered by (blockNumber, logIndex)
+        """
+        block_from = max(self.__to_block_number(filter_params.get("fromBlock", "latest")), 1)
+        block_to = min(self.__to_block_number(filter_params.get("toBlock", "latest")), self.block_count)
+        address_list = filter_params.get("address")
+        if address_list is None:
+            address_list = list(self.contract_list.keys())
+        elif isinstance(address_list, str):
+            address_list = [address_list]
+        topics = filter_params.get("topics") or [None]
+        topic_list = [topics[0]] if isinstance(topics[0], str) else topics[0]
+
+        logs = []
+        for address in address_list:
+            contract = self.contract_list.get(address.lower())
+            if contract is None:
+                continue
+            contract_index, contract_name, event_count = contract
+            event_list = self.event_list[contract_name]
+            for topic in (topic_list or event_list.keys()):
+                if topic.lower() not in event_list:
+                    continue
+                event_index, event_abi = event_list[topic.lower()]
+                # ブロック範囲に含まれるログの番号の範囲
+                k_from = max(-(-(block_from - 1) * event_count // self.block_count), 0)
+                k_to = min(-(-block_to * event_count // self.block_count) - 1, event_count - 1)
+                for k in range(k_from, k_to + 1):
+                    block_number = 1 + k * self.block_count // event_count
+                    logs.append((
+                        block_number,
+                        contract_index * 64 + event_index,
+                        address.lower(),
+                        topic.lower(),
+                        event_abi,
+                        k
+                    ))
+        logs.sort(key=lambda log: (log[0], log[1], log[5]))
+        return [self.__make_log(*log) for log in logs]
+
+    def call(self, transaction: dict) -> str:
+        """Result of eth_call
+
+        :param transaction: call transaction
+        :return: ABI encoded result (hex string)
+        """
+        selector = transaction.get("data", "0x")[:10].lower()
+        return self.call_result_list.get(
+            (transaction.get("to", "").lower(), selector),
+            self.DEFAULT_CALL_RESULT
+        )
+
+    def __make_log(self, block_number: int, log_index: int, address: str, topic: str, event_abi: dict, k: int) -> dict:
+        topics = [topic]
+        head = []
+        tail = []
+        data_inputs = [_input for _input in event_abi["inputs"] if not _input["indexed"]]
+        offset = 32 * len(data_inputs)
+        for _input in event_abi["inputs"]:
+            if _input["type"] == "string":
+                value = self.STRING_VALUE.encode("utf-8")
+                encoded = _word(len(value)) + value.hex().ljust(-(-len(value) // 32) * 64, "0")
+                word = _word(offset)
+                offset += len(encoded) // 2
+                tail.append(encoded)
+            elif _input["type"] == "address":
+                if _input["name"] == "tokenAddress" and len(self.token_address_list) > 0:
+                    word = _word(int(self.token_address_list[k % len(self.token_address_list)], 16))
+                else:
+                    word = _word(0x1000 + k % self.HOLDER_COUNT)
+            elif _input["type"] == "bool":
+                word = _word(k % 2)
+            else:
+                word = _word(k + 1)
+            if _input["indexed"]:
+                topics.append("0x" + word)
+            else:
+                head.append(word)
+        return {
+            "address": address,
+            "topics": topics,
+            "data": "0x" + "".join(head) + "".join(tail),
+            "blockNumber": hex(block_number),
+            "blockHash": self.__get_block_hash(block_number),
+            # ログごとに一意なトランザクションハッシュ
+            "transactionHash": f"0x{block_number:016x}{log_index:016x}{k:032x}",
+            "transactionIndex": "0x0",
+            "logIndex": hex(log_index),
+            "removed": False
+        }
+
+    def __to_block_number(self, block_identifier) -> int:
+        if block_identifier in ("latest", "pending", None):
+            return self.block_count
+        if block_identifier == "earliest":
+            return 0
+        if isinstance(block_identifier, int):
+            return block_identifier
+        return int(block_identifier, 16)
+
+    @staticmethod
+    def __get_block_hash(block_number: int) -> str:
+        return f"0x{0xb10c:032x}{block_number:032x}"
+
+
+def _word(value: int) -> str:
+    return f"{value:064x}"
+
+
+class FakeNode:
+    """Local JSON-RPC server serving a SyntheticChain (for benchmarks and tests)
+
+    Supports single and batch requests over HTTP with keep-alive. Every HTTP
+    request is delayed by latency seconds, as a round trip to a remote node.
+    The calls are counted per method and can be read with the bench_getStats
+    method (bench_resetStats resets them); these methods are not counted.
+
+    New blocks are added with mine(). They are notified to the block filters
+    (eth_newBlockFilter / eth_getFilterChanges) and, if ws_port is given,
+    to the newHeads subscriptions (eth_subscribe) over WebSocket.
+    """
+
+    def __init__(self, chain: SyntheticChain, latency: float = 0, host: str = "127.0.0.1", port: int = 0,
+                 ws_port: Optional[int] = None):
+        self.chain = chain
+        self.latency = latency
+        self.server = ThreadingHTTPServer((host, port), _RequestHandler)
+        self.server.daemon_threads = True
+        self.server.node = self
+        self.lock = threading.Lock()
+        self.call_count = {}
+        self.request_count = 0
+        self.log_count = 0
+        # filter id -> last block number returned by eth_getFilterChanges
+        self.block_filter_list = {}
+        self.block_filter_count = 0
+        # WebSocket connection -> newHeads subscription id
+        self.subscription_list = {}
+        self.ws_loop = None
+        self.ws_server = None
+        if ws_port is not None:
+            self.__start_ws_server(host, ws_port)
+
+    @property
+    def endpoint_uri(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def ws_endpoint_uri(self) -> Optional[str]:
+        if self.ws_server is None:
+            return None
+        host, port = self.ws_server.server.sockets[0].getsockname()[:2]
+        return f"ws://{host}:{port}"
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.ws_loop is not None:
+            asyncio.run_coroutine_threadsafe(self.__close_ws_server(), self.ws_loop).result()
+            self.ws_loop.call_soon_threadsafe(self.ws_loop.stop)
+
+    def mine(self, count: int = 1):
+        """Add new blocks to the chain
+
+        :param count: number of the blocks
+        :return: None
+        """
+        with self.lock:
+            block_from = self.chain.block_count + 1
+            self.chain.block_count += count
+            block_to = self.chain.block_count
+        if self.ws_loop is not None:
+            asyncio.run_coroutine_threadsafe(self.__publish_new_heads(block_from, block_to), self.ws_loop).result()
+
+    def handle(self, request):
+        """Handle a JSON-RPC request
+
+        :param request: request (dict) or batch request (list)
+        :return: response
+        """
+        if isinstance(request, list):
+            response = [self.__dispatch(item) for item in request]
+            methods = [item.get("method", "") for item in request]
+        else:
+            response = self.__dispatch(request)
+            methods = [request.get("method", "")]
+        if not all(method.startswith("bench_") for method in methods):
+            with self.lock:
+                self.request_count += 1
+        return response
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "calls": dict(self.call_count),
+                "requests": self.request_count,
+                "logs": self.log_count
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.call_count = {}
+            self.request_count = 0
+            self.log_count = 0
+
+    def __dispatch(self, request: dict) -> dict:
+        method = request.get("method")
+        params = request.get("params") or []
+        try:
+            if method == "bench_getStats":
+                result = self.get_stats()
+            elif method == "bench_resetStats":
+                self.reset_stats()
+                result = True
+            else:
+                with self.lock:
+                    self.call_count[method] = self.call_count.get(method, 0) + 1
+                if method == "eth_getLogs":
+                    result = self.chain.get_logs(params[0])
+                    with self.lock:
+                        self.log_count += len(result)
+                elif method == "eth_getBlockByNumber":
+                    result = self.chain.get_block(params[0])
+                elif method == "eth_blockNumber":
+                    result = hex(self.chain.get_block_number())
+                elif method == "eth_newBlockFilter":
+                    result = self.__new_block_filter()
+                elif method == "eth_getFilterChanges":
+                    result = self.__get_filter_changes(params[0])
+                elif method == "eth_uninstallFilter":
+                    with self.lock:
+                        result = self.block_filter_list.pop(params[0], None) is not None
+                elif method == "eth_call":
+                    result = self.chain.call(params[0])
+                elif method == "eth_chainId":
+                    result = "0x7e1"
+                elif method == "net_version":
+                    result = "2017"
+                else:
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": request.get("id"),
+                        "error": {"code": -32601, "message": f"the method {method} does not exist"}
+                    }
+        except Exception as err:
+            return {
+                "jsonrpc": "2.0",
+                "id": request.get("id"),
+                "error": {"code": -32000, "message": str(err)}
+            }
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def __new_block_filter(self) -> str:
+        with self.lock:
+            self.block_filter_count += 1
+            filter_id = hex(self.block_filter_count)
+            self.block_filter_list[filter_id] = self.chain.block_count
+        return filter_id
+
+    def __get_filter_changes(self, filter_id: str) -> List[str]:
+        """Hashes of the blocks added since the last call
+
+        :param filter_id: filter id
+        :return: block hashes
+        """
+        with self.lock:
+            if filter_id not in self.block_filter_list:
+                raise Exception("filter not found")
+            block_from = self.block_filter_list[filter_id] + 1
+            block_to = self.chain.block_count
+            self.block_filter_list[filter_id] = block_to
+        return [self.chain.get_block(hex(block_number))["hash"] for block_number in range(block_from, block_to + 1)]
+
+    def __start_ws_server(self, host: str, port: int):
+        self.ws_loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.ws_loop)
+            self.ws_server = self.ws_loop.run_until_complete(websockets.serve(self.__handle_ws, host, port))
+            started.set()
+            self.ws_loop.run_forever()
+
+        threading.Thread(target=run, name="FAKE-NODE-WS", daemon=True).start()
+        started.wait()
+
+    async def __close_ws_server(self):
+        self.ws_server.close()
+        await self.ws_server.wait_closed()
+
+    async def __handle_ws(self, ws, path=None):
+        """Handle the JSON-RPC requests over a WebSocket connection
+
+        eth_subscribe supports newHeads only. The other methods are handled as over HTTP.
+        """
+        try:
+            async for message in ws:
+                request = json.loads(message)
+                params = request.get("params") or []
+                if request.get("method") == "eth_subscribe":
+                    if params[:1] != ["newHeads"]:
+                        response = {
+                            "jsonrpc": "2.0",
+                            "id": request.get("id"),
+                            "error": {"code": -32000, "message": f"unsupported subscription: {params}"}
+                        }
+                    else:
+                        subscription_id = hex(id(ws))
+                        self.subscription_list[ws] = subscription_id
+                        response = {"jsonrpc": "2.0", "id": request.get("id"), "result": subscription_id}
+                else:
+                    response = self.handle(request)
+                await ws.send(json.dumps(response))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.subscription_list.pop(ws, None)
+
+    async def __publish_new_heads(self, block_from: int, block_to: int):
+        for block_number in range(block_from, block_to + 1):
+            block = self.chain.get_block(hex(block_number))
+            for ws, subscription_id in list(self.subscription_list.items()):
+                try:
+                    await ws.send(json.dumps({
+                        "jsonrpc": "2.0",
+                        "method": "eth_subscription",
+                        "params": {"subscription": subscription_id, "result": block}
+                    }))
+                except websockets.ConnectionClosed:
+                    self.subscription_list.pop(ws, None)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        node = self.server.node
+        if node.latency > 0:
+            time.sleep(node.latency)
+        body = json.dumps(node.handle(request)).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(conn, spec: dict, latency: float = 0, host: str = "127.0.0.1", port: int = 0):
+    """Run a FakeNode (target of a child process)
+
+    :param conn: connection to which the endpoint URI is sent once the server is listening
+    :param spec: chain spec {"block_count": int, "contract_list": [(address, contract name, event count, is token)],
+                             "call_result_list": [(address, signature, result)]}
+    :param latency: latency of each HTTP request (seconds)
+    :param host: host
+    :param port: port (0: any free port)
+    :return: None
+    """
+    chain = SyntheticChain(spec["block_count"])
+    for address, contract_name, event_count, is_token in spec["contract_list"]:
+        chain.add_contract(address, contract_name, event_count, is_token=is_token)
+    for address, signature, result in spec.get("call_result_list", []):
+        chain.set_call_result(address, signature, result)
+    node = FakeNode(chain, latency=latency, host=host, port=port)
+    conn.send(node.endpoint_uri)
+    node.serve_forever()
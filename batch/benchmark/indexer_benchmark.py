@@ -0,0 +1,269 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import requests
+from eth_utils import to_checksum_address
+
+path = os.path.join(os.path.dirname(__file__), '../../')
+sys.path.append(path)
+
+from batch.benchmark.fake_node import serve
+
+# Indexer throughput benchmark
+#
+#   python batch/benchmark/indexer_benchmark.py --indexer transfer --tokens 100 --events 100 --latency 0.005
+#
+# The initial sync of each indexer is run against a local fake JSON-RPC node (batch/benchmark/fake_node.py)
+# serving N tokens x M events, and the following metrics are written as JSON:
+#   - events_per_second: logs returned by eth_getLogs / elapsed time of the initial sync
+#   - rpc_calls_per_event: JSON-RPC calls (each call of a batch request is counted) per log
+#   - http_requests_per_event: HTTP requests (round trips) per log
+#   - db_statements_per_event: SQL statements executed per log
+#   - peak_rss_kb: peak RSS of the process running the indexer
+#
+# NOTE: All the rows of the tokens table and of the index tables are deleted.
+#       The test database (TEST_DATABASE_URL) is used unless --database-url is given.
+
+# Indexers to be benchmarked (option name: (module, token template, token contract, emitter of the logs))
+#   "token": each token emits M logs of every event
+#   "exchange": the exchange the tokens are traded on emits N x M logs of every event
+#   indexer_PersonalInfo is not covered: its logs carry RSA encrypted data of registered issuers.
+SCENARIO_LIST = {
+    "transfer": ("batch.indexer_Transfer", "TEMPLATE_ID_SB", "IbetStraightBond", "token"),
+    "apply_for": ("batch.indexer_ApplyFor", "TEMPLATE_ID_SB", "IbetStraightBond", "token"),
+    "consume": ("batch.indexer_Consume", "TEMPLATE_ID_COUPON", "IbetCoupon", "token"),
+    "transfer_approval": ("batch.indexer_TransferApproval", "TEMPLATE_ID_SHARE", "IbetShare", "token"),
+    "order": ("batch.indexer_Order", "TEMPLATE_ID_SB", "IbetStraightBond", "exchange"),
+    "agreement": ("batch.indexer_Agreement", "TEMPLATE_ID_SB", "IbetStraightBond", "exchange"),
+}
+
+EXCHANGE_CONTRACT_NAME = "IbetStraightBondExchange"
+EXCHANGE_ADDRESS = to_checksum_address(f"0x{0xe0000:040x}")
+
+
+def get_token_address(index: int) -> str:
+    return to_checksum_address(f"0x{0x70000 + index:040x}")
+
+
+def get_chain_spec(indexer: str, token_count: int, event_count: int, block_count: int) -> dict:
+    """Spec of the synthetic chain served by the fake node
+
+    :param indexer: option name of the indexer
+    :param token_count: number of tokens (N)
+    :param event_count: number of logs of each event per token (M)
+    :param block_count: number of blocks
+    :return: chain spec (see fake_node.serve)
+    """
+    module_name, template, contract_name, emitter = SCENARIO_LIST[indexer]
+    contract_list = [
+        (get_token_address(i), contract_name, event_count if emitter == "token" else 0, True)
+        for i in range(token_count)
+    ]
+    contract_list.append(
+        (EXCHANGE_ADDRESS, EXCHANGE_CONTRACT_NAME, token_count * event_count if emitter == "exchange" else 0, False)
+    )
+    return {
+        "block_count": block_count,
+        "contract_list": contract_list,
+        "call_result_list": [
+            (get_token_address(i), "tradableExchange()", f"0x{int(EXCHANGE_ADDRESS, 16):064x}")
+            for i in range(token_count)
+        ]
+    }
+
+
+def run_scenario(indexer: str, token_count: int) -> dict:
+    """Run the initial sync of an indexer (runs in a child process)
+
+    :param indexer: option name of the indexer
+    :param token_count: number of tokens
+    :return: metrics
+    """
+    from sqlalchemy import event
+
+    from app.models import (
+        Token,
+        Transfer,
+        IDXBalanceEvent,
+        TokenHolderBalance,
+        ApplyFor,
+        Consume,
+        Order,
+        Agreement,
+        IDXTransferApproval,
+        TransferApprovalHistory,
+        IDXBlockNumber,
+        IDXBlockHash,
+        IDXBlockTimestamp,
+        IDXTokenExchange,
+        IDXContractUpdate
+    )
+    from config import Config
+    from batch.lib.shared import (
+        engine,
+        db_session
+    )
+
+    module_name, template, contract_name, emitter = SCENARIO_LIST[indexer]
+
+    # DB初期化
+    Token.metadata.create_all(bind=engine)
+    for model in (Token, Transfer, IDXBalanceEvent, TokenHolderBalance, ApplyFor, Consume, Order, Agreement,
+                  IDXTransferApproval, TransferApprovalHistory, IDXBlockNumber, IDXBlockHash, IDXBlockTimestamp,
+                  IDXTokenExchange, IDXContractUpdate):
+        db_session.query(model).delete(synchronize_session=False)
+    with open(os.path.join(path, f"contracts/{contract_name}.json"), "r") as f:
+        abi = json.load(f)["abi"]
+    for i in range(token_count):
+        token = Token()
+        token.template_id = getattr(Config, template)
+        token.tx_hash = f"0x{i:064x}"
+        token.admin_address = Config.ZERO_ADDRESS
+        token.token_address = get_token_address(i)
+        token.abi = json.dumps(abi)
+        token.bytecode = ""
+        token.bytecode_runtime = ""
+        db_session.add(token)
+    db_session.commit()
+
+    module = importlib.import_module(module_name)
+    sink = module.Sinks()
+    sink.register(module.DBSink(db_session))
+    processor = module.Processor(sink=sink, db=db_session)
+
+    statement_count = 0
+
+    def count_statement(*args, **kwargs):
+        nonlocal statement_count
+        statement_count += 1
+
+    event.listen(engine, "before_cursor_execute", count_statement)
+    _call_node(Config.WEB3_HTTP_PROVIDER, "bench_resetStats")
+    start_time = time.perf_counter()
+    try:
+        processor.initial_sync()
+    finally:
+        processor.close()
+    elapsed_time = time.perf_counter() - start_time
+    event.remove(engine, "before_cursor_execute", count_statement)
+    stats = _call_node(Config.WEB3_HTTP_PROVIDER, "bench_getStats")
+    db_session.remove()
+
+    event_count = stats["logs"]
+    rpc_call_count = sum(stats["calls"].values())
+    return {
+        "events": event_count,
+        "elapsed_seconds": round(elapsed_time, 3),
+        "events_per_second": round(event_count / elapsed_time, 1),
+        "rpc_calls": stats["calls"],
+        "rpc_calls_per_event": round(rpc_call_count / event_count, 4) if event_count > 0 else None,
+        "http_requests_per_event": round(stats["requests"] / event_count, 4) if event_count > 0 else None,
+        "db_statements": statement_count,
+        "db_statements_per_event": round(statement_count / event_count, 4) if event_count > 0 else None,
+        # Linuxではキロバイト単位
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def _call_node(endpoint_uri: str, method: str):
+    response = requests.post(endpoint_uri, json={"jsonrpc": "2.0", "id": 1, "method": method, "params": []})
+    response.raise_for_status()
+    return response.json()["result"]
+
+
+def run(indexer: str, token_count: int, event_count: int, block_count: int, latency: float) -> dict:
+    """Benchmark an indexer
+
+    The fake node and the indexer run in separate processes,
+    so that the node does not share the CPU time and the RSS of the indexer.
+
+    :param indexer: option name of the indexer
+    :param token_count: number of tokens (N)
+    :param event_count: number of logs of each event per token (M)
+    :param block_count: number of blocks
+    :param latency: latency of each HTTP request to the node (seconds)
+    :return: parameters and metrics
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe()
+    node_process = ctx.Process(
+        target=serve,
+        args=(child_conn, get_chain_spec(indexer, token_count, event_count, block_count), latency),
+        daemon=True
+    )
+    node_process.start()
+    try:
+        os.environ["WEB3_HTTP_PROVIDER"] = parent_conn.recv()
+        os.environ.pop("WEB3_HTTP_PROVIDER_LIST", None)
+        with ctx.Pool(processes=1) as pool:
+            metrics = pool.apply(run_scenario, (indexer, token_count))
+    finally:
+        node_process.terminate()
+        node_process.join()
+
+    result = {
+        "indexer": indexer,
+        "tokens": token_count,
+        "events_per_token": event_count,
+        "blocks": block_count,
+        "latency": latency
+    }
+    result.update(metrics)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexer benchmark against a local fake JSON-RPC node")
+    parser.add_argument("--indexer", action="append", choices=list(SCENARIO_LIST.keys()),
+                        help="indexer to be benchmarked (repeatable, default: all)")
+    parser.add_argument("--tokens", type=int, default=100, help="number of tokens (N)")
+    parser.add_argument("--events", type=int, default=100, help="number of logs of each event per token (M)")
+    parser.add_argument("--blocks", type=int, default=10000, help="number of blocks")
+    parser.add_argument("--latency", type=float, default=0, help="latency of each request to the node (seconds)")
+    parser.add_argument("--database-url", help="database to be used (default: TEST_DATABASE_URL)")
+    parser.add_argument("--output", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    from config import TestingConfig
+    os.environ["DATABASE_URL"] = args.database_url or TestingConfig.SQLALCHEMY_DATABASE_URI
+    # 新規ブロック通知は使用しない
+    os.environ.pop("BLOCK_NOTIFICATION_MODE", None)
+
+    result_list = [
+        run(indexer, args.tokens, args.events, args.blocks, args.latency)
+        for indexer in (args.indexer or list(SCENARIO_LIST.keys()))
+    ]
+    output = json.dumps(result_list, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,38 +20,41 @@ import logging
 from logging.config import dictConfig
 import os
 import sys
-import time
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import (
-    sessionmaker,
-    scoped_session
+from eth_utils import to_checksum_address
+from sqlalchemy import (
+    and_,
+    bindparam
 )
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
 
 path = os.path.join(os.path.dirname(__file__), '../')
 sys.path.append(path)
 
 from app.models import (
-    Token,
     Agreement,
-    AgreementStatus,
-    Order
+    AgreementStatus
 )
-from app.utils import ContractUtils
 from config import Config
+from batch.lib.block_checkpoint import BlockCheckpoint
+from batch.lib.bulk_insert import insert_on_conflict_do_nothing
+from batch.lib.index_upgrade import check_legacy_index
+from batch.lib.log_fetcher import LogFetcher
+from batch.lib.reorg_detector import ReorgDetector
+from batch.lib.shared import (
+    web3,
+    block_notifier,
+    db_session,
+    block_height_poller,
+    exchange_registry,
+    block_timestamp_cache,
+    batch_metrics
+)
 
 dictConfig(Config.LOG_CONFIG)
 log_fmt = '[%(asctime)s] [INDEXER-Agreement] [%(process)d] [%(levelname)s] %(message)s'
 logging.basicConfig(format=log_fmt)
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
-db_session = scoped_session(sessionmaker())
-db_session.configure(bind=engine)
+task_metrics = batch_metrics.get_task("INDEXER-Agreement")
 
 
 class Sinks:
@@ -73,201 +76,292 @@ class Sinks:
         for sink in self.sinks:
             sink.on_settlement_ng(*args, **kwargs)
 
-    def flush(self, *args, **kwargs):
+    def on_rollback(self, *args, **kwargs):
         for sink in self.sinks:
-            sink.flush(*args, **kwargs)
+            sink.on_rollback(*args, **kwargs)
+
+    def flush(self, *args, **kwargs):
+        with task_metrics.time_flush():
+            for sink in self.sinks:
+                sink.flush(*args, **kwargs)
 
 
 class DBSink:
     def __init__(self, db):
         self.db = db
+        self.agreement_list = []
+        self.agreement_status_list = {}
 
     def on_agree(self, token_address, exchange_address, order_id, agreement_id,
-                 buyer_address, seller_address, price, amount, agent_address):
+                 buyer_address, seller_address, price, amount, agent_address, block_number):
         logging.debug(f"Agree: exchange_address={exchange_address}, order_id={order_id}, agreement_id={agreement_id}")
-        agreement = self.__get_agreement(exchange_address, order_id, agreement_id)
-        if agreement is None:
-            agreement = Agreement()
-            agreement.token_address = token_address
-            agreement.exchange_address = exchange_address
-            agreement.order_id = order_id
-            agreement.agreement_id = agreement_id
-            agreement.unique_order_id = exchange_address + '_' + str(order_id)
-            agreement.buyer_address = buyer_address
-            agreement.seller_address = seller_address
-            agreement.price = price
-            agreement.amount = amount
-            agreement.agent_address = agent_address
-            agreement.status = AgreementStatus.PENDING.value
-            self.db.merge(agreement)
-
-    def on_settlement_ok(self, exchange_address, order_id, agreement_id):
+        self.agreement_list.append({
+            "token_address": token_address,
+            "exchange_address": exchange_address,
+            "order_id": order_id,
+            "agreement_id": agreement_id,
+            "unique_order_id": exchange_address + '_' + str(order_id),
+            "buyer_address": buyer_address,
+            "seller_address": seller_address,
+            "price": price,
+            "amount": amount,
+            "agent_address": agent_address,
+            "status": AgreementStatus.PENDING.value,
+            "block_number": block_number
+        })
+
+    def on_settlement_ok(self, exchange_address, order_id, agreement_id, block_number):
         logging.debug(f"SettlementOK: exchange_address={exchange_address}, orderId={order_id}, agreementId={agreement_id}")
-        agreement = self.__get_agreement(exchange_address, order_id, agreement_id)
-        if agreement is not None:
-            agreement.status = AgreementStatus.DONE.value
+        self.agreement_status_list[(exchange_address, order_id, agreement_id)] = \
+            (AgreementStatus.DONE.value, block_number)
 
-    def on_settlement_ng(self, exchange_address, order_id, agreement_id, order_amount):
+    def on_settlement_ng(self, exchange_address, order_id, agreement_id, block_number):
         logging.debug(f"SettlementNG: exchange_address={exchange_address}, orderId={order_id}, agreementId={agreement_id}")
-        agreement = self.__get_agreement(exchange_address, order_id, agreement_id)
-        if agreement is not None:
-            agreement.status = AgreementStatus.CANCELED.value
-        order = self.db.query(Order). \
-            filter(Order.exchange_address == exchange_address). \
-            filter(Order.order_id == order_id). \
-            first()
-        if order is not None and not order.is_buy:
-            order.amount = order_amount
+        self.agreement_status_list[(exchange_address, order_id, agreement_id)] = \
+            (AgreementStatus.CANCELED.value, block_number)
+
+    def on_rollback(self, block_number):
+        logging.debug(f"Rollback: block_number={block_number}")
+        # 分岐点より後のブロックで登録された約定を削除する
+        self.db.query(Agreement). \
+            filter(Agreement.block_number > block_number). \
+            delete(synchronize_session=False)
+        # 分岐点より後のブロックで更新された約定ステータスを未決済に戻す（再同期時に改めて反映する）
+        self.db.query(Agreement). \
+            filter(Agreement.status_block_number > block_number). \
+            update(
+                {Agreement.status: AgreementStatus.PENDING.value, Agreement.status_block_number: None},
+                synchronize_session=False
+            )
 
     def flush(self):
+        # 未登録の約定を一括で登録した後、約定ステータスの更新を反映する
+        #   注文数量は注文インデクサが約定イベントから更新する
+        insert_on_conflict_do_nothing(
+            db=self.db,
+            model=Agreement,
+            rows=self.agreement_list,
+            index_elements=["exchange_address", "order_id", "agreement_id"]
+        )
+        if len(self.agreement_status_list) > 0:
+            self.db.execute(
+                Agreement.__table__.update().
+                where(and_(
+                    Agreement.exchange_address == bindparam("_exchange_address"),
+                    Agreement.order_id == bindparam("_order_id"),
+                    Agreement.agreement_id == bindparam("_agreement_id")
+                )).
+                values(status=bindparam("_status"), status_block_number=bindparam("_status_block_number")),
+                [
+                    {
+                        "_exchange_address": exchange_address,
+                        "_order_id": order_id,
+                        "_agreement_id": agreement_id,
+                        "_status": status,
+                        "_status_block_number": status_block_number
+                    }
+                    for (exchange_address, order_id, agreement_id), (status, status_block_number)
+                    in self.agreement_status_list.items()
+                ]
+            )
         self.db.commit()
-
-    def __get_agreement(self, exchange_address, order_id, agreement_id):
-        return self.db.query(Agreement). \
-            filter(Agreement.exchange_address == exchange_address). \
-            filter(Agreement.order_id == order_id). \
-            filter(Agreement.agreement_id == agreement_id). \
-            first()
+        self.agreement_list = []
+        self.agreement_status_list = {}
 
 
 class Processor:
     def __init__(self, sink, db):
         self.sink = sink
-        self.latest_block = web3.eth.blockNumber
+        self.latest_block = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
         self.db = db
+        self.block_checkpoint = BlockCheckpoint(db=db, indexer_name="Agreement")
+        self.reorg_detector = ReorgDetector(
+            block_height_poller,
+            db=db,
+            indexer_name="Agreement",
+            block_timestamp_cache=block_timestamp_cache
+        )
+        self.log_fetcher = LogFetcher(web3, db=db)
+        self.exchange_registry = exchange_registry
+
+    def close(self):
+        """リソースの解放（LogFetcherのスレッドプールを停止する）"""
+        self.log_fetcher.close()
 
     def get_exchange_list(self):
-        tokens = self.db.query(Token). \
-            filter(Token.token_address != None). \
-            all()
-        self.exchange_list = []
-        exchange_address_list = []
-        for token in tokens:
-            token_contract = ContractUtils.get_contract('IbetStandardTokenInterface', token.token_address)
-            try:
-                exchange_address = token_contract.functions.tradableExchange().call()
-            except Exception as e:
-                logging.warning(e)
-                continue
-            if exchange_address not in exchange_address_list:
-                exchange_address_list.append(exchange_address)
-                if token.template_id == 1:  # BONDトークン
-                    self.exchange_list.append(
-                        ContractUtils.get_contract('IbetStraightBondExchange', exchange_address)
-                    )
-                elif token.template_id == 2:  # COUPONトークン
-                    self.exchange_list.append(
-                        ContractUtils.get_contract('IbetCouponExchange', exchange_address)
-                    )
-                elif token.template_id == 3:  # MEMBERSHIPトークン
-                    self.exchange_list.append(
-                        ContractUtils.get_contract('IbetMembershipExchange', exchange_address)
-                    )
-                else:
-                    continue
+        self.exchange_list = self.exchange_registry.get_exchange_list()
 
     def initial_sync(self):
+        # 旧バージョンで登録したデータが残っている場合は同期しない（manage.py upgrade_index）
+        check_legacy_index(self.db, indexer_name="Agreement")
         self.get_exchange_list()
-        # 1,000,000ブロックずつ同期処理を行う
-        _to_block = 999999
-        _from_block = 0
-        if self.latest_block > 999999:
-            while _to_block < self.latest_block:
-                self.__sync_all(_from_block, _to_block)
-                _to_block += 1000000
-                _from_block += 1000000
-            self.__sync_all(_from_block, self.latest_block)
-        else:
-            self.__sync_all(_from_block, self.latest_block)
+        self.block_checkpoint.load()
+        self.__rollback_reorg()
+        self.__sync_all(self.latest_block)
 
     def sync_new_logs(self):
         self.get_exchange_list()
-        blockTo = web3.eth.blockNumber
-        if blockTo <= self.latest_block:
-            return
-        self.__sync_all(self.latest_block + 1, blockTo)
+        blockTo = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
+        self.__rollback_reorg()
+        self.__sync_all(blockTo)
         self.latest_block = blockTo
 
-    def __sync_all(self, block_from, block_to):
-        logging.info("syncing from={}, to={}".format(block_from, block_to))
-        self.__sync_agree(block_from, block_to)
-        self.__sync_settlement_ok(block_from, block_to)
-        self.__sync_settlement_ng(block_from, block_to)
+    def backfill(self, block_checkpoint, block_to, phase):
+        """過去ブロックの同期（manage.py backfill）
+
+        :param block_checkpoint: パーティションの同期済blockNumber
+        :param block_to: パーティションの最終ブロック
+        :param phase: 1: Agree, 2: SettlementOK・SettlementNG
+        :return: 同期が完了していないコントラクトアドレスのリスト
+        """
+        self.get_exchange_list()
+        self.__sync_range(block_checkpoint, block_to, phase=phase)
+        return [
+            exchange.address for exchange in self.exchange_list
+            if block_checkpoint.get_block_number(exchange.address) < block_to
+        ]
+
+    def __rollback_reorg(self):
+        # チェーンの再編成を検知した場合、分岐点以降のデータを削除して再同期する
+        block_number = self.reorg_detector.detect()
+        if block_number is not None:
+            self.sink.on_rollback(block_number=block_number)
+            self.block_checkpoint.rewind(block_number)
+            self.sink.flush()
+
+    def __sync_all(self, block_to):
+        self.__sync_range(self.block_checkpoint, block_to)
+        # 同期済ブロックのハッシュを記録する（reorg検知用）
+        self.reorg_detector.record(block_to)
         self.sink.flush()
+        task_metrics.set_block(block_to, block_height_poller.get_block_number())
+
+    def __sync_range(self, block_checkpoint, block_to, phase=None):
+        # DEXごとの同期済blockNumberから1,000,000ブロックずつ同期処理を行う
+        for _from_block, _to_block, exchange_list in \
+                block_checkpoint.get_sync_ranges(self.exchange_list, block_to):
+            exchange_list = block_checkpoint.filter_synced(exchange_list, _from_block)
+            if len(exchange_list) == 0:
+                continue
+            logging.info("syncing from={}, to={}".format(_from_block, _to_block))
+            # NOTE: 並列バックフィル時は、全範囲の約定を登録（phase=1）した後に約定ステータスを反映（phase=2）する
+            failed_address_list = []
+            if phase in (None, 1):
+                failed_address_list += self.__sync_agree(exchange_list, _from_block, _to_block)
+            if phase in (None, 2):
+                failed_address_list += \
+                    self.__sync_settlement_ok(exchange_list, _from_block, _to_block) + \
+                    self.__sync_settlement_ng(exchange_list, _from_block, _to_block)
+            task_metrics.add_errors(failed_address_list)
+            block_checkpoint.set_block_number(
+                [exchange.address for exchange in exchange_list if exchange.address not in failed_address_list],
+                _to_block
+            )
+            self.sink.flush()
 
     # Agree Event
-    def __sync_agree(self, block_from, block_to):
-        for exchange_contract in self.exchange_list:
+    def __sync_agree(self, exchange_list, block_from, block_to):
+        try:
+            events = self.log_fetcher.get_logs(exchange_list, "Agree", block_from, block_to)
+        except Exception as e:
+            logging.error(e)
+            return [exchange.address for exchange in exchange_list]
+
+        task_metrics.add_events(len(events))
+        exchange_contracts = {exchange.address: exchange for exchange in exchange_list}
+        failed_address_list = []
+        for event in events:
+            exchange_contract = exchange_contracts[to_checksum_address(event['address'])]
             try:
-                events = exchange_contract.events.Agree.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
-                )
-                for event in events:
-                    args = event['args']
-                    if args['amount'] > sys.maxsize:
-                        pass
-                    else:
-                        self.sink.on_agree(
-                            token_address=args['tokenAddress'],
-                            exchange_address=exchange_contract.address,
-                            order_id=args['orderId'],
-                            agreement_id=args['agreementId'],
-                            buyer_address=args['buyAddress'],
-                            seller_address=args['sellAddress'],
-                            price=args['price'],
-                            amount=args['amount'],
-                            agent_address=args['agentAddress']
-                        )
+                args = event['args']
+                if args['amount'] > sys.maxsize:
+                    pass
+                else:
+                    self.sink.on_agree(
+                        token_address=args['tokenAddress'],
+                        exchange_address=exchange_contract.address,
+                        order_id=args['orderId'],
+                        agreement_id=args['agreementId'],
+                        buyer_address=args['buyAddress'],
+                        seller_address=args['sellAddress'],
+                        price=args['price'],
+                        amount=args['amount'],
+                        agent_address=args['agentAddress'],
+                        block_number=event['blockNumber']
+                    )
             except Exception as e:
                 logging.error(e)
+                failed_address_list.append(exchange_contract.address)
+        return failed_address_list
 
     # SettlementOK Event
-    def __sync_settlement_ok(self, block_from, block_to):
-        for exchange_contract in self.exchange_list:
+    def __sync_settlement_ok(self, exchange_list, block_from, block_to):
+        try:
+            events = self.log_fetcher.get_logs(exchange_list, "SettlementOK", block_from, block_to)
+        except Exception as e:
+            logging.error(e)
+            return [exchange.address for exchange in exchange_list]
+
+        task_metrics.add_events(len(events))
+        exchange_contracts = {exchange.address: exchange for exchange in exchange_list}
+        failed_address_list = []
+        for event in events:
+            exchange_contract = exchange_contracts[to_checksum_address(event['address'])]
             try:
-                events = exchange_contract.events.SettlementOK.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
+                args = event['args']
+                self.sink.on_settlement_ok(
+                    exchange_address=exchange_contract.address,
+                    order_id=args['orderId'],
+                    agreement_id=args['agreementId'],
+                    block_number=event['blockNumber']
                 )
-                for event in events:
-                    args = event['args']
-                    self.sink.on_settlement_ok(
-                        exchange_address=exchange_contract.address,
-                        order_id=args['orderId'],
-                        agreement_id=args['agreementId']
-                    )
             except Exception as e:
                 logging.error(e)
+                failed_address_list.append(exchange_contract.address)
+        return failed_address_list
 
     # SettlementNG Event
-    def __sync_settlement_ng(self, block_from, block_to):
-        for exchange_contract in self.exchange_list:
+    def __sync_settlement_ng(self, exchange_list, block_from, block_to):
+        try:
+            events = self.log_fetcher.get_logs(exchange_list, "SettlementNG", block_from, block_to)
+        except Exception as e:
+            logging.error(e)
+            return [exchange.address for exchange in exchange_list]
+
+        task_metrics.add_events(len(events))
+        exchange_contracts = {exchange.address: exchange for exchange in exchange_list}
+        failed_address_list = []
+        for event in events:
+            exchange_contract = exchange_contracts[to_checksum_address(event['address'])]
             try:
-                events = exchange_contract.events.SettlementNG.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
+                args = event['args']
+                self.sink.on_settlement_ng(
+                    exchange_address=exchange_contract.address,
+                    order_id=args['orderId'],
+                    agreement_id=args['agreementId'],
+                    block_number=event['blockNumber']
                 )
-                for event in events:
-                    args = event['args']
-                    order_id = args['orderId']
-                    order = exchange_contract.functions.getOrder(order_id).call()
-                    self.sink.on_settlement_ng(
-                        exchange_address=exchange_contract.address,
-                        order_id=order_id,
-                        agreement_id=args['agreementId'],
-                        order_amount=order[2]
-                    )
             except Exception as e:
                 logging.error(e)
+                failed_address_list.append(exchange_contract.address)
+        return failed_address_list
+
+
+def main():
+    _sink = Sinks()
+    _sink.register(DBSink(db_session))
+    processor = Processor(sink=_sink, db=db_session)
+    batch_metrics.start()
+    logging.info("Service started successfully")
 
+    try:
+        processor.initial_sync()
+        while True:
+            processor.sync_new_logs()
+            block_notifier.wait(Config.INTERVAL_INDEXER_AGREEMENT)
+    finally:
+        processor.close()
 
-_sink = Sinks()
-_sink.register(DBSink(db_session))
-processor = Processor(sink=_sink, db=db_session)
-logging.info("Service started successfully")
 
-processor.initial_sync()
-while True:
-    processor.sync_new_logs()
-    time.sleep(Config.INTERVAL_INDEXER_AGREEMENT)
+if __name__ == "__main__":
+    main()
@@ -21,45 +21,44 @@ from datetime import (
     timezone,
     timedelta
 )
-import json
 import logging
 from logging.config import dictConfig
 import os
 import sys
-import time
 
 from eth_utils import to_checksum_address
-from sqlalchemy import create_engine
-from sqlalchemy.orm import (
-    sessionmaker,
-    scoped_session
-)
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
 from web3.exceptions import MismatchedABI
 
 path = os.path.join(os.path.dirname(__file__), '../')
 sys.path.append(path)
 
 from app.models import (
-    Token,
     Consume
 )
 from config import Config
+from batch.lib.block_checkpoint import BlockCheckpoint
+from batch.lib.bulk_insert import insert_on_conflict_do_nothing
+from batch.lib.index_upgrade import check_legacy_index
+from batch.lib.log_fetcher import LogFetcher
+from batch.lib.reorg_detector import ReorgDetector
+from batch.lib.shared import (
+    web3,
+    block_notifier,
+    db_session,
+    block_height_poller,
+    token_registry,
+    block_timestamp_cache,
+    batch_metrics
+)
 
 dictConfig(Config.LOG_CONFIG)
 log_fmt = '[%(asctime)s] [INDEXER-Consume] [%(process)d] [%(levelname)s] %(message)s'
 logging.basicConfig(format=log_fmt)
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
-db_session = scoped_session(sessionmaker())
-db_session.configure(bind=engine)
-
 JST = timezone(timedelta(hours=+9), "JST")
 
+task_metrics = batch_metrics.get_task("INDEXER-Consume")
+
 
 class Sinks:
     def __init__(self):
@@ -72,126 +71,199 @@ class Sinks:
         for sink in self.sinks:
             sink.on_consume(*args, **kwargs)
 
-    def flush(self, *args, **kwargs):
+    def on_rollback(self, *args, **kwargs):
         for sink in self.sinks:
-            sink.flush(*args, **kwargs)
+            sink.on_rollback(*args, **kwargs)
+
+    def flush(self, *args, **kwargs):
+        with task_metrics.time_flush():
+            for sink in self.sinks:
+                sink.flush(*args, **kwargs)
 
 
 class DBSink:
     def __init__(self, db):
         self.db = db
+        self.consume_list = []
 
-    def on_consume(self, transaction_hash, token_address,
+    def on_consume(self, transaction_hash, token_address, block_number, log_index,
                    consumer_address, balance, total_used_amount, used_amount, block_timestamp):
         logging.debug(f"Consume: transaction_hash={transaction_hash}, token_address={token_address}, used_amount={used_amount}")
-        consume_record = self.__get_record(transaction_hash, token_address)
-        if consume_record is None:
-            consume_record = Consume()
-            consume_record.transaction_hash = transaction_hash
-            consume_record.token_address = token_address
-            consume_record.consumer_address = consumer_address
-            consume_record.balance = balance
-            consume_record.total_used_amount = total_used_amount
-            consume_record.used_amount = used_amount
-            consume_record.block_timestamp = block_timestamp
-            self.db.merge(consume_record)
+        self.consume_list.append({
+            "transaction_hash": transaction_hash,
+            "token_address": token_address,
+            "block_number": block_number,
+            "log_index": log_index,
+            "consumer_address": consumer_address,
+            "balance": balance,
+            "total_used_amount": total_used_amount,
+            "used_amount": used_amount,
+            "block_timestamp": block_timestamp
+        })
+
+    def on_rollback(self, block_number):
+        logging.debug(f"Rollback: block_number={block_number}")
+        # 分岐点より後のブロックで登録されたイベントを削除する
+        self.db.query(Consume). \
+            filter(Consume.block_number > block_number). \
+            delete(synchronize_session=False)
 
     def flush(self):
+        # 未登録のイベントのみ一括で登録する
+        insert_on_conflict_do_nothing(
+            db=self.db,
+            model=Consume,
+            rows=self.consume_list,
+            index_elements=["transaction_hash", "token_address", "log_index"]
+        )
         self.db.commit()
-
-    def __get_record(self, transaction_hash, token_address):
-        return self.db.query(Consume). \
-            filter(Consume.transaction_hash == transaction_hash). \
-            filter(Consume.token_address == token_address). \
-            first()
+        self.consume_list = []
 
 
 class Processor:
     def __init__(self, sink, db):
         self.sink = sink
-        self.latest_block = web3.eth.blockNumber
+        self.latest_block = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
         self.db = db
         self.token_list = []
+        self.block_checkpoint = BlockCheckpoint(db=db, indexer_name="Consume")
+        self.reorg_detector = ReorgDetector(
+            block_height_poller,
+            db=db,
+            indexer_name="Consume",
+            block_timestamp_cache=block_timestamp_cache
+        )
+        self.log_fetcher = LogFetcher(web3, db=db)
+        self.block_timestamp = block_timestamp_cache
+        self.token_registry = token_registry
+
+    def close(self):
+        """リソースの解放（LogFetcherのスレッドプールを停止する）"""
+        self.log_fetcher.close()
 
     def get_consumable_token_list(self):
         self.token_list = []
-        issued_token_list = self.db.query(Token).all()
-        for issued_token in issued_token_list:
-            if issued_token.token_address is not None:
-                abi = json.loads(issued_token.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
-                token_contract = web3.eth.contract(
-                    address=issued_token.token_address,
-                    abi=abi
-                )
-                # Consumeイベントを発生させるトークンのみを追加
-                try:
-                    if token_contract.events.Consume is not None:
-                        self.token_list.append(token_contract)
-                except MismatchedABI:
-                    # Consumeイベントを発生させないトークンの場合、スキップ
-                    pass
+        for token_contract in self.token_registry.get_token_list():
+            # Consumeイベントを発生させるトークンのみを追加
+            try:
+                if token_contract.events.Consume is not None:
+                    self.token_list.append(token_contract)
+            except MismatchedABI:
+                # Consumeイベントを発生させないトークンの場合、スキップ
+                pass
 
     def initial_sync(self):
+        # 旧バージョンで登録したデータが残っている場合は同期しない（manage.py upgrade_index）
+        check_legacy_index(self.db, indexer_name="Consume")
         self.get_consumable_token_list()
-        # 1,000,000ブロックずつ同期処理を行う
-        _to_block = 999999
-        _from_block = 0
-        if self.latest_block > 999999:
-            while _to_block < self.latest_block:
-                self.__sync_all(_from_block, _to_block)
-                _to_block += 1000000
-                _from_block += 1000000
-            self.__sync_all(_from_block, self.latest_block)
-        else:
-            self.__sync_all(_from_block, self.latest_block)
+        self.block_checkpoint.load()
+        self.__rollback_reorg()
+        self.__sync_all(self.latest_block)
 
     def sync_new_logs(self):
         self.get_consumable_token_list()
-        blockTo = web3.eth.blockNumber
-        if blockTo <= self.latest_block:
-            return
-        self.__sync_all(self.latest_block + 1, blockTo)
+        blockTo = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
+        self.__rollback_reorg()
+        self.__sync_all(blockTo)
         self.latest_block = blockTo
 
-    def __sync_all(self, block_from, block_to):
-        logging.info("syncing from={}, to={}".format(block_from, block_to))
-        self.__sync_consume(block_from, block_to)
-        self.sink.flush()
+    def backfill(self, block_checkpoint, block_to):
+        """過去ブロックの同期（manage.py backfill）
 
-    def __sync_consume(self, block_from, block_to):
-        for token in self.token_list:
+        :param block_checkpoint: パーティションの同期済blockNumber
+        :param block_to: パーティションの最終ブロック
+        :return: 同期が完了していないコントラクトアドレスのリスト
+        """
+        self.get_consumable_token_list()
+        self.__sync_range(block_checkpoint, block_to)
+        return [
+            token.address for token in self.token_list
+            if block_checkpoint.get_block_number(token.address) < block_to
+        ]
+
+    def __rollback_reorg(self):
+        # チェーンの再編成を検知した場合、分岐点以降のデータを削除して再同期する
+        block_number = self.reorg_detector.detect()
+        if block_number is not None:
+            self.sink.on_rollback(block_number=block_number)
+            self.block_checkpoint.rewind(block_number)
+            self.sink.flush()
+
+    def __sync_all(self, block_to):
+        self.__sync_range(self.block_checkpoint, block_to)
+        # 同期済ブロックのハッシュを記録する（reorg検知用）
+        self.reorg_detector.record(block_to)
+        self.sink.flush()
+        task_metrics.set_block(block_to, block_height_poller.get_block_number())
+
+    def __sync_range(self, block_checkpoint, block_to):
+        # トークンごとの同期済blockNumberから1,000,000ブロックずつ同期処理を行う
+        for _from_block, _to_block, token_list in block_checkpoint.get_sync_ranges(self.token_list, block_to):
+            token_list = block_checkpoint.filter_synced(token_list, _from_block)
+            if len(token_list) == 0:
+                continue
+            logging.info("syncing from={}, to={}".format(_from_block, _to_block))
+            failed_address_list = self.__sync_consume(token_list, _from_block, _to_block)
+            task_metrics.add_errors(failed_address_list)
+            block_checkpoint.set_block_number(
+                [token.address for token in token_list if token.address not in failed_address_list],
+                _to_block
+            )
+            self.sink.flush()
+
+    def __sync_consume(self, token_list, block_from, block_to):
+        # 全トークンのConsumeイベントを1回のgetLogsで取得する
+        try:
+            events = self.log_fetcher.get_logs(token_list, "Consume", block_from, block_to)
+            self.block_timestamp.prefetch([event['blockNumber'] for event in events])
+        except Exception as e:
+            logging.error(e)
+            return [token.address for token in token_list]
+
+        task_metrics.add_events(len(events))
+        failed_address_list = []
+        for event in events:
+            token_address = to_checksum_address(event['address'])
             try:
-                events = token.events.Consume.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
-                )
-                for event in events:
-                    args = event['args']
-                    transaction_hash = event['transactionHash'].hex()
-                    block_timestamp = datetime.fromtimestamp(web3.eth.getBlock(event['blockNumber'])['timestamp'], JST)
-                    # オーバーフロー対策
-                    if args['balance'] > sys.maxsize or args['used'] > sys.maxsize or args['value'] > sys.maxsize:
-                        pass
-                    else:
-                        self.sink.on_consume(
-                            transaction_hash=transaction_hash,
-                            token_address=to_checksum_address(token.address),
-                            consumer_address=args['consumer'],
-                            balance=args['balance'],
-                            total_used_amount=args['used'],
-                            used_amount=args['value'],
-                            block_timestamp=block_timestamp
-                        )
+                args = event['args']
+                transaction_hash = event['transactionHash'].hex()
+                block_timestamp = datetime.fromtimestamp(self.block_timestamp.get(event['blockNumber']), JST)
+                # オーバーフロー対策
+                if args['balance'] > sys.maxsize or args['used'] > sys.maxsize or args['value'] > sys.maxsize:
+                    pass
+                else:
+                    self.sink.on_consume(
+                        transaction_hash=transaction_hash,
+                        token_address=token_address,
+                        block_number=event['blockNumber'],
+                        log_index=event['logIndex'],
+                        consumer_address=args['consumer'],
+                        balance=args['balance'],
+                        total_used_amount=args['used'],
+                        used_amount=args['value'],
+                        block_timestamp=block_timestamp
+                    )
             except Exception as e:
                 logging.error(e)
+                failed_address_list.append(token_address)
+        return failed_address_list
+
+
+def main():
+    _sink = Sinks()
+    _sink.register(DBSink(db_session))
+    processor = Processor(sink=_sink, db=db_session)
+    batch_metrics.start()
+    logging.info("Service started successfully")
 
+    try:
+        processor.initial_sync()
+        while True:
+            processor.sync_new_logs()
+            block_notifier.wait(Config.INTERVAL_INDEXER_CONSUME)
+    finally:
+        processor.close()
 
-_sink = Sinks()
-_sink.register(DBSink(db_session))
-processor = Processor(sink=_sink, db=db_session)
-logging.info("Service started successfully")
 
-processor.initial_sync()
-while True:
-    processor.sync_new_logs()
-    time.sleep(Config.INTERVAL_INDEXER_CONSUME)
+if __name__ == "__main__":
+    main()
@@ -22,34 +22,42 @@ import os
 import sys
 import time
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import (
-    sessionmaker,
-    scoped_session
+from eth_utils import to_checksum_address
+from sqlalchemy import (
+    and_,
+    bindparam,
+    delete
 )
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
 
 path = os.path.join(os.path.dirname(__file__), '../')
 sys.path.append(path)
 
 from app.models import (
-    Token,
-    Order
+    Order,
+    IDXOrderAmountEvent
 )
-from app.utils import ContractUtils
 from config import Config
+from batch.lib.block_checkpoint import BlockCheckpoint
+from batch.lib.bulk_insert import insert_on_conflict_do_nothing
+from batch.lib.index_upgrade import check_legacy_index
+from batch.lib.log_fetcher import LogFetcher
+from batch.lib.order_reconciler import OrderReconciler
+from batch.lib.reorg_detector import ReorgDetector
+from batch.lib.shared import (
+    web3,
+    block_notifier,
+    db_session,
+    block_height_poller,
+    exchange_registry,
+    block_timestamp_cache,
+    batch_metrics
+)
 
 dictConfig(Config.LOG_CONFIG)
 log_fmt = '[%(asctime)s] [INDEXER-Order] [%(process)d] [%(levelname)s] %(message)s'
 logging.basicConfig(format=log_fmt)
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
-db_session = scoped_session(sessionmaker())
-db_session.configure(bind=engine)
+task_metrics = batch_metrics.get_task("INDEXER-Order")
 
 
 class Sinks:
@@ -71,193 +79,475 @@ class Sinks:
         for sink in self.sinks:
             sink.on_agree(*args, **kwargs)
 
-    def flush(self, *args, **kwargs):
+    def on_settlement_ng(self, *args, **kwargs):
+        for sink in self.sinks:
+            sink.on_settlement_ng(*args, **kwargs)
+
+    def on_reconcile(self, *args, **kwargs):
+        for sink in self.sinks:
+            sink.on_reconcile(*args, **kwargs)
+
+    def on_sync_failed(self, *args, **kwargs):
+        for sink in self.sinks:
+            sink.on_sync_failed(*args, **kwargs)
+
+    def on_rollback(self, *args, **kwargs):
         for sink in self.sinks:
-            sink.flush(*args, **kwargs)
+            sink.on_rollback(*args, **kwargs)
+
+    def flush(self, *args, **kwargs):
+        with task_metrics.time_flush():
+            for sink in self.sinks:
+                sink.flush(*args, **kwargs)
 
 
 class DBSink:
+    """注文イベントを登録し、注文の取消・数量を更新する
+
+    注文数量は新規に登録された約定・約定取消イベント（idx_order_amount_event）の分のみ増減するため、
+    同じイベントを再同期しても二重に計上されない。
+    """
+
     def __init__(self, db):
         self.db = db
+        self.new_order_list = []
+        self.cancelled_order_list = {}
+        self.amount_event_list = []
+        self.order_amount_list = {}
 
     def on_new_order(self, token_address, exchange_address, order_id, account_address,
-                     is_buy, price, amount, agent_address):
+                     is_buy, price, amount, agent_address, block_number):
         logging.debug(f"NewOrder: exchange_address={exchange_address}, order_id={order_id}")
-        order = self.__get_order(exchange_address, order_id)
-        if order is None:
-            order = Order()
-            order.token_address = token_address
-            order.exchange_address = exchange_address
-            order.order_id = order_id
-            order.unique_order_id = exchange_address + '_' + str(order_id)
-            order.account_address = account_address
-            order.is_buy = is_buy
-            order.price = price
-            order.amount = amount
-            order.agent_address = agent_address
-            order.is_cancelled = False
-            self.db.merge(order)
-
-    def on_cancel_order(self, exchange_address, order_id):
+        self.new_order_list.append({
+            "token_address": token_address,
+            "exchange_address": exchange_address,
+            "order_id": order_id,
+            "unique_order_id": exchange_address + '_' + str(order_id),
+            "account_address": account_address,
+            "is_buy": is_buy,
+            "price": price,
+            "amount": amount,
+            "agent_address": agent_address,
+            "is_cancelled": False,
+            "block_number": block_number
+        })
+
+    def on_cancel_order(self, exchange_address, order_id, block_number):
         logging.debug(f"CancelOrder: exchange_address={exchange_address}, order_id={order_id}")
-        order = self.__get_order(exchange_address, order_id)
-        if order is not None:
-            order.is_cancelled = True
+        self.cancelled_order_list[(exchange_address, order_id)] = block_number
 
-    def on_agree(self, exchange_address, order_id, order_amount):
+    def on_agree(self, exchange_address, order_id, agreement_id, amount, block_number):
         logging.debug(f"Agree: exchange_address={exchange_address}, order_id={order_id}")
-        order = self.__get_order(exchange_address, order_id)
-        if order is not None:
-            order.amount = order_amount
+        self.amount_event_list.append({
+            "exchange_address": exchange_address,
+            "order_id": order_id,
+            "agreement_id": agreement_id,
+            "event": "Agree",
+            "amount": amount,
+            "block_number": block_number
+        })
+
+    def on_settlement_ng(self, exchange_address, order_id, agreement_id, amount, block_number):
+        logging.debug(f"SettlementNG: exchange_address={exchange_address}, order_id={order_id}")
+        self.amount_event_list.append({
+            "exchange_address": exchange_address,
+            "order_id": order_id,
+            "agreement_id": agreement_id,
+            "event": "SettlementNG",
+            "amount": amount,
+            "block_number": block_number
+        })
+
+    def on_reconcile(self, exchange_address, order_id, order_amount):
+        logging.warning(f"Order amount reconciled: exchange_address={exchange_address}, order_id={order_id}")
+        self.order_amount_list[(exchange_address, order_id)] = order_amount
+
+    def on_sync_failed(self, exchange_address_list):
+        # 同期に失敗したDEXの約定・約定取消イベントは破棄する（同じブロック範囲を再同期した際に改めて反映する）
+        exchange_address_list = set(exchange_address_list)
+        self.amount_event_list = [
+            amount_event for amount_event in self.amount_event_list
+            if amount_event["exchange_address"] not in exchange_address_list
+        ]
+
+    def on_rollback(self, block_number):
+        logging.debug(f"Rollback: block_number={block_number}")
+        # 分岐点より後のブロックの約定・約定取消イベントを削除し、注文数量への反映を取り消す
+        deleted_amount_events = self.db.execute(
+            delete(IDXOrderAmountEvent).
+            where(IDXOrderAmountEvent.block_number > block_number).
+            returning(IDXOrderAmountEvent.exchange_address, IDXOrderAmountEvent.order_id,
+                      IDXOrderAmountEvent.event, IDXOrderAmountEvent.amount)
+        ).fetchall()
+        self.__apply_amount_events(deleted_amount_events, sign=-1)
+        # 分岐点より後のブロックで登録された注文を削除する
+        self.db.query(Order). \
+            filter(Order.block_number > block_number). \
+            delete(synchronize_session=False)
+        # 分岐点より後のブロックで取り消された注文を未取消に戻す（再同期時に改めて反映する）
+        self.db.query(Order). \
+            filter(Order.cancelled_block_number > block_number). \
+            update({Order.is_cancelled: False, Order.cancelled_block_number: None}, synchronize_session=False)
 
     def flush(self):
+        # 未登録の注文を一括で登録した後、取消・数量の更新を反映する
+        #   更新は（DEXアドレス, 注文ID）の順に行う（デッドロック回避）
+        insert_on_conflict_do_nothing(
+            db=self.db,
+            model=Order,
+            rows=self.new_order_list,
+            index_elements=["exchange_address", "order_id"]
+        )
+        if len(self.cancelled_order_list) > 0:
+            self.db.execute(
+                Order.__table__.update().
+                where(and_(
+                    Order.exchange_address == bindparam("_exchange_address"),
+                    Order.order_id == bindparam("_order_id")
+                )).
+                values(is_cancelled=True, cancelled_block_number=bindparam("_cancelled_block_number")),
+                [
+                    {
+                        "_exchange_address": exchange_address,
+                        "_order_id": order_id,
+                        "_cancelled_block_number": cancelled_block_number
+                    }
+                    for (exchange_address, order_id), cancelled_block_number
+                    in sorted(self.cancelled_order_list.items())
+                ]
+            )
+        # 新規に登録された約定・約定取消イベントの分のみ注文数量を増減する
+        inserted_amount_events = insert_on_conflict_do_nothing(
+            db=self.db,
+            model=IDXOrderAmountEvent,
+            rows=self.amount_event_list,
+            index_elements=["exchange_address", "order_id", "agreement_id", "event"],
+            returning=[IDXOrderAmountEvent.exchange_address, IDXOrderAmountEvent.order_id,
+                       IDXOrderAmountEvent.event, IDXOrderAmountEvent.amount]
+        )
+        self.__apply_amount_events(inserted_amount_events)
+        if len(self.order_amount_list) > 0:
+            self.db.execute(
+                Order.__table__.update().
+                where(and_(
+                    Order.exchange_address == bindparam("_exchange_address"),
+                    Order.order_id == bindparam("_order_id")
+                )).
+                values(amount=bindparam("_amount")),
+                [
+                    {"_exchange_address": exchange_address, "_order_id": order_id, "_amount": amount}
+                    for (exchange_address, order_id), amount in sorted(self.order_amount_list.items())
+                ]
+            )
         self.db.commit()
-
-    def __get_order(self, exchange_address, order_id):
-        return self.db.query(Order). \
-            filter(Order.exchange_address == exchange_address). \
-            filter(Order.order_id == order_id). \
-            first()
+        self.new_order_list = []
+        self.cancelled_order_list = {}
+        self.amount_event_list = []
+        self.order_amount_list = {}
+
+    def __apply_amount_events(self, amount_events, sign=1):
+        """約定・約定取消イベントを注文数量に反映する
+
+        約定時は約定数量を減算し、約定取消時は売注文の場合のみ約定数量を戻す。
+
+        :param amount_events: 約定・約定取消イベント（exchange_address, order_id, event, amount）
+        :param sign: 1: 反映、-1: 反映の取消（ロールバック）
+        :return: None
+        """
+        agreed_amount_list = {}
+        settlement_ng_amount_list = {}
+        for amount_event in amount_events:
+            amount_list = agreed_amount_list if amount_event.event == "Agree" else settlement_ng_amount_list
+            key = (amount_event.exchange_address, amount_event.order_id)
+            amount_list[key] = amount_list.get(key, 0) + amount_event.amount * sign
+        if len(agreed_amount_list) > 0:
+            self.db.execute(
+                Order.__table__.update().
+                where(and_(
+                    Order.exchange_address == bindparam("_exchange_address"),
+                    Order.order_id == bindparam("_order_id")
+                )).
+                values(amount=Order.__table__.c.amount - bindparam("_amount")),
+                [
+                    {"_exchange_address": exchange_address, "_order_id": order_id, "_amount": amount}
+                    for (exchange_address, order_id), amount in sorted(agreed_amount_list.items())
+                ]
+            )
+        if len(settlement_ng_amount_list) > 0:
+            self.db.execute(
+                Order.__table__.update().
+                where(and_(
+                    Order.exchange_address == bindparam("_exchange_address"),
+                    Order.order_id == bindparam("_order_id"),
+                    Order.is_buy == False
+                )).
+                values(amount=Order.__table__.c.amount + bindparam("_amount")),
+                [
+                    {"_exchange_address": exchange_address, "_order_id": order_id, "_amount": amount}
+                    for (exchange_address, order_id), amount in sorted(settlement_ng_amount_list.items())
+                ]
+            )
 
 
 class Processor:
     def __init__(self, sink, db):
         self.sink = sink
-        self.latest_block = web3.eth.blockNumber
+        self.latest_block = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
         self.db = db
+        self.block_checkpoint = BlockCheckpoint(db=db, indexer_name="Order")
+        self.reorg_detector = ReorgDetector(
+            block_height_poller,
+            db=db,
+            indexer_name="Order",
+            block_timestamp_cache=block_timestamp_cache
+        )
+        self.log_fetcher = LogFetcher(web3, db=db)
+        self.exchange_registry = exchange_registry
+        self.order_reconciler = OrderReconciler(db=db)
+        self.reconciled_at = time.monotonic()
+        self.reconcile_required = False
+
+    def close(self):
+        """リソースの解放（LogFetcherのスレッドプールを停止する）"""
+        self.log_fetcher.close()
 
     def get_exchange_list(self):
-        tokens = self.db.query(Token). \
-            filter(Token.token_address != None). \
-            all()
-        self.exchange_list = []
-        exchange_address_list = []
-        for token in tokens:
-            token_contract = ContractUtils.get_contract('IbetStandardTokenInterface', token.token_address)
-            try:
-                exchange_address = token_contract.functions.tradableExchange().call()
-            except Exception as e:
-                logging.warning(e)
-                continue
-            if exchange_address not in exchange_address_list:
-                exchange_address_list.append(exchange_address)
-                if token.template_id == 1:  # BONDトークン
-                    self.exchange_list.append(
-                        ContractUtils.get_contract('IbetStraightBondExchange', exchange_address)
-                    )
-                elif token.template_id == 2:  # COUPONトークン
-                    self.exchange_list.append(
-                        ContractUtils.get_contract('IbetCouponExchange', exchange_address)
-                    )
-                elif token.template_id == 3:  # MEMBERSHIPトークン
-                    self.exchange_list.append(
-                        ContractUtils.get_contract('IbetMembershipExchange', exchange_address)
-                    )
-                else:
-                    continue
+        self.exchange_list = self.exchange_registry.get_exchange_list()
 
     def initial_sync(self):
+        # 旧バージョンで登録したデータが残っている場合は同期しない（manage.py upgrade_index）
+        check_legacy_index(self.db, indexer_name="Order")
         self.get_exchange_list()
-        # 1,000,000ブロックずつ同期処理を行う
-        _to_block = 999999
-        _from_block = 0
-        if self.latest_block > 999999:
-            while _to_block < self.latest_block:
-                self.__sync_all(_from_block, _to_block)
-                _to_block += 1000000
-                _from_block += 1000000
-            self.__sync_all(_from_block, self.latest_block)
-        else:
-            self.__sync_all(_from_block, self.latest_block)
+        self.block_checkpoint.load()
+        self.__rollback_reorg()
+        self.__sync_all(self.latest_block)
 
     def sync_new_logs(self):
         self.get_exchange_list()
-        blockTo = web3.eth.blockNumber
-        if blockTo <= self.latest_block:
-            return
-        self.__sync_all(self.latest_block + 1, blockTo)
+        blockTo = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
+        self.__rollback_reorg()
+        self.__sync_all(blockTo)
+        self.__reconcile_order_amount(blockTo)
         self.latest_block = blockTo
 
-    def __sync_all(self, block_from, block_to):
-        logging.info("syncing from={}, to={}".format(block_from, block_to))
-        self.__sync_new_order(block_from, block_to)
-        self.__sync_cancel_order(block_from, block_to)
-        self.__sync_agree(block_from, block_to)
+    def backfill(self, block_checkpoint, block_to, phase):
+        """過去ブロックの同期（manage.py backfill）
+
+        :param block_checkpoint: パーティションの同期済blockNumber
+        :param block_to: パーティションの最終ブロック
+        :param phase: 1: NewOrder, 2: CancelOrder・Agree・SettlementNG
+        :return: 同期が完了していないコントラクトアドレスのリスト
+        """
+        self.get_exchange_list()
+        self.__sync_range(block_checkpoint, block_to, phase=phase)
+        return [
+            exchange.address for exchange in self.exchange_list
+            if block_checkpoint.get_block_number(exchange.address) < block_to
+        ]
+
+    def __rollback_reorg(self):
+        # チェーンの再編成を検知した場合、分岐点以降のデータを削除して再同期する
+        block_number = self.reorg_detector.detect()
+        if block_number is not None:
+            self.sink.on_rollback(block_number=block_number)
+            self.block_checkpoint.rewind(block_number)
+            self.sink.flush()
+            # 再同期後にコントラクトの注文数量と突合する
+            self.reconcile_required = True
+
+    def __reconcile_order_amount(self, block_number):
+        # イベントから算出した注文数量をコントラクトの注文数量と定期的に突合する
+        interval = Config.INDEXER_ORDER_RECONCILE_INTERVAL
+        now = time.monotonic()
+        if not self.reconcile_required and (interval <= 0 or now - self.reconciled_at < interval):
+            return
+        # 同期が完了しているDEXのみを対象とする
+        exchange_list = [
+            exchange for exchange in self.exchange_list
+            if self.block_checkpoint.get_block_number(exchange.address) == block_number
+        ]
+        try:
+            mismatched = self.order_reconciler.reconcile(exchange_list, block_number)
+        except Exception as e:
+            logging.error(e)
+            return
+        for (exchange_address, order_id), order_amount in mismatched.items():
+            self.sink.on_reconcile(
+                exchange_address=exchange_address,
+                order_id=order_id,
+                order_amount=order_amount
+            )
+        self.sink.flush()
+        self.reconciled_at = now
+        self.reconcile_required = len(exchange_list) < len(self.exchange_list)
+
+    def __sync_all(self, block_to):
+        self.__sync_range(self.block_checkpoint, block_to)
+        # 同期済ブロックのハッシュを記録する（reorg検知用）
+        self.reorg_detector.record(block_to)
         self.sink.flush()
+        task_metrics.set_block(block_to, block_height_poller.get_block_number())
+
+    def __sync_range(self, block_checkpoint, block_to, phase=None):
+        # DEXごとの同期済blockNumberから1,000,000ブロックずつ同期処理を行う
+        for _from_block, _to_block, exchange_list in \
+                block_checkpoint.get_sync_ranges(self.exchange_list, block_to):
+            exchange_list = block_checkpoint.filter_synced(exchange_list, _from_block)
+            if len(exchange_list) == 0:
+                continue
+            logging.info("syncing from={}, to={}".format(_from_block, _to_block))
+            # NOTE: 並列バックフィル時は、全範囲の注文を登録（phase=1）した後に取消・数量を反映（phase=2）する
+            failed_address_list = []
+            if phase in (None, 1):
+                failed_address_list += self.__sync_new_order(exchange_list, _from_block, _to_block)
+            if phase in (None, 2):
+                failed_address_list += \
+                    self.__sync_cancel_order(exchange_list, _from_block, _to_block) + \
+                    self.__sync_agree(exchange_list, _from_block, _to_block) + \
+                    self.__sync_settlement_ng(exchange_list, _from_block, _to_block)
+            if len(failed_address_list) > 0:
+                self.sink.on_sync_failed(exchange_address_list=failed_address_list)
+            task_metrics.add_errors(failed_address_list)
+            block_checkpoint.set_block_number(
+                [exchange.address for exchange in exchange_list if exchange.address not in failed_address_list],
+                _to_block
+            )
+            self.sink.flush()
 
     # Order Event
-    def __sync_new_order(self, block_from, block_to):
-        for exchange_contract in self.exchange_list:
+    def __sync_new_order(self, exchange_list, block_from, block_to):
+        try:
+            events = self.log_fetcher.get_logs(exchange_list, "NewOrder", block_from, block_to)
+        except Exception as e:
+            logging.error(e)
+            return [exchange.address for exchange in exchange_list]
+
+        task_metrics.add_events(len(events))
+        exchange_contracts = {exchange.address: exchange for exchange in exchange_list}
+        failed_address_list = []
+        for event in events:
+            exchange_contract = exchange_contracts[to_checksum_address(event['address'])]
             try:
-                events = exchange_contract.events.NewOrder.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
-                )
-                for event in events:
-                    args = event['args']
-                    if args['price'] > sys.maxsize or args['amount'] > sys.maxsize:
-                        pass
-                    else:
-                        self.sink.on_new_order(
-                            token_address=args['tokenAddress'],
-                            exchange_address=exchange_contract.address,
-                            order_id=args['orderId'],
-                            account_address=args['accountAddress'],
-                            is_buy=args['isBuy'],
-                            price=args['price'],
-                            amount=args['amount'],
-                            agent_address=args['agentAddress'],
-                        )
+                args = event['args']
+                if args['price'] > sys.maxsize or args['amount'] > sys.maxsize:
+                    pass
+                else:
+                    self.sink.on_new_order(
+                        token_address=args['tokenAddress'],
+                        exchange_address=exchange_contract.address,
+                        order_id=args['orderId'],
+                        account_address=args['accountAddress'],
+                        is_buy=args['isBuy'],
+                        price=args['price'],
+                        amount=args['amount'],
+                        agent_address=args['agentAddress'],
+                        block_number=event['blockNumber']
+                    )
             except Exception as e:
                 logging.error(e)
+                failed_address_list.append(exchange_contract.address)
+        return failed_address_list
 
     # CancelOrder Event
-    def __sync_cancel_order(self, block_from, block_to):
-        for exchange_contract in self.exchange_list:
+    def __sync_cancel_order(self, exchange_list, block_from, block_to):
+        try:
+            events = self.log_fetcher.get_logs(exchange_list, "CancelOrder", block_from, block_to)
+        except Exception as e:
+            logging.error(e)
+            return [exchange.address for exchange in exchange_list]
+
+        task_metrics.add_events(len(events))
+        exchange_contracts = {exchange.address: exchange for exchange in exchange_list}
+        failed_address_list = []
+        for event in events:
+            exchange_contract = exchange_contracts[to_checksum_address(event['address'])]
             try:
-                events = exchange_contract.events.CancelOrder.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
+                self.sink.on_cancel_order(
+                    exchange_address=exchange_contract.address,
+                    order_id=event['args']['orderId'],
+                    block_number=event['blockNumber']
                 )
-                for event in events:
-                    self.sink.on_cancel_order(
-                        exchange_address=exchange_contract.address,
-                        order_id=event['args']['orderId']
-                    )
             except Exception as e:
                 logging.error(e)
+                failed_address_list.append(exchange_contract.address)
+        return failed_address_list
 
     # Agree Event
-    def __sync_agree(self, block_from, block_to):
-        for exchange_contract in self.exchange_list:
+    def __sync_agree(self, exchange_list, block_from, block_to):
+        try:
+            events = self.log_fetcher.get_logs(exchange_list, "Agree", block_from, block_to)
+        except Exception as e:
+            logging.error(e)
+            return [exchange.address for exchange in exchange_list]
+
+        task_metrics.add_events(len(events))
+        exchange_contracts = {exchange.address: exchange for exchange in exchange_list}
+        failed_address_list = []
+        for event in events:
+            exchange_contract = exchange_contracts[to_checksum_address(event['address'])]
             try:
-                events = exchange_contract.events.Agree.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
-                )
-                for event in events:
-                    args = event['args']
-                    if args['amount'] > sys.maxsize:
-                        pass
-                    else:
-                        order_id = args['orderId']
-                        order = exchange_contract.functions.getOrder(order_id).call()
-                        order_amount = order[2]
-                        self.sink.on_agree(
-                            exchange_address=exchange_contract.address,
-                            order_id=event['args']['orderId'],
-                            order_amount=order_amount
-                        )
+                args = event['args']
+                if args['amount'] > sys.maxsize:
+                    pass
+                else:
+                    self.sink.on_agree(
+                        exchange_address=exchange_contract.address,
+                        order_id=args['orderId'],
+                        agreement_id=args['agreementId'],
+                        amount=args['amount'],
+                        block_number=event['blockNumber']
+                    )
             except Exception as e:
                 logging.error(e)
+                failed_address_list.append(exchange_contract.address)
+        return failed_address_list
+
+    # SettlementNG Event
+    def __sync_settlement_ng(self, exchange_list, block_from, block_to):
+        try:
+            events = self.log_fetcher.get_logs(exchange_list, "SettlementNG", block_from, block_to)
+        except Exception as e:
+            logging.error(e)
+            return [exchange.address for exchange in exchange_list]
+
+        task_metrics.add_events(len(events))
+        exchange_contracts = {exchange.address: exchange for exchange in exchange_list}
+        failed_address_list = []
+        for event in events:
+            exchange_contract = exchange_contracts[to_checksum_address(event['address'])]
+            try:
+                args = event['args']
+                if args['amount'] > sys.maxsize:
+                    pass
+                else:
+                    self.sink.on_settlement_ng(
+                        exchange_address=exchange_contract.address,
+                        order_id=args['orderId'],
+                        agreement_id=args['agreementId'],
+                        amount=args['amount'],
+                        block_number=event['blockNumber']
+                    )
+            except Exception as e:
+                logging.error(e)
+                failed_address_list.append(exchange_contract.address)
+        return failed_address_list
+
+
+def main():
+    _sink = Sinks()
+    _sink.register(DBSink(db_session))
+    processor = Processor(sink=_sink, db=db_session)
+    batch_metrics.start()
+    logging.info("Service started successfully")
 
+    try:
+        processor.initial_sync()
+        while True:
+            processor.sync_new_logs()
+            block_notifier.wait(Config.INTERVAL_INDEXER_ORDER)
+    finally:
+        processor.close()
 
-_sink = Sinks()
-_sink.register(DBSink(db_session))
-processor = Processor(sink=_sink, db=db_session)
-logging.info("Service started successfully")
 
-processor.initial_sync()
-while True:
-    processor.sync_new_logs()
-    time.sleep(Config.INTERVAL_INDEXER_ORDER)
+if __name__ == "__main__":
+    main()
@@ -29,16 +29,8 @@ import logging
 from logging.config import dictConfig
 import os
 import sys
-import time
 
 from eth_utils import to_checksum_address
-from sqlalchemy import create_engine
-from sqlalchemy.orm import (
-    sessionmaker,
-    scoped_session
-)
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
 from web3.exceptions import BadFunctionCallOutput
 
 path = os.path.join(os.path.dirname(__file__), '../')
@@ -50,41 +42,42 @@ from app.models import (
     PersonalInfoBlockNumber
 )
 from app.models import PersonalInfo as PersonalInfoModel
+from app.utils import ContractUtils
 from config import Config
+from batch.lib.log_fetcher import LogFetcher
+from batch.lib.shared import (
+    web3,
+    block_notifier,
+    db_session,
+    block_height_poller,
+    block_timestamp_cache,
+    batch_metrics
+)
 
 dictConfig(Config.LOG_CONFIG)
 log_fmt = '[%(asctime)s] [INDEXER-PersonalInfo] [%(process)d] [%(levelname)s] %(message)s'
 logging.basicConfig(format=log_fmt)
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
-db_session = scoped_session(sessionmaker())
-db_session.configure(bind=engine)
-
 JST = timezone(timedelta(hours=+9), "JST")
 
+task_metrics = batch_metrics.get_task("INDEXER-PersonalInfo")
+
 
 class PersonalInfoContract:
     """PersonalInfoコントラクト"""
 
-    def __init__(self, issuer_address: str, custom_personal_info_address=None):
+    def __init__(self, issuer_address: str, log_fetcher: LogFetcher, custom_personal_info_address=None):
         issuer = db_session.query(Issuer). \
             filter(Issuer.eth_account == to_checksum_address(issuer_address)). \
             first()
         self.issuer = issuer
+        self.log_fetcher = log_fetcher
 
         if custom_personal_info_address is None:
             contract_address = issuer.personal_info_contract_address
         else:
             contract_address = to_checksum_address(custom_personal_info_address)
-        contract_file = f"contracts/PersonalInfo.json"
-        contract_json = json.load(open(contract_file, "r"))
-        self.personal_info_contract = web3.eth.contract(
-            address=to_checksum_address(contract_address),
-            abi=contract_json['abi'],
-        )
+        self.personal_info_contract = ContractUtils.get_contract("PersonalInfo", contract_address)
 
     def get_info(self, account_address: str, default_value=None):
         """個人情報取得
@@ -150,10 +143,7 @@ class PersonalInfoContract:
         :param block_to: block to
         :return: event entries
         """
-        events = self.personal_info_contract.events.Register.getLogs(
-            fromBlock=block_from,
-            toBlock=block_to
-        )
+        events = self.log_fetcher.get_logs([self.personal_info_contract], "Register", block_from, block_to)
         return events
 
     def get_modify_event(self, block_from, block_to):
@@ -163,10 +153,7 @@ class PersonalInfoContract:
         :param block_to: block to
         :return: event entries
         """
-        events = self.personal_info_contract.events.Modify.getLogs(
-            fromBlock=block_from,
-            toBlock=block_to
-        )
+        events = self.log_fetcher.get_logs([self.personal_info_contract], "Modify", block_from, block_to)
         return events
 
 
@@ -186,8 +173,9 @@ class Sinks:
             sink.on_personalinfo_modify(*args, **kwargs)
 
     def flush(self, *args, **kwargs):
-        for sink in self.sinks:
-            sink.flush(*args, **kwargs)
+        with task_metrics.time_flush():
+            for sink in self.sinks:
+                sink.flush(*args, **kwargs)
 
 
 class DBSink:
@@ -231,14 +219,20 @@ class DBSink:
 class Processor:
     def __init__(self, sink, db):
         self.sink = sink
-        self.latest_block = web3.eth.blockNumber
+        self.latest_block = block_height_poller.get_block_number()
         self.db = db
         self.personalinfo_list = []
+        self.block_timestamp = block_timestamp_cache
+        self.log_fetcher = LogFetcher(web3, db=db)
+
+    def close(self):
+        """リソースの解放（LogFetcherのスレッドプールを停止する）"""
+        self.log_fetcher.close()
 
     def process(self):
         self.__refresh_personalinfo_list()
         block_number = self.__get_blocknumber()  # DB同期済の直近のblockNumber
-        latest_block = web3.eth.blockNumber  # 現在の最新のblockNumber
+        latest_block = block_height_poller.get_block_number()  # 現在の最新のblockNumber
         logging.info("syncing from={}, to={}".format(block_number, latest_block))
         if block_number >= latest_block:
             logging.debug("Skip Process")
@@ -246,6 +240,7 @@ class Processor:
             self.__sync_all(block_number + 1, latest_block)
             self.__set_blocknumber(latest_block)
             self.sink.flush()
+            task_metrics.set_block(latest_block, block_height_poller.get_block_number())
 
     def __refresh_personalinfo_list(self):
         self.personalinfo_list.clear()
@@ -282,6 +277,7 @@ class Processor:
         for item in unique_list:
             personalinfo_contract = PersonalInfoContract(
                 issuer_address=item["issuer_address"],
+                log_fetcher=self.log_fetcher,
                 custom_personal_info_address=item["personalinfo_address"]
             )
             self.personalinfo_list.append(personalinfo_contract)
@@ -319,13 +315,17 @@ class Processor:
         for _personalinfo in self.personalinfo_list:
             try:
                 register_event_list = _personalinfo.get_register_event(block_from, block_to)
+                task_metrics.add_events(len(register_event_list))
+                self.block_timestamp.prefetch([
+                    event["blockNumber"] for event in register_event_list
+                    if event["args"].get("link_address") == _personalinfo.issuer.eth_account
+                ])
                 for event in register_event_list:
                     args = event["args"]
                     account_address = args.get("account_address", Config.ZERO_ADDRESS)
                     link_address = args.get("link_address", Config.ZERO_ADDRESS)
                     if link_address == _personalinfo.issuer.eth_account:
-                        block = web3.eth.getBlock(event["blockNumber"])
-                        timestamp = datetime.fromtimestamp(block["timestamp"])
+                        timestamp = datetime.fromtimestamp(self.block_timestamp.get(event["blockNumber"]))
                         decrypted_personalinfo = _personalinfo.get_info(account_address=account_address)
                         self.sink.on_personalinfo_register(
                             account_address=account_address,
@@ -336,18 +336,23 @@ class Processor:
                         self.sink.flush()
             except Exception as err:
                 logging.error(err)
+                task_metrics.add_errors([_personalinfo.personal_info_contract.address])
 
     def __sync_personalinfo_modify(self, block_from, block_to):
         for _personalinfo in self.personalinfo_list:
             try:
                 register_event_list = _personalinfo.get_modify_event(block_from, block_to)
+                task_metrics.add_events(len(register_event_list))
+                self.block_timestamp.prefetch([
+                    event["blockNumber"] for event in register_event_list
+                    if event["args"].get("link_address") == _personalinfo.issuer.eth_account
+                ])
                 for event in register_event_list:
                     args = event["args"]
                     account_address = args.get("account_address", Config.ZERO_ADDRESS)
                     link_address = args.get("link_address", Config.ZERO_ADDRESS)
                     if link_address == _personalinfo.issuer.eth_account:
-                        block = web3.eth.getBlock(event["blockNumber"])
-                        timestamp = datetime.fromtimestamp(block["timestamp"])
+                        timestamp = datetime.fromtimestamp(self.block_timestamp.get(event["blockNumber"]))
                         decrypted_personalinfo = _personalinfo.get_info(account_address=account_address)
                         self.sink.on_personalinfo_modify(
                             account_address=account_address,
@@ -358,18 +363,28 @@ class Processor:
                         self.sink.flush()
             except Exception as err:
                 logging.error(err)
+                task_metrics.add_errors([_personalinfo.personal_info_contract.address])
 
 
-_sink = Sinks()
-_sink.register(DBSink(db_session))
-processor = Processor(sink=_sink, db=db_session)
-logging.info("Service started successfully")
+def main():
+    _sink = Sinks()
+    _sink.register(DBSink(db_session))
+    processor = Processor(sink=_sink, db=db_session)
+    batch_metrics.start()
+    logging.info("Service started successfully")
 
-while True:
     try:
-        processor.process()
-        logging.debug("Processed")
-    except Exception as ex:
-        logging.exception(ex)
+        while True:
+            try:
+                processor.process()
+                logging.debug("Processed")
+            except Exception as ex:
+                logging.exception(ex)
+
+            block_notifier.wait(Config.INTERVAL_INDEXER_PERSONAL_INFO)
+    finally:
+        processor.close()
+
 
-    time.sleep(Config.INTERVAL_INDEXER_PERSONAL_INFO)
+if __name__ == "__main__":
+    main()
@@ -21,44 +21,47 @@ from datetime import (
     timezone,
     timedelta
 )
-import json
 import logging
 from logging.config import dictConfig
 import os
 import sys
-import time
 
 from eth_utils import to_checksum_address
-from sqlalchemy import create_engine
-from sqlalchemy.orm import (
-    sessionmaker,
-    scoped_session
-)
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
 
 path = os.path.join(os.path.dirname(__file__), '../')
 sys.path.append(path)
 
 from config import Config
+from sqlalchemy import delete
+
 from app.models import (
-    Token,
-    Transfer
+    Transfer,
+    IDXBalanceEvent
+)
+from batch.lib.block_checkpoint import BlockCheckpoint
+from batch.lib.bulk_insert import insert_on_conflict_do_nothing
+from batch.lib.index_upgrade import check_legacy_index
+from batch.lib.holder_balance import HolderBalanceDelta
+from batch.lib.log_fetcher import LogFetcher
+from batch.lib.reorg_detector import ReorgDetector
+from batch.lib.shared import (
+    web3,
+    block_notifier,
+    db_session,
+    block_height_poller,
+    token_registry,
+    block_timestamp_cache,
+    batch_metrics
 )
 
 dictConfig(Config.LOG_CONFIG)
 log_fmt = '[%(asctime)s] [INDEXER-Transfer] [%(process)d] [%(levelname)s] %(message)s'
 logging.basicConfig(format=log_fmt)
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
-db_session = scoped_session(sessionmaker())
-db_session.configure(bind=engine)
-
 JST = timezone(timedelta(hours=+9), "JST")
 
+task_metrics = batch_metrics.get_task("INDEXER-Transfer")
+
 
 class Sinks:
     def __init__(self):
@@ -71,117 +74,306 @@ class Sinks:
         for sink in self.sinks:
             sink.on_transfer(*args, **kwargs)
 
-    def flush(self, *args, **kwargs):
+    def on_balance_event(self, *args, **kwargs):
         for sink in self.sinks:
-            sink.flush(*args, **kwargs)
+            sink.on_balance_event(*args, **kwargs)
+
+    def on_rollback(self, *args, **kwargs):
+        for sink in self.sinks:
+            sink.on_rollback(*args, **kwargs)
+
+    def flush(self, *args, **kwargs):
+        with task_metrics.time_flush():
+            for sink in self.sinks:
+                sink.flush(*args, **kwargs)
 
 
 class DBSink:
+    """Transferイベント・残高変動イベントを登録し、保有者残高（token_holder_balance）を更新する
+
+    保有者残高は新規に登録されたイベントの分のみ増減するため、同じイベントを再同期しても二重に計上されない。
+    """
+
     def __init__(self, db):
         self.db = db
+        self.transfer_list = []
+        self.balance_event_list = []
 
-    def on_transfer(self, transaction_hash, token_address,
+    def on_transfer(self, transaction_hash, token_address, block_number, log_index,
                     account_address_from, account_address_to, transfer_amount, block_timestamp):
         logging.debug(f"Transfer: transaction_hash={transaction_hash}")
-        transfer_record = self.__get_record(transaction_hash, token_address)
-        if transfer_record is None:
-            transfer_record = Transfer()
-            transfer_record.transaction_hash = transaction_hash
-            transfer_record.token_address = token_address
-            transfer_record.account_address_from = account_address_from
-            transfer_record.account_address_to = account_address_to
-            transfer_record.transfer_amount = transfer_amount
-            transfer_record.block_timestamp = block_timestamp
-            self.db.merge(transfer_record)
+        self.transfer_list.append({
+            "transaction_hash": transaction_hash,
+            "token_address": token_address,
+            "block_number": block_number,
+            "log_index": log_index,
+            "account_address_from": account_address_from,
+            "account_address_to": account_address_to,
+            "transfer_amount": transfer_amount,
+            "block_timestamp": block_timestamp
+        })
+
+    def on_balance_event(self, transaction_hash, token_address, block_number, log_index,
+                         event, account_address, amount):
+        logging.debug(f"{event}: transaction_hash={transaction_hash}")
+        self.balance_event_list.append({
+            "transaction_hash": transaction_hash,
+            "token_address": token_address,
+            "block_number": block_number,
+            "log_index": log_index,
+            "event": event,
+            "account_address": account_address,
+            "amount": amount
+        })
+
+    def on_rollback(self, block_number):
+        logging.debug(f"Rollback: block_number={block_number}")
+        # 分岐点より後のブロックで登録されたイベントを削除し、保有者残高から差し引く
+        delta = HolderBalanceDelta()
+        deleted_transfers = self.db.execute(
+            delete(Transfer).
+            where(Transfer.block_number > block_number).
+            returning(Transfer.token_address, Transfer.account_address_from, Transfer.account_address_to,
+                      Transfer.transfer_amount, Transfer.block_number)
+        ).fetchall()
+        for row in deleted_transfers:
+            delta.add_transfer(row.token_address, row.account_address_to, row.account_address_from,
+                               row.transfer_amount, row.block_number)
+        deleted_balance_events = self.db.execute(
+            delete(IDXBalanceEvent).
+            where(IDXBalanceEvent.block_number > block_number).
+            returning(IDXBalanceEvent.token_address, IDXBalanceEvent.account_address,
+                      IDXBalanceEvent.amount, IDXBalanceEvent.block_number)
+        ).fetchall()
+        for row in deleted_balance_events:
+            delta.add(row.token_address, row.account_address, -row.amount, row.block_number)
+        delta.apply(self.db, rollback_block_number=block_number)
 
     def flush(self):
+        # 未登録のイベントのみ一括で登録する
+        delta = HolderBalanceDelta()
+        inserted_transfers = insert_on_conflict_do_nothing(
+            db=self.db,
+            model=Transfer,
+            rows=self.transfer_list,
+            index_elements=["transaction_hash", "token_address", "log_index"],
+            returning=[Transfer.token_address, Transfer.account_address_from, Transfer.account_address_to,
+                       Transfer.transfer_amount, Transfer.block_number]
+        )
+        for row in inserted_transfers:
+            delta.add_transfer(row.token_address, row.account_address_from, row.account_address_to,
+                               row.transfer_amount, row.block_number)
+        inserted_balance_events = insert_on_conflict_do_nothing(
+            db=self.db,
+            model=IDXBalanceEvent,
+            rows=self.balance_event_list,
+            index_elements=["transaction_hash", "token_address", "log_index"],
+            returning=[IDXBalanceEvent.token_address, IDXBalanceEvent.account_address,
+                       IDXBalanceEvent.amount, IDXBalanceEvent.block_number]
+        )
+        for row in inserted_balance_events:
+            delta.add(row.token_address, row.account_address, row.amount, row.block_number)
+        # 新規に登録されたイベントの分のみ保有者残高を増減する
+        delta.apply(self.db)
         self.db.commit()
-
-    def __get_record(self, transaction_hash, token_address):
-        return self.db.query(Transfer). \
-            filter(Transfer.transaction_hash == transaction_hash). \
-            filter(Transfer.token_address == token_address). \
-            first()
+        self.transfer_list = []
+        self.balance_event_list = []
 
 
 class Processor:
+    # Transfer以外で残高（balanceOf）が変動するイベント
+    #   コントラクトにイベントが定義されていない場合は同期しない
+    BALANCE_EVENT_LIST = ("Issue", "Redeem", "Lock", "Unlock", "Consume")
+
     def __init__(self, sink, db):
         self.sink = sink
-        self.latest_block = web3.eth.blockNumber
+        self.latest_block = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
         self.db = db
         self.token_list = []
+        self.block_checkpoint = BlockCheckpoint(db=db, indexer_name="Transfer")
+        self.reorg_detector = ReorgDetector(
+            block_height_poller,
+            db=db,
+            indexer_name="Transfer",
+            block_timestamp_cache=block_timestamp_cache
+        )
+        self.log_fetcher = LogFetcher(web3, db=db)
+        self.block_timestamp = block_timestamp_cache
+        self.token_registry = token_registry
+
+    def close(self):
+        """リソースの解放（LogFetcherのスレッドプールを停止する）"""
+        self.log_fetcher.close()
 
     def get_token_list(self):
-        self.token_list = []
-        issued_token_list = self.db.query(Token).all()
-        for issued_token in issued_token_list:
-            if issued_token.token_address is not None:
-                abi = json.loads(issued_token.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
-                token_contract = web3.eth.contract(
-                    address=issued_token.token_address,
-                    abi=abi
-                )
-                self.token_list.append(token_contract)
+        self.token_list = self.token_registry.get_token_list()
 
     def initial_sync(self):
+        # 旧バージョンで登録したデータが残っている場合は同期しない（manage.py upgrade_index）
+        check_legacy_index(self.db, indexer_name="Transfer")
         self.get_token_list()
-        # 1,000,000ブロックずつ同期処理を行う
-        _to_block = 999999
-        _from_block = 0
-        if self.latest_block > 999999:
-            while _to_block < self.latest_block:
-                self.__sync_all(_from_block, _to_block)
-                _to_block += 1000000
-                _from_block += 1000000
-            self.__sync_all(_from_block, self.latest_block)
-        else:
-            self.__sync_all(_from_block, self.latest_block)
+        self.block_checkpoint.load()
+        self.__rollback_reorg()
+        self.__sync_all(self.latest_block)
 
     def sync_new_logs(self):
         self.get_token_list()
-        blockTo = web3.eth.blockNumber
-        if blockTo <= self.latest_block:
-            return
-        self.__sync_all(self.latest_block + 1, blockTo)
+        blockTo = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
+        self.__rollback_reorg()
+        self.__sync_all(blockTo)
         self.latest_block = blockTo
 
-    def __sync_all(self, block_from, block_to):
-        logging.info("syncing from={}, to={}".format(block_from, block_to))
-        self.__sync_transfer(block_from, block_to)
-        self.sink.flush()
+    def backfill(self, block_checkpoint, block_to):
+        """過去ブロックの同期（manage.py backfill）
 
-    def __sync_transfer(self, block_from, block_to):
-        for token in self.token_list:
+        :param block_checkpoint: パーティションの同期済blockNumber
+        :param block_to: パーティションの最終ブロック
+        :return: 同期が完了していないコントラクトアドレスのリスト
+        """
+        self.get_token_list()
+        self.__sync_range(block_checkpoint, block_to)
+        return [
+            token.address for token in self.token_list
+            if block_checkpoint.get_block_number(token.address) < block_to
+        ]
+
+    def __rollback_reorg(self):
+        # チェーンの再編成を検知した場合、分岐点以降のデータを削除して再同期する
+        block_number = self.reorg_detector.detect()
+        if block_number is not None:
+            self.sink.on_rollback(block_number=block_number)
+            self.block_checkpoint.rewind(block_number)
+            self.sink.flush()
+
+    def __sync_all(self, block_to):
+        self.__sync_range(self.block_checkpoint, block_to)
+        # 同期済ブロックのハッシュを記録する（reorg検知用）
+        self.reorg_detector.record(block_to)
+        self.sink.flush()
+        task_metrics.set_block(block_to, block_height_poller.get_block_number())
+
+    def __sync_range(self, block_checkpoint, block_to):
+        # トークンごとの同期済blockNumberから1,000,000ブロックずつ同期処理を行う
+        for _from_block, _to_block, token_list in block_checkpoint.get_sync_ranges(self.token_list, block_to):
+            token_list = block_checkpoint.filter_synced(token_list, _from_block)
+            if len(token_list) == 0:
+                continue
+            logging.info("syncing from={}, to={}".format(_from_block, _to_block))
+            failed_address_list = self.__sync_transfer(token_list, _from_block, _to_block)
+            for event_name in self.BALANCE_EVENT_LIST:
+                for token_address in self.__sync_balance_event(token_list, event_name, _from_block, _to_block):
+                    if token_address not in failed_address_list:
+                        failed_address_list.append(token_address)
+            task_metrics.add_errors(failed_address_list)
+            block_checkpoint.set_block_number(
+                [token.address for token in token_list if token.address not in failed_address_list],
+                _to_block
+            )
+            self.sink.flush()
+
+    def __sync_transfer(self, token_list, block_from, block_to):
+        # 全トークンのTransferイベントを1回のgetLogsで取得する
+        try:
+            events = self.log_fetcher.get_logs(token_list, "Transfer", block_from, block_to)
+            self.block_timestamp.prefetch([event['blockNumber'] for event in events])
+        except Exception as e:
+            logging.error(e)
+            return [token.address for token in token_list]
+
+        task_metrics.add_events(len(events))
+        failed_address_list = []
+        for event in events:
+            token_address = to_checksum_address(event['address'])
             try:
-                events = token.events.Transfer.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
+                args = event['args']
+                transaction_hash = event['transactionHash'].hex()
+                block_timestamp = datetime.fromtimestamp(self.block_timestamp.get(event['blockNumber']), JST)
+                if args['value'] > sys.maxsize:
+                    pass
+                else:
+                    self.sink.on_transfer(
+                        transaction_hash=transaction_hash,
+                        token_address=token_address,
+                        block_number=event['blockNumber'],
+                        log_index=event['logIndex'],
+                        account_address_from=args['from'],
+                        account_address_to=args['to'],
+                        transfer_amount=args['value'],
+                        block_timestamp=block_timestamp
+                    )
+            except Exception as e:
+                logging.error(e)
+                failed_address_list.append(token_address)
+        return failed_address_list
+
+    def __sync_balance_event(self, token_list, event_name, block_from, block_to):
+        try:
+            events = self.log_fetcher.get_logs(token_list, event_name, block_from, block_to)
+        except Exception as e:
+            logging.error(e)
+            return [token.address for token in token_list]
+
+        task_metrics.add_events(len(events))
+        failed_address_list = []
+        for event in events:
+            token_address = to_checksum_address(event['address'])
+            try:
+                account_address, amount = self.__get_balance_change(event_name, event['args'])
+                if account_address is None or abs(amount) > sys.maxsize:
+                    continue
+                self.sink.on_balance_event(
+                    transaction_hash=event['transactionHash'].hex(),
+                    token_address=token_address,
+                    block_number=event['blockNumber'],
+                    log_index=event['logIndex'],
+                    event=event_name,
+                    account_address=account_address,
+                    amount=amount
                 )
-                for event in events:
-                    args = event['args']
-                    transaction_hash = event['transactionHash'].hex()
-                    block_timestamp = datetime.fromtimestamp(web3.eth.getBlock(event['blockNumber'])['timestamp'], JST)
-                    if args['value'] > sys.maxsize:
-                        pass
-                    else:
-                        self.sink.on_transfer(
-                            transaction_hash=transaction_hash,
-                            token_address=to_checksum_address(token.address),
-                            account_address_from=args['from'],
-                            account_address_to=args['to'],
-                            transfer_amount=args['value'],
-                            block_timestamp=block_timestamp
-                        )
             except Exception as e:
                 logging.error(e)
-
-
-_sink = Sinks()
-_sink.register(DBSink(db_session))
-processor = Processor(sink=_sink, db=db_session)
-logging.info("Service started successfully")
-
-processor.initial_sync()
-while True:
-    processor.sync_new_logs()
-    time.sleep(Config.INTERVAL_INDEXER_TRANSFER)
+                failed_address_list.append(token_address)
+        return failed_address_list
+
+    @staticmethod
+    def __get_balance_change(event_name, args):
+        """残高（balanceOf）の変動
+
+        :param event_name: イベント名
+        :param args: イベント引数
+        :return: 残高が変動するアカウントアドレス、変動数量（変動しない場合はアドレスがNone）
+        """
+        if event_name == "Issue" or event_name == "Redeem":
+            # ロック先を指定した発行・償却はロック数量（lockedOf）のみが変動する
+            #   債券のRedeemイベント（償還）は残高が変動しない（引数なし）
+            if 'target_address' not in args or args['locked_address'] != Config.ZERO_ADDRESS:
+                return None, 0
+            amount = args['amount'] if event_name == "Issue" else -args['amount']
+            return args['target_address'], amount
+        elif event_name == "Lock":
+            return args['from'], -args['value']
+        elif event_name == "Unlock":
+            return args['to'], args['value']
+        elif event_name == "Consume":
+            return args['consumer'], -args['value']
+        return None, 0
+
+
+def main():
+    _sink = Sinks()
+    _sink.register(DBSink(db_session))
+    processor = Processor(sink=_sink, db=db_session)
+    batch_metrics.start()
+    logging.info("Service started successfully")
+
+    try:
+        processor.initial_sync()
+        while True:
+            processor.sync_new_logs()
+            block_notifier.wait(Config.INTERVAL_INDEXER_TRANSFER)
+    finally:
+        processor.close()
+
+
+if __name__ == "__main__":
+    main()
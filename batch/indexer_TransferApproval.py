@@ -22,44 +22,41 @@ from datetime import (
     timezone,
     timedelta
 )
-import json
 import logging
 from logging.config import dictConfig
 import os
 import sys
-import time
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import (
-    sessionmaker,
-    scoped_session
-)
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
-from web3.exceptions import ABIEventFunctionNotFound
+from eth_utils import to_checksum_address
 
 path = os.path.join(os.path.dirname(__file__), '../')
 sys.path.append(path)
 
 from config import Config
 from app.models import (
-    Token,
     IDXTransferApproval
 )
+from batch.lib.block_checkpoint import BlockCheckpoint
+from batch.lib.log_fetcher import LogFetcher
+from batch.lib.reorg_detector import ReorgDetector
+from batch.lib.shared import (
+    web3,
+    block_notifier,
+    db_session,
+    block_height_poller,
+    token_registry,
+    block_timestamp_cache,
+    batch_metrics
+)
 
 dictConfig(Config.LOG_CONFIG)
 log_fmt = '[%(asctime)s] [INDEXER-Transfer-Approval] [%(process)d] [%(levelname)s] %(message)s'
 logging.basicConfig(format=log_fmt)
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
-db_session = scoped_session(sessionmaker())
-db_session.configure(bind=engine)
-
 JST = timezone(timedelta(hours=+9), "JST")
 
+task_metrics = batch_metrics.get_task("INDEXER-TransferApproval")
+
 
 class Sinks:
     def __init__(self):
@@ -72,9 +69,14 @@ class Sinks:
         for sink in self.sinks:
             sink.on_transfer_approval(*args, **kwargs)
 
-    def flush(self, *args, **kwargs):
+    def on_rollback(self, *args, **kwargs):
         for sink in self.sinks:
-            sink.flush(*args, **kwargs)
+            sink.on_rollback(*args, **kwargs)
+
+    def flush(self, *args, **kwargs):
+        with task_metrics.time_flush():
+            for sink in self.sinks:
+                sink.flush(*args, **kwargs)
 
 
 class DBSink:
@@ -88,7 +90,8 @@ class DBSink:
                              value: Optional[int] = None,
                              optional_data_applicant: Optional[str] = None,
                              optional_data_approver: Optional[str] = None,
-                             block_timestamp: Optional[int] = None):
+                             block_timestamp: Optional[int] = None,
+                             block_number: Optional[int] = None):
         """Update Transfer Approval data in DB
 
         :param event_type: event type [ApplyFor, Cancel, Approve]
@@ -100,6 +103,7 @@ class DBSink:
         :param optional_data_applicant: optional data (ApplyForTransfer)
         :param optional_data_approver: optional data (ApproveTransfer)
         :param block_timestamp: block timestamp
+        :param block_number: block number
         :return: None
         """
         transfer_approval = self.db.query(IDXTransferApproval). \
@@ -125,6 +129,7 @@ class DBSink:
                 block_timestamp,
                 tz=timezone.utc
             )
+            transfer_approval.application_block_number = block_number
         elif event_type == "Cancel":
             if transfer_approval is None:
                 transfer_approval = IDXTransferApproval()
@@ -133,6 +138,7 @@ class DBSink:
                 transfer_approval.from_address = from_address
                 transfer_approval.to_address = to_address
             transfer_approval.cancelled = True
+            transfer_approval.cancellation_block_number = block_number
         elif event_type == "Approve":
             if transfer_approval is None:
                 transfer_approval = IDXTransferApproval()
@@ -151,8 +157,43 @@ class DBSink:
                 block_timestamp,
                 tz=timezone.utc
             )
+            transfer_approval.approval_block_number = block_number
         self.db.merge(transfer_approval)
 
+    def on_rollback(self, block_number):
+        """Rollback after a chain reorganization
+
+        Transfer approval records are updated in place by the events.
+        The changes made by the events after the given block are reverted,
+        and are applied again by the events of the re-synchronized blocks.
+
+        :param block_number: block number to be rolled back to
+        :return: None
+        """
+        logging.debug(f"Rollback: block_number={block_number}")
+        self.db.query(IDXTransferApproval). \
+            filter(IDXTransferApproval.application_block_number > block_number). \
+            delete(synchronize_session=False)
+        self.db.query(IDXTransferApproval). \
+            filter(IDXTransferApproval.cancellation_block_number > block_number). \
+            update(
+                {
+                    IDXTransferApproval.cancelled: None,
+                    IDXTransferApproval.cancellation_block_number: None
+                },
+                synchronize_session=False
+            )
+        self.db.query(IDXTransferApproval). \
+            filter(IDXTransferApproval.approval_block_number > block_number). \
+            update(
+                {
+                    IDXTransferApproval.approval_datetime: None,
+                    IDXTransferApproval.approval_blocktimestamp: None,
+                    IDXTransferApproval.approval_block_number: None
+                },
+                synchronize_session=False
+            )
+
     def flush(self):
         self.db.commit()
 
@@ -160,160 +201,202 @@ class DBSink:
 class Processor:
     def __init__(self, sink, db):
         self.sink = sink
-        self.latest_block = web3.eth.blockNumber
+        self.latest_block = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
         self.db = db
         self.token_list = []
-
-    @staticmethod
-    def get_block_timestamp(event) -> datetime:
-        block_timestamp = web3.eth.getBlock(event["blockNumber"])["timestamp"]
+        self.block_checkpoint = BlockCheckpoint(db=db, indexer_name="TransferApproval")
+        self.reorg_detector = ReorgDetector(
+            block_height_poller,
+            db=db,
+            indexer_name="TransferApproval",
+            block_timestamp_cache=block_timestamp_cache
+        )
+        self.log_fetcher = LogFetcher(web3, db=db)
+        self.block_timestamp = block_timestamp_cache
+        self.token_registry = token_registry
+
+    def close(self):
+        """リソースの解放（LogFetcherのスレッドプールを停止する）"""
+        self.log_fetcher.close()
+
+    def get_block_timestamp(self, event) -> int:
+        block_timestamp = self.block_timestamp.get(event["blockNumber"])
         return block_timestamp
 
     def get_token_list(self):
-        self.token_list = []
-        issued_share_tokens = self.db.query(Token).\
-            filter(Token.template_id == Config.TEMPLATE_ID_SHARE).\
-            filter(Token.token_address != None). \
-            all()
-        for issued_token in issued_share_tokens:
-            abi = json.loads(issued_token.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
-            token_contract = web3.eth.contract(
-                address=issued_token.token_address,
-                abi=abi
-            )
-            self.token_list.append(token_contract)
+        self.token_list = self.token_registry.get_token_list(template_id=Config.TEMPLATE_ID_SHARE)
 
     def initial_sync(self):
         self.get_token_list()
-        # 1,000,000ブロックずつ同期処理を行う
-        _to_block = 999999
-        _from_block = 0
-        if self.latest_block > 999999:
-            while _to_block < self.latest_block:
-                self.__sync_all(_from_block, _to_block)
-                _to_block += 1000000
-                _from_block += 1000000
-            self.__sync_all(_from_block, self.latest_block)
-        else:
-            self.__sync_all(_from_block, self.latest_block)
+        self.block_checkpoint.load()
+        self.__rollback_reorg()
+        self.__sync_all(self.latest_block)
 
     def sync_new_logs(self):
         self.get_token_list()
-        blockTo = web3.eth.blockNumber
-        if blockTo <= self.latest_block:
-            return
-        self.__sync_all(self.latest_block + 1, blockTo)
+        blockTo = block_height_poller.get_block_number() - Config.INDEXER_CONFIRMATION_DEPTH
+        self.__rollback_reorg()
+        self.__sync_all(blockTo)
         self.latest_block = blockTo
 
-    def __sync_all(self, block_from, block_to):
-        logging.info("syncing from={}, to={}".format(block_from, block_to))
-        self.__sync_apply_for_transfer(block_from, block_to)
-        self.__sync_cancel_transfer(block_from, block_to)
-        self.__sync_approve_transfer(block_from, block_to)
+    def __rollback_reorg(self):
+        # チェーンの再編成を検知した場合、分岐点以降のデータを削除して再同期する
+        block_number = self.reorg_detector.detect()
+        if block_number is not None:
+            self.sink.on_rollback(block_number=block_number)
+            self.block_checkpoint.rewind(block_number)
+            self.sink.flush()
+
+    def __sync_all(self, block_to):
+        # トークンごとの同期済blockNumberから1,000,000ブロックずつ同期処理を行う
+        for _from_block, _to_block, token_list in self.block_checkpoint.get_sync_ranges(self.token_list, block_to):
+            token_list = self.block_checkpoint.filter_synced(token_list, _from_block)
+            if len(token_list) == 0:
+                continue
+            logging.info("syncing from={}, to={}".format(_from_block, _to_block))
+            failed_address_list = \
+                self.__sync_apply_for_transfer(token_list, _from_block, _to_block) + \
+                self.__sync_cancel_transfer(token_list, _from_block, _to_block) + \
+                self.__sync_approve_transfer(token_list, _from_block, _to_block)
+            task_metrics.add_errors(failed_address_list)
+            self.block_checkpoint.set_block_number(
+                [token.address for token in token_list if token.address not in failed_address_list],
+                _to_block
+            )
+            self.sink.flush()
+        # 同期済ブロックのハッシュを記録する（reorg検知用）
+        self.reorg_detector.record(block_to)
         self.sink.flush()
+        task_metrics.set_block(block_to, block_height_poller.get_block_number())
 
-    def __sync_apply_for_transfer(self, block_from, block_to):
+    def __sync_apply_for_transfer(self, token_list, block_from, block_to):
         """Sync ApplyForTransfer Events
 
+        :param token_list: Token Contracts
         :param block_from: From Block
         :param block_to: To Block
-        :return: None
+        :return: Failed Token Addresses
         """
-        for token in self.token_list:
-            try:
-                events = token.events.ApplyForTransfer.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
-                )
-            except ABIEventFunctionNotFound:
-                continue
+        try:
+            events = self.log_fetcher.get_logs(token_list, "ApplyForTransfer", block_from, block_to)
+            self.block_timestamp.prefetch([event["blockNumber"] for event in events])
+        except Exception as e:
+            logging.exception(e)
+            return [token.address for token in token_list]
+
+        task_metrics.add_events(len(events))
+        failed_address_list = []
+        for event in events:
+            token_address = to_checksum_address(event["address"])
             try:
-                for event in events:
-                    args = event["args"]
-                    value = args.get("value", 0)
-                    if value > sys.maxsize:  # suppress overflow
-                        pass
-                    else:
-                        block_timestamp = self.get_block_timestamp(event=event)
-                        self.sink.on_transfer_approval(
-                            event_type="ApplyFor",
-                            token_address=token.address,
-                            application_id=args.get("index"),
-                            from_address=args.get("from", Config.ZERO_ADDRESS),
-                            to_address=args.get("to", Config.ZERO_ADDRESS),
-                            value=args.get("value"),
-                            optional_data_applicant=args.get("data"),
-                            block_timestamp=block_timestamp
-                        )
+                args = event["args"]
+                value = args.get("value", 0)
+                if value > sys.maxsize:  # suppress overflow
+                    pass
+                else:
+                    block_timestamp = self.get_block_timestamp(event=event)
+                    self.sink.on_transfer_approval(
+                        event_type="ApplyFor",
+                        token_address=token_address,
+                        application_id=args.get("index"),
+                        from_address=args.get("from", Config.ZERO_ADDRESS),
+                        to_address=args.get("to", Config.ZERO_ADDRESS),
+                        value=args.get("value"),
+                        optional_data_applicant=args.get("data"),
+                        block_timestamp=block_timestamp,
+                        block_number=event["blockNumber"]
+                    )
             except Exception as e:
                 logging.exception(e)
+                failed_address_list.append(token_address)
+        return failed_address_list
 
-    def __sync_cancel_transfer(self, block_from, block_to):
+    def __sync_cancel_transfer(self, token_list, block_from, block_to):
         """Sync CancelTransfer Events
 
+        :param token_list: Token Contracts
         :param block_from: From Block
         :param block_to: To Block
-        :return: None
+        :return: Failed Token Addresses
         """
-        for token in self.token_list:
+        try:
+            events = self.log_fetcher.get_logs(token_list, "CancelTransfer", block_from, block_to)
+        except Exception as e:
+            logging.exception(e)
+            return [token.address for token in token_list]
+
+        task_metrics.add_events(len(events))
+        failed_address_list = []
+        for event in events:
+            token_address = to_checksum_address(event["address"])
             try:
-                events = token.events.CancelTransfer.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
+                args = event["args"]
+                self.sink.on_transfer_approval(
+                    event_type="Cancel",
+                    token_address=token_address,
+                    application_id=args.get("index"),
+                    from_address=args.get("from", Config.ZERO_ADDRESS),
+                    to_address=args.get("to", Config.ZERO_ADDRESS),
+                    block_number=event["blockNumber"]
                 )
-            except ABIEventFunctionNotFound:
-                continue
-            try:
-                for event in events:
-                    args = event["args"]
-                    self.sink.on_transfer_approval(
-                        event_type="Cancel",
-                        token_address=token.address,
-                        application_id=args.get("index"),
-                        from_address=args.get("from", Config.ZERO_ADDRESS),
-                        to_address=args.get("to", Config.ZERO_ADDRESS),
-                    )
             except Exception as e:
                 logging.exception(e)
+                failed_address_list.append(token_address)
+        return failed_address_list
 
-    def __sync_approve_transfer(self, block_from, block_to):
+    def __sync_approve_transfer(self, token_list, block_from, block_to):
         """Sync ApproveTransfer Events
 
+        :param token_list: Token Contracts
         :param block_from: From Block
         :param block_to: To Block
-        :return: None
+        :return: Failed Token Addresses
         """
-        for token in self.token_list:
+        try:
+            events = self.log_fetcher.get_logs(token_list, "ApproveTransfer", block_from, block_to)
+            self.block_timestamp.prefetch([event["blockNumber"] for event in events])
+        except Exception as e:
+            logging.exception(e)
+            return [token.address for token in token_list]
+
+        task_metrics.add_events(len(events))
+        failed_address_list = []
+        for event in events:
+            token_address = to_checksum_address(event["address"])
             try:
-                events = token.events.ApproveTransfer.getLogs(
-                    fromBlock=block_from,
-                    toBlock=block_to
+                args = event["args"]
+                block_timestamp = self.get_block_timestamp(event=event)
+                self.sink.on_transfer_approval(
+                    event_type="Approve",
+                    token_address=token_address,
+                    application_id=args.get("index"),
+                    from_address=args.get("from", Config.ZERO_ADDRESS),
+                    to_address=args.get("to", Config.ZERO_ADDRESS),
+                    optional_data_approver=args.get("data"),
+                    block_timestamp=block_timestamp,
+                    block_number=event["blockNumber"]
                 )
-            except ABIEventFunctionNotFound:
-                continue
-            try:
-                for event in events:
-                    args = event["args"]
-                    block_timestamp = self.get_block_timestamp(event=event)
-                    self.sink.on_transfer_approval(
-                        event_type="Approve",
-                        token_address=token.address,
-                        application_id=args.get("index"),
-                        from_address=args.get("from", Config.ZERO_ADDRESS),
-                        to_address=args.get("to", Config.ZERO_ADDRESS),
-                        optional_data_approver=args.get("data"),
-                        block_timestamp=block_timestamp
-                    )
             except Exception as e:
                 logging.exception(e)
+                failed_address_list.append(token_address)
+        return failed_address_list
+
+
+def main():
+    _sink = Sinks()
+    _sink.register(DBSink(db_session))
+    processor = Processor(sink=_sink, db=db_session)
+    batch_metrics.start()
+    logging.info("Service started successfully")
 
+    try:
+        processor.initial_sync()
+        while True:
+            processor.sync_new_logs()
+            block_notifier.wait(Config.INTERVAL_INDEXER_TRANSFER_APPROVAL)
+    finally:
+        processor.close()
 
-_sink = Sinks()
-_sink.register(DBSink(db_session))
-processor = Processor(sink=_sink, db=db_session)
-logging.info("Service started successfully")
 
-processor.initial_sync()
-while True:
-    processor.sync_new_logs()
-    time.sleep(Config.INTERVAL_INDEXER_TRANSFER_APPROVAL)
+if __name__ == "__main__":
+    main()
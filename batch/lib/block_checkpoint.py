@@ -0,0 +1,161 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from typing import (
+    Dict,
+    List,
+    Tuple
+)
+
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import IDXBlockNumber
+
+
+class BlockCheckpoint:
+    """Synchronized block number of an indexer, kept per contract
+
+    Updates are staged in the indexer's DB session and committed by the
+    sink flush, so that a restart resumes from the last durable block.
+    """
+
+    # Maximum number of blocks to be synchronized at once
+    BLOCK_WINDOW = 1000000
+
+    def __init__(self, db, indexer_name: str, initial_block_number: int = -1):
+        """
+        :param db: DB session
+        :param indexer_name: indexer name
+        :param initial_block_number: block number of the contracts which have never been synchronized
+        """
+        self.db = db
+        self.indexer_name = indexer_name
+        self.initial_block_number = initial_block_number
+        self.block_numbers = None
+
+    def load(self) -> Dict[str, int]:
+        """Load the synchronized block numbers from DB
+
+        :return: block number of each contract address
+        """
+        records = self.db.query(IDXBlockNumber). \
+            filter(IDXBlockNumber.indexer_name == self.indexer_name). \
+            all()
+        self.block_numbers = {
+            record.contract_address: record.latest_block_number for record in records
+        }
+        return self.block_numbers
+
+    def get_block_number(self, contract_address: str) -> int:
+        """Get the synchronized block number
+
+        :param contract_address: contract address
+        :return: synchronized block number (initial_block_number if the contract has never been synchronized)
+        """
+        if self.block_numbers is None:
+            self.load()
+        return self.block_numbers.get(contract_address, self.initial_block_number)
+
+    def set_block_number(self, contract_address_list: List[str], block_number: int):
+        """Set the synchronized block number
+
+        NOTE: The change is committed with the next commit of the DB session.
+
+        :param contract_address_list: contract addresses
+        :param block_number: synchronized block number
+        :return: None
+        """
+        if len(contract_address_list) == 0:
+            return
+        if self.block_numbers is None:
+            self.load()
+        stmt = insert(IDXBlockNumber).values([
+            {
+                "indexer_name": self.indexer_name,
+                "contract_address": contract_address,
+                "latest_block_number": block_number
+            } for contract_address in contract_address_list
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["indexer_name", "contract_address"],
+            set_={"latest_block_number": stmt.excluded.latest_block_number}
+        )
+        self.db.execute(stmt)
+        for contract_address in contract_address_list:
+            self.block_numbers[contract_address] = block_number
+
+    def rewind(self, block_number: int):
+        """Rewind the synchronized block numbers after a chain reorganization
+
+        Contracts synchronized beyond the given block are set back to it.
+
+        NOTE: The change is committed with the next commit of the DB session.
+
+        :param block_number: block number to be rewound to
+        :return: None
+        """
+        if self.block_numbers is None:
+            self.load()
+        self.db.query(IDXBlockNumber). \
+            filter(IDXBlockNumber.indexer_name == self.indexer_name). \
+            filter(IDXBlockNumber.latest_block_number > block_number). \
+            update({IDXBlockNumber.latest_block_number: block_number}, synchronize_session=False)
+        for contract_address, latest_block_number in self.block_numbers.items():
+            if latest_block_number > block_number:
+                self.block_numbers[contract_address] = block_number
+
+    def get_sync_ranges(self, contract_list: list, block_to: int) -> List[Tuple[int, int, list]]:
+        """Get the block ranges to be synchronized
+
+        Contracts with the same synchronized block number are grouped and
+        synchronized together, so a contract added later is backfilled
+        on its own without the others being rescanned.
+
+        :param contract_list: contracts (web3 Contract)
+        :param block_to: block number to be synchronized to
+        :return: list of (block from, block to, contracts)
+        """
+        groups = {}
+        for contract in contract_list:
+            block_from = self.get_block_number(contract.address) + 1
+            if block_from <= block_to:
+                groups.setdefault(block_from, []).append(contract)
+
+        sync_ranges = []
+        for block_from in sorted(groups.keys()):
+            _from_block = block_from
+            while _from_block <= block_to:
+                _to_block = min(_from_block + self.BLOCK_WINDOW - 1, block_to)
+                sync_ranges.append((_from_block, _to_block, groups[block_from]))
+                _from_block = _to_block + 1
+        return sync_ranges
+
+    def filter_synced(self, contract_list: list, block_from: int) -> list:
+        """Extract the contracts synchronized up to the block just before the range
+
+        Contracts that failed in a previous range are excluded so that the
+        failed range is retried in the next process instead of being skipped.
+
+        :param contract_list: contracts (web3 Contract)
+        :param block_from: first block of the range
+        :return: contracts
+        """
+        return [
+            contract for contract in contract_list
+            if self.get_block_number(contract.address) == block_from - 1
+        ]
@@ -0,0 +1,157 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import threading
+import time
+from typing import Optional
+
+from web3.exceptions import BlockNotFound
+
+from config import Config
+
+
+class BlockHeightPoller:
+    """Latest block shared by the tasks of a batch process
+
+    The latest block is fetched (eth_getBlockByNumber("latest")) at most once per interval,
+    however many tasks ask for the latest block number.
+
+    The hashes of the recent blocks are kept as a chain linked by their parent hashes,
+    so that the reorg detectors of the indexers compare their buffered hashes without
+    calling the node. When a new block does not link to the chain, the blocks are
+    fetched back to the fork point and the hashes of the orphaned blocks are replaced.
+    """
+
+    # Polling interval (seconds)
+    INTERVAL = 1
+    # Maximum number of block hashes kept in memory
+    MAX_SIZE = Config.INDEXER_BLOCK_HASH_BUFFER_SIZE + Config.INDEXER_CONFIRMATION_DEPTH
+
+    def __init__(self, web3, interval: float = INTERVAL, max_size: int = MAX_SIZE):
+        self.web3 = web3
+        self.interval = interval
+        self.max_size = max_size
+        self.block_number = None
+        self.polled_at = 0
+        # block number -> (block hash, parent hash)
+        self.chain = {}
+        self.lock = threading.RLock()
+
+    def get_block_number(self) -> int:
+        """Get the latest block number
+
+        :return: latest block number
+        """
+        with self.lock:
+            self.__poll()
+            return self.block_number
+
+    def get_block_hash(self, block_number: int) -> Optional[str]:
+        """Get the hash of a block on the canonical chain
+
+        The node is called only for the blocks which are not in the chain kept in memory.
+
+        :param block_number: block number
+        :return: block hash (None if the block does not exist)
+        """
+        with self.lock:
+            self.__poll()
+            if block_number in self.chain:
+                return self.chain[block_number][0]
+            if len(self.chain) > 0 and block_number < min(self.chain):
+                return self.__extend_to(block_number)
+            try:
+                block = self.web3.eth.getBlock(block_number)
+            except BlockNotFound:
+                return None
+            self.__link(block)
+            return block["hash"].hex()
+
+    def update(self, block_number: int):
+        """Update the latest block number with a notified block
+
+        :param block_number: block number
+        :return: None
+        """
+        with self.lock:
+            if self.block_number is None or block_number > self.block_number:
+                self.block_number = block_number
+                self.polled_at = time.monotonic()
+
+    def __poll(self):
+        now = time.monotonic()
+        if self.block_number is None or now - self.polled_at >= self.interval:
+            block = self.web3.eth.getBlock("latest")
+            self.__link(block)
+            self.block_number = block["number"]
+            self.polled_at = now
+
+    def __link(self, block):
+        """Add a block to the chain
+
+        The blocks between the chain and the given block are fetched until the parent hash links
+        to the chain. The blocks after the link point are replaced (orphaned by a reorg).
+        If the block cannot be linked within the maximum size, the chain is started over.
+
+        :param block: block (the latest block, or a block after the oldest block in the chain)
+        :return: None
+        """
+        block_number = block["number"]
+        block_hash = block["hash"].hex()
+        known = self.chain.get(block_number)
+        if known is not None and known[0] == block_hash:
+            return
+
+        blocks = [block]
+        while len(self.chain) > 0:
+            lowest = blocks[-1]
+            parent = self.chain.get(lowest["number"] - 1)
+            if parent is not None and parent[0] == lowest["parentHash"].hex():
+                break
+            if lowest["number"] - 1 < min(self.chain) or len(blocks) >= self.max_size:
+                self.chain.clear()
+                break
+            blocks.append(self.web3.eth.getBlock(lowest["number"] - 1))
+
+        for number in [number for number in self.chain if number >= blocks[-1]["number"]]:
+            del self.chain[number]
+        for item in blocks:
+            self.chain[item["number"]] = (item["hash"].hex(), item["parentHash"].hex())
+        while len(self.chain) > self.max_size:
+            del self.chain[min(self.chain)]
+
+    def __extend_to(self, block_number: int) -> Optional[str]:
+        """Extend the chain back to an older block
+
+        :param block_number: block number (before the oldest block in the chain)
+        :return: block hash
+        """
+        lowest = min(self.chain)
+        if lowest - block_number > self.max_size - len(self.chain):
+            # 保持できない古いブロックはチェーンに追加しない
+            return self.web3.eth.getBlock(block_number)["hash"].hex()
+        for number in range(lowest - 1, block_number - 1, -1):
+            block = self.web3.eth.getBlock(number)
+            block_hash = block["hash"].hex()
+            if self.chain[number + 1][1] != block_hash:
+                # 最新ブロックの取得後にreorgが発生した場合、次のポーリングでチェーンを作り直す
+                self.chain.clear()
+                self.polled_at = 0
+                return self.web3.eth.getBlock(block_number)["hash"].hex()
+            self.chain[number] = (block_hash, block["parentHash"].hex())
+        return self.chain[block_number][0]
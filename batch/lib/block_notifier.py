@@ -0,0 +1,182 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import (
+    Callable,
+    Optional
+)
+
+import websockets
+
+
+class BlockNotifier:
+    """New block notification shared by the tasks of a batch process
+
+    The tasks wait for a new block with wait() instead of sleeping for a fixed interval.
+    New blocks are notified by one of the following sources:
+      - "websocket": newHeads subscription (eth_subscribe) over WebSocket
+      - "filter": eth_newBlockFilter polled with eth_getFilterChanges
+    If no source is configured, or while the source is unavailable,
+    wait() falls back to sleeping for the given interval.
+    """
+
+    MODE_WEBSOCKET = "websocket"
+    MODE_FILTER = "filter"
+
+    # Maximum wait time while the source is available (seconds)
+    TIMEOUT = 60
+    # Polling interval of eth_getFilterChanges (seconds)
+    FILTER_POLL_INTERVAL = 0.5
+    # Wait time before reconnecting to the source (seconds)
+    RECONNECT_INTERVAL = 5
+
+    def __init__(self, web3, mode: Optional[str] = None, ws_endpoint: Optional[str] = None,
+                 timeout: float = TIMEOUT, listener: Optional[Callable[[int], None]] = None):
+        """
+        :param web3: Web3 (used by the "filter" mode)
+        :param mode: notification source ("websocket", "filter" or None)
+        :param ws_endpoint: WebSocket endpoint (used by the "websocket" mode)
+        :param timeout: maximum wait time while the source is available (seconds)
+        :param listener: called with the block number of each new block
+        """
+        if mode not in (None, "", self.MODE_WEBSOCKET, self.MODE_FILTER):
+            raise ValueError(f"unknown block notification mode: {mode}")
+        if mode == self.MODE_WEBSOCKET and not ws_endpoint:
+            raise ValueError("ws_endpoint is required for the websocket mode")
+        self.web3 = web3
+        self.mode = mode or None
+        self.ws_endpoint = ws_endpoint
+        self.timeout = timeout
+        self.listener = listener
+
+        self.block_number = None
+        self.available = False
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.thread = None
+
+    def start(self):
+        """Start the notification source (only once)
+
+        :return: None
+        """
+        if self.mode is None:
+            return
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.__run, name="BLOCK-NOTIFIER", daemon=True)
+            self.thread.start()
+
+    def wait(self, interval: float):
+        """Wait for a new block
+
+        Returns immediately if a block newer than the one the calling thread
+        has already seen was notified in the meantime.
+
+        :param interval: sleep time used when no notification source is available (seconds)
+        :return: None
+        """
+        self.start()
+        with self.condition:
+            if self.available:
+                last = getattr(self.local, "block_number", None)
+                self.condition.wait_for(
+                    lambda: not self.available or self.__is_new_block(last),
+                    timeout=self.timeout
+                )
+                self.local.block_number = self.block_number
+                return
+        time.sleep(interval)
+
+    def notify(self, block_number: int):
+        """Notify a new block
+
+        :param block_number: block number
+        :return: None
+        """
+        with self.condition:
+            if self.block_number is not None and block_number <= self.block_number:
+                return
+            self.block_number = block_number
+            self.condition.notify_all()
+        if self.listener is not None:
+            self.listener(block_number)
+
+    def __is_new_block(self, last: Optional[int]) -> bool:
+        if self.block_number is None:
+            return False
+        return last is None or self.block_number > last
+
+    def __set_available(self, available: bool):
+        with self.condition:
+            self.available = available
+            self.condition.notify_all()
+
+    def __run(self):
+        while True:
+            try:
+                if self.mode == self.MODE_WEBSOCKET:
+                    asyncio.run(self.__subscribe())
+                else:
+                    self.__poll_filter()
+            except Exception as err:
+                logging.warning(f"block notification is unavailable, falling back to polling: {err}")
+            self.__set_available(False)
+            time.sleep(self.RECONNECT_INTERVAL)
+
+    async def __subscribe(self):
+        """Receive new blocks with a newHeads subscription"""
+        async with websockets.connect(self.ws_endpoint) as ws:
+            await ws.send(json.dumps({
+                "jsonrpc": "2.0",
+                "id": 1,
+                "method": "eth_subscribe",
+                "params": ["newHeads"]
+            }))
+            response = json.loads(await asyncio.wait_for(ws.recv(), timeout=self.timeout))
+            if response.get("error") is not None:
+                raise Exception(f"eth_subscribe failed: {response['error']}")
+            subscription_id = response["result"]
+            self.__set_available(True)
+            logging.info(f"Subscribed to newHeads: {self.ws_endpoint}")
+
+            while True:
+                # 一定時間ブロックが通知されない場合は接続断とみなして再接続する
+                message = json.loads(await asyncio.wait_for(ws.recv(), timeout=self.timeout * 2))
+                params = message.get("params") or {}
+                if params.get("subscription") != subscription_id:
+                    continue
+                self.notify(int(params["result"]["number"], 16))
+
+    def __poll_filter(self):
+        """Receive new blocks by polling a block filter"""
+        block_filter = self.web3.eth.filter("latest")
+        self.__set_available(True)
+        logging.info(f"Created block filter: {block_filter.filter_id}")
+
+        while True:
+            # フィルタが失効した場合は例外となり、フィルタを作り直す
+            if len(block_filter.get_new_entries()) > 0:
+                self.notify(self.web3.eth.blockNumber)
+            time.sleep(self.FILTER_POLL_INTERVAL)
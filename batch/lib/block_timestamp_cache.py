@@ -0,0 +1,148 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from collections import OrderedDict
+import threading
+from typing import (
+    Dict,
+    List
+)
+
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import IDXBlockTimestamp
+
+
+class BlockTimestampCache:
+    """Block timestamp cache shared by indexers and processors
+
+    Timestamps are looked up in the following order:
+      1. in-memory LRU cache
+      2. idx_block_timestamp table (only if db is given)
+      3. eth_getBlockByNumber sent as a JSON-RPC batch request (web3 must use PooledHTTPProvider)
+
+    NOTE: Timestamps written to the table are committed with the next commit of the DB session.
+    NOTE: The cache can be shared by the tasks of the batch supervisor.
+    """
+
+    # Maximum number of blocks kept in memory
+    MAX_SIZE = 10000
+    # Maximum number of calls in a JSON-RPC batch request
+    BATCH_SIZE = 100
+
+    def __init__(self, web3, db=None, max_size: int = MAX_SIZE):
+        self.web3 = web3
+        self.db = db
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = threading.RLock()
+
+    def get(self, block_number: int) -> int:
+        """Get the block timestamp
+
+        :param block_number: block number
+        :return: block timestamp (unixtime)
+        """
+        with self.lock:
+            if block_number not in self.cache:
+                self.__prefetch([block_number])
+            self.cache.move_to_end(block_number)
+            return self.cache[block_number]
+
+    def prefetch(self, block_number_list: List[int]):
+        """Load the timestamps of the given blocks into the cache
+
+        Duplicated block numbers are looked up only once.
+
+        :param block_number_list: block numbers
+        :return: None
+        """
+        with self.lock:
+            self.__prefetch(block_number_list)
+
+    def evict(self, block_number: int):
+        """Evict the timestamps of the blocks after a fork block
+
+        Called when a reorg is detected: the blocks after the fork block are orphaned
+        and the blocks with the same numbers on the canonical chain have other timestamps.
+
+        :param block_number: fork block number (the newest block still on the canonical chain)
+        :return: None
+        """
+        with self.lock:
+            for orphaned in [cached for cached in self.cache if cached > block_number]:
+                del self.cache[orphaned]
+            if self.db is not None:
+                self.db.query(IDXBlockTimestamp). \
+                    filter(IDXBlockTimestamp.block_number > block_number). \
+                    delete(synchronize_session=False)
+
+    def __prefetch(self, block_number_list: List[int]):
+        missing = sorted(set(
+            block_number for block_number in block_number_list if block_number not in self.cache
+        ))
+        if len(missing) == 0:
+            return
+
+        timestamps = {}
+        if self.db is not None:
+            records = self.db.query(IDXBlockTimestamp). \
+                filter(IDXBlockTimestamp.block_number.in_(missing)). \
+                all()
+            for record in records:
+                timestamps[record.block_number] = record.timestamp
+
+        fetched = self.__fetch([block_number for block_number in missing if block_number not in timestamps])
+        if self.db is not None and len(fetched) > 0:
+            stmt = insert(IDXBlockTimestamp).values([
+                {"block_number": block_number, "timestamp": timestamp}
+                for block_number, timestamp in fetched.items()
+            ])
+            self.db.execute(stmt.on_conflict_do_nothing(index_elements=["block_number"]))
+        timestamps.update(fetched)
+
+        for block_number, timestamp in timestamps.items():
+            self.cache[block_number] = timestamp
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def __fetch(self, block_number_list: List[int]) -> Dict[int, int]:
+        """Fetch the block timestamps from the node
+
+        :param block_number_list: block numbers
+        :return: block timestamp of each block number
+        """
+        timestamps = {}
+        for i in range(0, len(block_number_list), self.BATCH_SIZE):
+            chunk = block_number_list[i:i + self.BATCH_SIZE]
+            if len(chunk) == 1:
+                timestamps[chunk[0]] = self.web3.eth.getBlock(chunk[0])["timestamp"]
+                continue
+            response = self.web3.provider.make_batch_request([
+                {
+                    "jsonrpc": "2.0",
+                    "id": request_id,
+                    "method": "eth_getBlockByNumber",
+                    "params": [hex(block_number), False]
+                } for request_id, block_number in enumerate(chunk)
+            ])
+            for result in response:
+                if result.get("error") is not None or result.get("result") is None:
+                    raise Exception(f"failed to get block: {chunk[result['id']]}")
+                timestamps[chunk[result["id"]]] = int(result["result"]["timestamp"], 16)
+        return timestamps
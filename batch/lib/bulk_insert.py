@@ -0,0 +1,54 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from typing import (
+    List,
+    Optional
+)
+
+from sqlalchemy.dialects.postgresql import insert
+
+# Maximum number of rows in an INSERT statement
+CHUNK_SIZE = 1000
+
+
+def insert_on_conflict_do_nothing(db, model, rows: List[dict], index_elements: List[str],
+                                  returning: Optional[list] = None) -> list:
+    """Insert rows, skipping the ones which already exist
+
+    Rows are written with multi-row INSERT ... ON CONFLICT DO NOTHING statements,
+    so that re-indexing the same events is idempotent.
+
+    NOTE: The change is committed with the next commit of the DB session.
+
+    :param db: DB session
+    :param model: model class
+    :param rows: rows (column name -> value)
+    :param index_elements: columns of the unique constraint
+    :param returning: (optional) columns to be returned for the inserted rows
+    :return: the returned columns of the inserted rows (empty if returning is not given)
+    """
+    inserted_rows = []
+    for i in range(0, len(rows), CHUNK_SIZE):
+        stmt = insert(model).values(rows[i:i + CHUNK_SIZE])
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+        if returning is not None:
+            inserted_rows.extend(db.execute(stmt.returning(*returning)).fetchall())
+        else:
+            db.execute(stmt)
+    return inserted_rows
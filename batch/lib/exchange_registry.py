@@ -0,0 +1,123 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import logging
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import IDXTokenExchange
+from app.utils import ContractUtils
+from config import Config
+
+
+class ExchangeRegistry:
+    """Exchange contract registry shared by the Order and Agreement indexers
+
+    The tradable exchange of each token is cached in idx_token_exchange, so
+    tradableExchange() is called only for tokens which are not cached yet.
+    setTradableExchange() emits no event: the issuer app deletes the cached
+    row when it changes the exchange, and all tokens are checked again
+    every refresh interval.
+
+    The cached rows are kept in memory. They are read from DB again only on
+    a refresh, or when the number of rows differs from the memory (a row has
+    been deleted by the issuer app or added by another process).
+
+    NOTE: Changes are committed with the next commit of the DB session.
+    NOTE: The registry can be shared by the tasks of the batch supervisor.
+    """
+
+    # Exchange contract of each token template
+    EXCHANGE_CONTRACT_LIST = [
+        (Config.TEMPLATE_ID_SB, "IbetStraightBondExchange"),
+        (Config.TEMPLATE_ID_COUPON, "IbetCouponExchange"),
+        (Config.TEMPLATE_ID_MEMBERSHIP, "IbetMembershipExchange"),
+    ]
+
+    def __init__(self, token_registry, db, refresh_interval: int = Config.INDEXER_EXCHANGE_REFRESH_INTERVAL):
+        self.token_registry = token_registry
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.refreshed_at = time.monotonic()
+        self.contract_list = {}
+        self.exchange_address_list = None
+        self.lock = threading.Lock()
+
+    def get_exchange_list(self) -> list:
+        """Get the exchange contracts the issued tokens are traded on
+
+        :return: exchange contracts (web3 Contract)
+        """
+        with self.lock:
+            now = time.monotonic()
+            refresh = now - self.refreshed_at >= self.refresh_interval
+            row_count = self.db.query(func.count(IDXTokenExchange.token_address)).scalar()
+            if refresh or self.exchange_address_list is None or row_count != len(self.exchange_address_list):
+                self.exchange_address_list = {
+                    token_address: exchange_address for token_address, exchange_address in
+                    self.db.query(IDXTokenExchange.token_address, IDXTokenExchange.exchange_address).all()
+                }
+            exchange_address_list = self.exchange_address_list
+
+            exchange_list = {}
+            for template_id, contract_name in self.EXCHANGE_CONTRACT_LIST:
+                for token_contract in self.token_registry.get_token_list(template_id=template_id):
+                    token_address = token_contract.address
+                    if refresh or token_address not in exchange_address_list:
+                        try:
+                            exchange_address = token_contract.functions.tradableExchange().call()
+                        except Exception as e:
+                            logging.warning(e)
+                            continue
+                        if exchange_address_list.get(token_address) != exchange_address:
+                            self.__set_exchange_address(token_address, exchange_address)
+                            exchange_address_list[token_address] = exchange_address
+                    exchange_address = exchange_address_list[token_address]
+                    # DEXが未設定のトークンは対象外とする
+                    if exchange_address == Config.ZERO_ADDRESS or exchange_address in exchange_list:
+                        continue
+                    exchange_list[exchange_address] = self.__get_contract(contract_name, exchange_address)
+
+            if refresh:
+                self.refreshed_at = now
+            return list(exchange_list.values())
+
+    def __set_exchange_address(self, token_address: str, exchange_address: str):
+        stmt = insert(IDXTokenExchange).values(
+            token_address=token_address,
+            exchange_address=exchange_address
+        )
+        self.db.execute(stmt.on_conflict_do_update(
+            index_elements=["token_address"],
+            set_={"exchange_address": stmt.excluded.exchange_address}
+        ))
+
+    def __get_contract(self, contract_name: str, exchange_address: str):
+        """Get the exchange contract, reusing the contract object
+
+        :param contract_name: contract name
+        :param exchange_address: exchange address
+        :return: Contract
+        """
+        key = (contract_name, exchange_address)
+        if key not in self.contract_list:
+            self.contract_list[key] = ContractUtils.get_contract(contract_name, exchange_address)
+        return self.contract_list[key]
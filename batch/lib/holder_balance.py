@@ -0,0 +1,158 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from typing import Optional
+
+from sqlalchemy import (
+    func,
+    select,
+    union_all
+)
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import (
+    Transfer,
+    IDXBalanceEvent,
+    TokenHolderBalance
+)
+from config import Config
+
+# Maximum number of rows in an INSERT statement
+CHUNK_SIZE = 1000
+
+
+class HolderBalanceDelta:
+    """Changes of the holder balances (token_holder_balance)
+
+    The changes are accumulated per (token, account) and added to the stored
+    balances with INSERT ... ON CONFLICT DO UPDATE, so that the update does not
+    depend on the order of the blocks (backfill partitions run concurrently).
+
+    Only the changes of newly indexed events must be added: the callers pass the
+    rows returned by the idempotent inserts (or deletes on a rollback), so that
+    re-indexing the same events does not change the balances twice.
+    """
+
+    def __init__(self):
+        self.delta_list = {}
+
+    def add(self, token_address: str, account_address: str, amount: int, block_number: int):
+        """Add a change of a balance
+
+        :param token_address: token address
+        :param account_address: account address (the zero address is ignored)
+        :param amount: change of the balance (negative on decrease)
+        :param block_number: block number of the event
+        :return: None
+        """
+        if account_address is None or account_address == Config.ZERO_ADDRESS:
+            return
+        key = (token_address, account_address)
+        amount_sum, max_block_number = self.delta_list.get(key, (0, block_number))
+        self.delta_list[key] = (amount_sum + amount, max(max_block_number, block_number))
+
+    def add_transfer(self, token_address: str, account_address_from: str, account_address_to: str,
+                     amount: int, block_number: int):
+        """Add the changes of a Transfer event
+
+        :param token_address: token address
+        :param account_address_from: transfer from
+        :param account_address_to: transfer to
+        :param amount: transfer amount
+        :param block_number: block number of the event
+        :return: None
+        """
+        self.add(token_address, account_address_from, -amount, block_number)
+        self.add(token_address, account_address_to, amount, block_number)
+
+    def apply(self, db, rollback_block_number: Optional[int] = None):
+        """Write the changes
+
+        NOTE: The change is committed with the next commit of the DB session.
+
+        :param db: DB session
+        :param rollback_block_number: (optional) block number rolled back to.
+            When given, updated_block is set back to the block if it is later.
+        :return: None
+        """
+        # 同じ順序で行ロックを取得する（並行して更新する場合のデッドロック回避）
+        rows = [
+            {
+                "token_address": token_address,
+                "account_address": account_address,
+                "balance": amount,
+                "updated_block": block_number if rollback_block_number is None else rollback_block_number
+            } for (token_address, account_address), (amount, block_number) in sorted(self.delta_list.items())
+        ]
+        for i in range(0, len(rows), CHUNK_SIZE):
+            stmt = insert(TokenHolderBalance).values(rows[i:i + CHUNK_SIZE])
+            if rollback_block_number is None:
+                updated_block = func.greatest(TokenHolderBalance.updated_block, stmt.excluded.updated_block)
+            else:
+                updated_block = func.least(TokenHolderBalance.updated_block, stmt.excluded.updated_block)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=["token_address", "account_address"],
+                set_={
+                    "balance": TokenHolderBalance.balance + stmt.excluded.balance,
+                    "updated_block": updated_block
+                }
+            ))
+        self.delta_list = {}
+
+
+def rebuild(db):
+    """Rebuild token_holder_balance from the indexed events (transfer and idx_balance_event)
+
+    NOTE: Stop indexer_Transfer while rebuilding. The change is committed with the next commit of the DB session.
+
+    :param db: DB session
+    :return: number of the rows
+    """
+    change_list = union_all(
+        select([
+            Transfer.token_address,
+            Transfer.account_address_to.label("account_address"),
+            Transfer.transfer_amount.label("amount"),
+            Transfer.block_number
+        ]),
+        select([
+            Transfer.token_address,
+            Transfer.account_address_from.label("account_address"),
+            (-Transfer.transfer_amount).label("amount"),
+            Transfer.block_number
+        ]),
+        select([
+            IDXBalanceEvent.token_address,
+            IDXBalanceEvent.account_address,
+            IDXBalanceEvent.amount,
+            IDXBalanceEvent.block_number
+        ])
+    ).alias("change_list")
+    db.query(TokenHolderBalance).delete(synchronize_session=False)
+    result = db.execute(insert(TokenHolderBalance).from_select(
+        ["token_address", "account_address", "balance", "updated_block"],
+        select([
+            change_list.c.token_address,
+            change_list.c.account_address,
+            func.sum(change_list.c.amount),
+            func.max(change_list.c.block_number)
+        ]).
+        where(change_list.c.account_address != Config.ZERO_ADDRESS).
+        group_by(change_list.c.token_address, change_list.c.account_address)
+    ))
+    return result.rowcount
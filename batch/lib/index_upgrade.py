@@ -0,0 +1,123 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from typing import Dict
+
+from sqlalchemy import (
+    delete,
+    select,
+    tuple_
+)
+
+from app.models import (
+    Transfer,
+    ApplyFor,
+    Consume,
+    Order,
+    IDXOrderAmountEvent,
+    Agreement,
+    IDXBlockNumber
+)
+
+# Indexed table and legacy row condition of each indexer
+LEGACY_ROW_LIST = {
+    "Transfer": (Transfer, Transfer.log_index == None),
+    "ApplyFor": (ApplyFor, ApplyFor.log_index == None),
+    "Consume": (Consume, Consume.log_index == None),
+    "Order": (Order, Order.block_number == None),
+    "Agreement": (Agreement, Agreement.block_number == None)
+}
+
+
+def check_legacy_index(db, indexer_name: str):
+    """Check that the index has no rows indexed by an older version
+
+    The indexers synchronize the contracts without a checkpoint from block 0,
+    which duplicates the rows or the order amount changes indexed by an older version.
+
+    :param db: DB session
+    :param indexer_name: indexer name
+    :return: None
+    :raises RuntimeError: rows indexed by an older version remain
+    """
+    model, condition = LEGACY_ROW_LIST[indexer_name]
+    if db.query(model.id).filter(condition).first() is not None:
+        raise RuntimeError(
+            f"{model.__tablename__} has rows indexed by an older version: "
+            f"run `python manage.py upgrade_index` before starting the indexer"
+        )
+
+
+def delete_legacy_events(db) -> Dict[str, int]:
+    """Delete the events indexed before log_index was introduced
+
+    The rows have no log_index, and PostgreSQL does not treat NULLs as equal in
+    the unique constraint (transaction_hash, token_address, log_index), so the
+    re-indexed events would be inserted next to them instead of being skipped.
+    The indexers re-index the deleted events from their first block.
+
+    NOTE: The change is committed with the next commit of the DB session.
+
+    :param db: DB session
+    :return: number of the deleted rows of each table
+    """
+    deleted = {}
+    for indexer_name in ["Transfer", "ApplyFor", "Consume"]:
+        model, condition = LEGACY_ROW_LIST[indexer_name]
+        deleted[model.__tablename__] = db.query(model). \
+            filter(condition). \
+            delete(synchronize_session=False)
+    return deleted
+
+
+def delete_legacy_exchange_events(db) -> Dict[str, int]:
+    """Delete the orders and agreements indexed before block_number was introduced
+
+    The rows cannot be rolled back on a chain reorganization, and the order amounts
+    already include the Agree events, which the Order indexer applies once more
+    when it replays them. The checkpoints of the exchanges are deleted, so that
+    the indexers re-index the deleted events from their first block.
+
+    NOTE: The change is committed with the next commit of the DB session.
+
+    :param db: DB session
+    :return: number of the deleted rows of each table
+    """
+    deleted = {}
+    for indexer_name in ["Order", "Agreement"]:
+        model, condition = LEGACY_ROW_LIST[indexer_name]
+        exchange_address_list = [
+            exchange_address for (exchange_address,) in
+            db.query(model.exchange_address).filter(condition).distinct()
+        ]
+        if model is Order:
+            # 旧バージョンの注文に適用済の数量変更イベントも削除して再適用させる
+            db.execute(
+                delete(IDXOrderAmountEvent).
+                where(tuple_(IDXOrderAmountEvent.exchange_address, IDXOrderAmountEvent.order_id).in_(
+                    select([Order.exchange_address, Order.order_id]).where(condition)
+                ))
+            )
+        deleted[model.__tablename__] = db.query(model). \
+            filter(condition). \
+            delete(synchronize_session=False)
+        db.query(IDXBlockNumber). \
+            filter(IDXBlockNumber.indexer_name == indexer_name). \
+            filter(IDXBlockNumber.contract_address.in_(exchange_address_list)). \
+            delete(synchronize_session=False)
+    return deleted
@@ -0,0 +1,225 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import threading
+
+from eth_utils import to_checksum_address
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+
+
+class DecodedLog:
+    """Event log decoded by LogDecoder
+
+    Items are read in the same way as the event data of web3
+    (event["args"], event["blockNumber"], ...).
+    """
+
+    __slots__ = (
+        "event",
+        "address",
+        "blockNumber",
+        "blockHash",
+        "transactionHash",
+        "transactionIndex",
+        "logIndex",
+        "args"
+    )
+
+    def __init__(self, event, address, block_number, block_hash, transaction_hash, transaction_index, log_index, args):
+        self.event = event
+        self.address = address
+        self.blockNumber = block_number
+        self.blockHash = block_hash
+        self.transactionHash = transaction_hash
+        self.transactionIndex = transaction_index
+        self.logIndex = log_index
+        self.args = args
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+class LogDecoder:
+    """Decoder of the raw logs returned by eth_getLogs
+
+    The decoding steps of each event ABI are compiled once. Topics and
+    32-byte words of static types (address, bool, intN, uintN, bytesN) are
+    parsed directly from the hex strings of the JSON-RPC response; only the
+    data of events with dynamic types (e.g. string) is decoded by eth_abi.
+
+    The result is the same as the event data decoded by web3 (processLog),
+    which is kept available with format() for verification.
+
+    NOTE: The decoder can be shared by threads.
+    """
+
+    def __init__(self, web3):
+        self.web3 = web3
+        self.compiled_list = {}
+        self.address_list = {}
+        self.lock = threading.Lock()
+
+    def to_checksum_address(self, address: str) -> str:
+        """Checksum address, cached per address
+
+        :param address: address (hex string)
+        :return: checksum address
+        """
+        checksum_address = self.address_list.get(address)
+        if checksum_address is None:
+            checksum_address = to_checksum_address(address)
+            self.address_list[address] = checksum_address
+        return checksum_address
+
+    def decode(self, event_abi: dict, log: dict) -> DecodedLog:
+        """Decode a raw log
+
+        :param event_abi: event ABI
+        :param log: raw log of eth_getLogs
+        :return: decoded log
+        """
+        event_name, topic_decoder_list, word_decoder_list, data_name_list, data_type_list = self.__compile(event_abi)
+
+        args = {}
+        topics = log["topics"]
+        for i, (name, decoder) in enumerate(topic_decoder_list):
+            args[name] = decoder(topics[i + 1][2:])
+        data = log["data"]
+        if word_decoder_list is not None:
+            for i, (name, decoder) in enumerate(word_decoder_list):
+                args[name] = decoder(data[2 + i * 64:2 + (i + 1) * 64])
+        elif len(data_name_list) > 0:
+            values = self.web3.codec.decode_abi(data_type_list, bytes.fromhex(data[2:]))
+            for name, _type, value in zip(data_name_list, data_type_list, values):
+                args[name] = self.to_checksum_address(value) if _type == "address" else value
+
+        return DecodedLog(
+            event=event_name,
+            address=self.to_checksum_address(log["address"]),
+            block_number=int(log["blockNumber"], 16),
+            block_hash=HexBytes(log["blockHash"]),
+            transaction_hash=HexBytes(log["transactionHash"]),
+            transaction_index=int(log["transactionIndex"], 16),
+            log_index=int(log["logIndex"], 16),
+            args=args
+        )
+
+    def format(self, log: dict) -> AttributeDict:
+        """Format a raw log in the same way as web3.eth.getLogs
+
+        :param log: raw log of eth_getLogs
+        :return: formatted log (to be decoded by processLog of web3)
+        """
+        return AttributeDict({
+            "address": self.to_checksum_address(log["address"]),
+            "topics": [HexBytes(topic) for topic in log["topics"]],
+            "data": log["data"],
+            "blockNumber": int(log["blockNumber"], 16),
+            "blockHash": HexBytes(log["blockHash"]),
+            "transactionHash": HexBytes(log["transactionHash"]),
+            "transactionIndex": int(log["transactionIndex"], 16),
+            "logIndex": int(log["logIndex"], 16),
+            "removed": log.get("removed", False)
+        })
+
+    @staticmethod
+    def verify(decoded_log: DecodedLog, event_data) -> None:
+        """Verify a decoded log against the event data decoded by web3
+
+        :param decoded_log: log decoded by LogDecoder
+        :param event_data: event data decoded by web3 (processLog)
+        :return: None
+        :raises ValueError: if the results differ
+        """
+        for key in ("event", "address", "blockNumber", "blockHash", "transactionHash", "transactionIndex", "logIndex"):
+            if decoded_log[key] != event_data[key]:
+                raise ValueError(f"decoded log mismatch: {key}={decoded_log[key]}, web3={event_data[key]}")
+        if decoded_log.args != dict(event_data["args"]):
+            raise ValueError(f"decoded log mismatch: args={decoded_log.args}, web3={dict(event_data['args'])}")
+
+    def __compile(self, event_abi: dict) -> tuple:
+        """Compile the decoding steps of an event ABI
+
+        :param event_abi: event ABI
+        :return: (event name, topic decoders, data word decoders, data names, data types)
+        """
+        key = (
+            event_abi["name"],
+            tuple((_input["name"], _input["type"], _input["indexed"]) for _input in event_abi["inputs"])
+        )
+        compiled = self.compiled_list.get(key)
+        if compiled is not None:
+            return compiled
+
+        topic_decoder_list = []
+        data_name_list = []
+        data_type_list = []
+        for _input in event_abi["inputs"]:
+            if _input["indexed"]:
+                # 動的な型のindexed引数はtopicにハッシュ値が格納される
+                decoder = self.__get_word_decoder(_input["type"]) or bytes.fromhex
+                topic_decoder_list.append((_input["name"], decoder))
+            else:
+                data_name_list.append(_input["name"])
+                data_type_list.append(_input["type"])
+
+        # 静的な型のみの場合は32バイトごとに直接デコードする
+        word_decoder_list = [
+            (name, self.__get_word_decoder(_type)) for name, _type in zip(data_name_list, data_type_list)
+        ]
+        if any(decoder is None for _, decoder in word_decoder_list):
+            word_decoder_list = None
+
+        compiled = (event_abi["name"], topic_decoder_list, word_decoder_list, data_name_list, data_type_list)
+        with self.lock:
+            self.compiled_list[key] = compiled
+        return compiled
+
+    def __get_word_decoder(self, _type: str):
+        """Get the decoder of a 32-byte word
+
+        :param _type: ABI type
+        :return: function decoding a 64-digit hex string (None if the type is not a static 32-byte type)
+        """
+        if "[" in _type:
+            return None
+        if _type == "address":
+            return lambda word: self.to_checksum_address("0x" + word[24:])
+        if _type == "bool":
+            return lambda word: int(word, 16) != 0
+        if _type.startswith("uint"):
+            return lambda word: int(word, 16)
+        if _type.startswith("int"):
+            bits = int(_type[3:] or 256)
+            return lambda word: _to_signed(int(word, 16), bits)
+        if _type.startswith("bytes") and len(_type) > 5:
+            size = int(_type[5:])
+            return lambda word: bytes.fromhex(word[:size * 2])
+        return None
+
+
+def _to_signed(value: int, bits: int) -> int:
+    value &= (1 << bits) - 1
+    return value - (1 << bits) if value >= (1 << (bits - 1)) else value
@@ -0,0 +1,264 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+from eth_utils import (
+    encode_hex,
+    event_abi_to_log_topic
+)
+from requests.exceptions import Timeout
+from web3.exceptions import (
+    ABIEventFunctionNotFound,
+    MismatchedABI
+)
+
+from app.utils.contract_utils import contract_call_cache
+from config import Config
+from batch.lib.log_decoder import LogDecoder
+
+
+class LogFetcher:
+    """Event log fetcher
+
+    Fetches the logs of an event emitted by any of the given contracts with
+    a single eth_getLogs call (address array and topic0 filter), so that the
+    number of RPC calls per poll does not grow with the number of contracts.
+
+    The block range is split into sub-ranges whose size adapts to the node:
+    it is halved when the node times out or refuses to return that many
+    logs, and doubled again while the ranges are sparse.
+
+    When there are many contracts, the addresses are split into chunks which
+    are fetched concurrently by the thread pool of the fetcher, so at most
+    max_workers eth_getLogs calls are in flight. Each call is bounded by the
+    read timeout of the Web3 provider (WEB3_HTTP_READ_TIMEOUT). Only the RPC
+    calls run in the thread pool; the merged logs are returned in
+    (blockNumber, logIndex) order, so that sink writes stay ordered.
+    Call close() to shut down the thread pool when the fetcher is no longer used.
+
+    The raw eth_getLogs responses are decoded by LogDecoder (decode_mode "fast").
+    The web3 decoder (processLog) can be used instead ("web3"), or both can be
+    run and compared ("verify"), which raises an error on any difference.
+
+    When db is given, the contracts which emitted the events changing the cached
+    results (ContractCallCache.UPDATE_EVENT_LIST) are recorded in idx_contract_update
+    (committed with the next commit of the DB session), which invalidates the
+    contract call cache of the issuer app. Other events, such as Transfer, do not
+    change the results reused across blocks and are not recorded.
+    """
+
+    DECODE_MODE_FAST = "fast"
+    DECODE_MODE_WEB3 = "web3"
+    DECODE_MODE_VERIFY = "verify"
+
+    # Maximum number of blocks in an eth_getLogs call
+    MAX_WINDOW = 1000000
+    # The window is doubled after consecutive calls returning fewer logs than SPARSE_LOG_COUNT
+    SPARSE_LOG_COUNT = 1000
+    SPARSE_CALL_COUNT = 3
+    # Number of retries of a sub-range on other errors
+    MAX_RETRIES = 3
+    # Wait time before a retry (seconds)
+    RETRY_INTERVAL = 1
+
+    # Error messages returned by nodes when the result of eth_getLogs is too large
+    RANGE_ERROR_MESSAGES = (
+        "query returned more than",
+        "query timeout exceeded",
+        "response size exceeded",
+        "too many",
+        "limit exceeded",
+        "block range"
+    )
+
+    def __init__(self, web3, db=None,
+                 address_chunk_size: int = Config.INDEXER_FETCH_ADDRESS_CHUNK_SIZE,
+                 max_workers: int = Config.INDEXER_FETCH_MAX_WORKERS,
+                 decode_mode: str = Config.INDEXER_LOG_DECODE_MODE):
+        if decode_mode not in (self.DECODE_MODE_FAST, self.DECODE_MODE_WEB3, self.DECODE_MODE_VERIFY):
+            raise ValueError(f"unknown decode mode: {decode_mode}")
+        self.web3 = web3
+        self.db = db
+        self.decoder = LogDecoder(web3)
+        self.decode_mode = decode_mode
+        self.window = {}
+        self.address_chunk_size = address_chunk_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def close(self):
+        """Shut down the thread pool
+
+        :return: None
+        """
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_logs(self, contract_list: list, event_name: str, block_from: int, block_to: int) -> list:
+        """Get the event logs
+
+        Contracts whose ABI does not have the event are skipped.
+        If the ABIs define the event with different signatures,
+        all of them are fetched in the same call.
+
+        :param contract_list: contracts (web3 Contract)
+        :param event_name: event name
+        :param block_from: from block
+        :param block_to: to block
+        :return: decoded event logs ordered by (blockNumber, logIndex)
+        """
+        event_list = {}
+        topic_list = []
+        for contract in contract_list:
+            try:
+                event = contract.events[event_name]()
+            except (ABIEventFunctionNotFound, MismatchedABI):
+                continue
+            event_list[contract.address] = event
+            topic = encode_hex(event_abi_to_log_topic(event.abi))
+            if topic not in topic_list:
+                topic_list.append(topic)
+
+        if len(event_list) == 0:
+            return []
+
+        start_time = time.time()
+        address_list = list(event_list.keys())
+        future_list = [
+            self.executor.submit(
+                self.__get_raw_logs,
+                event_name=event_name,
+                address_list=address_list[i:i + self.address_chunk_size],
+                topic_list=topic_list,
+                block_from=block_from,
+                block_to=block_to
+            ) for i in range(0, len(address_list), self.address_chunk_size)
+        ]
+        logs = []
+        for future in future_list:
+            logs.extend(future.result())
+        elapsed_time = max(time.time() - start_time, 0.001)
+        logging.info(
+            f"getLogs: event={event_name}, from={block_from}, to={block_to}, logs={len(logs)}, "
+            f"blocks/s={(block_to - block_from + 1) / elapsed_time:.1f}, logs/s={len(logs) / elapsed_time:.1f}"
+        )
+
+        events = []
+        for log in logs:
+            event = event_list.get(self.decoder.to_checksum_address(log["address"]))
+            if event is None:
+                continue
+            if self.decode_mode == self.DECODE_MODE_WEB3:
+                events.append(event.processLog(self.decoder.format(log)))
+                continue
+            decoded_log = self.decoder.decode(event.abi, log)
+            if self.decode_mode == self.DECODE_MODE_VERIFY:
+                self.decoder.verify(decoded_log, event.processLog(self.decoder.format(log)))
+            events.append(decoded_log)
+        events.sort(key=lambda e: (e["blockNumber"], e["logIndex"]))
+
+        if self.db is not None and event_name in contract_call_cache.UPDATE_EVENT_LIST and len(events) > 0:
+            block_number_list = {}
+            for event in events:
+                block_number_list[self.decoder.to_checksum_address(event["address"])] = event["blockNumber"]
+            contract_call_cache.invalidate(block_number_list, db_session=self.db)
+        return events
+
+    def __get_raw_logs(self, event_name: str, address_list: list, topic_list: list,
+                       block_from: int, block_to: int) -> list:
+        """Get the raw logs with the adaptive window
+
+        :param event_name: event name (the window size is kept per event)
+        :param address_list: contract addresses
+        :param topic_list: topic0 values
+        :param block_from: from block
+        :param block_to: to block
+        :return: raw logs (JSON-RPC response)
+        """
+        logs = []
+        window = self.window.get(event_name, self.MAX_WINDOW)
+        retry_count = 0
+        sparse_count = 0
+        _from_block = block_from
+        while _from_block <= block_to:
+            _to_block = min(_from_block + window - 1, block_to)
+            try:
+                _logs = self.__eth_get_logs({
+                    "fromBlock": hex(_from_block),
+                    "toBlock": hex(_to_block),
+                    "address": address_list,
+                    "topics": [topic_list]
+                })
+            except Exception as e:
+                if self.__is_range_error(e) and _to_block > _from_block:
+                    # 範囲を半分にして同じ開始ブロックから再取得する
+                    window = max((_to_block - _from_block + 1) // 2, 1)
+                    sparse_count = 0
+                    logging.warning(f"getLogs: shrinking the window to {window} blocks: {e}")
+                    continue
+                retry_count += 1
+                if retry_count > self.MAX_RETRIES:
+                    self.window[event_name] = window
+                    raise
+                logging.warning(f"getLogs: retrying from={_from_block}, to={_to_block}: {e}")
+                time.sleep(self.RETRY_INTERVAL)
+                continue
+
+            logs.extend(_logs)
+            retry_count = 0
+            _from_block = _to_block + 1
+            if len(_logs) < self.SPARSE_LOG_COUNT:
+                sparse_count += 1
+            else:
+                sparse_count = 0
+            if sparse_count >= self.SPARSE_CALL_COUNT:
+                window = min(window * 2, self.MAX_WINDOW)
+                sparse_count = 0
+
+        self.window[event_name] = window
+        return logs
+
+    def __eth_get_logs(self, filter_params: dict) -> list:
+        """Call eth_getLogs without the result formatters of web3
+
+        :param filter_params: filter parameters
+        :return: raw logs
+        """
+        response = self.web3.provider.make_request("eth_getLogs", [filter_params])
+        if response.get("error") is not None:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def __is_range_error(self, e: Exception) -> bool:
+        """Whether the error is caused by the size of the block range
+
+        :param e: exception
+        :return: True if the range should be split
+        """
+        if isinstance(e, Timeout):
+            return True
+        message = str(e.args[0].get("message", "")) if len(e.args) > 0 and isinstance(e.args[0], dict) else str(e)
+        message = message.lower()
+        return any(m in message for m in self.RANGE_ERROR_MESSAGES)
@@ -0,0 +1,244 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from contextlib import contextmanager
+from datetime import datetime
+import logging
+import threading
+import time
+from typing import Iterable
+
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import BatchTaskMetrics
+from config import Config
+
+
+class Histogram:
+    """Latency histogram (cumulative buckets, as in Prometheus)"""
+
+    # Upper bounds of the buckets (seconds)
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.bucket_count = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        for i, upper_bound in enumerate(self.BUCKETS):
+            if seconds <= upper_bound:
+                break
+        else:
+            i = len(self.BUCKETS)
+        self.bucket_count[i] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def to_dict(self) -> dict:
+        buckets = []
+        cumulative_count = 0
+        for upper_bound, count in zip(list(self.BUCKETS) + ["+Inf"], self.bucket_count):
+            cumulative_count += count
+            buckets.append([upper_bound, cumulative_count])
+        return {
+            "buckets": buckets,
+            "count": self.count,
+            "sum": round(self.sum, 6)
+        }
+
+
+class TaskMetrics:
+    """Metrics of a batch task (indexer or processor)
+
+    NOTE: The metrics can be updated by the threads of the task.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.block_number = None
+        self.head_block_number = None
+        self.event_count = 0
+        self.error_count = {}
+        self.flush_latency = Histogram()
+        self.updated_at = None
+        self.lock = threading.Lock()
+
+    def set_block(self, block_number: int, head_block_number: int):
+        """Record the block the task has processed up to
+
+        :param block_number: last processed block
+        :param head_block_number: latest block of the node
+        :return: None
+        """
+        with self.lock:
+            self.block_number = block_number
+            self.head_block_number = head_block_number
+            self.updated_at = datetime.utcnow()
+
+    def add_events(self, count: int):
+        """Count the processed events (or records of a processor)
+
+        :param count: number of events
+        :return: None
+        """
+        with self.lock:
+            self.event_count += count
+            self.updated_at = datetime.utcnow()
+
+    def add_errors(self, address_list: Iterable[str]):
+        """Count the errors per token (or contract)
+
+        :param address_list: addresses of the tokens which failed (an address may appear more than once)
+        :return: None
+        """
+        with self.lock:
+            for address in address_list:
+                self.error_count[address] = self.error_count.get(address, 0) + 1
+
+    @contextmanager
+    def time_flush(self):
+        """Measure the latency of a DB flush"""
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.flush_latency.observe(time.monotonic() - start_time)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            head_lag = None
+            if self.block_number is not None and self.head_block_number is not None:
+                head_lag = self.head_block_number - self.block_number
+            return {
+                "block_number": self.block_number,
+                "head_block_number": self.head_block_number,
+                "head_lag": head_lag,
+                "events": self.event_count,
+                "errors": sum(self.error_count.values()),
+                "errors_per_token": dict(self.error_count),
+                "flush_latency": self.flush_latency.to_dict(),
+                "updated_at": self.updated_at.isoformat() if self.updated_at is not None else None
+            }
+
+
+class BatchMetrics:
+    """Metrics of the tasks of a batch process
+
+    Each task records its metrics in a TaskMetrics. The JSON-RPC calls are
+    recorded per method for the whole process (task name "RPC") by setting
+    observe_rpc() as the observer of PooledHTTPProvider. Once started, the metrics are written to the
+    batch_task_metrics table every interval seconds by a background thread,
+    from which the issuer app serves them (/dashboard/batch_metrics).
+
+    The metrics are counted since the process started.
+    NOTE: The metrics can be shared by the tasks of the batch supervisor.
+    """
+
+    # Task name of the JSON-RPC metrics
+    RPC_TASK_NAME = "RPC"
+
+    def __init__(self, db, interval: float = Config.BATCH_METRICS_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self.task_list = {}
+        self.rpc_call_count = {}
+        self.rpc_error_count = {}
+        self.rpc_latency = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def get_task(self, name: str) -> TaskMetrics:
+        """Get the metrics of a task
+
+        :param name: task name
+        :return: TaskMetrics
+        """
+        with self.lock:
+            if name not in self.task_list:
+                self.task_list[name] = TaskMetrics(name)
+            return self.task_list[name]
+
+    def observe_rpc(self, method: str, seconds: float, failed: bool = False):
+        """Record a JSON-RPC call
+
+        :param method: JSON-RPC method
+        :param seconds: latency (seconds)
+        :param failed: whether the call failed
+        :return: None
+        """
+        with self.lock:
+            self.rpc_call_count[method] = self.rpc_call_count.get(method, 0) + 1
+            if failed:
+                self.rpc_error_count[method] = self.rpc_error_count.get(method, 0) + 1
+            if method not in self.rpc_latency:
+                self.rpc_latency[method] = Histogram()
+            self.rpc_latency[method].observe(seconds)
+
+    def get_rpc_metrics(self) -> dict:
+        with self.lock:
+            return {
+                "calls": dict(self.rpc_call_count),
+                "errors": dict(self.rpc_error_count),
+                "latency": {method: histogram.to_dict() for method, histogram in self.rpc_latency.items()}
+            }
+
+    def start(self):
+        """Start writing the metrics to DB (only once)
+
+        :return: None
+        """
+        with self.lock:
+            if self.thread is not None or self.interval <= 0:
+                return
+            self.thread = threading.Thread(target=self.__run, name="BATCH-METRICS", daemon=True)
+            self.thread.start()
+
+    def write(self):
+        """Write the metrics to DB
+
+        :return: None
+        """
+        with self.lock:
+            task_list = list(self.task_list.values())
+        metrics_list = [(task.name, task.to_dict()) for task in task_list]
+        metrics_list.append((self.RPC_TASK_NAME, self.get_rpc_metrics()))
+
+        now = datetime.utcnow()
+        for task_name, metrics in metrics_list:
+            stmt = insert(BatchTaskMetrics).values(
+                task_name=task_name,
+                metrics=metrics,
+                modified=now
+            )
+            self.db.execute(stmt.on_conflict_do_update(
+                index_elements=["task_name"],
+                set_={"metrics": stmt.excluded.metrics, "modified": stmt.excluded.modified}
+            ))
+        self.db.commit()
+
+    def __run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except Exception as err:
+                logging.warning(f"failed to write the batch metrics: {err}")
+                self.db.rollback()
+
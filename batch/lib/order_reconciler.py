@@ -0,0 +1,73 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from typing import (
+    Dict,
+    Tuple
+)
+
+from app.models import Order
+from app.utils import ContractUtils
+
+
+class OrderReconciler:
+    """Reconciliation of the indexed order amounts with the exchange contracts
+
+    The remaining amount of an order is derived from the events by the Order indexer.
+    This checks it against getOrder() of the exchange contract at a given block.
+    """
+
+    # Maximum number of orders checked in one ContractUtils.batch_call()
+    BATCH_SIZE = 100
+    # Index of the amount in the output of getOrder()
+    AMOUNT_INDEX = 2
+
+    def __init__(self, db):
+        self.db = db
+
+    def reconcile(self, exchange_list: list, block_number: int) -> Dict[Tuple[str, int], int]:
+        """Find the orders whose indexed amount differs from the contract
+
+        Cancelled orders and filled orders (amount 0) are not checked.
+
+        :param exchange_list: exchange contracts (web3 Contract)
+        :param block_number: block number the orders are indexed up to
+        :return: amount on the contract of each mismatched (exchange address, order id)
+        """
+        exchange_contracts = {exchange.address: exchange for exchange in exchange_list}
+        if len(exchange_contracts) == 0:
+            return {}
+        orders = self.db.query(Order.exchange_address, Order.order_id, Order.amount). \
+            filter(Order.exchange_address.in_(list(exchange_contracts.keys()))). \
+            filter(Order.is_cancelled == False). \
+            filter(Order.amount > 0). \
+            order_by(Order.exchange_address, Order.order_id). \
+            all()
+
+        mismatched = {}
+        for i in range(0, len(orders), self.BATCH_SIZE):
+            chunk = orders[i:i + self.BATCH_SIZE]
+            order_list = ContractUtils.batch_call(
+                [exchange_contracts[order.exchange_address].functions.getOrder(order.order_id) for order in chunk],
+                block_identifier=block_number
+            )
+            for order, contract_order in zip(chunk, order_list):
+                amount = contract_order[self.AMOUNT_INDEX]
+                if order.amount != amount:
+                    mismatched[(order.exchange_address, order.order_id)] = amount
+        return mismatched
@@ -0,0 +1,148 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import IDXBlockHash
+from config import Config
+
+
+class ReorgDetector:
+    """Chain reorganization detector of an indexer
+
+    The hashes of the blocks an indexer synchronized to are kept in a ring
+    buffer (idx_block_hash). Since a block hash covers all of its ancestors,
+    it is enough to compare the latest buffered hash with the node: if it
+    differs, the buffer is walked back to the newest block which is still
+    on the canonical chain, and the indexer is rolled back to that block.
+
+    The canonical hashes are taken from the block chain kept by the shared
+    BlockHeightPoller, so that a poll without a reorg does not call the node.
+    The buffer may grow up to twice its size before it is pruned.
+
+    NOTE: Changes are committed with the next commit of the DB session.
+    """
+
+    def __init__(self, block_height_poller, db, indexer_name: str,
+                 size: int = Config.INDEXER_BLOCK_HASH_BUFFER_SIZE, block_timestamp_cache=None):
+        """
+        :param block_height_poller: BlockHeightPoller
+        :param db: DB session
+        :param indexer_name: indexer name
+        :param size: number of the buffered blocks
+        :param block_timestamp_cache: BlockTimestampCache (the timestamps of the orphaned blocks are evicted)
+        """
+        self.block_height_poller = block_height_poller
+        self.db = db
+        self.indexer_name = indexer_name
+        self.size = size
+        self.block_timestamp_cache = block_timestamp_cache
+        # Number of the buffered blocks (None: not counted yet)
+        self.count = None
+
+    def detect(self) -> Optional[int]:
+        """Detect a reorg
+
+        :return: block number to be rolled back to (None if no reorg is detected)
+        """
+        latest = self.db.query(IDXBlockHash). \
+            filter(IDXBlockHash.indexer_name == self.indexer_name). \
+            order_by(IDXBlockHash.block_number.desc()). \
+            first()
+        if latest is None or self.__is_canonical(latest):
+            return None
+
+        records = self.db.query(IDXBlockHash). \
+            filter(IDXBlockHash.indexer_name == self.indexer_name). \
+            filter(IDXBlockHash.block_number < latest.block_number). \
+            order_by(IDXBlockHash.block_number.desc()). \
+            all()
+        rollback_block_number = None
+        for record in records:
+            if self.__is_canonical(record):
+                rollback_block_number = record.block_number
+                break
+        if rollback_block_number is None:
+            # バッファよりも深いreorgの場合、バッファの最古ブロックの直前まで巻き戻す
+            oldest = records[-1] if len(records) > 0 else latest
+            rollback_block_number = oldest.block_number - 1
+            logging.warning(f"reorg deeper than the block hash buffer: indexer={self.indexer_name}")
+        logging.warning(
+            f"reorg detected: indexer={self.indexer_name}, "
+            f"latest={latest.block_number}, rollback_to={rollback_block_number}"
+        )
+
+        self.db.query(IDXBlockHash). \
+            filter(IDXBlockHash.indexer_name == self.indexer_name). \
+            filter(IDXBlockHash.block_number > rollback_block_number). \
+            delete(synchronize_session=False)
+        self.count = None
+        if self.block_timestamp_cache is not None:
+            self.block_timestamp_cache.evict(rollback_block_number)
+        return rollback_block_number
+
+    def record(self, block_number: int):
+        """Record the hash of a synchronized block
+
+        :param block_number: block number
+        :return: None
+        """
+        stmt = insert(IDXBlockHash).values(
+            indexer_name=self.indexer_name,
+            block_number=block_number,
+            block_hash=self.block_height_poller.get_block_hash(block_number)
+        )
+        self.db.execute(stmt.on_conflict_do_update(
+            index_elements=["indexer_name", "block_number"],
+            set_={"block_hash": stmt.excluded.block_hash}
+        ))
+
+        if self.count is None:
+            self.count = self.db.query(IDXBlockHash). \
+                filter(IDXBlockHash.indexer_name == self.indexer_name). \
+                count()
+        else:
+            self.count += 1
+        if self.count < self.size * 2:
+            return
+
+        # バッファのサイズを超えた古いブロックを削除する
+        oldest = self.db.query(IDXBlockHash.block_number). \
+            filter(IDXBlockHash.indexer_name == self.indexer_name). \
+            order_by(IDXBlockHash.block_number.desc()). \
+            offset(self.size - 1). \
+            limit(1). \
+            scalar()
+        if oldest is not None:
+            self.db.query(IDXBlockHash). \
+                filter(IDXBlockHash.indexer_name == self.indexer_name). \
+                filter(IDXBlockHash.block_number < oldest). \
+                delete(synchronize_session=False)
+        self.count = None
+
+    def __is_canonical(self, record: IDXBlockHash) -> bool:
+        """Whether the buffered block is on the canonical chain of the node
+
+        :param record: buffered block hash
+        :return: True if the hash matches the node
+        """
+        # ノードのheadが巻き戻っている場合、ブロックが存在しない（None）
+        return self.block_height_poller.get_block_hash(record.block_number) == record.block_hash
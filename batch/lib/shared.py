@@ -0,0 +1,58 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+from sqlalchemy import create_engine
+from sqlalchemy.orm import (
+    sessionmaker,
+    scoped_session
+)
+
+from app.utils import Web3Utils
+from config import Config
+from batch.lib.block_height_poller import BlockHeightPoller
+from batch.lib.block_notifier import BlockNotifier
+from batch.lib.block_timestamp_cache import BlockTimestampCache
+from batch.lib.exchange_registry import ExchangeRegistry
+from batch.lib.metrics import BatchMetrics
+from batch.lib.token_registry import TokenRegistry
+
+# Resources shared by the batch processes
+#   When the batches run in the supervisor, all the tasks share these objects.
+#   db_session is thread-local, so each task uses its own session on the shared connection pool.
+engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
+db_session = scoped_session(sessionmaker())
+db_session.configure(bind=engine)
+
+batch_metrics = BatchMetrics(db=db_session)
+
+# The app modules used by the batches (ContractUtils, etc.) share the same Web3,
+# so all the JSON-RPC calls of the process are recorded in the metrics.
+web3 = Web3Utils.get_web3()
+web3.provider.observer = batch_metrics.observe_rpc
+
+block_height_poller = BlockHeightPoller(web3)
+block_notifier = BlockNotifier(
+    web3,
+    mode=Config.BLOCK_NOTIFICATION_MODE,
+    ws_endpoint=Config.WEB3_WS_PROVIDER,
+    timeout=Config.BLOCK_NOTIFICATION_TIMEOUT,
+    listener=block_height_poller.update
+)
+token_registry = TokenRegistry(web3, db=db_session)
+block_timestamp_cache = BlockTimestampCache(web3, db=db_session)
+exchange_registry = ExchangeRegistry(token_registry, db=db_session)
@@ -0,0 +1,112 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import json
+import threading
+from typing import Optional
+
+from sqlalchemy import or_
+
+from app.models import Token
+
+
+class TokenRegistry:
+    """Issued token registry of a batch process
+
+    Only tokens registered after the last refresh, and tokens whose
+    token_address has not been set yet (it is set by processor_IssueEvent
+    after the deploy transaction is mined), are read from DB.
+    The bytecode columns are never read, and the ABI is read once per token.
+
+    The registry can be shared by the tasks of the batch supervisor.
+    """
+
+    def __init__(self, web3, db):
+        self.web3 = web3
+        self.db = db
+        self.last_id = 0
+        self.pending_id_list = set()
+        self.abi_list = {}
+        self.contract_list = {}
+        self.template_id_list = {}
+        self.token_id_list = {}
+        self.lock = threading.Lock()
+
+    def get_token_list(self, template_id: Optional[int] = None) -> list:
+        """Get the token contracts
+
+        :param template_id: template id (all templates if None)
+        :return: contracts (web3 Contract) of the deployed tokens, ordered by token id
+        """
+        with self.lock:
+            self.refresh()
+            return [
+                self.contract_list[token_id] for token_id in sorted(self.contract_list.keys())
+                if template_id is None or self.template_id_list[token_id] == template_id
+            ]
+
+    def get_contract(self, token_address: str):
+        """Get the contract of a token
+
+        :param token_address: token address
+        :return: contract (web3 Contract), None if the token has not been deployed
+        """
+        with self.lock:
+            self.refresh()
+            token_id = self.token_id_list.get(token_address)
+            return self.contract_list[token_id] if token_id is not None else None
+
+    def refresh(self):
+        """Load the new tokens and the newly deployed tokens from DB
+
+        :return: None
+        """
+        query = self.db.query(Token.id, Token.template_id, Token.token_address)
+        if len(self.pending_id_list) > 0:
+            query = query.filter(or_(Token.id > self.last_id, Token.id.in_(list(self.pending_id_list))))
+        else:
+            query = query.filter(Token.id > self.last_id)
+
+        for token_id, template_id, token_address in query.order_by(Token.id).all():
+            if token_address is None:
+                self.pending_id_list.add(token_id)
+            else:
+                self.contract_list[token_id] = self.web3.eth.contract(
+                    address=token_address,
+                    abi=self.__get_abi(token_id, template_id)
+                )
+                self.template_id_list[token_id] = template_id
+                self.token_id_list[token_address] = token_id
+                self.pending_id_list.discard(token_id)
+            self.last_id = max(self.last_id, token_id)
+
+    def __get_abi(self, token_id: int, template_id: int) -> list:
+        """Get the parsed ABI of a token
+
+        Parsed ABIs are cached per template, so tokens deployed with
+        the same contract share one ABI object.
+
+        :param token_id: token id
+        :param template_id: template id
+        :return: ABI
+        """
+        abi_str = self.db.query(Token.abi).filter(Token.id == token_id).scalar()
+        key = (template_id, abi_str)
+        if key not in self.abi_list:
+            self.abi_list[key] = json.loads(abi_str.replace("'", '"').replace('True', 'true').replace('False', 'false'))
+        return self.abi_list[key]
@@ -24,13 +24,6 @@ import os
 import sys
 import time
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import (
-    sessionmaker,
-    scoped_session
-)
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
 from eth_utils import to_checksum_address
 
 path = os.path.join(os.path.dirname(__file__), "../")
@@ -43,92 +36,100 @@ from app.models import (
     TransferApprovalHistory
 )
 from config import Config
+from batch.lib.shared import (
+    web3,
+    db_session,
+    batch_metrics
+)
 
 dictConfig(Config.LOG_CONFIG)
 log_fmt = "[%(asctime)s] [PROCESSOR-ApproveTransfer] [%(process)d] [%(levelname)s] %(message)s"
 logging.basicConfig(format=log_fmt)
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
-db_session = scoped_session(sessionmaker())
-db_session.configure(bind=engine)
+task_metrics = batch_metrics.get_task("PROCESSOR-ApproveTransfer")
 
 
 def get_abi(token: Token):
     return json.loads(token.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
 
 
-while True:
-    logging.debug("Loop Start")
-
-    applications_tmp = db_session.query(IDXTransferApproval). \
-        filter(IDXTransferApproval.cancelled == None). \
-        all()
-    applications = []
-    for application in applications_tmp:
-        transfer_history = db_session.query(TransferApprovalHistory).\
-            filter(TransferApprovalHistory.token_address == application.token_address).\
-            filter(TransferApprovalHistory.application_id == application.application_id).\
-            first()
-        if transfer_history is None:
-            applications.append(application)
-
-    for application in applications:
-        token = db_session.query(Token). \
-            filter(Token.token_address == application.token_address). \
-            first()
-        if token is None:
-            logging.warning(f"token not found: {application.token_address}")
-            continue
-
-        try:
-            TokenContract = web3.eth.contract(
-                address=token.token_address,
-                abi=get_abi(token)
-            )
-
-            # Approve Transfer
-            now = str(datetime.utcnow().timestamp())
-            approve_tx = TokenContract.functions.approveTransfer(application.application_id, now). \
-                buildTransaction({"from": to_checksum_address(token.admin_address), "gas": Config.TX_GAS_LIMIT})
-            tx_hash, txn_receipt = ContractUtils.send_transaction(
-                transaction=approve_tx,
-                eth_account=to_checksum_address(token.admin_address),
-                db_session=db_session
-            )
-            transfer_approve_history = TransferApprovalHistory()
-            transfer_approve_history.token_address = application.token_address
-            transfer_approve_history.application_id = application.application_id
-
-            if txn_receipt["status"] == 1:  # Success
-                transfer_approve_history.result = 1
-                db_session.add(transfer_approve_history)
-                logging.debug(f"Transfer approved: "
-                              f"token_address = {application.token_address}, "
-                              f"application_id = {application.application_id}")
-            else:  # Fail
-                # Cancel Transfer
-                cancel_tx = TokenContract.functions.cancelTransfer(application.application_id, now). \
+def main():
+    batch_metrics.start()
+    while True:
+        logging.debug("Loop Start")
+
+        applications_tmp = db_session.query(IDXTransferApproval). \
+            filter(IDXTransferApproval.cancelled == None). \
+            all()
+        applications = []
+        for application in applications_tmp:
+            transfer_history = db_session.query(TransferApprovalHistory).\
+                filter(TransferApprovalHistory.token_address == application.token_address).\
+                filter(TransferApprovalHistory.application_id == application.application_id).\
+                first()
+            if transfer_history is None:
+                applications.append(application)
+
+        for application in applications:
+            token = db_session.query(Token). \
+                filter(Token.token_address == application.token_address). \
+                first()
+            if token is None:
+                logging.warning(f"token not found: {application.token_address}")
+                continue
+
+            try:
+                TokenContract = web3.eth.contract(
+                    address=token.token_address,
+                    abi=get_abi(token)
+                )
+
+                # Approve Transfer
+                now = str(datetime.utcnow().timestamp())
+                approve_tx = TokenContract.functions.approveTransfer(application.application_id, now). \
                     buildTransaction({"from": to_checksum_address(token.admin_address), "gas": Config.TX_GAS_LIMIT})
                 tx_hash, txn_receipt = ContractUtils.send_transaction(
-                    transaction=cancel_tx,
+                    transaction=approve_tx,
                     eth_account=to_checksum_address(token.admin_address),
                     db_session=db_session
                 )
-                transfer_approve_history.result = 2  # Error
-                db_session.add(transfer_approve_history)
-                logging.error(f"Transfer was canceled: "
+                transfer_approve_history = TransferApprovalHistory()
+                transfer_approve_history.token_address = application.token_address
+                transfer_approve_history.application_id = application.application_id
+
+                if txn_receipt["status"] == 1:  # Success
+                    transfer_approve_history.result = 1
+                    db_session.add(transfer_approve_history)
+                    logging.debug(f"Transfer approved: "
+                                  f"token_address = {application.token_address}, "
+                                  f"application_id = {application.application_id}")
+                else:  # Fail
+                    # Cancel Transfer
+                    cancel_tx = TokenContract.functions.cancelTransfer(application.application_id, now). \
+                        buildTransaction({"from": to_checksum_address(token.admin_address), "gas": Config.TX_GAS_LIMIT})
+                    tx_hash, txn_receipt = ContractUtils.send_transaction(
+                        transaction=cancel_tx,
+                        eth_account=to_checksum_address(token.admin_address),
+                        db_session=db_session
+                    )
+                    transfer_approve_history.result = 2  # Error
+                    db_session.add(transfer_approve_history)
+                    logging.error(f"Transfer was canceled: "
+                                  f"token_address = {application.token_address}, "
+                                  f"application_id = {application.application_id}")
+                db_session.commit()
+                task_metrics.add_events(1)
+            except Exception as err:
+                logging.exception(err)
+                task_metrics.add_errors([application.token_address])
+                logging.error(f"Process failed: "
                               f"token_address = {application.token_address}, "
                               f"application_id = {application.application_id}")
-            db_session.commit()
-        except Exception as err:
-            logging.exception(err)
-            logging.error(f"Process failed: "
-                          f"token_address = {application.token_address}, "
-                          f"application_id = {application.application_id}")
-            continue
-
-    logging.debug("Loop Finished")
-    time.sleep(Config.INTERVAL_PROCESSOR_APPROVE_TRANSFER)
+                continue
+
+        logging.debug("Loop Finished")
+        time.sleep(Config.INTERVAL_PROCESSOR_APPROVE_TRANSFER)
+
+
+if __name__ == "__main__":
+    main()
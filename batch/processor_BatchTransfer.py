@@ -23,14 +23,6 @@ import os
 import sys
 import time
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import (
-    sessionmaker,
-    scoped_session
-)
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
-
 path = os.path.join(os.path.dirname(__file__), '../')
 sys.path.append(path)
 
@@ -40,72 +32,83 @@ from app.models import (
     Token
 )
 from config import Config
+from batch.lib.shared import (
+    web3,
+    db_session,
+    batch_metrics
+)
 
 dictConfig(Config.LOG_CONFIG)
 log_fmt = '[%(asctime)s] [PROCESSOR-BatchTransfer] [%(process)d] [%(levelname)s] %(message)s'
 logging.basicConfig(format=log_fmt)
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
-db_session = scoped_session(sessionmaker())
-db_session.configure(bind=engine)
+task_metrics = batch_metrics.get_task("PROCESSOR-BatchTransfer")
 
 
 # 常時起動（無限ループ）
-while True:
-    logging.debug('Loop Start')
-
-    # 実行承認済、かつ未実行のレコードリストを抽出
-    transfer_list = db_session.query(BulkTransfer).\
-        filter(BulkTransfer.approved == True).\
-        filter(BulkTransfer.status == 0).\
-        all()
-
-    # レコード単位で移転処理を実行
-    for record in transfer_list:
-        # Tokenコントラクトに接続
-        token = db_session.query(Token). \
-            filter(Token.token_address == record.token_address). \
-            filter(Token.admin_address == record.eth_account.lower()). \
-            first()
-        if token is None:
-            logging.warning('Cannot handle token address %s', record.token_address)
-            continue
-        token_abi = json.loads(token.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
-        TokenContract = web3.eth.contract(
-            address=token.token_address,
-            abi=token_abi
-        )
-        # 強制移転処理
-        from_address = record.from_address
-        to_address = record.to_address
-        amount = record.amount
-        try:
-            tx = TokenContract.functions.transferFrom(from_address, to_address, amount). \
-                buildTransaction({'from': record.eth_account, 'gas': Config.TX_GAS_LIMIT})
-            tx_hash, txn_receipt = ContractUtils.send_transaction(
-                transaction=tx,
-                eth_account=record.eth_account,
-                db_session=db_session
+
+
+def main():
+    batch_metrics.start()
+    while True:
+        logging.debug('Loop Start')
+
+        # 実行承認済、かつ未実行のレコードリストを抽出
+        transfer_list = db_session.query(BulkTransfer).\
+            filter(BulkTransfer.approved == True).\
+            filter(BulkTransfer.status == 0).\
+            all()
+
+        # レコード単位で移転処理を実行
+        for record in transfer_list:
+            # Tokenコントラクトに接続
+            token = db_session.query(Token). \
+                filter(Token.token_address == record.token_address). \
+                filter(Token.admin_address == record.eth_account.lower()). \
+                first()
+            if token is None:
+                logging.warning('Cannot handle token address %s', record.token_address)
+                continue
+            token_abi = json.loads(token.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
+            TokenContract = web3.eth.contract(
+                address=token.token_address,
+                abi=token_abi
             )
-            # エラー判定
-            if txn_receipt["status"] == 1:  # トランザクションが正常終了
-                record.status = 1  # 正常終了
-                logging.info(f"Transfer was successful: eth_account={record.eth_account}, "
-                             f"upload_id={record.upload_id}, id={record.id}")
-            else:
+            # 強制移転処理
+            from_address = record.from_address
+            to_address = record.to_address
+            amount = record.amount
+            try:
+                tx = TokenContract.functions.transferFrom(from_address, to_address, amount). \
+                    buildTransaction({'from': record.eth_account, 'gas': Config.TX_GAS_LIMIT})
+                tx_hash, txn_receipt = ContractUtils.send_transaction(
+                    transaction=tx,
+                    eth_account=record.eth_account,
+                    db_session=db_session
+                )
+                # エラー判定
+                if txn_receipt["status"] == 1:  # トランザクションが正常終了
+                    record.status = 1  # 正常終了
+                    task_metrics.add_events(1)
+                    logging.info(f"Transfer was successful: eth_account={record.eth_account}, "
+                                 f"upload_id={record.upload_id}, id={record.id}")
+                else:
+                    record.status = 2  # 異常終了
+                    task_metrics.add_errors([record.token_address])
+                    logging.error(f"Transfer was failed: eth_account={record.eth_account}, "
+                                  f"upload_id={record.upload_id}, id={record.id}")
+            except Exception as err:
                 record.status = 2  # 異常終了
+                task_metrics.add_errors([record.token_address])
                 logging.error(f"Transfer was failed: eth_account={record.eth_account}, "
-                              f"upload_id={record.upload_id}, id={record.id}")
-        except Exception as err:
-            record.status = 2  # 異常終了
-            logging.error(f"Transfer was failed: eth_account={record.eth_account}, "
-                          f"upload_id={record.upload_id}, id={record.id} : {err}")
+                              f"upload_id={record.upload_id}, id={record.id} : {err}")
+
+            # 更新情報をコミット
+            db_session.commit()
+
+        logging.debug('Loop Finished')
+        time.sleep(Config.INTERVAL_PROCESSOR_BATCH_TRANSFER)
 
-        # 更新情報をコミット
-        db_session.commit()
 
-    logging.debug('Loop Finished')
-    time.sleep(Config.INTERVAL_PROCESSOR_BATCH_TRANSFER)
+if __name__ == "__main__":
+    main()
@@ -33,22 +33,14 @@ import time
 
 from eth_utils import to_checksum_address
 from sqlalchemy import (
-    create_engine,
     func
 )
-from sqlalchemy.orm import (
-    sessionmaker,
-    scoped_session
-)
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
 
 path = os.path.join(os.path.dirname(__file__), '../')
 sys.path.append(path)
 
 from app.utils import ContractUtils
 from app.models import (
-    Token,
     UTXO,
     BondLedger,
     BondLedgerBlockNumber,
@@ -57,20 +49,22 @@ from app.models import (
     PersonalInfo as PersonalInfoModel
 )
 from config import Config
+from batch.lib.shared import (
+    db_session,
+    block_height_poller,
+    token_registry,
+    block_timestamp_cache,
+    batch_metrics
+)
 
 dictConfig(Config.LOG_CONFIG)
 log_fmt = '[%(asctime)s] [PROCESSOR-BondLedger] [%(process)d] [%(levelname)s] %(message)s'
 logging.basicConfig(format=log_fmt)
 
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-web3.middleware_onion.inject(geth_poa_middleware, layer=0)
-
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
-db_session = scoped_session(sessionmaker())
-db_session.configure(bind=engine)
-
 JST = timezone(timedelta(hours=+9), "JST")
 
+task_metrics = batch_metrics.get_task("PROCESSOR-BondLedger")
+
 
 class Sinks:
     def __init__(self):
@@ -88,8 +82,9 @@ class Sinks:
             sink.on_bond_ledger(*args, **kwargs)
 
     def flush(self, *args, **kwargs):
-        for sink in self.sinks:
-            sink.flush(*args, **kwargs)
+        with task_metrics.time_flush():
+            for sink in self.sinks:
+                sink.flush(*args, **kwargs)
 
 
 class DBSink:
@@ -344,11 +339,13 @@ class Processor:
         self.sink = sink
         self.db = db
         self.token_list = []
+        self.block_timestamp = block_timestamp_cache
+        self.token_registry = token_registry
 
     def process(self):
         self.__refresh_token_list()
         ledger_block_number = self.__get_ledger_blocknumber()
-        latest_block = web3.eth.blockNumber
+        latest_block = block_height_poller.get_block_number()
         if ledger_block_number >= latest_block:
             logging.debug("skip process")
             pass
@@ -360,24 +357,14 @@ class Processor:
                     self.__create_ledger(token)
             self.__set_ledger_blocknumber(latest_block)
             self.sink.flush()
+            task_metrics.set_block(latest_block, block_height_poller.get_block_number())
 
     def __refresh_token_list(self):
         """発行済トークンの直近化
 
         :return: None
         """
-        self.token_list = []
-        issued_tokens = self.db.query(Token). \
-            filter(Token.template_id == Config.TEMPLATE_ID_SB). \
-            all()
-        for issued_token in issued_tokens:
-            if issued_token.token_address is not None:
-                abi = json.loads(issued_token.abi.replace("'", '"').replace('True', 'true').replace('False', 'false'))
-                token_contract = web3.eth.contract(
-                    address=issued_token.token_address,
-                    abi=abi
-                )
-                self.token_list.append(token_contract)
+        self.token_list = self.token_registry.get_token_list(template_id=Config.TEMPLATE_ID_SB)
 
     def __get_ledger_blocknumber(self):
         block_number = self.db.query(BondLedgerBlockNumber).first()
@@ -413,6 +400,8 @@ class Processor:
             fromBlock=from_block,
             toBlock=to_block
         )
+        task_metrics.add_events(len(events))
+        self.block_timestamp.prefetch([event["blockNumber"] for event in events])
         for event in events:
             event_triggered = True
 
@@ -422,7 +411,7 @@ class Processor:
             to_account = args.get("to", Config.ZERO_ADDRESS)
             amount = args.get("value")
             block_timestamp = datetime.fromtimestamp(
-                web3.eth.getBlock(event['blockNumber'])['timestamp']
+                self.block_timestamp.get(event['blockNumber'])
             )
             block_timestamp_jst = block_timestamp.replace(tzinfo=timezone.utc). \
                 astimezone(JST)
@@ -459,16 +448,22 @@ class Processor:
         self.sink.on_bond_ledger(token=token)
 
 
-sinks = Sinks()
-sinks.register(DBSink(db_session))
-processor = Processor(db=db_session, sink=sinks)
+def main():
+    sinks = Sinks()
+    sinks.register(DBSink(db_session))
+    processor = Processor(db=db_session, sink=sinks)
+    batch_metrics.start()
+
+    while True:
+        try:
+            processor.process()
+            logging.debug("processed")
+        except Exception as ex:
+            logging.exception(ex)
+
+        # 1分間隔で実行
+        time.sleep(Config.INTERVAL_PROCESSOR_BOND_LEDGER_JP)
 
-while True:
-    try:
-        processor.process()
-        logging.debug("processed")
-    except Exception as ex:
-        logging.exception(ex)
 
-    # 1分間隔で実行
-    time.sleep(Config.INTERVAL_PROCESSOR_BOND_LEDGER_JP)
+if __name__ == "__main__":
+    main()
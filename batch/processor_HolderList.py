@@ -0,0 +1,150 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import logging
+from logging.config import dictConfig
+import os
+import sys
+import time
+
+path = os.path.join(os.path.dirname(__file__), '../')
+sys.path.append(path)
+
+from app.utils import HolderListUtils
+from app.models import (
+    HolderList,
+    HolderListJob,
+    HolderListJobStatus,
+    Issuer,
+    Token
+)
+from config import Config
+from batch.lib.block_checkpoint import BlockCheckpoint
+from batch.lib.token_registry import TokenRegistry
+from batch.lib.shared import (
+    web3,
+    db_session,
+    batch_metrics
+)
+
+dictConfig(Config.LOG_CONFIG)
+log_fmt = '[%(asctime)s] [PROCESSOR-HolderList] [%(process)d] [%(levelname)s] %(message)s'
+logging.basicConfig(format=log_fmt)
+
+task_metrics = batch_metrics.get_task("PROCESSOR-HolderList")
+
+
+class Processor:
+    """Holder list (CSV) jobs of the JWT API
+
+    The jobs are registered by POST /api/{share,bond,membership}/holders/<token_address>.
+    Each job writes one HolderList row and records its id in the job.
+
+    The holder list is created as of the block number of the job. A job waits
+    until the Transfer indexer has synchronized the token up to that block,
+    since the holders are taken from token_holder_balance.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.transfer_checkpoint = BlockCheckpoint(db=db, indexer_name="Transfer")
+        self.token_registry = TokenRegistry(web3, db=db)
+
+    def recover(self):
+        """Return the jobs interrupted while processing to the queue
+
+        :return: None
+        """
+        self.db.query(HolderListJob). \
+            filter(HolderListJob.status == HolderListJobStatus.PROCESSING.value). \
+            update({HolderListJob.status: HolderListJobStatus.PENDING.value}, synchronize_session=False)
+        self.db.commit()
+
+    def process(self):
+        """Process the pending jobs in order of registration
+
+        :return: None
+        """
+        job_list = self.db.query(HolderListJob). \
+            filter(HolderListJob.status == HolderListJobStatus.PENDING.value). \
+            order_by(HolderListJob.created). \
+            all()
+        if len(job_list) == 0:
+            return
+        self.transfer_checkpoint.load()
+        for job in job_list:
+            if self.transfer_checkpoint.get_block_number(job.token_address) < job.block_number:
+                logging.debug(f"Waiting for the Transfer indexer: job_id={job.job_id}")
+                continue
+            job.status = HolderListJobStatus.PROCESSING.value
+            self.db.commit()
+            try:
+                holder_list = self.__create_holder_list(job)
+                self.db.add(holder_list)
+                self.db.flush()
+                job.holder_list_id = holder_list.id
+                job.status = HolderListJobStatus.SUCCEEDED.value
+                self.db.commit()
+                task_metrics.add_events(1)
+                logging.info(f"Holder list was created: job_id={job.job_id}, token_address={job.token_address}, "
+                             f"block_number={job.block_number}, holder_list_id={holder_list.id}")
+            except Exception as err:
+                self.db.rollback()
+                job.status = HolderListJobStatus.FAILED.value
+                self.db.commit()
+                task_metrics.add_errors([job.token_address])
+                logging.exception(f"Failed to create holder list: job_id={job.job_id}, "
+                                  f"token_address={job.token_address} : {err}")
+
+    def __create_holder_list(self, job: HolderListJob) -> HolderList:
+        token = self.db.query(Token.id). \
+            filter(Token.token_address == job.token_address). \
+            filter(Token.admin_address == job.eth_account.lower()). \
+            filter(Token.template_id == job.template_id). \
+            first()
+        token_contract = self.token_registry.get_contract(job.token_address) if token is not None else None
+        if token_contract is None:
+            raise ValueError(f"Token not found: {job.token_address}")
+        issuer = self.db.query(Issuer). \
+            filter(Issuer.eth_account == job.eth_account). \
+            first()
+
+        csv_data = HolderListUtils.create_csv(
+            token_contract=token_contract,
+            template_id=job.template_id,
+            issuer_name=issuer.issuer_name if issuer is not None else None,
+            block_number=job.block_number,
+            db_session=self.db
+        )
+        return HolderList(token_address=job.token_address, holder_list=csv_data)
+
+
+# 常時起動（無限ループ）
+def main():
+    batch_metrics.start()
+    processor = Processor(db=db_session)
+    processor.recover()
+    while True:
+        logging.debug('Loop Start')
+        processor.process()
+        logging.debug('Loop Finished')
+        time.sleep(Config.INTERVAL_PROCESSOR_HOLDER_LIST)
+
+
+if __name__ == "__main__":
+    main()
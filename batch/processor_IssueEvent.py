@@ -22,60 +22,70 @@ import os
 import sys
 import time
 
-from sqlalchemy import create_engine
-from web3 import Web3
-
 path = os.path.join(os.path.dirname(__file__), '../')
 sys.path.append(path)
 
 from config import Config
-
-web3 = Web3(Web3.HTTPProvider(Config.WEB3_HTTP_PROVIDER))
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI, echo=False)
+from batch.lib.shared import (
+    web3,
+    engine,
+    batch_metrics
+)
 
 dictConfig(Config.LOG_CONFIG)
 log_fmt = '[%(asctime)s] [PROCESSOR-IssueEvent] [%(process)d] [%(levelname)s] %(message)s'
 logging.basicConfig(format=log_fmt)
 
+task_metrics = batch_metrics.get_task("PROCESSOR-IssueEvent")
 
-while True:
-    # コントラクトアドレスが登録されていないTokenの一覧を抽出
-    try:
-        token_unprocessed = engine.execute(
-            "select * from tokens where token_address IS NULL"
-        )
-    except Exception as err:
-        logging.error("%s", err)
-        time.sleep(10)
-        continue
-
-    for row in token_unprocessed:
-        tx_hash = row['tx_hash']
-        tx_hash_hex = '0x' + tx_hash[2:]
 
+def main():
+    batch_metrics.start()
+    while True:
+        # コントラクトアドレスが登録されていないTokenの一覧を抽出
         try:
-            tx_receipt = web3.eth.getTransactionReceipt(tx_hash_hex)
+            token_unprocessed = engine.execute(
+                "select * from tokens where token_address IS NULL"
+            )
         except Exception as err:
-            logging.exception(err)
+            logging.error("%s", err)
+            time.sleep(10)
             continue
 
-        if tx_receipt is not None:
-            # ブロックの状態を確認して、コントラクトアドレスが登録されているかを確認する。
-            if 'contractAddress' in tx_receipt.keys():
-                admin_address = tx_receipt['from'].lower()
-                contract_address = tx_receipt['contractAddress']
-
-                # 登録済みトークン情報に発行者のアドレスと、トークンアドレスの登録を行う。
-                try:
-                    query_tokens = "update tokens " + \
-                        "set admin_address = \'" + admin_address + "\' , " + \
-                        "token_address = \'" + contract_address + "\' " + \
-                        "where tx_hash = \'" + tx_hash + "\'"
-                    engine.execute(query_tokens)
-                except Exception as err:
-                    logging.error("%s", err)
-                    break
-
-                logging.info("issued --> " + contract_address)
-
-    time.sleep(Config.INTERVAL_PROCESSOR_ISSUE_EVENT)
+        for row in token_unprocessed:
+            tx_hash = row['tx_hash']
+            tx_hash_hex = '0x' + tx_hash[2:]
+
+            try:
+                tx_receipt = web3.eth.getTransactionReceipt(tx_hash_hex)
+            except Exception as err:
+                logging.exception(err)
+                task_metrics.add_errors([tx_hash])
+                continue
+
+            if tx_receipt is not None:
+                # ブロックの状態を確認して、コントラクトアドレスが登録されているかを確認する。
+                if 'contractAddress' in tx_receipt.keys():
+                    admin_address = tx_receipt['from'].lower()
+                    contract_address = tx_receipt['contractAddress']
+
+                    # 登録済みトークン情報に発行者のアドレスと、トークンアドレスの登録を行う。
+                    try:
+                        query_tokens = "update tokens " + \
+                            "set admin_address = \'" + admin_address + "\' , " + \
+                            "token_address = \'" + contract_address + "\' " + \
+                            "where tx_hash = \'" + tx_hash + "\'"
+                        engine.execute(query_tokens)
+                    except Exception as err:
+                        logging.error("%s", err)
+                        task_metrics.add_errors([tx_hash])
+                        break
+
+                    logging.info("issued --> " + contract_address)
+                    task_metrics.add_events(1)
+
+        time.sleep(Config.INTERVAL_PROCESSOR_ISSUE_EVENT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Copyright BOOSTRY Co., Ltd.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+See the License for the specific language governing permissions and
+limitations under the License.
+
+SPDX-License-Identifier: Apache-2.0
+"""
+import importlib
+import logging
+from logging.config import dictConfig
+import os
+import sys
+import threading
+import time
+
+path = os.path.join(os.path.dirname(__file__), '../')
+sys.path.append(path)
+
+from config import Config
+
+dictConfig(Config.LOG_CONFIG)
+log_fmt = '[%(asctime)s] [%(threadName)s] [%(process)d] [%(levelname)s] %(message)s'
+logging.basicConfig(format=log_fmt)
+
+from batch.lib.shared import db_session
+
+# Tasks (thread name, module)
+#   Each task runs the main() of the batch module in its own thread.
+#   The processing interval of each task is Config.INTERVAL_* as when it runs as a process.
+TASK_LIST = [
+    ("PROCESSOR-IssueEvent", "batch.processor_IssueEvent"),
+    ("PROCESSOR-BatchTransfer", "batch.processor_BatchTransfer"),
+    ("PROCESSOR-BondLedger", "batch.processor_BondLedger_JP"),
+    ("PROCESSOR-ApproveTransfer", "batch.processor_ApproveTransfer"),
+    ("PROCESSOR-HolderList", "batch.processor_HolderList"),
+    ("INDEXER-Transfer", "batch.indexer_Transfer"),
+    ("INDEXER-TransferApproval", "batch.indexer_TransferApproval"),
+    ("INDEXER-ApplyFor", "batch.indexer_ApplyFor"),
+    ("INDEXER-Consume", "batch.indexer_Consume"),
+    ("INDEXER-Order", "batch.indexer_Order"),
+    ("INDEXER-Agreement", "batch.indexer_Agreement"),
+    ("INDEXER-PersonalInfo", "batch.indexer_PersonalInfo"),
+]
+
+# Wait time before a crashed task is restarted (seconds)
+RESTART_INTERVAL = 10
+
+
+def run_task(module):
+    """Run a task, restarting it when it crashes
+
+    :param module: batch module
+    :return: None
+    """
+    while True:
+        try:
+            module.main()
+        except Exception as err:
+            logging.exception(err)
+        finally:
+            # 異常終了したタスクのDBセッションを破棄する
+            db_session.remove()
+        logging.error(f"Task stopped, restarting in {RESTART_INTERVAL} seconds")
+        time.sleep(RESTART_INTERVAL)
+
+
+def main():
+    thread_list = []
+    for name, module_name in TASK_LIST:
+        # NOTE: Modules are imported in the main thread, before the tasks start.
+        module = importlib.import_module(module_name)
+        thread = threading.Thread(target=run_task, args=(module,), name=name, daemon=True)
+        thread_list.append(thread)
+
+    for thread in thread_list:
+        thread.start()
+    logging.info("Service started successfully")
+
+    for thread in thread_list:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -127,6 +127,49 @@ class Config:
 
     # Web3
     WEB3_HTTP_PROVIDER = os.environ.get("WEB3_HTTP_PROVIDER") or "http://localhost:8545"
+    WEB3_WS_PROVIDER = os.environ.get("WEB3_WS_PROVIDER")
+
+    # Web3 HTTP Provider
+    # - JSON-RPC endpoints (comma separated, default: WEB3_HTTP_PROVIDER)
+    # - endpoint selection: "failover" (switch to the next endpoint on errors) or "round_robin"
+    # - maximum number of pooled (keep-alive) connections per endpoint in a process
+    # - connect timeout and read timeout of a JSON-RPC request (seconds)
+    # - number of retries on transient errors and backoff factor of the retries (seconds)
+    WEB3_HTTP_PROVIDER_LIST = [uri.strip() for uri in os.environ.get("WEB3_HTTP_PROVIDER_LIST").split(",")
+                               if uri.strip() != ""] \
+        if os.environ.get("WEB3_HTTP_PROVIDER_LIST") else [WEB3_HTTP_PROVIDER]
+    WEB3_HTTP_PROVIDER_STRATEGY = os.environ.get("WEB3_HTTP_PROVIDER_STRATEGY") or "failover"
+    WEB3_HTTP_POOL_SIZE = int(os.environ.get("WEB3_HTTP_POOL_SIZE")) \
+        if os.environ.get("WEB3_HTTP_POOL_SIZE") else 10
+    WEB3_HTTP_CONNECT_TIMEOUT = float(os.environ.get("WEB3_HTTP_CONNECT_TIMEOUT")) \
+        if os.environ.get("WEB3_HTTP_CONNECT_TIMEOUT") else 5
+    WEB3_HTTP_READ_TIMEOUT = float(os.environ.get("WEB3_HTTP_READ_TIMEOUT")) \
+        if os.environ.get("WEB3_HTTP_READ_TIMEOUT") else 60
+    WEB3_HTTP_MAX_RETRIES = int(os.environ.get("WEB3_HTTP_MAX_RETRIES")) \
+        if os.environ.get("WEB3_HTTP_MAX_RETRIES") else 3
+    WEB3_HTTP_RETRY_BACKOFF = float(os.environ.get("WEB3_HTTP_RETRY_BACKOFF")) \
+        if os.environ.get("WEB3_HTTP_RETRY_BACKOFF") else 0.5
+
+    # Contract Call Cache
+    # - maximum number of cached call results in a process (0: disabled)
+    # - storage of the call results: "memory" (per process) or "db" (contract_call_result table, shared by the processes)
+    # - period during which the latest block number is reused across requests (seconds, 0: resolved once per request)
+    # - maximum age of the results of the functions which almost never change (e.g. name()) reused in later blocks (seconds)
+    # - interval of reading the contract updates recorded by the indexers (seconds)
+    CONTRACT_CALL_CACHE_SIZE = int(os.environ.get("CONTRACT_CALL_CACHE_SIZE")) \
+        if os.environ.get("CONTRACT_CALL_CACHE_SIZE") else 10000
+    CONTRACT_CALL_CACHE_STORAGE = os.environ.get("CONTRACT_CALL_CACHE_STORAGE") or "memory"
+    CONTRACT_CALL_CACHE_BLOCK_NUMBER_TTL = float(os.environ.get("CONTRACT_CALL_CACHE_BLOCK_NUMBER_TTL")) \
+        if os.environ.get("CONTRACT_CALL_CACHE_BLOCK_NUMBER_TTL") else 0
+    CONTRACT_CALL_CACHE_STATIC_TTL = int(os.environ.get("CONTRACT_CALL_CACHE_STATIC_TTL")) \
+        if os.environ.get("CONTRACT_CALL_CACHE_STATIC_TTL") else 600
+    CONTRACT_CALL_CACHE_REFRESH_INTERVAL = float(os.environ.get("CONTRACT_CALL_CACHE_REFRESH_INTERVAL")) \
+        if os.environ.get("CONTRACT_CALL_CACHE_REFRESH_INTERVAL") else 1
+
+    # Token Holder Balance
+    # - source of the holder balances: "db" (token_holder_balance maintained by indexer_Transfer)
+    #   or "verify" (checked against the contracts, the values of the contracts are used on a mismatch)
+    HOLDER_BALANCE_MODE = os.environ.get("HOLDER_BALANCE_MODE") or "db"
 
     # Transaction Gas Limit
     TX_GAS_LIMIT = int(os.environ.get("TX_GAS_LIMIT")) if os.environ.get("TX_GAS_LIMIT") else 6000000
@@ -144,6 +187,47 @@ class Config:
     # Zero Address
     ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
 
+    # Indexer Log Fetching
+    # - number of contract addresses in an eth_getLogs call
+    # - maximum number of eth_getLogs calls in flight (each call is bounded by WEB3_HTTP_READ_TIMEOUT)
+    # - decoder of the logs: "fast" (raw log decoder), "web3" (web3 decoder) or "verify" (both, compared)
+    INDEXER_FETCH_ADDRESS_CHUNK_SIZE = int(os.environ.get("INDEXER_FETCH_ADDRESS_CHUNK_SIZE")) \
+        if os.environ.get("INDEXER_FETCH_ADDRESS_CHUNK_SIZE") else 100
+    INDEXER_FETCH_MAX_WORKERS = int(os.environ.get("INDEXER_FETCH_MAX_WORKERS")) \
+        if os.environ.get("INDEXER_FETCH_MAX_WORKERS") else 4
+    INDEXER_LOG_DECODE_MODE = os.environ.get("INDEXER_LOG_DECODE_MODE") or "fast"
+
+    # Indexer Reorg Handling
+    # - number of blocks behind the head which are not indexed yet (confirmation depth)
+    # - number of recent block hashes kept per indexer to detect reorgs
+    INDEXER_CONFIRMATION_DEPTH = int(os.environ.get("INDEXER_CONFIRMATION_DEPTH")) \
+        if os.environ.get("INDEXER_CONFIRMATION_DEPTH") else 0
+    INDEXER_BLOCK_HASH_BUFFER_SIZE = int(os.environ.get("INDEXER_BLOCK_HASH_BUFFER_SIZE")) \
+        if os.environ.get("INDEXER_BLOCK_HASH_BUFFER_SIZE") else 128
+
+    # Exchange Discovery
+    # - interval of checking tradableExchange() of all the tokens again (seconds)
+    INDEXER_EXCHANGE_REFRESH_INTERVAL = int(os.environ.get("INDEXER_EXCHANGE_REFRESH_INTERVAL")) \
+        if os.environ.get("INDEXER_EXCHANGE_REFRESH_INTERVAL") else 600
+
+    # Order Amount Reconciliation
+    # - interval of checking the order amounts derived from the events against getOrder() (seconds, 0: disabled)
+    INDEXER_ORDER_RECONCILE_INTERVAL = int(os.environ.get("INDEXER_ORDER_RECONCILE_INTERVAL")) \
+        if os.environ.get("INDEXER_ORDER_RECONCILE_INTERVAL") else 0
+
+    # New Block Notification
+    # - notification source which wakes the indexers: "websocket" (newHeads), "filter" (eth_newBlockFilter)
+    #   or unset (sleep for INTERVAL_INDEXER_*)
+    # - maximum wait time for a new block while the source is available (seconds)
+    BLOCK_NOTIFICATION_MODE = os.environ.get("BLOCK_NOTIFICATION_MODE")
+    BLOCK_NOTIFICATION_TIMEOUT = int(os.environ.get("BLOCK_NOTIFICATION_TIMEOUT")) \
+        if os.environ.get("BLOCK_NOTIFICATION_TIMEOUT") else 60
+
+    # Batch Metrics
+    # - interval of writing the metrics of the batch tasks to the batch_task_metrics table (seconds, 0: disabled)
+    BATCH_METRICS_INTERVAL = int(os.environ.get("BATCH_METRICS_INTERVAL")) \
+        if os.environ.get("BATCH_METRICS_INTERVAL") else 10
+
     # Batch Processing Interval
     INTERVAL_INDEXER_AGREEMENT = int(os.environ.get("INTERVAL_INDEXER_AGREEMENT")) \
         if os.environ.get("INTERVAL_INDEXER_AGREEMENT") else 1
@@ -165,6 +249,8 @@ class Config:
         if os.environ.get("INTERVAL_PROCESSOR_BATCH_TRANSFER") else 10
     INTERVAL_PROCESSOR_BOND_LEDGER_JP = int(os.environ.get("INTERVAL_PROCESSOR_BOND_LEDGER_JP")) \
         if os.environ.get("INTERVAL_PROCESSOR_BOND_LEDGER_JP") else 60
+    INTERVAL_PROCESSOR_HOLDER_LIST = int(os.environ.get("INTERVAL_PROCESSOR_HOLDER_LIST")) \
+        if os.environ.get("INTERVAL_PROCESSOR_HOLDER_LIST") else 1
     INTERVAL_PROCESSOR_ISSUE_EVENT = int(os.environ.get("INTERVAL_PROCESSOR_ISSUE_EVENT")) \
         if os.environ.get("INTERVAL_PROCESSOR_ISSUE_EVENT") else 10
 
@@ -312,6 +312,65 @@ def issuer_save(issuer_file, rsa_privatekey, eoa_keyfile_password):
     print("Successfully updated.")
 
 
+###############################################
+# インデックスのバックフィル
+###############################################
+@manager.option('--indexer', dest='indexer', help='transfer, apply_for, consume, order or agreement', required=True)
+@manager.option('--from', dest='block_from', type=int, help='first block', required=True)
+@manager.option('--to', dest='block_to', type=int, help='last block', required=True)
+@manager.option('--workers', dest='workers', type=int, help='number of worker processes', default=4, required=False)
+def backfill(indexer, block_from, block_to, workers):
+    """Backfills an index from the past blocks with worker processes
+
+    Stop the live indexer while backfilling. Run the same command again to resume an interrupted run.
+    """
+    from batch.backfill import run
+
+    if not run(indexer=indexer, block_from=block_from, block_to=block_to, workers=workers):
+        sys.exit(1)
+
+
+###############################################
+# インデックスのアップグレード
+###############################################
+@manager.command
+def upgrade_index():
+    """Deletes the indexed events which the current indexers cannot deduplicate
+
+    Upgrade order: stop the batches, update the DB schema, run this command, then start the batches.
+    The indexers re-index the deleted events from their first block, and refuse to start while they remain.
+    Running it after the indexers have re-indexed the events deletes the duplicated old rows.
+    """
+    from batch.lib.index_upgrade import (
+        delete_legacy_events,
+        delete_legacy_exchange_events
+    )
+
+    deleted = delete_legacy_events(db.session)
+    deleted.update(delete_legacy_exchange_events(db.session))
+    db.session.commit()
+    for table_name, row_count in deleted.items():
+        print(f"{table_name}: {row_count} rows deleted")
+    print("Successfully upgraded.")
+
+
+###############################################
+# 保有者残高の再構築
+###############################################
+@manager.command
+def rebuild_holder_balance():
+    """Rebuilds token_holder_balance from the indexed Transfer and balance change events
+
+    Stop the Transfer indexer while rebuilding. Events indexed before token_holder_balance was introduced
+    are not included in idx_balance_event: resynchronize the Transfer indexer from its first block before rebuilding.
+    """
+    from batch.lib.holder_balance import rebuild
+
+    row_count = rebuild(db.session)
+    db.session.commit()
+    print(f"Successfully rebuilt: {row_count} rows")
+
+
 ###############################################
 # テスト実行
 ###############################################
@@ -22,17 +22,7 @@ source ~/.bash_profile
 cd /app/ibet-Issuer
 
 # batch
-python batch/processor_IssueEvent.py &
-python batch/processor_BatchTransfer.py &
-python batch/processor_BondLedger_JP.py &
-python batch/processor_ApproveTransfer.py &
-python batch/indexer_Transfer.py &
-python batch/indexer_TransferApproval.py &
-python batch/indexer_ApplyFor.py &
-python batch/indexer_Consume.py &
-python batch/indexer_Order.py &
-python batch/indexer_Agreement.py &
-python batch/indexer_PersonalInfo.py &
+python batch/supervisor.py &
 
 #run server
 gunicorn -b 0.0.0.0:5000 --reload manage:app --config guniconf.py